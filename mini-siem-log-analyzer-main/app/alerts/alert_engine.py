@@ -1,4 +1,5 @@
-from typing import List, Dict, Any
+import hashlib
+from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
 
 from utils.logging import setup_logger
@@ -8,11 +9,21 @@ from app.alerts.email_alert import send_email
 
 logger = setup_logger("alert_engine")
 
-# Global alert deduplication cache (title -> timestamp)
+# Global alert deduplication cache (fingerprint -> timestamp)
 _alert_cache: Dict[str, datetime] = {}
 _ALERT_COOLDOWN_MINUTES = 5  # Don't send same alert within 5 minutes
 
 
+ENTITY_KEYS = ('ip', 'user', 'host', 'device_serial')
+
+
+def alert_fingerprint(rule_id: str, entities: Optional[Dict[str, Any]] = None, key: Optional[str] = None) -> str:
+    """Stable id for "the same alert": the rule plus its entity keys (and an optional detector-specific key)."""
+    entities = entities or {}
+    parts = [rule_id] + [str(entities.get(k) or '').lower() for k in ENTITY_KEYS] + [key or '']
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
 def dispatch_alerts(alerts: List[Dict[str, Any]], config: Dict[str, Any], db):
     enabled = config.get('enabled_channels', [])
     now = datetime.utcnow()
@@ -21,24 +32,29 @@ def dispatch_alerts(alerts: List[Dict[str, Any]], config: Dict[str, Any], db):
         title = a.get('title', 'Alert')
         severity = a.get('severity', 'LOW')
         desc = a.get('description', '')
+        rule_id = a.get('rule_id')
+        entities = a.get('entities') or {}
+        fingerprint = alert_fingerprint(rule_id or title, entities, a.get('fingerprint_key'))
         
-        # Deduplicate: Skip if same alert sent recently
-        if title in _alert_cache:
-            last_sent = _alert_cache[title]
+        # Deduplicate: the same rule and entities within the cooldown only bump the stored alert
+        if fingerprint in _alert_cache:
+            last_sent = _alert_cache[fingerprint]
             if now - last_sent < timedelta(minutes=_ALERT_COOLDOWN_MINUTES):
-                logger.debug(f"Skipping duplicate alert: {title}")
+                logger.debug(f"Repeat of a recent alert, not sent again: {title}")
+                db.repeat_alert(fingerprint, now.isoformat())
                 continue
         
         # Update cache
-        _alert_cache[title] = now
+        _alert_cache[fingerprint] = now
         
         # Clean old cache entries (older than cooldown period)
         expired = [k for k, v in _alert_cache.items() if now - v > timedelta(minutes=_ALERT_COOLDOWN_MINUTES)]
         for k in expired:
             del _alert_cache[k]
         
-        # Record in DB
-        db.insert_alert(severity, title, desc, now.isoformat())
+        # Record in DB, with the rule, entities and contributing events
+        db.insert_alert(severity, title, desc, now.isoformat(), rule_id=rule_id, fingerprint=fingerprint,
+                        entities=entities, events=a.get('events'))
         
         # Send alerts
         message = f"{title}\n{desc}"  # Title already includes [SEVERITY] prefix
@@ -0,0 +1,437 @@
+"""
+Compressed columnar cold tier for aged event partitions.
+
+An aged partition is rewritten as one segment file
+(``<archive_dir>/events_YYYYMMDD.seg``) and the SQLite file is deleted.
+A segment is a sequence of blocks of ``block_rows`` rows, ordered by
+``ts_us``; each block stores every column separately:
+
+* strings (timestamp, channel, user, ip, command, message) are
+  dictionary-encoded per block - the distinct values once, then one small
+  integer code per row (code 0 is NULL);
+* integers (ts_us, event_id) are delta-encoded int64 with a null mask.
+
+Each column chunk is compressed on its own with zlib or lzma. The footer
+(compressed JSON) holds, per block, the chunk offsets plus min/max
+``ts_us`` and ``event_id``, so ``SegmentReader.scan`` skips blocks that
+cannot match without reading them, decodes filter columns first, and only
+decompresses the remaining columns of blocks that still have hits.
+
+File layout: ``MAGIC | chunks... | footer | <u32 footer length> | MAGIC``.
+"""
+import glob
+import json
+import lzma
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+
+from app.core.partitions import (EVENT_COLUMNS, FILTER_COLUMNS, PartitionSet, partition_bounds, now_us, GRANULARITY_US,
+                                 events_source)
+from utils.logging import setup_logger
+
+logger = setup_logger("archive")
+
+MAGIC = b'SIEMSEG1'
+INT_COLUMNS = frozenset(('ts_us', 'event_id'))
+CODECS = {
+    'zlib': (lambda b: zlib.compress(b, 6), zlib.decompress),
+    'lzma': (lambda b: lzma.compress(b, preset=6), lzma.decompress),
+}
+_SWAP = sys.byteorder != 'little'  # on disk everything is little-endian
+
+
+def _to_bytes(values: array) -> bytes:
+    if _SWAP:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if _SWAP:
+        values.byteswap()
+    return values
+
+
+def _encode_ints(values: List[Optional[int]]) -> bytes:
+    nulls = bytes(v is None for v in values)
+    deltas = array('q')
+    prev = 0
+    for v in values:
+        v = prev if v is None else v
+        deltas.append(v - prev)
+        prev = v
+    return (b'\x01' + nulls if any(nulls) else b'\x00') + _to_bytes(deltas)
+
+
+def _decode_ints(data: bytes, count: int) -> List[Optional[int]]:
+    has_nulls = data[0] == 1
+    nulls = data[1:1 + count] if has_nulls else None
+    deltas = _from_bytes('q', data[1 + count if has_nulls else 1:])
+    out: List[Optional[int]] = []
+    total = 0
+    for d in deltas:
+        total += d
+        out.append(total)
+    if nulls:
+        for i, flag in enumerate(nulls):
+            if flag:
+                out[i] = None
+    return out
+
+
+def _encode_strings(values: List[Optional[str]]) -> bytes:
+    codes_of: Dict[str, int] = {}
+    words: List[bytes] = []
+    codes = array('I')
+    for v in values:
+        if v is None:
+            codes.append(0)
+            continue
+        code = codes_of.get(v)
+        if code is None:
+            code = codes_of[v] = len(words) + 1
+            words.append(str(v).encode('utf-8', 'surrogatepass'))
+        codes.append(code)
+    typecode = 'B' if len(words) < 0xff else 'H' if len(words) < 0xffff else 'I'
+    if typecode != 'I':
+        codes = array(typecode, codes)
+    lengths = array('I', (len(w) for w in words))
+    return (typecode.encode() + struct.pack('<I', len(words)) + _to_bytes(lengths) + b''.join(words)
+            + _to_bytes(codes))
+
+
+def _decode_dictionary(data: bytes) -> Tuple[List[Optional[str]], array]:
+    typecode = chr(data[0])
+    (count,) = struct.unpack_from('<I', data, 1)
+    pos = 5 + 4 * count
+    lengths = _from_bytes('I', data[5:pos])
+    words: List[Optional[str]] = [None]
+    for n in lengths:
+        words.append(data[pos:pos + n].decode('utf-8', 'surrogatepass'))
+        pos += n
+    return words, _from_bytes(typecode, data[pos:])
+
+
+def write_segment(path: str, rows: List[tuple], block_rows: int = 8192, codec: str = 'zlib') -> Dict[str, Any]:
+    """Write rows (``EVENT_COLUMNS`` tuples, sorted by ts_us) as a segment; atomic via a temp file."""
+    compress = CODECS[codec][0]
+    blocks = []
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        for start in range(0, len(rows), block_rows):
+            block = rows[start:start + block_rows]
+            stats: Dict[str, Any] = {'rows': len(block), 'chunks': {}}
+            for name, values in zip(EVENT_COLUMNS, zip(*block)):
+                raw = _encode_ints(values) if name in INT_COLUMNS else _encode_strings(values)
+                data = compress(raw)
+                stats['chunks'][name] = [f.tell(), len(data)]
+                f.write(data)
+                if name in INT_COLUMNS:
+                    present = [v for v in values if v is not None]
+                    key = 'ts' if name == 'ts_us' else 'eid'
+                    stats[key + '_min'] = min(present) if present else None
+                    stats[key + '_max'] = max(present) if present else None
+            blocks.append(stats)
+        footer = zlib.compress(json.dumps({
+            'version': 1, 'codec': codec, 'columns': list(EVENT_COLUMNS), 'rows': len(rows), 'blocks': blocks,
+        }).encode())
+        f.write(footer)
+        f.write(struct.pack('<I', len(footer)))
+        f.write(MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return {'rows': len(rows), 'blocks': len(blocks), 'bytes': os.path.getsize(path)}
+
+
+class SegmentReader:
+    """Reads one segment; only the footer is loaded up front."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            f.seek(-(len(MAGIC) + 4), os.SEEK_END)
+            (length,) = struct.unpack('<I', f.read(4))
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not an event segment")
+            f.seek(-(len(MAGIC) + 4 + length), os.SEEK_END)
+            self.footer = json.loads(zlib.decompress(f.read(length)))
+        self.decompress = CODECS[self.footer['codec']][1]
+        self.blocks = self.footer['blocks']
+        self.rows = self.footer['rows']
+        self.blocks_read = 0
+        self.blocks_skipped = 0
+
+    def _column(self, f, block: Dict[str, Any], name: str) -> List[Any]:
+        offset, length = block['chunks'][name]
+        f.seek(offset)
+        data = self.decompress(f.read(length))
+        if name in INT_COLUMNS:
+            return _decode_ints(data, block['rows'])
+        words, codes = _decode_dictionary(data)
+        return [words[c] for c in codes]
+
+    @staticmethod
+    def _may_match(block: Dict[str, Any], start_us: Optional[int], end_us: Optional[int],
+                   event_ids: Optional[set]) -> bool:
+        if start_us is not None or end_us is not None:
+            if block['ts_min'] is None:
+                return False
+            if start_us is not None and block['ts_max'] < start_us:
+                return False
+            if end_us is not None and block['ts_min'] >= end_us:
+                return False
+        if event_ids is not None:
+            if block['eid_min'] is None or not any(block['eid_min'] <= e <= block['eid_max'] for e in event_ids):
+                return False
+        return True
+
+    def scan(self, start_us: Optional[int] = None, end_us: Optional[int] = None,
+             filters: Optional[Dict[str, Any]] = None, limit: Optional[int] = None,
+             newest_first: bool = True) -> Iterator[tuple]:
+        """Rows (``EVENT_COLUMNS`` tuples) in the time range matching the column filters."""
+        wanted: Dict[str, set] = {}
+        for column, value in (filters or {}).items():
+            if column not in FILTER_COLUMNS:
+                raise ValueError(f"Cannot filter events on {column!r}")
+            wanted[column] = set(value) if isinstance(value, (list, tuple, set)) else {value}
+        event_ids = None
+        if 'event_id' in wanted:
+            # Same coercion SQLite's INTEGER affinity applies to '4625'
+            event_ids = wanted['event_id'] = {int(e) for e in wanted['event_id'] if str(e).lstrip('-').isdigit()}
+        produced = 0
+        blocks = reversed(self.blocks) if newest_first else iter(self.blocks)
+        with open(self.path, 'rb') as f:
+            for block in blocks:
+                if not self._may_match(block, start_us, end_us, event_ids):
+                    self.blocks_skipped += 1
+                    continue
+                self.blocks_read += 1
+                columns: Dict[str, List[Any]] = {}
+                hits = range(block['rows'])
+                if start_us is not None or end_us is not None:
+                    ts = columns['ts_us'] = self._column(f, block, 'ts_us')
+                    hits = [i for i in hits if ts[i] is not None
+                            and (start_us is None or ts[i] >= start_us) and (end_us is None or ts[i] < end_us)]
+                for column, values in wanted.items():
+                    if not hits:
+                        break
+                    col = columns[column] = self._column(f, block, column)
+                    hits = [i for i in hits if col[i] in values]
+                if not hits:
+                    continue
+                for name in EVENT_COLUMNS:
+                    if name not in columns:
+                        columns[name] = self._column(f, block, name)
+                ordered = [columns[name] for name in EVENT_COLUMNS]
+                for i in (reversed(hits) if newest_first else hits):
+                    yield tuple(col[i] for col in ordered)
+                    produced += 1
+                    if limit is not None and produced >= limit:
+                        return
+
+
+class ArchiveSet:
+    """Segment files in the archive directory, named after the partition they came from."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._readers: Dict[str, Tuple[float, SegmentReader]] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def list(self) -> List[Tuple[str, int, int, str]]:
+        """(partition name, start_us, end_us, path) per segment, oldest first."""
+        found = []
+        for path in glob.glob(os.path.join(self.directory, 'events_*.seg')):
+            # events_YYYYMMDD.seg, or events_YYYYMMDD.<n>.seg for late rows archived again
+            name = os.path.basename(path).split('.')[0]
+            bounds = partition_bounds(name)
+            if bounds:
+                found.append((name, bounds[0], bounds[1], path))
+        found.sort(key=lambda s: (s[1], s[2], s[3]))
+        return found
+
+    def overlapping(self, start_us: Optional[int], end_us: Optional[int]) -> List[Tuple[str, int, int, str]]:
+        return [s for s in self.list()
+                if (start_us is None or s[2] > start_us) and (end_us is None or s[1] < end_us)]
+
+    def new_path(self, name: str) -> str:
+        path = os.path.join(self.directory, name + '.seg')
+        n = 0
+        while os.path.exists(path):
+            n += 1
+            path = os.path.join(self.directory, f"{name}.{n}.seg")
+        return path
+
+    def reader(self, path: str) -> SegmentReader:
+        """Cached reader (footers are small; segments never change once written)."""
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            cached = self._readers.get(path)
+            if cached is None or cached[0] != mtime:
+                cached = self._readers[path] = (mtime, SegmentReader(path))
+            return cached[1]
+
+    def scan(self, path: str, start_us: Optional[int], end_us: Optional[int], filters: Optional[Dict[str, Any]],
+             limit: int) -> List[tuple]:
+        try:
+            return list(self.reader(path).scan(start_us, end_us, filters, limit))
+        except (OSError, ValueError) as e:
+            logger.debug(f"Skipping segment {path}: {e}")
+            return []
+
+    def expired(self, retention_days: float, now: Optional[int] = None) -> List[str]:
+        cutoff = (now if now is not None else now_us()) - int(retention_days * GRANULARITY_US['day'])
+        return [path for _, _, end, path in self.list() if end <= cutoff]
+
+    def remove(self, path: str) -> bool:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Could not remove segment {path}, will retry: {e}")
+            return False
+        with self._lock:
+            self._readers.pop(path, None)
+        return True
+
+
+class PublishSegment:
+    """
+    Writer idle job: swap a partition for its freshly written segment.
+
+    The segment is written as ``<segment>.pending`` (invisible to
+    queries); here it is renamed into place and the partition deleted,
+    unless rows arrived after the snapshot, in which case the pending file
+    is dropped and the next pass archives the partition again.
+    """
+
+    def __init__(self, db, name: str, max_id: int, segment: str):
+        self.name = f"archive:{name}"
+        self.db = db
+        self.partition = name
+        self.max_id = max_id
+        self.segment = segment
+
+    def step(self, conn: sqlite3.Connection) -> bool:
+        try:
+            self._publish(conn)
+        finally:
+            self.db.archiver.inflight.discard(self.partition)
+        return False
+
+    def _publish(self, conn: sqlite3.Connection):
+        path = self.db.partitions.path(self.partition)
+        pending = self.segment + '.pending'
+        if not os.path.exists(path):
+            _discard(pending)  # removed by retention meanwhile
+            return
+        check = sqlite3.connect(path, timeout=30)
+        try:
+            current = check.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        finally:
+            check.close()
+        if current != self.max_id:
+            logger.info(f"Partition {self.partition} changed while archiving; will retry")
+            _discard(pending)
+            return
+        os.replace(pending, self.segment)
+        self.db.release_partition(conn, self.partition)
+
+
+def _discard(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class Archiver:
+    """
+    Background thread that moves partitions older than ``after_days`` into segments.
+
+    The partition is read through a read-only snapshot and compressed off
+    the writer thread; publishing the segment and deleting the SQLite file
+    is handed to the writer (``PublishSegment``) so it never races an
+    attached partition or a late insert.
+    """
+
+    def __init__(self, db, after_days: float, codec: str = 'zlib', block_rows: int = 8192,
+                 interval_seconds: float = 3600):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown archive codec: {codec}")
+        self.db = db
+        self.after_days = after_days
+        self.codec = codec
+        self.block_rows = max(1, int(block_rows))
+        self.interval_seconds = interval_seconds
+        self.segments_written = 0
+        self.rows_archived = 0
+        self.inflight: set = set()  # partitions whose segment awaits PublishSegment
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="DB-Archiver")
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 30.0):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _run(self):
+        # Leftovers of a pass interrupted before the writer published them
+        for path in glob.glob(os.path.join(self.db.archive.directory, '*.pending')):
+            _discard(path)
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Archive pass failed: {e}", exc_info=True)
+            self._stop.wait(self.interval_seconds)
+
+    def run_once(self) -> int:
+        """Archive every aged partition; returns how many were archived."""
+        from app.core.db import open_readonly
+        partitions: PartitionSet = self.db.partitions
+        done = 0
+        current = partitions.name_for(now_us())
+        for name in partitions.expired(self.after_days):
+            if self._stop.is_set():
+                break
+            if name == current or name in self.inflight:
+                continue
+            path = partitions.path(name)
+            conn = open_readonly(path)
+            try:
+                conn.execute("BEGIN")  # one snapshot for the rows and the id we verify against
+                max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+                rows = conn.execute(
+                    f"SELECT {', '.join(EVENT_COLUMNS)} FROM {events_source(conn)} WHERE id <= ? ORDER BY ts_us, id",
+                    (max_id,)).fetchall()
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+            segment = self.db.archive.new_path(name)
+            info = write_segment(segment + '.pending', rows, self.block_rows, self.codec)
+            before = sum(os.path.getsize(path + s) for s in ('', '-wal') if os.path.exists(path + s))
+            self.segments_written += 1
+            self.rows_archived += info['rows']
+            logger.info(f"Archived {name}: {info['rows']} rows, {before // 1024} KiB -> {info['bytes'] // 1024} KiB")
+            self.inflight.add(name)
+            self.db.queue_jobs([PublishSegment(self.db, name, max_id, segment)])
+            done += 1
+        return done
+
+    def stats(self) -> Dict[str, Any]:
+        return {'segments_written': self.segments_written, 'rows_archived': self.rows_archived}
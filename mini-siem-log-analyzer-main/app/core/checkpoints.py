@@ -0,0 +1,74 @@
+import json
+import os
+import threading
+from typing import Dict, Any, Optional
+
+from utils.logging import setup_logger
+
+logger = setup_logger("checkpoints")
+
+
+class CheckpointStore:
+    """
+    Persisted per-channel high-water marks (record number + timestamp).
+
+    State is kept as a small JSON document and rewritten atomically
+    (temp file + rename) so a crash mid-write never leaves a torn file.
+    A store without a path keeps checkpoints in memory only.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._data = data
+        except Exception as e:
+            logger.error(f"Failed to load checkpoints from {self.path}: {e}")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cp = self._data.get(key)
+            return dict(cp) if cp else None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        with self._lock:
+            self._data[key] = dict(value)
+
+    def reset(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {k: dict(v) for k, v in self._data.items()}
+
+    def replace(self, data: Dict[str, Dict[str, Any]]):
+        with self._lock:
+            self._data = {k: dict(v) for k, v in (data or {}).items()}
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            snapshot = json.dumps(self._data, indent=2)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.error(f"Failed to save checkpoints to {self.path}: {e}")
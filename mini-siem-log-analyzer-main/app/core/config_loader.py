@@ -20,6 +20,8 @@ class AppConfig:
     thresholds: Dict[str, Any] = field(default_factory=dict)
     database: Dict[str, str] = field(default_factory=dict)
     export: Dict[str, str] = field(default_factory=dict)
+    collector: Dict[str, Any] = field(default_factory=dict)
+    pipeline: Dict[str, Any] = field(default_factory=dict)
 
     @staticmethod
     def load(path: str) -> "AppConfig":
@@ -37,6 +39,8 @@ class AppConfig:
             thresholds=data.get('thresholds', {}),
             database=data.get('database', {}),
             export=data.get('export', {}),
+            collector=data.get('collector', {}),
+            pipeline=data.get('pipeline', {}),
         )
         return cfg
 
@@ -56,4 +60,6 @@ class AppConfig:
                 'thresholds': cfg.thresholds,
                 'database': cfg.database,
                 'export': cfg.export,
+                'collector': cfg.collector,
+                'pipeline': cfg.pipeline,
             }, f, indent=2)
@@ -1,67 +1,679 @@
+import atexit
 import os
+import queue
 import sqlite3
-from typing import List, Dict, Any
-
-SCHEMA_SQL = """
-CREATE TABLE IF NOT EXISTS events (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    timestamp TEXT,
-    channel TEXT,
-    event_id INTEGER,
-    user TEXT,
-    ip TEXT,
-    command TEXT,
-    message TEXT
-);
-
-CREATE TABLE IF NOT EXISTS alerts (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    created_at TEXT,
-    severity TEXT,
-    title TEXT,
-    description TEXT
-);
-"""
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+from app.core.migrations import MAIN_MIGRATIONS, get_meta, main_backfills, run_migrations, set_meta, to_epoch_us
+from app.core.partitions import PartitionSet, alert_evidence, group_rows, query_events
+from app.core.search import FtsBackfill, PartitionFtsRebuild, search_events
+from app.core.archive import ArchiveSet, Archiver
+from app.core import rollups
+from app.core.event import Event
+from app.core.interning import StringInterner
+from app.core.spool import Spool
+from utils.logging import setup_logger
+
+logger = setup_logger("db")
+
+# message/command are interned (app/core/interning.py); readers use the events_v view
+INSERT_EVENT_SQL = ("INSERT INTO events(timestamp, ts_us, channel, event_id, user, ip, command_id, message_id) "
+                    "VALUES(?,?,?,?,?,?,?,?)")
+INSERT_ALERT_SQL = ("INSERT INTO alerts(created_at, created_us, severity, title, description, rule_id, fingerprint, "
+                    "ip, user, host, device_serial) VALUES(?,?,?,?,?,?,?,?,?,?,?)")
+INSERT_ALERT_EVENT_SQL = "INSERT OR IGNORE INTO alert_events(alert_id, partition, event_row) VALUES(?,?,?)"
+REPEAT_ALERT_SQL = ("UPDATE alerts SET occurrences = occurrences + 1, last_seen = ?, last_seen_us = ? "
+                    "WHERE id = (SELECT max(id) FROM alerts WHERE fingerprint = ?)")
+ALERT_ENTITIES = ('ip', 'user', 'host', 'device_serial')
+
+
+def readonly_uri(path: str) -> str:
+    return 'file:' + os.path.abspath(path).replace('\\', '/') + '?mode=ro'
+
+
+def open_readonly(path: str, timeout: float = 5.0) -> sqlite3.Connection:
+    """Read-only connection for dashboards/queries; never blocks the writer under WAL."""
+    conn = sqlite3.connect(readonly_uri(path), uri=True, timeout=timeout, check_same_thread=False)
+    conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+def default_partition_dir(path: str) -> str:
+    return os.path.join(os.path.dirname(path) or '.', 'partitions')
+
+
+def default_archive_dir(path: str) -> str:
+    return os.path.join(os.path.dirname(path) or '.', 'archive')
+
+
+def default_spool_dir(path: str) -> str:
+    return os.path.join(os.path.dirname(path) or '.', 'spool')
+
+
+def _notify(callbacks: List[tuple], stored: bool):
+    """Run each ``(on_commit, on_error)`` pair's callback for the outcome of its batch."""
+    for on_commit, on_error in callbacks:
+        cb = on_commit if stored else on_error
+        if cb is None:
+            continue
+        try:
+            cb()
+        except Exception as e:
+            logger.error(f"DB commit callback failed: {e}")
 
 
 class Database:
-    def __init__(self, path: str):
-        os.makedirs(os.path.dirname(path), exist_ok=True)
+    """
+    SQLite store with a single writer thread.
+
+    The writer owns one long-lived connection in WAL mode and group-commits:
+    queued inserts are applied inside an open transaction that is committed
+    every ``flush_rows`` rows or ``flush_interval_ms`` milliseconds, whichever
+    comes first. ``insert_events``/``insert_alert`` return as soon as the
+    work is queued (the queue is bounded, so a stalled disk applies
+    backpressure); ``flush()`` blocks until everything queued so far is
+    committed and ``close()`` flushes and stops the writer. Readers use
+    ``reader()`` - separate read-only connections that never take the write
+    lock.
+
+    Events go to time partitions (``app/core/partitions.py``) that the
+    writer ATTACHes on demand, keeping at most ``max_attached`` open; the
+    main database keeps alerts, metadata and pre-partitioning events.
+    Partitions older than ``archive_after_days`` are compressed into
+    columnar segments (``app/core/archive.py``) by a background thread.
+    ``query()`` reads across all of them. Partitions and segments older
+    than ``retention_days`` are deleted by the writer while idle.
+    Per-minute/hour/day counts (``app/core/rollups.py``) are updated in the
+    same transaction as the rows and answer ``timeseries()``/``totals()``.
+    Stored ``Event`` objects get their ``ref`` (partition, row id), which
+    ``insert_alert`` turns into ``alert_events`` links for
+    ``alert_evidence()``.
+
+    When a write or commit fails, the transaction is rolled back and the
+    batches it held go to a local spool (``app/core/spool.py``); so do
+    batches that wait more than ``spool_after_ms`` for a full queue. The
+    database is then left alone for ``spool_retry_seconds`` (doubling up
+    to a minute while it keeps failing), meanwhile batches go straight to
+    the spool, and the writer replays the spool while idle once writes
+    succeed again. Spooled batches count as persisted for ``on_commit``;
+    batches that could be neither stored nor spooled run ``on_error``.
+
+    ``database`` config: ``path``, ``flush_rows`` (500),
+    ``flush_interval_ms`` (200), ``synchronous`` ("NORMAL"),
+    ``cache_size_kb`` (65536), ``mmap_size_mb`` (256), ``queue_size`` (1000),
+    ``partition`` ("day", "hour" or "none"), ``partition_dir``
+    (``partitions/`` next to the database), ``retention_days`` (0 = keep),
+    ``max_attached`` (8), ``archive_after_days`` (0 = never),
+    ``archive_dir`` (``archive/`` next to the database), ``archive_codec``
+    ("zlib" or "lzma"), ``archive_block_rows`` (8192),
+    ``rollup_retention_days`` ({"1m": 7, "1h": 90}), ``intern_cache_kb``
+    (16384 per attached database), ``spool_dir`` (``spool/`` next to the
+    database), ``spool_max_mb`` (256, 0 = no spool), ``spool_segment_mb``
+    (8), ``spool_fsync`` (true), ``spool_after_ms`` (2000),
+    ``spool_retry_seconds`` (5).
+    """
+
+    def __init__(self, path: str, flush_rows: int = 500, flush_interval_ms: int = 200, synchronous: str = "NORMAL",
+                 cache_size_kb: int = 65536, mmap_size_mb: int = 256, queue_size: int = 1000,
+                 partition: Optional[str] = "day", partition_dir: Optional[str] = None, retention_days: float = 0,
+                 max_attached: int = 8, archive_after_days: float = 0, archive_dir: Optional[str] = None,
+                 archive_codec: str = "zlib", archive_block_rows: int = 8192,
+                 rollup_retention_days: Optional[Dict[str, float]] = None, intern_cache_kb: int = 16384,
+                 spool_dir: Optional[str] = None, spool_max_mb: float = 256, spool_segment_mb: float = 8,
+                 spool_fsync: bool = True, spool_after_ms: int = 2000, spool_retry_seconds: float = 5):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
         self.path = path
+        self.flush_rows = max(1, int(flush_rows))
+        self.flush_interval = max(0, int(flush_interval_ms)) / 1000.0
+        self.synchronous = synchronous
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size_mb = mmap_size_mb
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self.rows_written = 0
+        self.commits = 0
+        self.failed_batches = 0
+        self.partitions_removed = 0
+        self.partitions = None
+        if partition and partition != 'none':
+            self.partitions = PartitionSet(partition_dir or default_partition_dir(path), partition)
+        self.retention_days = float(retention_days or 0)
+        # SQLite allows 10 attached databases by default
+        self.max_attached = min(10, max(1, int(max_attached)))
+        self._attached: "OrderedDict[str, str]" = OrderedDict()
+        self._insert_sql: Dict[str, str] = {}
+        self._interner = StringInterner(intern_cache_kb)
+        self._staged: List[tuple] = []  # (kind, partition, rows, events) in the open transaction
+        self.spool = None
+        if spool_max_mb:
+            self.spool = Spool(spool_dir or default_spool_dir(path), float(spool_max_mb) * 2**20,
+                               float(spool_segment_mb) * 2**20, spool_fsync)
+        self.spool_after = max(0, int(spool_after_ms)) / 1000.0
+        self.spool_retry = max(0.1, float(spool_retry_seconds))
+        self._retry_delay = 0.0  # > 0 while the database is failing
+        self._retry_at = 0.0
+        self.rollup_retention_days = dict(rollups.DEFAULT_RETENTION_DAYS, **(rollup_retention_days or {}))
+        self._next_retention = time.monotonic()
+        self.archive = ArchiveSet(archive_dir or default_archive_dir(path))
+        self.archiver = None
+        if archive_after_days and self.partitions:
+            self.archiver = Archiver(self, float(archive_after_days), archive_codec, archive_block_rows)
+        self._conn = self._connect()
         self._init()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="DB-Writer")
+        self._thread.start()
+        if self.archiver:
+            self.archiver.start()
+        # Queued rows must not be lost when a script simply returns
+        atexit.register(self.close)
+
+    @classmethod
+    def from_config(cls, database: Dict[str, Any], default_path: str) -> "Database":
+        return cls(
+            database.get('path', default_path),
+            flush_rows=database.get('flush_rows', 500),
+            flush_interval_ms=database.get('flush_interval_ms', 200),
+            synchronous=database.get('synchronous', 'NORMAL'),
+            cache_size_kb=database.get('cache_size_kb', 65536),
+            mmap_size_mb=database.get('mmap_size_mb', 256),
+            queue_size=database.get('queue_size', 1000),
+            partition=database.get('partition', 'day'),
+            partition_dir=database.get('partition_dir'),
+            retention_days=database.get('retention_days', 0),
+            max_attached=database.get('max_attached', 8),
+            archive_after_days=database.get('archive_after_days', 0),
+            archive_dir=database.get('archive_dir'),
+            archive_codec=database.get('archive_codec', 'zlib'),
+            archive_block_rows=database.get('archive_block_rows', 8192),
+            rollup_retention_days=database.get('rollup_retention_days'),
+            intern_cache_kb=database.get('intern_cache_kb', 16384),
+            spool_dir=database.get('spool_dir'),
+            spool_max_mb=database.get('spool_max_mb', 256),
+            spool_segment_mb=database.get('spool_segment_mb', 8),
+            spool_fsync=database.get('spool_fsync', True),
+            spool_after_ms=database.get('spool_after_ms', 2000),
+            spool_retry_seconds=database.get('spool_retry_seconds', 5),
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        # Created here, used only by the writer thread from now on
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size_mb) * 1024 * 1024}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
 
     def _init(self):
-        conn = sqlite3.connect(self.path)
-        try:
-            conn.executescript(SCHEMA_SQL)
-        finally:
-            conn.close()
+        # Schema changes run before the writer starts; long data rewrites run later, in chunks, while idle
+        run_migrations(self._conn, MAIN_MIGRATIONS)
+        self._backfills = [b for b in main_backfills() + [FtsBackfill()] if b.pending(self._conn)]
+        if rollups.RollupBackfill.plan(self._conn, self.partitions, self.archive):
+            self._backfills.append(rollups.RollupBackfill())
+
+    # --- public API (returns once queued) -------------------------------
 
-    def insert_events(self, events: List[Dict[str, Any]]):
+    def insert_events(self, events: List[Dict[str, Any]], on_commit: Optional[Callable[[], None]] = None,
+                      on_error: Optional[Callable[[], None]] = None):
+        """
+        Queue events for insertion; ``on_commit`` runs once they are committed
+        (or spooled), ``on_error`` instead if they were lost.
+        """
         if not events:
+            if on_commit is not None:
+                self._put(('call', None, (on_commit, on_commit)))  # nothing to lose
             return
-        conn = sqlite3.connect(self.path)
+        rows = [(
+            e.get('timestamp'), to_epoch_us(e.get('timestamp')), e.get('channel'), e.get('event_id'),
+            e.get('user'), e.get('ip'), e.get('command'), e.get('message')
+        ) for e in events]
+        # Routed and counted here, on the caller's thread; the writer only inserts (and sets Event.ref)
+        groups = group_rows(rows, self.partitions, events) if self.partitions else [(None, rows, events)]
+        self._offer(('events', [(name, batch, rollups.count_events(batch), origin) for name, batch, origin in groups],
+                     (on_commit, on_error)))
+
+    def insert_alert(self, severity: str, title: str, description: str, created_at: str,
+                     rule_id: Optional[str] = None, fingerprint: Optional[str] = None,
+                     entities: Optional[Dict[str, Any]] = None, events: Optional[List[Any]] = None):
+        """
+        Queue an alert. ``entities`` holds ``ip``/``user``/``host``/``device_serial``;
+        ``events`` are the contributing Event objects, linked by the row ids
+        the writer gave them (insert them first: the queue is processed in order).
+        """
+        created_us = to_epoch_us(created_at)
+        entities = entities or {}
+        row = (created_at, created_us, severity, title, description, rule_id, fingerprint) + tuple(
+            entities.get(k) for k in ALERT_ENTITIES)
+        self._offer(('alert', [(None, [row], rollups.count_alert(created_us, severity), list(events or ()))], None))
+
+    def repeat_alert(self, fingerprint: str, seen_at: str):
+        """Queue a repeat of the latest alert with ``fingerprint``: bumps its ``occurrences`` and ``last_seen``."""
+        self._offer(('repeat', [(None, [(seen_at, to_epoch_us(seen_at), fingerprint)], None, None)], None))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Commit everything queued so far; True once it is on disk."""
+        if self._closed or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        self._put(('flush', done, None))
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 30.0):
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self.archiver:
+            self.archiver.stop(timeout)
+        if self._thread.is_alive():
+            self._queue.put(('stop', None, None))
+            self._thread.join(timeout)
+        if self.spool:
+            self.spool.close()
+
+    def reader(self) -> sqlite3.Connection:
+        """New read-only connection to the main database (caller closes it)."""
+        return open_readonly(self.path)
+
+    def query(self, time_range: Optional[Tuple[Any, Any]] = None, filters: Optional[Dict[str, Any]] = None,
+              limit: int = 1000) -> List[Dict[str, Any]]:
+        """Newest-first events in ``time_range`` ((start, end), either may be None) matching column ``filters``."""
+        return query_events(self.path, self.partitions, time_range, filters, limit, archive=self.archive)
+
+    def alert_evidence(self, alert_id: int) -> Optional[Dict[str, Any]]:
+        """An alert with its linked events, oldest first (see ``alert_evidence`` in ``app/core/partitions.py``)."""
+        return alert_evidence(self.path, self.partitions, alert_id)
+
+    def search(self, text: str, time_range: Optional[Tuple[Any, Any]] = None, filters: Optional[Dict[str, Any]] = None,
+               page: int = 1, page_size: int = 50, raw: bool = False) -> Dict[str, Any]:
+        """Ranked full-text search over message/command (see ``app/core/search.py``)."""
+        return search_events(self.path, self.partitions, text, time_range, filters, page, page_size, raw)
+
+    def timeseries(self, kind: str = 'events', time_range: Optional[Tuple[Any, Any]] = None, granularity: str = 'auto',
+                   filters: Optional[Dict[str, Any]] = None, group_by: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Event/alert counts per 1m/1h/1d bucket from the rollups (see ``app/core/rollups.py``)."""
+        conn = self.reader()
         try:
-            cur = conn.cursor()
-            cur.executemany(
-                "INSERT INTO events(timestamp, channel, event_id, user, ip, command, message) VALUES(?,?,?,?,?,?,?)",
-                [(
-                    e.get('timestamp'), e.get('channel'), e.get('event_id'),
-                    e.get('user'), e.get('ip'), e.get('command'), e.get('message')
-                ) for e in events]
-            )
-            conn.commit()
+            return rollups.timeseries(conn, kind, time_range, granularity, filters, group_by)
         finally:
             conn.close()
 
-    def insert_alert(self, severity: str, title: str, description: str, created_at: str):
-        conn = sqlite3.connect(self.path)
+    def totals(self, kind: str = 'events', time_range: Optional[Tuple[Any, Any]] = None,
+               filters: Optional[Dict[str, Any]] = None, group_by: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        conn = self.reader()
         try:
-            cur = conn.cursor()
-            cur.execute(
-                "INSERT INTO alerts(created_at, severity, title, description) VALUES(?,?,?,?)",
-                (created_at, severity, title, description)
-            )
-            conn.commit()
+            return rollups.totals(conn, kind, time_range, filters, group_by, self.rollup_retention_days)
         finally:
             conn.close()
+
+    def rebuild_search_index(self):
+        """Re-index every event in the background (writer idle time); search keeps working meanwhile."""
+        jobs = [FtsBackfill(reset=True)]
+        if self.partitions:
+            jobs += [PartitionFtsRebuild(self.partitions, name) for name, _, _ in self.partitions.list()]
+        self.queue_jobs(jobs)
+
+    def queue_jobs(self, jobs: List[Any]):
+        """Hand ``step(conn) -> more`` jobs to the writer, which runs them while idle."""
+        self._put(('jobs', jobs, None))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queued': self._queue.qsize(),
+            'rows_written': self.rows_written,
+            'commits': self.commits,
+            'failed_batches': self.failed_batches,
+            'backfills_pending': [b.name for b in self._backfills],
+            'partitions_attached': list(self._attached),
+            'partitions_removed': self.partitions_removed,
+            'archive': self.archiver.stats() if self.archiver else None,
+            'interning': self._interner.stats(),
+            'available': self._retry_delay == 0,
+            'spool': self.spool.stats() if self.spool else None,
+        }
+
+    def _put(self, item: tuple):
+        if self._closed:
+            raise RuntimeError("Database is closed")
+        self._queue.put(item)
+
+    def _offer(self, item: tuple):
+        """Queue an insert; if the writer leaves it waiting ``spool_after_ms``, spool it from this thread."""
+        if self.spool is None:
+            return self._put(item)
+        if self._closed:
+            raise RuntimeError("Database is closed")
+        try:
+            self._queue.put(item, timeout=self.spool_after)
+            return
+        except queue.Full:
+            pass
+        kind, groups, hooks = item
+        logger.warning(f"DB writer is not keeping up; spooling {sum(len(g[1]) for g in groups)} rows")
+        stored = [self.spool.append(kind, name, rows) for name, rows, _, _ in groups]
+        if hooks is not None:
+            _notify([hooks], all(stored))
+
+    # --- writer thread ----------------------------------------------------
+
+    def _run(self):
+        conn = self._conn
+        pending_rows = 0
+        callbacks: List[Tuple[Optional[Callable[[], None]], Optional[Callable[[], None]]]] = []
+        waiters: List[threading.Event] = []
+        deadline: Optional[float] = None
+        stopping = False
+        while True:
+            replay = self.spool is not None and self.spool.pending() and not self._unavailable()
+            if deadline is not None:
+                timeout = max(0.0, deadline - time.monotonic())
+            elif self._backfills or replay:
+                timeout = 0.05
+            else:
+                wake = self._next_retention
+                if self.spool is not None and self.spool.pending():
+                    wake = min(wake, self._retry_at)
+                timeout = max(0.0, wake - time.monotonic())
+            try:
+                kind, payload, hooks = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                kind, payload, hooks = 'tick', None, None
+                if deadline is None:
+                    if self._backfills:
+                        self._backfill_step(conn)
+                    elif replay:
+                        self._replay_step(conn)
+                    elif time.monotonic() >= self._next_retention:
+                        self._apply_retention(conn)
+                    continue
+
+            if kind in ('events', 'alert', 'repeat'):
+                stored = True
+                if self._unavailable():
+                    stored = self._spool_all([(kind, name, rows, None) for name, rows, _, _ in payload])
+                else:
+                    done = 0
+                    try:
+                        if not conn.in_transaction:
+                            conn.execute("BEGIN")
+                            deadline = time.monotonic() + self.flush_interval
+                        for name, rows, counts, extra in payload:
+                            self._write(conn, kind, name, rows, counts, extra)
+                            pending_rows += len(rows)
+                            done += 1
+                    except (sqlite3.Error, OSError) as e:
+                        logger.error(f"DB write failed ({kind}): {e}")
+                        stored = self._spill(conn, e, [(kind, name, rows, None) for name, rows, _, _ in payload[done:]])
+                        pending_rows = 0
+                        deadline = None
+                        if not stored:
+                            # Part of the rolled-back transaction is gone; its batches cannot be committed
+                            _notify(callbacks, False)
+                            callbacks = []
+                if hooks is not None:
+                    if stored:
+                        callbacks.append(hooks)
+                    else:
+                        _notify([hooks], False)
+            elif kind == 'call':
+                callbacks.append(hooks)
+            elif kind == 'jobs':
+                self._backfills.extend(payload)
+            elif kind == 'flush':
+                waiters.append(payload)
+            elif kind == 'stop':
+                stopping = True
+
+            due = deadline is not None and time.monotonic() >= deadline
+            if pending_rows >= self.flush_rows or due or waiters or stopping or (callbacks and deadline is None):
+                self._commit(conn, pending_rows, callbacks)
+                pending_rows = 0
+                callbacks = []
+                deadline = None
+                for w in waiters:
+                    w.set()
+                waiters = []
+            if stopping:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+                return
+
+    def _insert_for(self, conn: sqlite3.Connection, name: Optional[str]) -> Tuple[str, str]:
+        """(INSERT statement, schema) for a partition (None = main events table), attaching it first if needed."""
+        if name is None:
+            return INSERT_EVENT_SQL, 'main'
+        alias = self._attached.get(name)
+        if alias is not None:
+            self._attached.move_to_end(name)
+            return self._insert_sql[alias], alias
+        # DETACH and per-schema PRAGMAs are refused inside a transaction: commit what is staged so far
+        # (the batch's callbacks still wait for the final commit) and reopen. Only a new partition
+        # (day rollover, historical imports) pays for this.
+        reopen = conn.in_transaction
+        if reopen:
+            conn.execute("COMMIT")
+            self.commits += 1
+            self._staged = []
+        try:
+            if len(self._attached) >= self.max_attached:
+                self._detach(conn, next(iter(self._attached)))
+            path = self.partitions.ensure(name)
+            alias = 'p_' + name
+            conn.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+            self._attached[name] = alias
+            conn.execute(f"PRAGMA {alias}.synchronous={self.synchronous}")
+            self._insert_sql[alias] = INSERT_EVENT_SQL.replace("INTO events", f"INTO {alias}.events", 1)
+        finally:
+            if reopen:
+                conn.execute("BEGIN")
+        return self._insert_sql[alias], alias
+
+    def _write(self, conn: sqlite3.Connection, kind: str, name: Optional[str], rows: List[tuple], counts,
+               extra: Optional[list] = None):
+        """
+        Insert one partition's rows (or an alert) and their rollup counts into the open transaction.
+
+        ``extra`` is the source events (which get ``ref`` set) or an alert's
+        contributing events (whose refs become ``alert_events`` links).
+        """
+        if kind == 'events':
+            sql, schema = self._insert_for(conn, name if self.partitions else None)
+            conn.executemany(sql, self._interner.rows(conn, schema, rows))
+            rollups.apply(conn, 'events', counts)
+            if extra:
+                # One writer, so the batch got consecutive ids ending at the last one inserted
+                first = conn.execute("SELECT last_insert_rowid()").fetchone()[0] - len(rows) + 1
+                partition = '' if schema == 'main' else name
+                for row_id, evt in enumerate(extra, first):
+                    if isinstance(evt, Event):
+                        evt.ref = (partition, row_id)
+        elif kind == 'repeat':
+            conn.executemany(REPEAT_ALERT_SQL, rows)
+        else:
+            for row in rows:
+                # Rows spooled before the entity columns existed are padded out
+                alert_id = conn.execute(INSERT_ALERT_SQL, tuple(row) + (None,) * (11 - len(row))).lastrowid
+                refs = {evt.ref for evt in extra or () if getattr(evt, 'ref', None)}
+                if refs:
+                    conn.executemany(INSERT_ALERT_EVENT_SQL, [(alert_id, p, r) for p, r in sorted(refs)])
+            rollups.apply(conn, 'alerts', counts)
+        self._staged.append((kind, name, rows, extra))
+
+    def _detach(self, conn: sqlite3.Connection, name: str):
+        alias = self._attached.pop(name)
+        self._insert_sql.pop(alias, None)
+        self._interner.forget(alias)
+        conn.execute(f"DETACH DATABASE {alias}")
+
+    def release_partition(self, conn: sqlite3.Connection, name: str) -> bool:
+        """
+        Detach (if attached) and delete a partition file, and its ``alert_events`` links.
+        Writer thread only, outside a transaction.
+        """
+        if name in self._attached:
+            try:
+                self._detach(conn, name)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not detach partition {name}: {e}")
+                return False
+        if self.partitions.remove(name):
+            self.partitions_removed += 1
+            conn.execute("DELETE FROM alert_events WHERE partition = ?", (name,))
+            return True
+        return False
+
+    def _apply_retention(self, conn: sqlite3.Connection):
+        self._next_retention = time.monotonic() + 3600
+        try:
+            removed = rollups.prune(conn, self.rollup_retention_days)
+            if removed:
+                logger.info(f"Retention: pruned {removed} minute/hour rollup rows")
+        except sqlite3.Error as e:
+            logger.error(f"Rollup pruning failed: {e}")
+        if not self.retention_days:
+            return
+        if self.partitions:
+            for name in self.partitions.expired(self.retention_days):
+                if self.release_partition(conn, name):
+                    logger.info(f"Retention: removed partition {name} (older than {self.retention_days:g} days)")
+        for path in self.archive.expired(self.retention_days):
+            if self.archive.remove(path):
+                logger.info(f"Retention: removed segment {os.path.basename(path)}")
+
+    def _backfill_step(self, conn: sqlite3.Connection):
+        backfill = self._backfills[0]
+        try:
+            more = backfill.step(conn)
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Background job {backfill.name} failed, will retry on next start: {e}")
+            more = False
+        if not more:
+            self._backfills.pop(0)
+
+    def _commit(self, conn: sqlite3.Connection, rows: int, callbacks: List[tuple]):
+        stored = True
+        if conn.in_transaction:
+            try:
+                conn.execute("COMMIT")
+                self.rows_written += rows
+                self.commits += 1
+                self._available()
+            except sqlite3.Error as e:
+                logger.error(f"DB commit failed, rolling back {rows} rows: {e}")
+                stored = self._spill(conn, e)
+        self._staged = []
+        _notify(callbacks, stored)
+
+    # --- spool (app/core/spool.py) ------------------------------------------
+
+    def _unavailable(self) -> bool:
+        """True while a recent failure keeps the writer off the database (batches go to the spool)."""
+        return self.spool is not None and time.monotonic() < self._retry_at
+
+    def _spill(self, conn: sqlite3.Connection, error: Exception, extra: List[tuple] = ()) -> bool:
+        """Roll back the open transaction and spool what it held plus ``extra``; False if any of it was lost."""
+        try:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        except sqlite3.Error:
+            pass
+        # Strings interned in this transaction are gone with it, and so are the row ids handed out
+        self._interner.forget()
+        work = self._staged + list(extra)
+        self._staged = []
+        for kind, _, _, items in work:
+            if kind == 'events':
+                for evt in items or ():
+                    if isinstance(evt, Event):
+                        evt.ref = None
+        self._failing(error)
+        return self._spool_all(work)
+
+    def _spool_all(self, work: List[tuple]) -> bool:
+        stored = [self.spool.append(kind, name, rows) for kind, name, rows, _ in work] if self.spool else [False] * len(work)
+        self.failed_batches += stored.count(False)
+        return all(stored)
+
+    def _failing(self, error: Exception):
+        if self.spool is None:
+            return
+        self._retry_delay = min(max(60.0, self.spool_retry), self._retry_delay * 2) if self._retry_delay else self.spool_retry
+        self._retry_at = time.monotonic() + self._retry_delay
+        logger.warning(f"Database unavailable ({error}); spooling to {self.spool.directory}, "
+                       f"retrying in {self._retry_delay:g}s")
+
+    def _available(self):
+        if self._retry_delay:
+            logger.info("Database writes succeed again; replaying the spool while idle")
+            self._retry_delay = 0.0
+
+    def _replay_step(self, conn: sqlite3.Connection):
+        """
+        Move one spooled record into SQLite.
+
+        The read position (``meta``) is committed with the rows when they go
+        to the main database. A commit spanning an attached partition is not
+        atomic under WAL, so partition rows are committed first together
+        with a marker in the partition file (``spool_replayed``), then the
+        rollups and read position in main; a crash in between finds the
+        marker and does not insert the rows again.
+        """
+        path = self.spool.segments()[0]
+        segment = os.path.basename(path)
+        key = 'spool:' + segment
+        try:
+            offset = max(int(get_meta(conn, key) or Spool.START), Spool.START)
+            record = self.spool.read(path, offset)
+            if record is None:
+                if self.spool.finish(path, offset):
+                    conn.execute("DELETE FROM meta WHERE key=?", (key,))
+                    logger.info(f"Replayed spool segment {segment}")
+                return
+            kind, name, rows, end = record
+            counts = None
+            if kind == 'events':
+                counts = rollups.count_events(rows)
+            elif kind == 'alert':
+                counts = rollups.count_alert(rows[0][1], rows[0][2])
+            # Attach outside the transaction
+            schema = self._insert_for(conn, name if self.partitions else None)[1] if kind == 'events' else 'main'
+            marker = (segment, offset)
+            if schema != 'main':
+                conn.execute("BEGIN")
+                if conn.execute(f"SELECT 1 FROM {schema}.spool_replayed WHERE segment=? AND offset=?",
+                                marker).fetchone() is None:
+                    self._write(conn, kind, name, rows, None)
+                    conn.execute(f"INSERT INTO {schema}.spool_replayed (segment, offset) VALUES (?, ?)", marker)
+                conn.execute("COMMIT")
+                conn.execute("BEGIN")
+                rollups.apply(conn, 'events', counts)
+            else:
+                conn.execute("BEGIN")
+                self._write(conn, kind, name, rows, counts)
+            set_meta(conn, key, end)
+            conn.execute("COMMIT")
+            if schema != 'main':
+                conn.execute(f"DELETE FROM {schema}.spool_replayed WHERE segment=? AND offset=?", marker)
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Spool replay failed: {e}")
+            self._staged = []
+            try:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            self._interner.forget()
+            self._failing(e)
+            return
+        self._staged = []
+        self.rows_written += len(rows)
+        self.commits += 1
+        self.spool.replayed_rows += len(rows)
+        self._available()
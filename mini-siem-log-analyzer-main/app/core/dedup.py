@@ -0,0 +1,157 @@
+import hashlib
+import math
+import threading
+import time
+from typing import List, Dict, Any, Optional
+
+from utils.logging import setup_logger
+
+logger = setup_logger("dedup")
+
+# Both WMI process inputs describe the same process creations: key them by pid and creation time
+_PROCESS_CHANNELS = ('ProcessWatcher', 'ProcessWatcherRT')
+
+
+def event_fingerprint(evt: Dict[str, Any]) -> str:
+    """
+    Stable identity of a logical event: channel, record id (or timestamp
+    when the source has none), event id and a hash of the message.
+
+    Events from the WMI process watchers carry no record id and their
+    timestamps are the time they were observed, so they are keyed on the
+    pid, the process creation time (``Win32_Process.CreationDate``, which
+    tells a reused pid apart) and the command line instead. That also
+    collapses the polled fallback and the real-time watcher reporting the
+    same process.
+    """
+    channel = evt.get('channel') or ''
+    message = evt.get('message') or ''
+    if channel in _PROCESS_CHANNELS and evt.get('pid') is not None:
+        key = (f"process\x1f{evt['pid']}\x1f{evt.get('creation_date')}\x1f{evt.get('event_id')}"
+               f"\x1f{evt.get('command') or message}")
+    else:
+        position = evt.get('record_id')
+        if position is None:
+            position = evt.get('timestamp')
+        msg_hash = hashlib.blake2b(message.encode('utf-8', 'replace'), digest_size=8).hexdigest()
+        key = f"{channel}\x1f{position}\x1f{evt.get('event_id')}\x1f{msg_hash}"
+    return hashlib.blake2b(key.encode('utf-8', 'replace'), digest_size=16).hexdigest()
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter sized for ``capacity`` items at ``error_rate``."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(1, int(capacity))
+        bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_bits = max(8, bits)
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, fp: str):
+        # Kirsch-Mitzenmacher double hashing over the two halves of the fingerprint
+        h1 = int(fp[:16], 16)
+        h2 = int(fp[16:], 16) | 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def __contains__(self, fp: str) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(fp))
+
+    def add(self, fp: str):
+        bits = self.bits
+        for p in self._positions(fp):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+class RotatingBloomFilter:
+    """
+    Two-generation Bloom filter with bounded memory.
+
+    New fingerprints go into the current generation; once it holds
+    ``capacity`` items (or is older than ``ttl_seconds``) the previous
+    generation is discarded and a fresh one started. A fingerprint is
+    therefore remembered for at least one full generation, and the overall
+    false-positive rate stays below about twice ``error_rate``.
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001, ttl_seconds: Optional[float] = None):
+        self.capacity = max(1, int(capacity))
+        self.error_rate = error_rate
+        self.ttl_seconds = ttl_seconds
+        self._current = BloomFilter(self.capacity, error_rate)
+        self._previous: Optional[BloomFilter] = None
+        self._started = time.monotonic()
+        self.rotations = 0
+
+    def _maybe_rotate(self):
+        expired = self.ttl_seconds is not None and time.monotonic() - self._started > self.ttl_seconds
+        if self._current.count >= self.capacity or expired:
+            self._previous = self._current
+            self._current = BloomFilter(self.capacity, self.error_rate)
+            self._started = time.monotonic()
+            self.rotations += 1
+
+    def __contains__(self, fp: str) -> bool:
+        return fp in self._current or (self._previous is not None and fp in self._previous)
+
+    def add(self, fp: str):
+        self._maybe_rotate()
+        self._current.add(fp)
+
+    def check_and_add(self, fp: str) -> bool:
+        """True if ``fp`` was (probably) seen before; records it either way."""
+        if fp in self:
+            return True
+        self.add(fp)
+        return False
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self._current.bits) + (len(self._previous.bits) if self._previous is not None else 0)
+
+
+class Deduplicator:
+    """
+    Drops events whose fingerprint was already seen, counting drops per
+    channel (the channel names the source that produced the event).
+
+    ``dedup`` config: ``capacity`` (fingerprints per generation),
+    ``error_rate`` (false-positive rate per generation, i.e. the chance a
+    new event is wrongly dropped) and optional ``ttl_seconds``.
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001, ttl_seconds: Optional[float] = None):
+        self._seen = RotatingBloomFilter(capacity, error_rate, ttl_seconds)
+        self._lock = threading.Lock()
+        self.dropped: Dict[str, int] = {}
+        self.passed = 0
+
+    def filter(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        unique: List[Dict[str, Any]] = []
+        dropped: Dict[str, int] = {}
+        with self._lock:
+            for evt in events:
+                if self._seen.check_and_add(event_fingerprint(evt)):
+                    channel = evt.get('channel') or 'unknown'
+                    dropped[channel] = dropped.get(channel, 0) + 1
+                else:
+                    unique.append(evt)
+            for channel, n in dropped.items():
+                self.dropped[channel] = self.dropped.get(channel, 0) + n
+            self.passed += len(unique)
+        if dropped:
+            logger.info(f"Dropped {sum(dropped.values())} duplicate events: {dropped}")
+        return unique
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'passed': self.passed,
+                'dropped': dict(self.dropped),
+                'rotations': self._seen.rotations,
+                'memory_bytes': self._seen.memory_bytes,
+            }
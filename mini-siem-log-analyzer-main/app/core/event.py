@@ -0,0 +1,131 @@
+import sys
+from typing import Dict, Any, Optional, Iterator, Tuple
+
+# Core fields every source fills in (possibly with None)
+FIELDS = ('timestamp', 'channel', 'event_id', 'record_id', 'user', 'ip', 'command', 'message', 'computer', 'pid')
+_FIELD_SET = frozenset(FIELDS)
+
+# Optional extension fields, kept in ``extra`` only on the events that carry them
+USB_FIELDS = ('usb_name', 'usb_model', 'usb_capacity_gb', 'usb_pnp_id', 'usb_kind')
+
+_intern = sys.intern
+
+
+class Event:
+    """
+    Compact typed event record passed between pipeline stages.
+
+    Core fields are slots (no per-instance ``__dict__``), channel names are
+    interned so every event shares one string object per channel, and
+    event ids are plain ints. Extension fields (USB details, anything a
+    source adds) go into ``extra``, which stays None for ordinary events.
+
+    During migration an Event also behaves like the dict it replaces:
+    ``evt.get('user')``, ``evt['ip'] = ...``, ``'usb_kind' in evt`` and
+    ``to_dict()`` for JSON export, so existing detectors keep working
+    unchanged while new code reads attributes directly (``evt.event_id``).
+
+    ``ref`` is set by the database writer once the event is stored:
+    ``(partition, row id)``, with ``''`` for the main events table. Alerts
+    use it to link their evidence; it is not part of the dict view.
+    """
+
+    __slots__ = FIELDS + ('extra', 'ref')
+
+    def __init__(self, timestamp: Optional[str] = None, channel: Optional[str] = None, event_id: Optional[int] = None,
+                 record_id: Optional[int] = None, user: Optional[str] = None, ip: Optional[str] = None,
+                 command: Optional[str] = None, message: Optional[str] = None, computer: Optional[str] = None,
+                 pid: Optional[int] = None, extra: Optional[Dict[str, Any]] = None):
+        self.timestamp = timestamp
+        self.channel = _intern(channel) if channel else channel
+        self.event_id = int(event_id) if event_id is not None else None
+        self.record_id = record_id
+        self.user = user
+        self.ip = ip
+        self.command = command
+        self.message = message
+        self.computer = computer
+        self.pid = pid
+        self.extra = extra or None
+        self.ref = None
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Event":
+        if isinstance(d, Event):
+            return d
+        get = d.get
+        extra = None
+        if any(k not in _FIELD_SET for k in d):
+            extra = {k: v for k, v in d.items() if k not in _FIELD_SET}
+        event_id = get('event_id')
+        try:
+            event_id = int(event_id) if event_id is not None else None
+        except (TypeError, ValueError):
+            event_id = None
+        return cls(get('timestamp'), get('channel'), event_id, get('record_id'), get('user'), get('ip'),
+                   get('command'), get('message'), get('computer'), get('pid'), extra)
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = {name: getattr(self, name) for name in FIELDS}
+        if self.extra:
+            d.update(self.extra)
+        return d
+
+    # --- dict-compatible view -------------------------------------------
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in _FIELD_SET:
+            return getattr(self, key)
+        if self.extra is not None:
+            return self.extra.get(key, default)
+        return default
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _FIELD_SET:
+            return getattr(self, key)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any):
+        if key in _FIELD_SET:
+            if key == 'channel' and value:
+                value = _intern(value)
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        return key in _FIELD_SET or (self.extra is not None and key in self.extra)
+
+    def keys(self) -> Iterator[str]:
+        yield from FIELDS
+        if self.extra:
+            yield from self.extra
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        for key in self.keys():
+            yield key, self[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return self.keys()
+
+    def __len__(self) -> int:
+        return len(FIELDS) + (len(self.extra) if self.extra else 0)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, Event):
+            other = other.to_dict()
+        return isinstance(other, dict) and self.to_dict() == other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Event({self.channel!r}, {self.event_id}, record_id={self.record_id}, timestamp={self.timestamp!r})"
+
+
+def as_dict(evt: Any) -> Dict[str, Any]:
+    """Plain dict for JSON/export, whether ``evt`` is an Event or already a dict."""
+    return evt.to_dict() if isinstance(evt, Event) else evt
@@ -1,12 +1,17 @@
-import win32evtlog
-import win32evtlogutil
-import win32con
-import json
-import os
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeout
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from utils.logging import setup_logger
-import subprocess
+from app.core.checkpoints import CheckpointStore
+from app.core.event import as_dict
+from app.core.feed import write_json_atomic
+from app.core.field_maps import FIELD_MAPS, extract_fields
+from app.core.ps_reader import PowerShellOperationalReader, CHANNEL as PS_CHANNEL
+try:
+    import win32evtlog
+except Exception:
+    win32evtlog = None
 try:
     import wmi
 except Exception:
@@ -14,114 +19,355 @@ except Exception:
 
 logger = setup_logger("event_collector")
 
-# Fallback process tracking when Security log (4688) not accessible
-_seen_pids: Dict[int, datetime] = {}
+# Fallback process tracking when Security log (4688) not accessible, keyed by (pid, CreationDate)
+_seen_pids: Dict[Tuple[int, Optional[str]], datetime] = {}
 _PROCESS_MAX_AGE_SECONDS = 300  # prune old pids to keep memory small
 
+# Used when the caller does not supply a persisted store
+_default_checkpoints = CheckpointStore()
+
+# Name of the WMI process fallback task next to the channel reads (it has no checkpoint)
+PROCESS_TASK = 'ProcessWatcher'
+
+# Streams 4104 records; started on first use, resumed from the channel checkpoint
+_ps_reader: Optional[PowerShellOperationalReader] = None
+
+
+def _get_ps_reader(checkpoints: CheckpointStore) -> PowerShellOperationalReader:
+    global _ps_reader
+    if _ps_reader is None:
+        cp = checkpoints.get(PS_CHANNEL)
+        _ps_reader = PowerShellOperationalReader(bookmark=cp.get('record_number') if cp else None)
+    _ps_reader.start()
+    return _ps_reader
+
+
+def stop_powershell_reader():
+    global _ps_reader
+    if _ps_reader is not None:
+        _ps_reader.stop()
+        _ps_reader = None
+
+
+def _record_to_event(channel: str, evt) -> Dict[str, Any]:
+    inserts = evt.StringInserts
+    event_id = evt.EventID & 0xFFFF
+    event = {
+        'timestamp': evt.TimeGenerated.isoformat() if evt.TimeGenerated else datetime.utcnow().isoformat(),
+        'channel': channel,
+        'event_id': event_id,
+        'record_id': evt.RecordNumber,
+        'user': inserts[0] if inserts else None,
+        'ip': None,
+        'command': None,
+        'message': ' '.join(i for i in inserts if i is not None) if inserts else ''
+    }
+    # Mapped event ids get their named fields (target user, IpAddress, CommandLine, ...) by position
+    if event_id in FIELD_MAPS:
+        event['user'] = None
+        event.update(extract_fields(event_id, inserts))
+    return event
+
+
+def _record_timestamp(evt) -> Optional[str]:
+    return evt.TimeGenerated.isoformat() if evt.TimeGenerated else None
+
+
+def _checkpoint_still_valid(handle, checkpoint: Dict[str, Any]) -> bool:
+    """Re-read the checkpointed record and make sure it is the one we saw (not a cleared + refilled log)."""
+    try:
+        flags = win32evtlog.EVENTLOG_SEEK_READ | win32evtlog.EVENTLOG_FORWARDS_READ
+        batch = win32evtlog.ReadEventLog(handle, flags, checkpoint['record_number'])
+    except Exception:
+        return False
+    if not batch or batch[0].RecordNumber != checkpoint['record_number']:
+        return False
+    return checkpoint.get('timestamp') is None or _record_timestamp(batch[0]) == checkpoint.get('timestamp')
 
-def collect_latest_events(channels: List[str], max_records: int = 250) -> List[Dict[str, Any]]:
+
+def _resolve_start(channel: str, handle, checkpoint: Optional[Dict[str, Any]], oldest: int, newest: int,
+                   max_records: int) -> int:
+    if not checkpoint:
+        # First run for this channel: behave like before and pick up only the newest max_records
+        return max(oldest, newest - max_records + 1)
+    last = checkpoint.get('record_number', 0)
+    if last > newest:
+        logger.warning(f"Channel {channel}: log was cleared (checkpoint {last} > newest {newest}); restarting at {oldest}")
+        return oldest
+    if last < oldest - 1:
+        logger.warning(f"Channel {channel}: log wrapped, {oldest - last - 1} records overwritten before they were read")
+        return oldest
+    if last >= oldest and not _checkpoint_still_valid(handle, checkpoint):
+        logger.warning(f"Channel {channel}: checkpoint record {last} changed (log cleared and refilled); restarting at {oldest}")
+        return oldest
+    return last + 1
+
+
+def _read_channel(channel: str, max_records: int,
+                  checkpoint: Optional[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Read records newer than ``checkpoint``, oldest first: (events, the
+    channel's checkpoint after them, None if it is reset). The caller
+    applies the checkpoint once it hands the events on.
+    """
     events: List[Dict[str, Any]] = []
-    for channel in channels:
-        channel_count = 0
-        try:
-            # Classic logs via OpenEventLog
-            if True:
-                handle = win32evtlog.OpenEventLog(None, channel)
-                flags = win32evtlog.EVENTLOG_BACKWARDS_READ | win32evtlog.EVENTLOG_SEQUENTIAL_READ
-                # Loop until we reach max_records or no more events returned
-                while channel_count < max_records:
-                    evt_batch = win32evtlog.ReadEventLog(handle, flags, 0)
-                    if not evt_batch:
-                        break
-                    for evt in evt_batch:
-                        if channel_count >= max_records:
-                            break
-                        events.append({
-                            'timestamp': evt.TimeGenerated.isoformat() if evt.TimeGenerated else datetime.utcnow().isoformat(),
-                            'channel': channel,
-                            'event_id': evt.EventID & 0xFFFF,
-                            'user': evt.StringInserts[0] if evt.StringInserts else None,
-                            'ip': None,
-                            'command': None,
-                            'message': ' '.join(evt.StringInserts) if evt.StringInserts else ''
-                        })
-                        channel_count += 1
-                win32evtlog.CloseEventLog(handle)
-                logger.info(f"Channel {channel}: collected {channel_count} events")
-        except Exception as e:
-            logger.error(f"Failed to read {channel}: {e}")
-
-    # Fallback: if Security log failed (no 4688 events) and WMI available, synthesize new process events
-    security_requested = any(ch.lower() == 'security' for ch in channels)
-    have_security_events = any(ev.get('channel') == 'Security' for ev in events)
-    if security_requested and not have_security_events and wmi:
-        try:
-            c = wmi.WMI()
-            current_time = datetime.utcnow()
-            # prune old pids
-            for pid, ts in list(_seen_pids.items()):
-                if (current_time - ts).total_seconds() > _PROCESS_MAX_AGE_SECONDS:
-                    del _seen_pids[pid]
-            for proc in c.Win32_Process():
-                pid = int(proc.ProcessId)
-                if pid not in _seen_pids:
-                    _seen_pids[pid] = current_time
-                    cmdline = proc.CommandLine or proc.Name or ''
-                    events.append({
-                        'timestamp': current_time.isoformat(),
-                        'channel': 'ProcessWatcher',
-                        'event_id': 4688,  # synthetic new process creation
-                        'user': None,
-                        'ip': None,
-                        'command': cmdline,
-                        'message': cmdline,
-                    })
-            logger.info(f"ProcessWatcher: synthesized {sum(1 for e in events if e.get('channel')=='ProcessWatcher')} process events")
-        except Exception as e:
-            logger.error(f"ProcessWatcher fallback failed: {e}")
-
-    # PowerShell Operational (4104) ingestion via PowerShell command (works without admin)
-    if any(ch.lower() == 'microsoft-windows-powershell/operational' for ch in channels):
-        try:
-            ps_cmd = (
-                "Get-WinEvent -LogName 'Microsoft-Windows-PowerShell/Operational' -MaxEvents 50 "
-                "| Where-Object {$_.Id -eq 4104} "
-                "| Select-Object TimeCreated, Id, Message | ConvertTo-Json -Compress"
-            )
-            result = subprocess.run([
-                'powershell.exe', '-NoProfile', '-ExecutionPolicy', 'Bypass', '-Command', ps_cmd
-            ], capture_output=True, text=True, timeout=8)
-            if result.returncode == 0 and result.stdout:
-                import json
-                try:
-                    items = json.loads(result.stdout)
-                    if isinstance(items, dict):
-                        items = [items]
-                    for it in items[:50]:
-                        msg = it.get('Message') or ''
-                        ts = it.get('TimeCreated') or datetime.utcnow().isoformat()
-                        events.append({
-                            'timestamp': ts,
-                            'channel': 'Microsoft-Windows-PowerShell/Operational',
-                            'event_id': 4104,
-                            'user': None,
-                            'ip': None,
-                            'command': msg,
-                            'message': msg,
-                        })
-                    logger.info(f"PowerShell Operational: collected {len([e for e in events if e.get('event_id')==4104])} events")
-                except Exception as je:
-                    snippet = (result.stdout or '')[:200]
-                    logger.error(f"Failed to parse 4104 JSON: {je} | Snippet: {snippet}")
-            else:
-                logger.error(f"Get-WinEvent 4104 failed: {result.stderr.strip()}")
-        except Exception as e:
-            logger.error(f"PowerShell Operational ingestion error: {e}")
-    logger.info(f"Total collected {len(events)} events")
+    handle = win32evtlog.OpenEventLog(None, channel)
+    try:
+        total = win32evtlog.GetNumberOfEventLogRecords(handle)
+        if total == 0:
+            if checkpoint:
+                logger.warning(f"Channel {channel}: log is empty, resetting checkpoint")
+            return events, None
+        oldest = win32evtlog.GetOldestEventLogRecord(handle)
+        newest = oldest + total - 1
+        start = _resolve_start(channel, handle, checkpoint, oldest, newest, max_records)
+        if start > newest:
+            return events, checkpoint
+
+        flags = win32evtlog.EVENTLOG_SEEK_READ | win32evtlog.EVENTLOG_FORWARDS_READ
+        last = None
+        while len(events) < max_records:
+            evt_batch = win32evtlog.ReadEventLog(handle, flags, start)
+            flags = win32evtlog.EVENTLOG_SEQUENTIAL_READ | win32evtlog.EVENTLOG_FORWARDS_READ
+            if not evt_batch:
+                break
+            for evt in evt_batch:
+                if evt.RecordNumber < start:
+                    continue
+                if len(events) >= max_records:
+                    break
+                events.append(_record_to_event(channel, evt))
+                last = evt
+        if last is not None:
+            checkpoint = {
+                'record_number': last.RecordNumber,
+                'timestamp': _record_timestamp(last),
+            }
+        return events, checkpoint
+    finally:
+        win32evtlog.CloseEventLog(handle)
+
+
+def _synthesize_process_events() -> List[Dict[str, Any]]:
+    """WMI fallback when Security (4688) is not readable: one synthetic event per newly seen pid."""
+    events: List[Dict[str, Any]] = []
+    c = wmi.WMI()
+    current_time = datetime.utcnow()
+    # prune old pids
+    for key, ts in list(_seen_pids.items()):
+        if (current_time - ts).total_seconds() > _PROCESS_MAX_AGE_SECONDS:
+            del _seen_pids[key]
+    for proc in c.Win32_Process():
+        pid = int(proc.ProcessId)
+        key = (pid, proc.CreationDate)  # a reused pid has a new creation time
+        if key not in _seen_pids:
+            _seen_pids[key] = current_time
+            cmdline = proc.CommandLine or proc.Name or ''
+            events.append({
+                'timestamp': current_time.isoformat(),
+                'channel': 'ProcessWatcher',
+                'event_id': 4688,  # synthetic new process creation
+                'pid': pid,
+                'creation_date': proc.CreationDate,
+                'user': None,
+                'ip': None,
+                'command': cmdline,
+                'message': cmdline,
+            })
     return events
 
 
+def _process_fallback(security: Optional[Future], timeout: float) -> List[Dict[str, Any]]:
+    """Runs on the pool: waits for the Security read and synthesizes process events only if it failed."""
+    if security is None:
+        return _synthesize_process_events()
+    try:
+        security.result(timeout=timeout)
+        return []  # Security is readable (an incremental read may legitimately return nothing)
+    except FutureTimeout:
+        return []  # undecided this cycle; Security will be retried
+    except Exception:
+        return _synthesize_process_events()
+
+
+def _drain_powershell(max_records: int, checkpoints: CheckpointStore) -> List[Dict[str, Any]]:
+    reader = _get_ps_reader(checkpoints)
+    ps_events = reader.drain(max_records)
+    if ps_events:
+        checkpoints.set(PS_CHANNEL, {
+            'record_number': reader.bookmark,
+            'timestamp': ps_events[-1].get('timestamp'),
+        })
+    return ps_events
+
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def _apply_checkpoint(checkpoints: CheckpointStore, channel: str, checkpoint: Optional[Dict[str, Any]]):
+    if checkpoint:
+        checkpoints.set(channel, checkpoint)
+    else:
+        checkpoints.reset(channel)
+
+
+class ChannelCollector:
+    """
+    Concurrent per-channel reads for one event log source: its thread pool,
+    the reads still running past their deadline (delivered by a later
+    ``collect``) and the per-task stats of the last call.
+    """
+
+    def __init__(self):
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_size = 0
+        self._inflight: Dict[str, Future] = {}
+        self.last_stats: Dict[str, Dict[str, Any]] = {}
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-task stats of the last ``collect`` call: events, seconds, status."""
+        return {k: dict(v) for k, v in self.last_stats.items()}
+
+    def close(self):
+        """Stop the pool; reads still in flight finish in the background and are discarded."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+            self._pool_size = 0
+        self._inflight = {}
+
+    def _get_pool(self, size: int) -> ThreadPoolExecutor:
+        if self._pool is None or self._pool_size < size:
+            old = self._pool
+            self._pool = ThreadPoolExecutor(max_workers=size, thread_name_prefix="collector")
+            self._pool_size = size
+            if old is not None:
+                old.shutdown(wait=False)
+        return self._pool
+
+    def collect(self, channels: List[str], max_records: int = 250, checkpoints: Optional[CheckpointStore] = None,
+                timeout: float = 5.0, timeouts: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+        """See ``collect_latest_events``."""
+        if checkpoints is None:
+            checkpoints = _default_checkpoints
+        timeouts = timeouts or {}
+        events: List[Dict[str, Any]] = []
+        stats: Dict[str, Dict[str, Any]] = {}
+        late_counts: Dict[str, int] = {}
+
+        def deliver(name: str, result) -> int:
+            # A channel's checkpoint moves only together with the events it covers
+            if name == PROCESS_TASK:
+                read = result
+            else:
+                read, checkpoint = result
+                _apply_checkpoint(checkpoints, name, checkpoint)
+            events.extend(read)
+            return len(read)
+
+        # Deliver reads that finished after their deadline in an earlier call
+        for name, fut in list(self._inflight.items()):
+            if fut.done():
+                del self._inflight[name]
+                try:
+                    result, elapsed = fut.result()
+                    late = deliver(name, result)
+                    late_counts[name] = late
+                    stats[name] = {'events': late, 'seconds': round(elapsed, 3), 'status': 'late', 'late_events': late}
+                except Exception as e:
+                    logger.error(f"Failed to read {name}: {e}")
+
+        classic = [ch for ch in channels if ch.lower() != PS_CHANNEL.lower()]  # Operational is streamed separately
+        if classic and win32evtlog is None:
+            for channel in classic:
+                logger.error(f"Failed to read {channel}: win32evtlog is not available")
+            classic = []
+
+        security = next((ch for ch in channels if ch.lower() == 'security'), None)
+        want_fallback = security is not None and wmi is not None
+        pool = self._get_pool(max(len(classic) + 1, 2))
+        started = time.monotonic()
+        submitted: Dict[str, Future] = {}
+        for channel in classic:
+            if channel in self._inflight:
+                stats[channel] = {'events': 0, 'seconds': 0.0, 'status': 'busy'}
+                continue
+            submitted[channel] = pool.submit(_timed, _read_channel, channel, max_records, checkpoints.get(channel))
+        if want_fallback and PROCESS_TASK not in self._inflight:
+            sec_future = submitted.get(security)
+            if sec_future is None and security in self._inflight:
+                sec_future = self._inflight[security]
+            sec_wait = timeouts.get(security, timeout)
+            submitted[PROCESS_TASK] = pool.submit(_timed, _process_fallback, sec_future, sec_wait)
+
+        # Each task has its own deadline measured from submission; stragglers stay in flight
+        for name, fut in sorted(submitted.items(), key=lambda kv: timeouts.get(kv[0], timeout)):
+            remaining = started + timeouts.get(name, timeout) - time.monotonic()
+            try:
+                result, elapsed = fut.result(timeout=max(0.0, remaining))
+                count = deliver(name, result)
+                stats[name] = {'events': count, 'seconds': round(elapsed, 3), 'status': 'ok'}
+            except FutureTimeout:
+                self._inflight[name] = fut
+                stats[name] = {'events': 0, 'seconds': round(time.monotonic() - started, 3), 'status': 'timeout'}
+                logger.warning(f"Channel {name}: no result within {timeouts.get(name, timeout)}s; will deliver later")
+            except Exception as e:
+                stats[name] = {'events': 0, 'seconds': round(time.monotonic() - started, 3), 'status': 'error'}
+                logger.error(f"Failed to read {name}: {e}")
+
+        for name, count in late_counts.items():
+            if 'late_events' not in stats[name]:  # a fresh read of the same channel replaced the 'late' entry
+                stats[name]['events'] += count
+                stats[name]['late_events'] = count
+
+        # PowerShell Operational (4104) via the long-lived PowerShell reader (works without admin); never blocks
+        if any(ch.lower() == PS_CHANNEL.lower() for ch in channels):
+            try:
+                ps_events, elapsed = _timed(_drain_powershell, max_records, checkpoints)
+                events.extend(ps_events)
+                stats[PS_CHANNEL] = {'events': len(ps_events), 'seconds': round(elapsed, 3), 'status': 'ok'}
+            except Exception as e:
+                stats[PS_CHANNEL] = {'events': 0, 'seconds': 0.0, 'status': 'error'}
+                logger.error(f"PowerShell Operational ingestion error: {e}")
+
+        self.last_stats = stats
+        summary = ', '.join(f"{k}={v['events']}/{v['seconds']}s/{v['status']}" for k, v in stats.items())
+        logger.info(f"Total collected {len(events)} events ({summary})")
+        return events
+
+
+# Backs the module-level functions for scripts; each WindowsEventLogSource has its own collector
+_default_collector = ChannelCollector()
+
+
+def last_collection_stats() -> Dict[str, Dict[str, Any]]:
+    """Per-task stats of the last ``collect_latest_events`` call: events, seconds, status."""
+    return _default_collector.stats()
+
+
+def collect_latest_events(channels: List[str], max_records: int = 250,
+                          checkpoints: Optional[CheckpointStore] = None,
+                          timeout: float = 5.0, timeouts: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+    """
+    Collect records written since the last call, per channel.
+
+    Each classic channel is read forward from its checkpoint (at most
+    ``max_records`` per call) on a thread pool, together with the WMI
+    process fallback, under its own deadline (``timeouts[channel]`` or
+    ``timeout`` seconds). A channel that misses its deadline is reported as
+    ``timeout`` and keeps running; its records are delivered by a later call
+    and it is not read again until it finishes. A channel's checkpoint in
+    ``checkpoints`` is advanced only when its records are returned (so a
+    late read never moves it ahead of the events handed out), but not
+    saved - call ``checkpoints.save()`` once the batch is persisted.
+    Timings are available from ``last_collection_stats``.
+    """
+    return _default_collector.collect(channels, max_records, checkpoints, timeout, timeouts)
+
+
 def export_latest_events(events: List[Dict[str, Any]], path: str):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(events, f, indent=2)
+    """Snapshot of the latest batch as a JSON array, replaced atomically (the feed in ``app/core/feed.py`` keeps history)."""
+    write_json_atomic(path, [as_dict(e) for e in events], separators=(',', ':'), default=str)
@@ -1,17 +1,139 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+import ipaddress
 import re
 
+# Starts with a character class so the regex engine can skip ahead quickly;
+# boundaries are checked by hand (a lookbehind would disable that).
+_IPV4 = re.compile(r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}")
+# Only used for the rare uncompressed IPv6 form; compressed ("::") addresses are located with str.find
+_IPV6_FULL = re.compile(r"[0-9A-Fa-f]{1,4}(?::[0-9A-Fa-f]{1,4}){7}")
+_IPV6_CHARS = frozenset("0123456789abcdefABCDEF:.")
+_WORD_CHARS = frozenset("0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_.")
 
-def normalize_event(evt: Dict[str, Any]) -> Dict[str, Any]:
-    msg = evt.get('message') or ''
-    cmd = evt.get('command') or ''
-    ip = None
-    # Extract simple IP
-    m = re.search(r"\b(\d{1,3}(?:\.\d{1,3}){3})\b", msg)
+# Formatted logon messages (Get-WinEvent / WMI) label the client address
+_ADDRESS_LABELS = ("Source Network Address:", "Client Address:", "Source Address:")
+_LOGON_EVENT_IDS = frozenset((4624, 4625, 4648, 4771, 4776))
+# Message text that never carries the event's network source (script blocks, synthetic USB events)
+_NO_IP_SCAN_EVENT_IDS = frozenset((4104, 9999))
+
+# Placeholders Windows writes when there is no address
+_NO_ADDRESS = frozenset(('-', '', '0.0.0.0', '::'))
+
+
+def clean_ip(value: Optional[str]) -> Optional[str]:
+    """Validate an address string; IPv4-mapped IPv6 becomes plain IPv4, placeholders become None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value in _NO_ADDRESS:
+        return None
+    if value.lower().startswith('::ffff:') and '.' in value:
+        value = value[7:]
+    address, _, zone = value.partition('%')
+    try:
+        addr = ipaddress.ip_address(address)
+    except ValueError:
+        return None
+    if addr.is_unspecified:
+        return None
+    return f"{addr}%{zone}" if zone and addr.version == 6 else str(addr)
+
+
+def _labelled_address(msg: str) -> Optional[str]:
+    for label in _ADDRESS_LABELS:
+        i = msg.find(label)
+        if i >= 0:
+            rest = msg[i + len(label):i + len(label) + 64].split(None, 1)
+            return rest[0] if rest else '-'
+    return None
+
+
+def _first_ipv4(msg: str):
+    for m in _IPV4.finditer(msg):
+        start, end = m.span()
+        # Reject pieces of longer dotted runs (file versions like 10.0.19041.1) and words
+        if start and msg[start - 1] in _WORD_CHARS:
+            continue
+        if end < len(msg) and msg[end] in _WORD_CHARS and not (msg[end] == '.' and not msg[end + 1:end + 2].isdigit()):
+            continue
+        text = m.group()
+        if text != '0.0.0.0' and all(int(part) <= 255 for part in text.split('.')):
+            return start, text
+    return None
+
+
+def _first_ipv6(msg: str):
+    i = msg.find('::')
+    while i >= 0:
+        start = i
+        while start and msg[start - 1] in _IPV6_CHARS:
+            start -= 1
+        end = i + 2
+        while end < len(msg) and msg[end] in _IPV6_CHARS:
+            end += 1
+        if end < len(msg) and msg[end] == '%':  # zone id, e.g. fe80::1%12
+            end += 1
+            while end < len(msg) and msg[end].isalnum():
+                end += 1
+        ip = clean_ip(msg[start:end].rstrip('.'))
+        if ip:
+            return start, ip
+        i = msg.find('::', end)
+    m = _IPV6_FULL.search(msg) if msg.count(':') >= 7 else None
     if m:
-        ip = m.group(1)
-    evt['ip'] = evt.get('ip') or ip
-    # Extract PowerShell command from message if present
-    if not cmd and 'powershell' in msg.lower():
-        evt['command'] = msg
-    return evt
+        ip = clean_ip(m.group())
+        if ip:
+            return m.start(), ip
+    return None
+
+
+def _scan_ip(msg: str) -> Optional[str]:
+    """First valid IPv4/IPv6 address in the message, by position."""
+    v4 = _first_ipv4(msg) if '.' in msg else None
+    v6 = _first_ipv6(msg) if ':' in msg else None
+    if v4 and v6:
+        return v4[1] if v4[0] < v6[0] else v6[1]
+    found = v4 or v6
+    return found[1] if found else None
+
+
+def normalize_events(events: List[Any]) -> List[Any]:
+    """
+    Normalize a batch in place (dicts or ``Event`` records) and return it.
+
+    Structured fields win: an event that already carries ``ip`` (e.g.
+    4625 IpAddress from the field maps or the EVTX reader) or ``command``
+    (4104 ScriptBlockText) is not scanned for it. Logon events with a
+    formatted message take the labelled source address rather than the
+    first address-looking token; 4104 script text and synthetic USB
+    events are never mined for an IP. Everything else gets one regex
+    pass for IPv4 plus a ``::`` lookup for IPv6, earliest address wins.
+    """
+    for evt in events:
+        msg = evt.get('message') or ''
+        if not msg:
+            continue
+        want_ip = not evt.get('ip')
+        want_ps = not evt.get('command')
+
+        if want_ip:
+            event_id = evt.get('event_id')
+            ip = None
+            if event_id in _LOGON_EVENT_IDS:
+                labelled = _labelled_address(msg)
+                if labelled is not None:
+                    evt['ip'] = clean_ip(labelled)
+                    want_ip = False
+            if want_ip and event_id not in _NO_IP_SCAN_EVENT_IDS:
+                ip = _scan_ip(msg)
+            if want_ip:
+                evt['ip'] = ip
+
+        # Extract PowerShell command from message if present
+        if want_ps and 'powershell' in msg.lower():
+            evt['command'] = msg
+    return events
+
+
+def normalize_event(evt: Dict[str, Any]) -> Dict[str, Any]:
+    return normalize_events([evt])[0]
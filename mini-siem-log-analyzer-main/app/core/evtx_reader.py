@@ -0,0 +1,582 @@
+"""
+Pure-Python streaming reader for exported ``.evtx`` files.
+
+The file is memory-mapped and walked chunk by chunk (64 KiB each); every
+record's BinXML is decoded just far enough to fill the event dicts that
+``normalize_events`` expects. Templates are parsed once per chunk and
+cached. With ``workers > 1`` chunks are parsed in a process pool, one
+chunk per task, and yielded back in file order.
+"""
+import mmap
+import os
+import struct
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+
+from app.core.field_maps import FIELD_MAPS, extract_named
+
+FILE_MAGIC = b"ElfFile\x00"
+CHUNK_MAGIC = b"ElfChnk\x00"
+RECORD_MAGIC = 0x00002a2a
+FILE_HEADER_SIZE = 4096
+CHUNK_SIZE = 65536
+CHUNK_HEADER_SIZE = 512
+
+_EPOCH_1601 = datetime(1601, 1, 1)
+
+# BinXML tokens (low nibble; 0x40 is the "more data / has attributes" flag)
+_TOK_EOF = 0x00
+_TOK_OPEN_START = 0x01
+_TOK_CLOSE_START = 0x02
+_TOK_CLOSE_EMPTY = 0x03
+_TOK_END_ELEMENT = 0x04
+_TOK_VALUE = 0x05
+_TOK_ATTRIBUTE = 0x06
+_TOK_CDATA = 0x07
+_TOK_CHARREF = 0x08
+_TOK_ENTITYREF = 0x09
+_TOK_PI_TARGET = 0x0A
+_TOK_PI_DATA = 0x0B
+_TOK_TEMPLATE_INSTANCE = 0x0C
+_TOK_NORMAL_SUB = 0x0D
+_TOK_OPTIONAL_SUB = 0x0E
+_TOK_FRAGMENT_HEADER = 0x0F
+
+# Substitution value types
+_T_NULL = 0x00
+_T_WSTRING = 0x01
+_T_ASTRING = 0x02
+_T_BOOL = 0x0D
+_T_BINARY = 0x0E
+_T_GUID = 0x0F
+_T_SIZET = 0x10
+_T_FILETIME = 0x11
+_T_SYSTEMTIME = 0x12
+_T_SID = 0x13
+_T_HEXINT32 = 0x14
+_T_HEXINT64 = 0x15
+_T_BINXML = 0x21
+_T_ARRAY = 0x80
+
+_FIXED = {
+    0x03: struct.Struct('<b'), 0x04: struct.Struct('<B'),
+    0x05: struct.Struct('<h'), 0x06: struct.Struct('<H'),
+    0x07: struct.Struct('<i'), 0x08: struct.Struct('<I'),
+    0x09: struct.Struct('<q'), 0x0A: struct.Struct('<Q'),
+    0x0B: struct.Struct('<f'), 0x0C: struct.Struct('<d'),
+}
+
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+
+# EventData names that map onto the normalized event fields
+_USER_FIELDS = ('TargetUserName', 'SubjectUserName', 'AccountName', 'UserName')
+_IP_FIELDS = ('IpAddress', 'SourceAddress', 'ClientAddress')
+_COMMAND_FIELDS = ('CommandLine', 'ScriptBlockText', 'HostApplication')
+_EMPTY_VALUES = ('', '-', None)
+
+
+class EvtxError(Exception):
+    pass
+
+
+class _Element:
+    __slots__ = ('name', 'attrs', 'children')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.attrs: List[Tuple[str, list]] = []
+        self.children: list = []
+
+
+class _Sub:
+    __slots__ = ('index',)
+
+    def __init__(self, index: int):
+        self.index = index
+
+
+class _Instance:
+    """A template instance: the cached template tree plus this record's substitution values."""
+    __slots__ = ('root', 'values')
+
+    def __init__(self, root, values: list):
+        self.root = root
+        self.values = values
+
+
+def filetime_to_datetime(ft: int) -> datetime:
+    return _EPOCH_1601 + timedelta(microseconds=ft // 10)
+
+
+def _format_guid(b: bytes) -> str:
+    d1, d2, d3 = struct.unpack_from('<IHH', b)
+    tail = b[8:16].hex()
+    return f"{{{d1:08X}-{d2:04X}-{d3:04X}-{tail[:4].upper()}-{tail[4:].upper()}}}"
+
+
+def _format_sid(b: bytes) -> str:
+    if len(b) < 8:
+        return b.hex()
+    revision, count = b[0], b[1]
+    authority = int.from_bytes(b[2:8], 'big')
+    subs = [str(_U32.unpack_from(b, 8 + 4 * i)[0]) for i in range(min(count, (len(b) - 8) // 4))]
+    return '-'.join(['S', str(revision), str(authority)] + subs)
+
+
+def _format_systemtime(b: bytes) -> str:
+    year, month, _dow, day, hour, minute, second, ms = struct.unpack_from('<8H', b)
+    try:
+        return datetime(year, month, day, hour, minute, second, ms * 1000).isoformat()
+    except ValueError:
+        return ''
+
+
+class _ChunkParser:
+    """Parses the records of one chunk; offsets in BinXML are relative to the chunk start."""
+
+    def __init__(self, buf: bytes):
+        self.buf = buf
+        self._names: Dict[int, str] = {}
+        self._templates: Dict[int, _Element] = {}
+        self._plans: Dict[int, List[tuple]] = {}
+
+    # -- structure -----------------------------------------------------------------
+    def _name(self, offset: int, start: int, pos: int) -> Tuple[str, int]:
+        """
+        Read the name at ``offset``. Names defined after the token at ``start``
+        are stored inline, so ``pos`` is advanced past them.
+        """
+        name = self._names.get(offset)
+        count = _U16.unpack_from(self.buf, offset + 6)[0]
+        if name is None:
+            name = self.buf[offset + 8:offset + 8 + count * 2].decode('utf-16le', errors='replace')
+            self._names[offset] = name
+        if offset > start:
+            pos += 8 + count * 2 + 2
+        return name, pos
+
+    def _element(self, pos: int) -> Tuple[_Element, int]:
+        buf = self.buf
+        token = buf[pos]
+        name_off = _U32.unpack_from(buf, pos + 7)[0]
+        after = pos + 11
+        if token & 0x40:
+            after += 4  # attribute list size
+        name, pos = self._name(name_off, pos, after)
+        elem = _Element(name)
+        # Attributes, then CloseStartElement / CloseEmptyElement
+        while True:
+            tok = buf[pos]
+            base = tok & 0x0F
+            if base == _TOK_ATTRIBUTE:
+                attr_name, pos = self._name(_U32.unpack_from(buf, pos + 1)[0], pos, pos + 5)
+                value, pos = self._content(pos, single=True)
+                elem.attrs.append((attr_name, value))
+            elif base == _TOK_CLOSE_EMPTY:
+                return elem, pos + 1
+            elif base == _TOK_CLOSE_START:
+                pos += 1
+                break
+            else:
+                raise EvtxError(f"unexpected token 0x{tok:02x} in element {name}")
+        children, pos = self._content(pos)
+        elem.children = children
+        return elem, pos
+
+    def _content(self, pos: int, single: bool = False) -> Tuple[list, int]:
+        """Parse child nodes until EndElement/EOF (or exactly one value node when ``single``)."""
+        buf = self.buf
+        nodes: list = []
+        while True:
+            tok = buf[pos]
+            base = tok & 0x0F
+            if base == _TOK_OPEN_START:
+                elem, pos = self._element(pos)
+                nodes.append(elem)
+            elif base == _TOK_VALUE:
+                vtype = buf[pos + 1]
+                count = _U16.unpack_from(buf, pos + 2)[0]
+                raw = buf[pos + 4:pos + 4 + count * 2]
+                nodes.append(raw.decode('utf-16le', errors='replace') if vtype == _T_WSTRING else raw.hex())
+                pos += 4 + count * 2
+            elif base in (_TOK_NORMAL_SUB, _TOK_OPTIONAL_SUB):
+                nodes.append(_Sub(_U16.unpack_from(buf, pos + 1)[0]))
+                pos += 4
+            elif base == _TOK_CDATA:
+                count = _U16.unpack_from(buf, pos + 1)[0]
+                nodes.append(buf[pos + 3:pos + 3 + count * 2].decode('utf-16le', errors='replace'))
+                pos += 3 + count * 2
+            elif base == _TOK_CHARREF:
+                nodes.append(chr(_U16.unpack_from(buf, pos + 1)[0]))
+                pos += 3
+            elif base == _TOK_ENTITYREF:
+                ent, pos = self._name(_U32.unpack_from(buf, pos + 1)[0], pos, pos + 5)
+                nodes.append({'lt': '<', 'gt': '>', 'amp': '&', 'quot': '"', 'apos': "'"}.get(ent, ''))
+            elif base == _TOK_PI_TARGET:
+                _, pos = self._name(_U32.unpack_from(buf, pos + 1)[0], pos, pos + 5)
+            elif base == _TOK_PI_DATA:
+                pos += 3 + _U16.unpack_from(buf, pos + 1)[0] * 2
+            elif base == _TOK_FRAGMENT_HEADER:
+                pos += 4
+                continue
+            elif base == _TOK_TEMPLATE_INSTANCE:
+                # The template's own EOF ends the stream; substitution values follow the instance directly
+                inst, pos = self._instance(pos)
+                nodes.append(inst)
+                return nodes, pos
+            elif base == _TOK_END_ELEMENT or base == _TOK_EOF:
+                return nodes, pos + 1
+            else:
+                raise EvtxError(f"unknown BinXML token 0x{tok:02x} at {pos}")
+            if single:
+                return nodes, pos
+
+    def _template(self, offset: int) -> Tuple[_Element, int]:
+        """Template definition at ``offset``: 24-byte header (next, guid, size) then its BinXML body."""
+        size = _U32.unpack_from(self.buf, offset + 20)[0]
+        end = offset + 24 + size
+        root = self._templates.get(offset)
+        if root is None:
+            nodes, _ = self._content(offset + 24)
+            root = nodes[0] if nodes else _Element('')
+            self._templates[offset] = root
+        return root, end
+
+    def _instance(self, pos: int) -> Tuple[_Instance, int]:
+        buf = self.buf
+        tmpl_off = _U32.unpack_from(buf, pos + 6)[0]
+        root, end = self._template(tmpl_off)
+        # Resident template: the definition follows the instance header inline
+        pos = end if tmpl_off > pos else pos + 10
+        count = _U32.unpack_from(buf, pos)[0]
+        pos += 4
+        decls = [(_U16.unpack_from(buf, pos + 4 * i)[0], buf[pos + 4 * i + 2]) for i in range(count)]
+        pos += 4 * count
+        values = []
+        for size, vtype in decls:
+            values.append(self._value(pos, size, vtype))
+            pos += size
+        return _Instance(root, values), pos
+
+    def _value(self, pos: int, size: int, vtype: int):
+        if size == 0 or vtype == _T_NULL:
+            return None
+        raw = self.buf[pos:pos + size]
+        if vtype == _T_WSTRING:
+            return raw.decode('utf-16le', errors='replace').rstrip('\x00')
+        if vtype == _T_ASTRING:
+            return raw.decode('latin-1').rstrip('\x00')
+        fixed = _FIXED.get(vtype)
+        if fixed is not None:
+            return fixed.unpack_from(raw)[0]
+        if vtype == _T_BOOL:
+            return 'true' if _U32.unpack_from(raw)[0] else 'false'
+        if vtype == _T_BINARY:
+            return raw.hex().upper()
+        if vtype == _T_GUID:
+            return _format_guid(raw)
+        if vtype == _T_SIZET or vtype == _T_HEXINT32 or vtype == _T_HEXINT64:
+            return hex(int.from_bytes(raw, 'little'))
+        if vtype == _T_FILETIME:
+            return filetime_to_datetime(_U64.unpack_from(raw)[0]).isoformat()
+        if vtype == _T_SYSTEMTIME:
+            return _format_systemtime(raw)
+        if vtype == _T_SID:
+            return _format_sid(raw)
+        if vtype == _T_BINXML:
+            nodes, _ = self._content(pos)
+            return nodes[0] if nodes else None
+        if vtype == _T_WSTRING | _T_ARRAY:
+            return [s for s in raw.decode('utf-16le', errors='replace').split('\x00') if s]
+        if vtype & _T_ARRAY:
+            fixed = _FIXED.get(vtype & 0x7F)
+            if fixed is not None:
+                return [v[0] for v in fixed.iter_unpack(raw[:len(raw) - len(raw) % fixed.size])]
+        return raw.hex()
+
+    # -- records ---------------------------------------------------------------------
+    def records(self) -> Iterator[Dict[str, Any]]:
+        buf = self.buf
+        free = min(_U32.unpack_from(buf, 48)[0], len(buf))
+        pos = CHUNK_HEADER_SIZE
+        while pos + 28 <= free:
+            magic, size = struct.unpack_from('<II', buf, pos)
+            if magic != RECORD_MAGIC or size < 28 or pos + size > len(buf):
+                break
+            record_id, written = struct.unpack_from('<QQ', buf, pos + 8)
+            try:
+                nodes, _ = self._content(pos + 24)
+                system: Dict[str, Any] = {}
+                data: Dict[str, Any] = {}
+                inserts: List[str] = []
+                for node in nodes:
+                    if isinstance(node, _Instance):
+                        steps = self._plans.get(id(node.root))
+                        if steps is None:
+                            steps = self._plans[id(node.root)] = _compile(node.root)
+                        _render(steps, node.values, system, data, inserts)
+                    elif isinstance(node, _Element):
+                        _walk_sections(node.children, [], system, data, inserts)
+                yield _to_event(system, data, inserts, record_id, written)
+            except (EvtxError, IndexError, struct.error):
+                pass  # corrupt record: skip it, keep the rest of the chunk
+            pos += size
+
+
+# -- rendering -------------------------------------------------------------------------
+def _resolve(node, values):
+    """Turn a template node into its value for this record (str/int/None or a nested node)."""
+    if isinstance(node, _Sub):
+        return values[node.index] if node.index < len(values) else None
+    return node
+
+
+def _text(nodes: list, values: list) -> Optional[str]:
+    if len(nodes) == 1:
+        n = nodes[0]
+        if n.__class__ is _Sub:
+            n = values[n.index] if n.index < len(values) else None
+        if n is None or n.__class__ in (_Element, _Instance):
+            return None
+        if n.__class__ is str:
+            return n
+        return ' '.join(str(x) for x in n) if isinstance(n, list) else str(n)
+    parts = []
+    for n in nodes:
+        n = _resolve(n, values)
+        if n is None or isinstance(n, (_Element, _Instance)):
+            continue
+        if isinstance(n, list):
+            parts.append(' '.join(str(x) for x in n))
+        else:
+            parts.append(str(n))
+    return ''.join(parts) if parts else None
+
+
+def _attr(elem: _Element, name: str, values: list) -> Optional[str]:
+    for attr_name, nodes in elem.attrs:
+        if attr_name == name:
+            return _text(nodes, values)
+    return None
+
+
+def _elements(nodes: list, values: list) -> Iterator[Tuple[_Element, list]]:
+    """Child elements with the value list they resolve against (descends into nested instances)."""
+    for n in nodes:
+        n = _resolve(n, values)
+        if isinstance(n, _Element):
+            yield n, values
+        elif isinstance(n, _Instance):
+            yield n.root, n.values
+
+
+def _collect_data(elem: _Element, values: list, data: Dict[str, Any], inserts: List[str]):
+    """EventData/UserData: named <Data> items (or leaf elements) in document order."""
+    for child, vals in _elements(elem.children, values):
+        if any(True for _ in _elements(child.children, vals)):
+            _collect_data(child, vals, data, inserts)
+            continue
+        _add_data(child, vals, data, inserts)
+
+
+def _add_data(item: _Element, values: list, data: Dict[str, Any], inserts: List[str]):
+    key = _attr(item, 'Name', values) if item.name == 'Data' else item.name
+    text = _text(item.children, values)
+    if key:
+        data[key] = text
+    if text is not None:
+        inserts.append(text)
+
+
+def _add_system(item: _Element, values: list, system: Dict[str, Any]):
+    if item.name == 'TimeCreated':
+        system['TimeCreated'] = _attr(item, 'SystemTime', values)
+    elif item.name == 'Provider':
+        system['Provider'] = _attr(item, 'Name', values)
+    elif item.name == 'Security':
+        system['UserID'] = _attr(item, 'UserID', values)
+    else:
+        system[item.name] = _text(item.children, values)
+
+
+def _walk_sections(nodes: list, values: list, system: Dict[str, Any], data: Dict[str, Any], inserts: List[str]):
+    for section, vals in _elements(nodes, values):
+        if section.name == 'System':
+            for item, ivals in _elements(section.children, vals):
+                _add_system(item, ivals, system)
+        elif section.name in ('EventData', 'UserData'):
+            _collect_data(section, vals, data, inserts)
+
+
+def _compile(root: _Element) -> List[tuple]:
+    """
+    Flatten a record template into render steps so the tree is walked once
+    per template instead of once per record. Substitutions in structural
+    positions (embedded BinXML) become dynamic steps walked per record.
+    """
+    steps: List[tuple] = []
+
+    def data_steps(elem: _Element):
+        for child in elem.children:
+            if isinstance(child, _Sub):
+                steps.append(('dyn_data', child))
+            elif isinstance(child, _Element):
+                if any(isinstance(c, _Element) for c in child.children):
+                    data_steps(child)
+                else:
+                    steps.append(('data', child))
+
+    for section in root.children if root.name == 'Event' else [root]:
+        if isinstance(section, _Sub):
+            steps.append(('dyn_section', section))
+        elif isinstance(section, _Element) and section.name == 'System':
+            for item in section.children:
+                if isinstance(item, _Sub):
+                    steps.append(('dyn_system', item))
+                elif isinstance(item, _Element):
+                    steps.append(('system', item))
+        elif isinstance(section, _Element) and section.name in ('EventData', 'UserData'):
+            data_steps(section)
+    return steps
+
+
+def _render(steps: List[tuple], values: list, system: Dict[str, Any], data: Dict[str, Any], inserts: List[str]):
+    for kind, node in steps:
+        if kind == 'system':
+            _add_system(node, values, system)
+        elif kind == 'data':
+            _add_data(node, values, data, inserts)
+        else:
+            v = _resolve(node, values)
+            if not isinstance(v, (_Element, _Instance)):
+                continue
+            elem, vals = (v.root, v.values) if isinstance(v, _Instance) else (v, values)
+            if kind == 'dyn_section':
+                _walk_sections([elem], vals, system, data, inserts)
+            elif kind == 'dyn_system':
+                _add_system(elem, vals, system)
+            elif any(True for _ in _elements(elem.children, vals)):
+                _collect_data(elem, vals, data, inserts)
+            else:
+                _add_data(elem, vals, data, inserts)
+
+
+def _to_event(system: Dict[str, Any], data: Dict[str, Any], inserts: List[str], record_id: int,
+              written: int) -> Dict[str, Any]:
+    try:
+        event_id = int(system.get('EventID') or 0) & 0xFFFF
+    except ValueError:
+        event_id = 0
+    try:
+        record_id = int(system.get('EventRecordID') or record_id)
+    except ValueError:
+        pass
+    timestamp = system.get('TimeCreated') or filetime_to_datetime(written).isoformat()
+    if timestamp.endswith('Z'):
+        timestamp = timestamp[:-1]
+
+    def first(names):
+        for n in names:
+            v = data.get(n)
+            if v not in _EMPTY_VALUES:
+                return v
+        return None
+
+    event = {
+        'timestamp': timestamp,
+        'channel': system.get('Channel'),
+        'event_id': event_id,
+        'record_id': record_id,
+        'user': first(_USER_FIELDS) or system.get('UserID'),
+        'ip': first(_IP_FIELDS),
+        'command': first(_COMMAND_FIELDS),
+        'message': ' '.join(inserts),
+        'computer': system.get('Computer'),
+    }
+    # Same structured keys as the live collector for the mapped event ids
+    if event_id in FIELD_MAPS:
+        event.update(extract_named(event_id, data))
+    return event
+
+
+# -- file level ------------------------------------------------------------------------
+def chunk_offsets(mm) -> List[int]:
+    """Offsets of every initialised chunk (the header's chunk count is not trusted)."""
+    if mm[:8] != FILE_MAGIC:
+        raise EvtxError("not an EVTX file (bad magic)")
+    offsets = []
+    pos = FILE_HEADER_SIZE
+    while pos + CHUNK_SIZE <= len(mm):
+        if mm[pos:pos + 8] == CHUNK_MAGIC:
+            offsets.append(pos)
+        pos += CHUNK_SIZE
+    return offsets
+
+
+def chunk_last_record_id(mm, offset: int) -> int:
+    return _U64.unpack_from(mm, offset + 32)[0]
+
+
+def parse_chunk(mm, offset: int) -> List[Dict[str, Any]]:
+    return list(_ChunkParser(bytes(mm[offset:offset + CHUNK_SIZE])).records())
+
+
+# Per-process state for pool workers: each worker maps the file once
+_worker_mm = None
+
+
+def _worker_init(path: str):
+    global _worker_mm
+    # The map holds its own descriptor, so the file can be closed right away;
+    # the map itself is closed when the worker process exits.
+    with open(path, 'rb') as f:
+        _worker_mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    Finalize(_worker_mm, _worker_mm.close, exitpriority=10)
+
+
+def _worker_parse(offset: int) -> List[Dict[str, Any]]:
+    return parse_chunk(_worker_mm, offset)
+
+
+def read_evtx(path: str, workers: int = 1, after_record_id: int = 0) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily yield event dicts from an ``.evtx`` file in file order.
+
+    ``workers > 1`` parses chunks in a process pool (one chunk per task,
+    at most ``2 * workers`` in flight). Records with an id up to
+    ``after_record_id`` are skipped, whole chunks at a time when possible.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < FILE_HEADER_SIZE:
+            raise EvtxError(f"{path}: file too small")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offsets = [o for o in chunk_offsets(mm) if chunk_last_record_id(mm, o) > after_record_id]
+            if workers <= 1:
+                for off in offsets:
+                    for evt in parse_chunk(mm, off):
+                        if evt['record_id'] > after_record_id:
+                            yield evt
+                return
+            with ProcessPoolExecutor(max_workers=workers, initializer=_worker_init, initargs=(path,)) as pool:
+                pending: deque = deque()
+                it = iter(offsets)
+                for off in it:
+                    pending.append(pool.submit(_worker_parse, off))
+                    if len(pending) >= workers * 2:
+                        break
+                while pending:
+                    batch = pending.popleft().result()
+                    nxt = next(it, None)
+                    if nxt is not None:
+                        pending.append(pool.submit(_worker_parse, nxt))
+                    for evt in batch:
+                        if evt['record_id'] > after_record_id:
+                            yield evt
+        finally:
+            mm.close()
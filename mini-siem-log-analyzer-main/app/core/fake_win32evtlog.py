@@ -0,0 +1,149 @@
+"""
+In-memory stand-in for the parts of ``win32evtlog`` used by the collector.
+
+Lets the checkpointed reader be exercised on Linux:
+
+    from app.core import fake_win32evtlog
+    fake_win32evtlog.install()
+    log = fake_win32evtlog.get_log("Security")
+    log.append(4625, ["S-1-0-0", "-", "-", "0x0", "S-1-0-0", "admin"])
+
+Record numbers keep growing across wraparound and restart at 1 after
+``clear()``, like the real Windows event log service.
+"""
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+EVENTLOG_SEQUENTIAL_READ = 0x0001
+EVENTLOG_SEEK_READ = 0x0002
+EVENTLOG_FORWARDS_READ = 0x0004
+EVENTLOG_BACKWARDS_READ = 0x0008
+
+ERROR_INVALID_PARAMETER = 87
+
+
+class error(Exception):
+    """Mirrors ``pywintypes.error`` (winerror, funcname, strerror)."""
+
+    def __init__(self, winerror: int, funcname: str, strerror: str):
+        super().__init__(winerror, funcname, strerror)
+        self.winerror = winerror
+        self.funcname = funcname
+        self.strerror = strerror
+
+
+class FakeEventLogRecord:
+    def __init__(self, record_number: int, event_id: int, inserts: Optional[List[str]],
+                 time_generated: datetime, source: str, computer: str):
+        self.RecordNumber = record_number
+        self.EventID = event_id
+        self.StringInserts = tuple(inserts) if inserts is not None else None
+        self.TimeGenerated = time_generated
+        self.TimeWritten = time_generated
+        self.SourceName = source
+        self.ComputerName = computer
+        self.EventType = 0
+        self.EventCategory = 0
+
+
+class FakeEventLog:
+    def __init__(self, name: str, max_records: Optional[int] = None):
+        self.name = name
+        self.max_records = max_records
+        self.records: List[FakeEventLogRecord] = []
+        self._next_number = 1
+        self._clock = datetime(2024, 1, 1)
+
+    def append(self, event_id: int, inserts: Optional[List[str]] = None, time_generated: Optional[datetime] = None,
+               source: str = "Fake", computer: str = "FAKEHOST") -> FakeEventLogRecord:
+        if time_generated is None:
+            self._clock += timedelta(seconds=1)
+            time_generated = self._clock
+        rec = FakeEventLogRecord(self._next_number, event_id, inserts, time_generated, source, computer)
+        self._next_number += 1
+        self.records.append(rec)
+        # Wraparound: overwrite the oldest records once the log is full
+        if self.max_records is not None and len(self.records) > self.max_records:
+            del self.records[:len(self.records) - self.max_records]
+        return rec
+
+    def clear(self):
+        self.records = []
+        self._next_number = 1
+
+    @property
+    def oldest(self) -> int:
+        return self.records[0].RecordNumber if self.records else 0
+
+
+class _Handle:
+    def __init__(self, log: FakeEventLog):
+        self.log = log
+        self.cursor: Optional[int] = None  # next record number for sequential reads
+        self.closed = False
+
+
+_logs: Dict[str, FakeEventLog] = {}
+batch_size = 16
+
+
+def get_log(channel: str, max_records: Optional[int] = None) -> FakeEventLog:
+    log = _logs.get(channel)
+    if log is None:
+        log = _logs[channel] = FakeEventLog(channel, max_records)
+    return log
+
+
+def reset():
+    _logs.clear()
+
+
+def OpenEventLog(server, channel: str) -> _Handle:
+    return _Handle(get_log(channel))
+
+
+def CloseEventLog(handle: _Handle):
+    handle.closed = True
+
+
+def GetOldestEventLogRecord(handle: _Handle) -> int:
+    return handle.log.oldest
+
+
+def GetNumberOfEventLogRecords(handle: _Handle) -> int:
+    return len(handle.log.records)
+
+
+def ReadEventLog(handle: _Handle, flags: int, offset: int) -> List[FakeEventLogRecord]:
+    records = handle.log.records
+    if not records:
+        return []
+    oldest = records[0].RecordNumber
+    newest = records[-1].RecordNumber
+    backwards = bool(flags & EVENTLOG_BACKWARDS_READ)
+    if flags & EVENTLOG_SEEK_READ:
+        if offset < oldest or offset > newest:
+            raise error(ERROR_INVALID_PARAMETER, "ReadEventLog", "The parameter is incorrect.")
+        start = offset
+    elif handle.cursor is not None:
+        start = handle.cursor
+    else:
+        start = newest if backwards else oldest
+
+    batch: List[FakeEventLogRecord] = []
+    number = start
+    while oldest <= number <= newest and len(batch) < batch_size:
+        batch.append(records[number - oldest])
+        number += -1 if backwards else 1
+    handle.cursor = number
+    return batch
+
+
+def install():
+    """Register this module as ``win32evtlog`` and point the collector at it."""
+    module = sys.modules[__name__]
+    sys.modules['win32evtlog'] = module
+    from app.core import event_collector
+    event_collector.win32evtlog = module
+    return module
@@ -0,0 +1,288 @@
+"""
+Append-only NDJSON event feed.
+
+The export stage appends each normalized batch to ``events-<seq>.ndjson``
+segments in ``export.feed_dir``: one compact JSON object per line, each
+batch in a single write, so a segment only ever grows. A segment is
+rolled over once it reaches ``feed_segment_mb`` or has been open for
+``feed_rotate_minutes``; the oldest are deleted beyond
+``feed_keep_segments``.
+
+``index.json`` lists the segments with their global byte offset
+(``base``), size, record count and ``ts_us`` range, and is replaced
+atomically (temp file + rename). A rollover creates the new segment and
+then publishes an index with the old one ``sealed``. Offsets are global
+and never reused, so a consumer keeps one number, reads from it and only
+ever sees complete lines (``FeedReader``, or the ``feed`` event source).
+"""
+import glob
+import json
+import os
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.core.event import as_dict
+from app.core.migrations import to_epoch_us
+from utils.logging import setup_logger
+
+logger = setup_logger("feed")
+
+INDEX = 'index.json'
+
+
+def write_json_atomic(path: str, data: Any, **kwargs):
+    """Write ``data`` as JSON to a temp file and rename it over ``path``; readers see the old or the new file."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, **kwargs)
+    os.replace(tmp, path)
+
+
+def read_index(directory: str) -> List[Dict[str, Any]]:
+    try:
+        with open(os.path.join(directory, INDEX), 'r', encoding='utf-8') as f:
+            return json.load(f).get('segments', [])
+    except FileNotFoundError:
+        return []
+
+
+def _line_end(f, end: int, floor: int = 0) -> int:
+    """Position just past the last newline in ``f`` before ``end`` (``floor`` if there is none)."""
+    while end > floor:
+        start = max(floor, end - 65536)
+        f.seek(start)
+        chunk = f.read(end - start)
+        cut = chunk.rfind(b'\n')
+        if cut >= 0:
+            return start + cut + 1
+        end = start
+    return floor
+
+
+class EventFeed:
+    """Writer side; ``append`` is safe to call from several export workers."""
+
+    def __init__(self, directory: str, segment_mb: float = 64, rotate_minutes: float = 60, keep_segments: int = 48):
+        self.directory = directory
+        self.segment_bytes = max(1, int(float(segment_mb) * 2**20))
+        self.rotate_seconds = max(1.0, float(rotate_minutes) * 60)
+        self.keep_segments = max(1, int(keep_segments))
+        self.records = 0
+        self.bytes = 0
+        self.rollovers = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._opened = 0.0
+        os.makedirs(directory, exist_ok=True)
+        self._segments = self._recover()
+
+    def append(self, events: List[Any]):
+        if not events:
+            return
+        lines = [json.dumps(as_dict(e), separators=(',', ':'), default=str) for e in events]
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        stamps = [ts for ts in (to_epoch_us(e.get('timestamp')) for e in events) if ts is not None]
+        with self._lock:
+            seg = self._active(len(data))
+            try:
+                self._file.write(data)
+                self._file.flush()
+            except OSError:
+                self._seal_partial(seg, data, events)
+                raise
+            seg['bytes'] += len(data)
+            seg['records'] += len(events)
+            if stamps:
+                lo, hi = min(stamps), max(stamps)
+                seg['min_ts_us'] = lo if seg['min_ts_us'] is None else min(seg['min_ts_us'], lo)
+                seg['max_ts_us'] = hi if seg['max_ts_us'] is None else max(seg['max_ts_us'], hi)
+            self.records += len(events)
+            self.bytes += len(data)
+            self._publish()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._publish()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'segments': len(self._segments),
+            'records': self.records,
+            'bytes': self.bytes,
+            'rollovers': self.rollovers,
+            'end_offset': self._segments[-1]['base'] + self._segments[-1]['bytes'] if self._segments else 0,
+        }
+
+    # --- internals (lock held) -----------------------------------------
+
+    def _recover(self) -> List[Dict[str, Any]]:
+        """Load the index and seal what the last run left open (dropping a torn final line)."""
+        segments = [s for s in read_index(self.directory) if os.path.exists(self._path(s))]
+        known = {s['name'] for s in segments}
+        for path in glob.glob(os.path.join(self.directory, 'events-*.ndjson')):
+            if os.path.basename(path) not in known:
+                os.remove(path)  # created by a rollover whose index was never published
+        if segments:
+            last = segments[-1]
+            path = self._path(last)
+            size = os.path.getsize(path)
+            with open(path, 'rb+') as f:
+                end = _line_end(f, size)
+                if end < size:
+                    f.truncate(end)
+                    logger.warning(f"Feed segment {last['name']} ended in a partial line; truncated to {end} bytes")
+            last['bytes'] = end
+            last['sealed'] = True
+        return segments
+
+    def _seal_partial(self, seg: Dict[str, Any], data: bytes, events: List[Any]):
+        """
+        Seal ``seg`` after a failed write of ``data``. Readers may already have
+        consumed the complete lines that reached the file, so the segment ends
+        after the last of them and the torn rest is truncated; if the file
+        cannot be inspected it is cut back to its recorded end.
+        """
+        start = seg['bytes']
+        try:
+            self._file.close()
+        except OSError:
+            pass
+        self._file = None
+        path = self._path(seg)
+        try:
+            with open(path, 'rb+') as f:
+                size = f.seek(0, os.SEEK_END)
+                end = _line_end(f, min(size, start + len(data)), start)
+                if end < size:
+                    f.truncate(end)
+        except OSError as e:
+            logger.error(f"Feed segment {seg['name']}: could not trim a failed write ({e}); cutting it back to {start} bytes")
+            end = start
+            try:
+                os.truncate(path, start)
+            except OSError as e:
+                logger.error(f"Feed segment {seg['name']}: could not truncate: {e}")
+        count = data[:end - start].count(b'\n')
+        if count:
+            stamps = [ts for ts in (to_epoch_us(e.get('timestamp')) for e in events[:count]) if ts is not None]
+            if stamps:
+                lo, hi = min(stamps), max(stamps)
+                seg['min_ts_us'] = lo if seg['min_ts_us'] is None else min(seg['min_ts_us'], lo)
+                seg['max_ts_us'] = hi if seg['max_ts_us'] is None else max(seg['max_ts_us'], hi)
+            logger.warning(f"Feed segment {seg['name']}: kept {count} of {len(events)} events of a failed write")
+        seg['bytes'] = end
+        seg['records'] += count
+        self.records += count
+        self.bytes += end - start
+        seg['sealed'] = True
+        self._publish()
+
+    def _path(self, seg: Dict[str, Any]) -> str:
+        return os.path.join(self.directory, seg['name'])
+
+    def _active(self, incoming: int) -> Dict[str, Any]:
+        if self._file is not None:
+            seg = self._segments[-1]
+            fresh = time.monotonic() - self._opened < self.rotate_seconds
+            if fresh and (seg['bytes'] == 0 or seg['bytes'] + incoming <= self.segment_bytes):
+                return seg
+            self._file.close()
+            self._file = None
+            self.rollovers += 1
+        return self._rollover()
+
+    def _rollover(self) -> Dict[str, Any]:
+        prev = self._segments[-1] if self._segments else None
+        seq = int(prev['name'][7:-7]) + 1 if prev else 1
+        seg = {
+            'name': f"events-{seq:08d}.ndjson",
+            'base': prev['base'] + prev['bytes'] if prev else 0,
+            'bytes': 0,
+            'records': 0,
+            'min_ts_us': None,
+            'max_ts_us': None,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'sealed': False,
+        }
+        self._file = open(self._path(seg), 'xb')
+        self._opened = time.monotonic()
+        if prev:
+            prev['sealed'] = True
+        self._segments.append(seg)
+        expired = self._segments[:-self.keep_segments]
+        self._segments = self._segments[-self.keep_segments:]
+        self._publish()
+        for old in expired:
+            try:
+                os.remove(self._path(old))
+            except OSError as e:
+                logger.warning(f"Could not delete feed segment {old['name']}: {e}")
+        return seg
+
+    def _publish(self):
+        try:
+            write_json_atomic(os.path.join(self.directory, INDEX), {'version': 1, 'segments': self._segments})
+        except OSError as e:
+            # e.g. a reader holding the index open on Windows; the next batch publishes again
+            logger.warning(f"Could not update feed index: {e}")
+
+
+class FeedReader:
+    """Reads complete lines from a feed directory, starting at a global byte offset."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def segments(self) -> List[Dict[str, Any]]:
+        return read_index(self.directory)
+
+    def offset_for_time(self, ts: Any) -> int:
+        """Offset of the first segment that may hold events at or after ``ts`` (ISO string, datetime or epoch us)."""
+        ts_us = to_epoch_us(ts)
+        segments = self.segments()
+        for seg in segments:
+            if ts_us is None or seg['max_ts_us'] is None or seg['max_ts_us'] >= ts_us:
+                return seg['base']
+        return segments[-1]['base'] + segments[-1]['bytes'] if segments else 0
+
+    def read(self, offset: int, max_records: int = 1000) -> Tuple[List[Dict[str, Any]], int, bool]:
+        """(events, next offset, at_end) from ``offset``; a line still being written is left for later."""
+        events: List[Dict[str, Any]] = []
+        segments = self.segments()
+        if segments and offset < segments[0]['base']:
+            logger.warning(f"Feed offset {offset} was already rotated away; resuming at {segments[0]['base']}")
+            offset = segments[0]['base']
+        for seg in segments:
+            end = seg['base'] + seg['bytes']
+            if seg['sealed'] and offset >= end:
+                continue
+            try:
+                f = open(os.path.join(self.directory, seg['name']), 'rb')
+            except FileNotFoundError:
+                continue  # removed by rotation since the index was read
+            with f:
+                f.seek(offset - seg['base'])
+                while len(events) < max_records and not (seg['sealed'] and offset >= end):
+                    line = f.readline()
+                    if not line.endswith(b'\n'):
+                        break
+                    offset += len(line)
+                    line = line.strip()
+                    if line:
+                        try:
+                            events.append(json.loads(line))
+                        except ValueError as e:
+                            logger.error(f"Feed {seg['name']}: skipping malformed line before offset {offset}: {e}")
+            if len(events) >= max_records:
+                return events, offset, False
+            if not seg['sealed']:
+                return events, offset, True
+            offset = end
+        return events, offset, True
@@ -0,0 +1,157 @@
+"""
+Positional StringInserts layouts for the event ids the detectors use.
+
+``win32evtlog`` hands back a record's EventData as an anonymous tuple of
+strings; the position of each named field is fixed per event id (and
+matches the order of the ``<Data Name=...>`` elements in the XML view).
+``extract_fields`` turns those inserts into the structured event keys
+once at ingest so no later stage has to search the message text.
+"""
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+from app.core.event_parser import clean_ip
+
+# event id -> EventData field name -> StringInserts index
+FIELD_MAPS: Dict[int, Dict[str, int]] = {
+    # An account was successfully logged on
+    4624: {
+        'SubjectUserSid': 0, 'SubjectUserName': 1, 'SubjectDomainName': 2, 'SubjectLogonId': 3,
+        'TargetUserSid': 4, 'TargetUserName': 5, 'TargetDomainName': 6, 'TargetLogonId': 7,
+        'LogonType': 8, 'LogonProcessName': 9, 'AuthenticationPackageName': 10, 'WorkstationName': 11,
+        'LogonGuid': 12, 'TransmittedServices': 13, 'LmPackageName': 14, 'KeyLength': 15,
+        'ProcessId': 16, 'ProcessName': 17, 'IpAddress': 18, 'IpPort': 19,
+    },
+    # An account failed to log on
+    4625: {
+        'SubjectUserSid': 0, 'SubjectUserName': 1, 'SubjectDomainName': 2, 'SubjectLogonId': 3,
+        'TargetUserSid': 4, 'TargetUserName': 5, 'TargetDomainName': 6, 'Status': 7,
+        'FailureReason': 8, 'SubStatus': 9, 'LogonType': 10, 'LogonProcessName': 11,
+        'AuthenticationPackageName': 12, 'WorkstationName': 13, 'TransmittedServices': 14,
+        'LmPackageName': 15, 'KeyLength': 16, 'ProcessId': 17, 'ProcessName': 18,
+        'IpAddress': 19, 'IpPort': 20,
+    },
+    # A logon was attempted using explicit credentials
+    4648: {
+        'SubjectUserSid': 0, 'SubjectUserName': 1, 'SubjectDomainName': 2, 'SubjectLogonId': 3,
+        'LogonGuid': 4, 'TargetUserName': 5, 'TargetDomainName': 6, 'TargetLogonGuid': 7,
+        'TargetServerName': 8, 'TargetInfo': 9, 'ProcessId': 10, 'ProcessName': 11,
+        'IpAddress': 12, 'IpPort': 13,
+    },
+    # A new process has been created
+    4688: {
+        'SubjectUserSid': 0, 'SubjectUserName': 1, 'SubjectDomainName': 2, 'SubjectLogonId': 3,
+        'NewProcessId': 4, 'NewProcessName': 5, 'TokenElevationType': 6, 'ProcessId': 7,
+        'CommandLine': 8, 'TargetUserSid': 9, 'TargetUserName': 10, 'TargetDomainName': 11,
+        'TargetLogonId': 12, 'ParentProcessName': 13, 'MandatoryLabel': 14,
+    },
+    # A user account was created
+    4720: {
+        'TargetUserName': 0, 'TargetDomainName': 1, 'TargetSid': 2,
+        'SubjectUserSid': 3, 'SubjectUserName': 4, 'SubjectDomainName': 5, 'SubjectLogonId': 6,
+    },
+    # A user account was locked out
+    4740: {
+        'TargetUserName': 0, 'TargetDomainName': 1, 'TargetSid': 2,
+        'SubjectUserSid': 3, 'SubjectUserName': 4, 'SubjectDomainName': 5, 'SubjectLogonId': 6,
+    },
+    # Kerberos pre-authentication failed
+    4771: {
+        'TargetUserName': 0, 'TargetSid': 1, 'ServiceName': 2, 'TicketOptions': 3, 'Status': 4,
+        'PreAuthType': 5, 'IpAddress': 6, 'IpPort': 7,
+    },
+    # The computer attempted to validate the credentials for an account (NTLM)
+    4776: {'PackageName': 0, 'TargetUserName': 1, 'Workstation': 2, 'Status': 3},
+    # PowerShell script block logging
+    4104: {'MessageNumber': 0, 'MessageTotal': 1, 'ScriptBlockText': 2, 'ScriptBlockId': 3, 'Path': 4},
+    # A service was installed in the system
+    7045: {'ServiceName': 0, 'ImagePath': 1, 'ServiceType': 2, 'StartType': 3, 'AccountName': 4},
+}
+
+# EventData field name -> event key. The common columns (user/ip/command)
+# are picked per event id below; everything else lands under its own key.
+EVENT_KEYS: Dict[str, str] = {
+    'IpAddress': 'ip',
+    'IpPort': 'ip_port',
+    'LogonType': 'logon_type',
+    'TargetUserName': 'target_user',
+    'TargetDomainName': 'target_domain',
+    'SubjectUserName': 'subject_user',
+    'WorkstationName': 'workstation',
+    'Workstation': 'workstation',
+    'Status': 'status',
+    'SubStatus': 'sub_status',
+    'NewProcessName': 'process_name',
+    'ProcessName': 'process_name',
+    'ParentProcessName': 'parent_process',
+    'CommandLine': 'command',
+    'ScriptBlockText': 'command',
+    'ServiceName': 'service_name',
+    'ImagePath': 'command',
+}
+
+# Which field is "the user" of each event; logon events default to the target account
+USER_FIELD: Dict[int, str] = {
+    4688: 'SubjectUserName',
+    4104: '',
+    7045: 'AccountName',
+}
+
+_EMPTY = ('', '-', None)
+_INT_KEYS = ('logon_type', 'ip_port')
+
+_compiled: Dict[int, List[Tuple[int, str]]] = {}
+
+
+def _plan(event_id: int) -> Optional[List[Tuple[int, str]]]:
+    """(insert index, event key) pairs for an event id, built once."""
+    plan = _compiled.get(event_id)
+    if plan is None:
+        layout = FIELD_MAPS.get(event_id)
+        if layout is None:
+            return None
+        user_field = USER_FIELD.get(event_id, 'TargetUserName')
+        plan = [(pos, EVENT_KEYS[name]) for name, pos in layout.items() if name in EVENT_KEYS]
+        if user_field:
+            plan.append((layout[user_field], 'user'))
+        _compiled[event_id] = plan
+    return plan
+
+
+def _convert(key: str, value: Any) -> Any:
+    if key == 'ip':
+        return clean_ip(value)
+    if key in _INT_KEYS:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    return value
+
+
+def extract_fields(event_id: int, inserts: Optional[Sequence[Any]]) -> Dict[str, Any]:
+    """Structured keys from a record's positional StringInserts ({} for unmapped ids)."""
+    plan = _plan(event_id)
+    if plan is None or not inserts:
+        return {}
+    fields: Dict[str, Any] = {}
+    count = len(inserts)
+    for pos, key in plan:
+        if pos < count:
+            value = inserts[pos]
+            if value not in _EMPTY:
+                value = _convert(key, value)
+                if value is not None:
+                    fields[key] = value
+    return fields
+
+
+def extract_named(event_id: int, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Same keys from named EventData (EVTX / XML), for the ids in ``FIELD_MAPS``."""
+    layout = FIELD_MAPS.get(event_id)
+    if layout is None or not data:
+        return {}
+    inserts = [None] * len(layout)
+    for name, pos in layout.items():
+        if name in data:
+            inserts[pos] = data[name]
+    return extract_fields(event_id, inserts)
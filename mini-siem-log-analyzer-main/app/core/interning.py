@@ -0,0 +1,91 @@
+"""
+Interning of repeated event text.
+
+The same service-start message and svchost command line arrive thousands
+of times a day. Each database (main and every partition) stores each
+distinct text once in ``strings(id, hash, text)`` and event rows carry
+``message_id``/``command_id``; readers use the ``events_v`` view, which
+joins the text back.
+
+The writer resolves text through a per-database LRU cache, so only the
+first occurrence of a string (or one evicted from the cache) costs a
+lookup by hash (CRC-32, collisions settled by comparing the text) and
+possibly an insert.
+"""
+import sqlite3
+import zlib
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+from utils.logging import setup_logger
+
+logger = setup_logger("interning")
+
+
+def text_hash(text: str) -> int:
+    return zlib.crc32(text.encode('utf-8', 'surrogatepass'))
+
+
+class StringInterner:
+    """text -> strings.id per attached schema; ``cache_kb`` bounds the cached text per schema."""
+
+    def __init__(self, cache_kb: int = 16384):
+        self.cache_chars = max(1, int(cache_kb)) * 1024
+        self._caches: Dict[str, "OrderedDict[str, int]"] = {}
+        self._sizes: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.inserted = 0
+
+    def rows(self, conn: sqlite3.Connection, schema: str, rows: List[tuple]) -> List[tuple]:
+        """Insert rows ending in (command, message) -> same rows ending in (command_id, message_id)."""
+        cache = self._caches.get(schema)
+        if cache is None:
+            cache = self._caches[schema] = OrderedDict()
+            self._sizes[schema] = 0
+        out = []
+        for row in rows:
+            out.append(row[:6] + (self._id(conn, schema, cache, row[6]), self._id(conn, schema, cache, row[7])))
+        return out
+
+    def _id(self, conn: sqlite3.Connection, schema: str, cache: "OrderedDict[str, int]", text: Any) -> Optional[int]:
+        if text is None:
+            return None
+        sid = cache.get(text)
+        if sid is not None:
+            cache.move_to_end(text)
+            self.hits += 1
+            return sid
+        self.misses += 1
+        text = str(text)
+        h = text_hash(text)
+        for row_id, stored in conn.execute(f"SELECT id, text FROM {schema}.strings WHERE hash = ?", (h,)):
+            if stored == text:
+                sid = row_id
+                break
+        else:
+            sid = conn.execute(f"INSERT INTO {schema}.strings(hash, text) VALUES(?, ?)", (h, text)).lastrowid
+            self.inserted += 1
+        cache[text] = sid
+        self._sizes[schema] += len(text)
+        while self._sizes[schema] > self.cache_chars and len(cache) > 1:
+            old, _ = cache.popitem(last=False)
+            self._sizes[schema] -= len(old)
+        return sid
+
+    def forget(self, schema: Optional[str] = None):
+        """Drop cached ids (a schema was detached, or a rollback may have discarded new strings)."""
+        if schema is None:
+            self._caches.clear()
+            self._sizes.clear()
+        else:
+            self._caches.pop(schema, None)
+            self._sizes.pop(schema, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'inserted': self.inserted,
+            'cached': sum(len(c) for c in self._caches.values()),
+        }
@@ -0,0 +1,367 @@
+"""
+Versioned schema migrations for the SQLite store.
+
+Each migration is ``(version, description, step)`` where ``step`` is SQL
+or a callable taking the connection. ``run_migrations`` applies the ones
+newer than ``PRAGMA user_version``, each in its own transaction that also
+bumps the version, so an interrupted upgrade resumes at the first
+unapplied step.
+
+Data rewrites that would take minutes on large tables (``ts_us``
+backfill) are not migrations: they are resumable ``Backfill`` jobs whose
+cursor lives in the ``meta`` table and that the writer runs in small
+chunks while idle.
+"""
+import sqlite3
+from datetime import datetime, timezone
+from typing import List, Tuple, Union, Callable, Optional, Any
+
+from utils.logging import setup_logger
+
+logger = setup_logger("migrations")
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_epoch_us(ts: Any) -> Optional[int]:
+    """ISO-8601 timestamp (naive = UTC, 'Z' or offset accepted) -> integer epoch microseconds."""
+    if not ts:
+        return None
+    if isinstance(ts, datetime):
+        dt = ts
+    else:
+        try:
+            dt = datetime.fromisoformat(ts[:-1] + '+00:00' if ts.endswith('Z') else ts)
+        except (TypeError, ValueError):
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def from_epoch_us(us: int) -> str:
+    return datetime.fromtimestamp(us / 1_000_000, tz=timezone.utc).replace(tzinfo=None).isoformat()
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _add_epoch_columns(conn: sqlite3.Connection):
+    if 'ts_us' not in _columns(conn, 'events'):
+        conn.execute("ALTER TABLE events ADD COLUMN ts_us INTEGER")
+    if 'created_us' not in _columns(conn, 'alerts'):
+        conn.execute("ALTER TABLE alerts ADD COLUMN created_us INTEGER")
+
+
+def fts5_available() -> bool:
+    try:
+        sqlite3.connect(':memory:').execute("CREATE VIRTUAL TABLE t USING fts5(x)")
+        return True
+    except sqlite3.Error:
+        return False
+
+
+# External-content FTS5 index over events.message/command, kept current by triggers
+# (so every writer path, including the group-commit writer, indexes in the same transaction)
+EVENTS_FTS_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(message, command, content='events', content_rowid='id')",
+    """CREATE TRIGGER IF NOT EXISTS events_fts_ai AFTER INSERT ON events BEGIN
+        INSERT INTO events_fts(rowid, message, command) VALUES (new.id, new.message, new.command);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS events_fts_ad AFTER DELETE ON events BEGIN
+        INSERT INTO events_fts(events_fts, rowid, message, command) VALUES ('delete', old.id, old.message, old.command);
+    END""",
+)
+
+
+def _create_events_fts(conn: sqlite3.Connection) -> bool:
+    if not fts5_available():
+        logger.warning("SQLite was built without FTS5; event search falls back to LIKE scans")
+        return False
+    for stmt in EVENTS_FTS_SQL:
+        conn.execute(stmt)
+    return True
+
+
+def _main_events_fts(conn: sqlite3.Connection):
+    # Rows already in the table are indexed later, in chunks, by the writer (app/core/search.py)
+    if _create_events_fts(conn):
+        bound = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        if bound:
+            set_meta(conn, 'backfill:events_fts', f"0:{bound}")
+
+
+def _partition_events_fts(conn: sqlite3.Connection):
+    # A partition is at most a day of rows: index whatever is already there in one go
+    if _create_events_fts(conn):
+        conn.execute("INSERT INTO events_fts(events_fts) VALUES('rebuild')")
+
+
+# Repeated message/command text is stored once per database in ``strings``; event rows carry
+# message_id/command_id (app/core/interning.py) and readers go through the ``events_v`` view.
+# Rows written before this keep their inline text, which the view falls back to.
+STRINGS_SQL = (
+    "CREATE TABLE IF NOT EXISTS strings (id INTEGER PRIMARY KEY, hash INTEGER NOT NULL, text TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_strings_hash ON strings(hash)",
+    """CREATE VIEW IF NOT EXISTS events_v AS
+        SELECT e.id AS id, e.timestamp AS timestamp, e.ts_us AS ts_us, e.channel AS channel, e.event_id AS event_id,
+               e.user AS user, e.ip AS ip, COALESCE(c.text, e.command) AS command, COALESCE(m.text, e.message) AS message
+        FROM events e LEFT JOIN strings m ON m.id = e.message_id LEFT JOIN strings c ON c.id = e.command_id""",
+)
+
+# FTS content moves to the view (so snippets and rebuilds see the text); triggers resolve the ids
+EVENTS_FTS_V_SQL = (
+    "DROP TRIGGER IF EXISTS events_fts_ai",
+    "DROP TRIGGER IF EXISTS events_fts_ad",
+    "DROP TABLE IF EXISTS events_fts",
+    "CREATE VIRTUAL TABLE events_fts USING fts5(message, command, content='events_v', content_rowid='id')",
+    """CREATE TRIGGER events_fts_ai AFTER INSERT ON events BEGIN
+        INSERT INTO events_fts(rowid, message, command) VALUES (new.id,
+            COALESCE((SELECT text FROM strings WHERE id = new.message_id), new.message),
+            COALESCE((SELECT text FROM strings WHERE id = new.command_id), new.command));
+    END""",
+    """CREATE TRIGGER events_fts_ad AFTER DELETE ON events BEGIN
+        INSERT INTO events_fts(events_fts, rowid, message, command) VALUES ('delete', old.id,
+            COALESCE((SELECT text FROM strings WHERE id = old.message_id), old.message),
+            COALESCE((SELECT text FROM strings WHERE id = old.command_id), old.command));
+    END""",
+)
+
+
+def _intern_strings(conn: sqlite3.Connection) -> bool:
+    """Shared part of main v7 / partition v4; True if the FTS index was recreated and needs filling."""
+    for column in ('message_id', 'command_id'):
+        if column not in _columns(conn, 'events'):
+            conn.execute(f"ALTER TABLE events ADD COLUMN {column} INTEGER")
+    for stmt in STRINGS_SQL:
+        conn.execute(stmt)
+    if not fts5_available():
+        return False
+    for stmt in EVENTS_FTS_V_SQL:
+        conn.execute(stmt)
+    return True
+
+
+def _main_intern_strings(conn: sqlite3.Connection):
+    # Re-indexed in chunks by the writer, like the original FTS backfill
+    if _intern_strings(conn):
+        bound = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        set_meta(conn, 'backfill:events_fts', f"0:{bound}" if bound else 'done')
+
+
+def _partition_intern_strings(conn: sqlite3.Connection):
+    if _intern_strings(conn):
+        conn.execute("INSERT INTO events_fts(events_fts) VALUES('rebuild')")
+
+
+def _create_rollups(conn: sqlite3.Connection):
+    # Maintained by the writer, read by app/core/rollups.py; NULL dimensions are stored as '' / 0
+    for g in ('1m', '1h', '1d'):
+        conn.execute(f"""CREATE TABLE IF NOT EXISTS rollup_events_{g} (
+            bucket_us INTEGER NOT NULL, channel TEXT NOT NULL, event_id INTEGER NOT NULL, count INTEGER NOT NULL,
+            PRIMARY KEY (bucket_us, channel, event_id)) WITHOUT ROWID""")
+        conn.execute(f"""CREATE TABLE IF NOT EXISTS rollup_alerts_{g} (
+            bucket_us INTEGER NOT NULL, severity TEXT NOT NULL, count INTEGER NOT NULL,
+            PRIMARY KEY (bucket_us, severity)) WITHOUT ROWID""")
+    # Existing rows still need counting; Database._init turns this into a concrete plan
+    set_meta(conn, 'backfill:rollups', 'pending')
+
+
+ALERT_LINK_COLUMNS = ('rule_id', 'fingerprint', 'ip', 'user', 'host', 'device_serial')
+
+
+def _alert_links(conn: sqlite3.Connection):
+    # Written by Database.insert_alert; evidence links name the partition ('' = main events) and its row id
+    existing = _columns(conn, 'alerts')
+    for column in ALERT_LINK_COLUMNS:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE alerts ADD COLUMN {column} TEXT")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_alerts_{column}_created ON alerts({column}, created_us)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS alert_events (
+        alert_id INTEGER NOT NULL, partition TEXT NOT NULL, event_row INTEGER NOT NULL,
+        PRIMARY KEY (alert_id, partition, event_row)) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_alert_events_event ON alert_events(partition, event_row)")
+
+
+def _alert_repeats(conn: sqlite3.Connection):
+    # Repeats suppressed by the alert cooldown bump the stored alert (Database.repeat_alert)
+    existing = _columns(conn, 'alerts')
+    if 'occurrences' not in existing:
+        conn.execute("ALTER TABLE alerts ADD COLUMN occurrences INTEGER NOT NULL DEFAULT 1")
+    for column, kind in (('last_seen', 'TEXT'), ('last_seen_us', 'INTEGER')):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE alerts ADD COLUMN {column} {kind}")
+
+
+Step = Union[str, Callable[[sqlite3.Connection], None]]
+
+MAIN_MIGRATIONS: List[Tuple[int, str, Step]] = [
+    (1, "base tables", """
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            channel TEXT,
+            event_id INTEGER,
+            user TEXT,
+            ip TEXT,
+            command TEXT,
+            message TEXT
+        );
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT,
+            severity TEXT,
+            title TEXT,
+            description TEXT
+        );
+    """),
+    (2, "meta table", "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"),
+    (3, "epoch microsecond columns", _add_epoch_columns),
+    (4, "hunt indexes", """
+        CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts_us);
+        CREATE INDEX IF NOT EXISTS idx_events_event_id_ts ON events(event_id, ts_us);
+        CREATE INDEX IF NOT EXISTS idx_events_ip_ts ON events(ip, ts_us);
+        CREATE INDEX IF NOT EXISTS idx_events_user_ts ON events(user, ts_us);
+        CREATE INDEX IF NOT EXISTS idx_alerts_created ON alerts(created_us);
+        CREATE INDEX IF NOT EXISTS idx_alerts_severity_created ON alerts(severity, created_us);
+    """),
+    (5, "full-text index", _main_events_fts),
+    (6, "rollup tables", _create_rollups),
+    (7, "interned message/command strings", _main_intern_strings),
+    (8, "alert rule, fingerprint, entities and evidence links", _alert_links),
+    (9, "alert repeat count and last seen", _alert_repeats),
+]
+
+
+# Each events partition file (app/core/partitions.py) is its own database with its own user_version
+PARTITION_MIGRATIONS: List[Tuple[int, str, Step]] = [
+    (1, "events table", """
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            timestamp TEXT,
+            ts_us INTEGER,
+            channel TEXT,
+            event_id INTEGER,
+            user TEXT,
+            ip TEXT,
+            command TEXT,
+            message TEXT
+        );
+    """),
+    (2, "hunt indexes", """
+        CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts_us);
+        CREATE INDEX IF NOT EXISTS idx_events_event_id_ts ON events(event_id, ts_us);
+        CREATE INDEX IF NOT EXISTS idx_events_ip_ts ON events(ip, ts_us);
+        CREATE INDEX IF NOT EXISTS idx_events_user_ts ON events(user, ts_us);
+    """),
+    (3, "full-text index", _partition_events_fts),
+    (4, "interned message/command strings", _partition_intern_strings),
+    (5, "spool replay markers", """
+        CREATE TABLE IF NOT EXISTS spool_replayed (
+            segment TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            PRIMARY KEY (segment, offset)
+        ) WITHOUT ROWID;
+    """),
+]
+
+
+def _statements(sql: str) -> List[str]:
+    return [s.strip() for s in sql.split(';') if s.strip()]
+
+
+def run_migrations(conn: sqlite3.Connection, migrations: List[Tuple[int, str, Step]], label: str = "main") -> int:
+    """Apply pending migrations (connection must be in autocommit mode); returns the new version."""
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, description, step in migrations:
+        if version <= current:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if callable(step):
+                step(conn)
+            else:
+                for stmt in _statements(step):
+                    conn.execute(stmt)
+            conn.execute(f"PRAGMA user_version={int(version)}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            logger.error(f"Migration {label} v{version} ({description}) failed", exc_info=True)
+            raise
+        current = version
+        logger.info(f"Applied {label} migration v{version}: {description}")
+    return current
+
+
+def get_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(conn: sqlite3.Connection, key: str, value: Any):
+    conn.execute("INSERT INTO meta(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                 (key, str(value)))
+
+
+class Backfill:
+    """
+    Resumable chunked rewrite of one column from another.
+
+    ``step(conn)`` converts the next ``chunk`` rows after the stored id
+    cursor in a single transaction and returns False once the table is
+    done. The cursor (``meta['backfill:<name>']``) commits together with
+    the rows, so a restart continues exactly where it stopped.
+    """
+
+    def __init__(self, name: str, table: str, source: str, target: str, convert: Callable[[Any], Any],
+                 chunk: int = 5000):
+        self.name = name
+        self.table = table
+        self.source = source
+        self.target = target
+        self.convert = convert
+        self.chunk = chunk
+        self.key = f"backfill:{name}"
+        self.rows = 0
+
+    def pending(self, conn: sqlite3.Connection) -> bool:
+        if get_meta(conn, self.key) == 'done':
+            return False
+        cursor = int(get_meta(conn, self.key) or 0)
+        return conn.execute(f"SELECT 1 FROM {self.table} WHERE id > ? LIMIT 1", (cursor,)).fetchone() is not None
+
+    def step(self, conn: sqlite3.Connection) -> bool:
+        state = get_meta(conn, self.key)
+        if state == 'done':
+            return False
+        cursor = int(state or 0)
+        rows = conn.execute(
+            f"SELECT id, {self.source} FROM {self.table} WHERE id > ? AND {self.target} IS NULL ORDER BY id LIMIT ?",
+            (cursor, self.chunk)).fetchall()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if rows:
+                updates = [(self.convert(value), rid) for rid, value in rows]
+                conn.executemany(f"UPDATE {self.table} SET {self.target}=? WHERE id=?", updates)
+                set_meta(conn, self.key, rows[-1][0])
+            more = len(rows) == self.chunk
+            if not more:
+                set_meta(conn, self.key, 'done')
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.rows += len(rows)
+        if not more:
+            logger.info(f"Backfill {self.name} finished ({self.rows} rows this run)")
+        return more
+
+
+def main_backfills() -> List[Backfill]:
+    return [
+        Backfill('events.ts_us', 'events', 'timestamp', 'ts_us', to_epoch_us),
+        Backfill('alerts.created_us', 'alerts', 'created_at', 'created_us', to_epoch_us),
+    ]
@@ -0,0 +1,286 @@
+"""
+Time-partitioned event storage.
+
+Events are written to one SQLite file per day (or hour) under the
+partition directory, ``events_YYYYMMDD.db`` / ``events_YYYYMMDDHH.db``;
+the name alone gives the partition's time range. Retention is deleting
+whole files, and queries only open the partitions whose range overlaps
+the request. Alerts, metadata and events written before partitioning
+stay in the main database, whose ``events`` table is searched as one
+more (unbounded) partition.
+"""
+import glob
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+
+from app.core.migrations import PARTITION_MIGRATIONS, run_migrations, to_epoch_us
+from utils.logging import setup_logger
+
+logger = setup_logger("partitions")
+
+GRANULARITY_US = {'day': 86400 * 1_000_000, 'hour': 3600 * 1_000_000}
+_NAME_FORMATS = {'day': '%Y%m%d', 'hour': '%Y%m%d%H'}
+_PREFIX = 'events_'
+
+EVENT_COLUMNS = ('timestamp', 'ts_us', 'channel', 'event_id', 'user', 'ip', 'command', 'message')
+# Columns ``query`` filters may use (equality, or IN for a list/tuple/set)
+FILTER_COLUMNS = frozenset(('channel', 'event_id', 'user', 'ip', 'command'))
+
+
+def now_us() -> int:
+    return int(time.time() * 1_000_000)
+
+
+def partition_name(ts_us: int, granularity: str = 'day') -> str:
+    start = ts_us - ts_us % GRANULARITY_US[granularity]
+    return _PREFIX + datetime.fromtimestamp(start / 1_000_000, tz=timezone.utc).strftime(_NAME_FORMATS[granularity])
+
+
+def partition_bounds(name: str) -> Optional[Tuple[int, int]]:
+    """[start, end) epoch microseconds covered by a partition name, None if it is not one."""
+    stamp = name[len(_PREFIX):] if name.startswith(_PREFIX) else ''
+    granularity = {8: 'day', 10: 'hour'}.get(len(stamp))
+    if granularity is None or not stamp.isdigit():
+        return None
+    try:
+        start = datetime.strptime(stamp, _NAME_FORMATS[granularity]).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    start_us = to_epoch_us(start)
+    return start_us, start_us + GRANULARITY_US[granularity]
+
+
+def to_range(time_range: Optional[Tuple[Any, Any]]) -> Tuple[Optional[int], Optional[int]]:
+    """(start, end) of ISO strings, datetimes or epoch microseconds -> (start_us, end_us); None = open."""
+    if not time_range:
+        return None, None
+    start, end = time_range
+    return tuple(v if v is None or isinstance(v, int) else to_epoch_us(v) for v in (start, end))
+
+
+class PartitionSet:
+    """The partition files in one directory; creates and migrates them on first use."""
+
+    def __init__(self, directory: str, granularity: str = 'day'):
+        if granularity not in GRANULARITY_US:
+            raise ValueError(f"Unknown partition granularity: {granularity}")
+        self.directory = directory
+        self.granularity = granularity
+        self._ready: set = set()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name + '.db')
+
+    def name_for(self, ts_us: int) -> str:
+        return partition_name(ts_us, self.granularity)
+
+    def ensure(self, name: str) -> str:
+        """Path of the partition, created and migrated if needed."""
+        path = self.path(name)
+        if name not in self._ready:
+            conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                run_migrations(conn, PARTITION_MIGRATIONS, label=name)
+            finally:
+                conn.close()
+            self._ready.add(name)
+        return path
+
+    def list(self) -> List[Tuple[str, int, int]]:
+        """(name, start_us, end_us) of every partition file, oldest first (day and hour files may mix)."""
+        found = []
+        for path in glob.glob(os.path.join(self.directory, _PREFIX + '*.db')):
+            name = os.path.basename(path)[:-3]
+            bounds = partition_bounds(name)
+            if bounds:
+                found.append((name, bounds[0], bounds[1]))
+        found.sort(key=lambda p: (p[1], p[2]))
+        return found
+
+    def overlapping(self, start_us: Optional[int], end_us: Optional[int]) -> List[Tuple[str, int, int]]:
+        return [p for p in self.list()
+                if (start_us is None or p[2] > start_us) and (end_us is None or p[1] < end_us)]
+
+    def expired(self, retention_days: float, now: Optional[int] = None) -> List[str]:
+        cutoff = (now if now is not None else now_us()) - int(retention_days * GRANULARITY_US['day'])
+        return [name for name, _, end in self.list() if end <= cutoff]
+
+    def remove(self, name: str) -> bool:
+        """Delete a partition file and its WAL/SHM; False if something still holds it open."""
+        path = self.path(name)
+        try:
+            for suffix in ('-wal', '-shm', ''):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        except OSError as e:
+            logger.warning(f"Could not remove partition {name}, will retry: {e}")
+            return False
+        self._ready.discard(name)
+        return True
+
+
+def event_conditions(start_us: Optional[int], end_us: Optional[int], filters: Optional[Dict[str, Any]],
+                     prefix: str = '') -> Tuple[List[str], list]:
+    """SQL conditions (columns qualified with ``prefix``) and parameters for a time range and filters."""
+    clauses, params = [], []
+    if start_us is not None:
+        clauses.append(f"{prefix}ts_us >= ?")
+        params.append(start_us)
+    if end_us is not None:
+        clauses.append(f"{prefix}ts_us < ?")
+        params.append(end_us)
+    for column, value in (filters or {}).items():
+        if column not in FILTER_COLUMNS:
+            raise ValueError(f"Cannot filter events on {column!r}")
+        if isinstance(value, (list, tuple, set)):
+            values = list(value)
+            clauses.append(f"{prefix}{column} IN ({','.join('?' * len(values))})" if values else "0")
+            params.extend(values)
+        else:
+            clauses.append(f"{prefix}{column} = ?")
+            params.append(value)
+    return clauses, params
+
+
+def _where(start_us: Optional[int], end_us: Optional[int], filters: Optional[Dict[str, Any]]) -> Tuple[str, list]:
+    clauses, params = event_conditions(start_us, end_us, filters)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def events_source(conn: sqlite3.Connection, schema: str = 'main') -> str:
+    """``events_v`` (interned text joined back), or ``events`` in a file that predates it."""
+    row = conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type='view' AND name='events_v'").fetchone()
+    return 'events_v' if row else 'events'
+
+
+def _select(path: str, where: str, params: list, limit: int) -> List[tuple]:
+    from app.core.db import open_readonly
+    try:
+        conn = open_readonly(path)
+    except sqlite3.OperationalError:
+        return []  # removed by retention since it was listed
+    try:
+        sql = f"SELECT {', '.join(EVENT_COLUMNS)} FROM {events_source(conn)}{where} ORDER BY ts_us DESC LIMIT ?"
+        return conn.execute(sql, params + [limit]).fetchall()
+    except sqlite3.OperationalError as e:
+        # A main database that predates the events table, or a partition still being created
+        logger.debug(f"Skipping {path}: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+def query_events(main_path: str, partitions: Optional[PartitionSet], time_range: Optional[Tuple[Any, Any]] = None,
+                 filters: Optional[Dict[str, Any]] = None, limit: int = 1000, archive=None) -> List[Dict[str, Any]]:
+    """
+    Newest-first events matching ``time_range``/``filters`` across partitions.
+
+    Partitions and archived segments (``archive``, an ``ArchiveSet``) are
+    read newest first, and the fan-out stops once ``limit`` rows are in
+    hand and the next source ends before the oldest of them. The main
+    database's legacy ``events`` table can hold any time, so its top rows
+    are merged in by ``ts_us``.
+    """
+    start_us, end_us = to_range(time_range)
+    where, params = _where(start_us, end_us, filters)
+    limit = max(1, int(limit))
+    key = lambda r: r[1] if r[1] is not None else -1
+    sources = []
+    if partitions is not None:
+        for name, start, end in partitions.overlapping(start_us, end_us):
+            sources.append((end, start, lambda n, p=partitions.path(name): _select(p, where, params, n)))
+    if archive is not None:
+        for name, start, end, path in archive.overlapping(start_us, end_us):
+            sources.append((end, start, lambda n, p=path: archive.scan(p, start_us, end_us, filters, n)))
+    sources.sort(key=lambda s: (s[0], s[1]), reverse=True)
+    rows: List[tuple] = []
+    for end, _, read in sources:
+        if len(rows) >= limit:
+            rows.sort(key=key, reverse=True)
+            del rows[limit:]
+            if end <= key(rows[-1]):
+                break
+        rows.extend(read(limit))
+    if os.path.exists(main_path):
+        rows.extend(_select(main_path, where, params, limit))
+    rows.sort(key=key, reverse=True)
+    return [dict(zip(EVENT_COLUMNS, r)) for r in rows[:limit]]
+
+
+ALERT_COLUMNS = ('id', 'created_at', 'created_us', 'severity', 'title', 'description', 'rule_id', 'fingerprint',
+                 'ip', 'user', 'host', 'device_serial', 'occurrences', 'last_seen')
+_ATTACH_LIMIT = 8  # partitions attached per query; SQLite allows 10 databases per connection
+
+
+def alert_evidence(main_path: str, partitions: Optional[PartitionSet], alert_id: int) -> Optional[Dict[str, Any]]:
+    """
+    An alert and its linked events (``alert_events``), oldest first; None if there is no such alert.
+
+    The partitions holding the evidence are attached read-only to one
+    connection and the rows come back from a single UNION ALL of
+    primary-key joins. Events already moved to the archive (or deleted by
+    retention) carry no row ids there and are left out.
+    """
+    from app.core.db import open_readonly, readonly_uri
+    if not os.path.exists(main_path):
+        return None
+    conn = open_readonly(main_path)
+    try:
+        try:
+            row = conn.execute(f"SELECT {', '.join(ALERT_COLUMNS)} FROM alerts WHERE id = ?", (alert_id,)).fetchone()
+        except sqlite3.OperationalError:
+            return None  # database predates the alert columns; migrated on the writer's next start
+        if row is None:
+            return None
+        alert = dict(zip(ALERT_COLUMNS, row))
+        names = [r[0] for r in conn.execute("SELECT DISTINCT partition FROM alert_events WHERE alert_id = ?",
+                                            (alert_id,))]
+        if partitions is not None:
+            names = [n for n in names if n == '' or os.path.exists(partitions.path(n))]
+        else:
+            names = [n for n in names if n == '']
+        columns = ', '.join('e.' + c for c in EVENT_COLUMNS)
+        rows: List[tuple] = []
+        for i in range(0, len(names), _ATTACH_LIMIT):
+            selects, params, attached = [], [], []
+            for name in names[i:i + _ATTACH_LIMIT]:
+                schema = 'main'
+                if name:
+                    schema = 'p_' + name
+                    conn.execute(f"ATTACH DATABASE ? AS {schema}", (readonly_uri(partitions.path(name)),))
+                    attached.append(schema)
+                selects.append(f"SELECT ae.partition, ae.event_row, {columns} FROM alert_events ae "
+                               f"JOIN {schema}.{events_source(conn, schema)} e ON e.id = ae.event_row "
+                               f"WHERE ae.alert_id = ? AND ae.partition = ?")
+                params += [alert_id, name]
+            try:
+                rows.extend(conn.execute(' UNION ALL '.join(selects), params).fetchall())
+            finally:
+                for schema in attached:
+                    conn.execute(f"DETACH DATABASE {schema}")
+        rows.sort(key=lambda r: r[3] if r[3] is not None else -1)
+        alert['events'] = [dict(zip(('partition', 'row') + EVENT_COLUMNS, r)) for r in rows]
+        return alert
+    finally:
+        conn.close()
+
+
+def group_rows(rows: List[tuple], partitions: PartitionSet,
+               items: Optional[list] = None) -> List[Tuple[str, List[tuple], Optional[list]]]:
+    """Split insert rows (ts_us at index 1), and the ``items`` they came from, by partition; rows without a time go to the current one."""
+    step = GRANULARITY_US[partitions.granularity]
+    current = now_us()
+    groups: Dict[int, Tuple[List[tuple], list]] = {}
+    for i, row in enumerate(rows):
+        ts = row[1] if row[1] is not None else current
+        batch, origin = groups.setdefault(ts - ts % step, ([], []))
+        batch.append(row)
+        if items is not None:
+            origin.append(items[i])
+    return [(partitions.name_for(start), batch, origin if items is not None else None)
+            for start, (batch, origin) in groups.items()]
@@ -0,0 +1,368 @@
+"""
+Staged SIEM runtime shared by ``main.py``, ``run.py`` and ``app.py``.
+
+    collect -> dedup -> normalize -> persist
+                                  -> export
+                                  -> detect -> alert
+
+Every stage owns a bounded queue and a configurable number of worker
+threads. A full queue blocks the stage feeding it, so a locked SQLite file
+or a slow Telegram retry backs work up towards the collector (whose push
+sources buffer in their own bounded deques) instead of growing memory.
+Persistence, export and detection consume the same normalized batch in
+parallel. Source checkpoints are committed only after the batch they were
+taken with - and every batch before it - has been persisted (or lost:
+a batch that fails before the writer stores or spools it is released
+without its checkpoints, so one bad batch cannot stall every later one).
+"""
+import os
+import queue
+import threading
+import time
+from typing import List, Dict, Any, Optional, Callable
+
+from app.core.checkpoints import CheckpointStore
+from app.core.db import Database
+from app.core.dedup import Deduplicator
+from app.core.event import Event
+from app.core.event_collector import export_latest_events
+from app.core.event_parser import normalize_events
+from app.core.feed import EventFeed
+from app.core.rules_engine import DetectionEngine
+from app.alerts.alert_engine import dispatch_alerts
+from app.sources.base import (EventSource, commit_checkpoints, poll_sources, restore_checkpoints,
+                              snapshot_checkpoints)
+from app.sources.factory import build_sources
+from utils.logging import setup_logger
+
+logger = setup_logger("pipeline")
+
+_STOP = object()
+
+# Later batches held back while an earlier one is still unfinished, before that one is given up on
+MAX_COMMIT_GAP = 1000
+
+
+class Batch:
+    __slots__ = ('seq', 'events', 'checkpoints', 'alerts', 'queued')
+
+    def __init__(self, seq: int, events: List[Dict[str, Any]], checkpoints: Dict[str, Dict[str, Any]]):
+        self.seq = seq
+        self.events = events
+        self.checkpoints = checkpoints
+        self.alerts: List[Dict[str, Any]] = []
+        self.queued = threading.Event()  # set once persist has handed the events to the writer
+
+
+class Stage:
+    """
+    A pool of worker threads applying ``fn`` to batches from a bounded queue.
+
+    ``fn`` may return a batch to forward to every downstream stage or None
+    to stop it here. Exceptions are logged and the batch is dropped (and
+    handed to ``on_drop``, if set); the workers keep running.
+    """
+
+    def __init__(self, name: str, fn: Callable[[Batch], Optional[Batch]], workers: int = 1, queue_size: int = 8):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.queue: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.downstream: List["Stage"] = []
+        self.on_drop: Optional[Callable[[Batch, str], None]] = None
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, daemon=True, name=f"Pipeline-{self.name}-{i}")
+            t.start()
+            self._threads.append(t)
+
+    def put(self, batch: Batch):
+        self.queue.put(batch)
+
+    def close(self, timeout: Optional[float] = None):
+        """Let queued batches finish, then stop the workers."""
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def _work(self):
+        while True:
+            batch = self.queue.get()
+            if batch is _STOP:
+                return
+            started = time.perf_counter()
+            try:
+                out = self.fn(batch)
+            except Exception as e:
+                out = None
+                with self._lock:
+                    self.failed += 1
+                logger.error(f"Stage {self.name} failed on batch {batch.seq}: {e}", exc_info=True)
+                if self.on_drop is not None:
+                    self.on_drop(batch, f"{self.name} failed: {e}")
+            with self._lock:
+                self.processed += 1
+                self.busy_seconds += time.perf_counter() - started
+            if out is not None:
+                for stage in self.downstream:
+                    stage.put(out)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queued': self.queue.qsize(),
+                'processed': self.processed,
+                'failed': self.failed,
+                'busy_seconds': round(self.busy_seconds, 3),
+            }
+
+
+class Pipeline:
+    """
+    Collector thread plus the dedup/normalize/persist/export/detect/alert
+    stages.
+
+    ``pipeline`` config: ``queue_size`` (batches per stage queue),
+    ``workers`` (per-stage thread counts, all default 1) and ``dedup``
+    (see ``Deduplicator``; ``{"enabled": false}`` turns it off). Detection keeps
+    per-detector state across batches (snapshotted to ``detector_state``
+    every ``detector_snapshot_seconds``), runs the declarative rules in
+    ``rules_dir`` next to the built-in detectors, and the alert cooldown cache is not
+    locked, so keep ``detect`` and ``alert`` at one worker.
+    """
+
+    STAGES = ('dedup', 'normalize', 'persist', 'export', 'detect', 'alert')
+
+    def __init__(self, sources: List[EventSource], db: Database, checkpoints: CheckpointStore,
+                 thresholds: Dict[str, Any], alerts_config: Dict[str, Any], interval_seconds: float = 10,
+                 max_records: int = 250, export_path: Optional[str] = None, options: Optional[Dict[str, Any]] = None,
+                 feed: Optional[EventFeed] = None, detector_state: Optional[str] = None,
+                 rules_dir: Optional[str] = None):
+        options = options or {}
+        workers = options.get('workers', {})
+        queue_size = options.get('queue_size', 8)
+        self.sources = sources
+        self.db = db
+        self.checkpoints = checkpoints
+        self.thresholds = thresholds
+        self.alerts_config = alerts_config
+        self.interval_seconds = interval_seconds
+        self.max_records = max_records
+        self.export_path = export_path
+        self.feed = feed
+        self.detection = DetectionEngine(thresholds, detector_state, options.get('detector_snapshot_seconds', 60),
+                                         rules_dir)
+        dedup = options.get('dedup', {})
+        self.dedup: Optional[Deduplicator] = None
+        if dedup.get('enabled', True):
+            self.dedup = Deduplicator(dedup.get('capacity', 100000), dedup.get('error_rate', 0.001), dedup.get('ttl_seconds'))
+
+        self.stages: Dict[str, Stage] = {
+            name: Stage(name, getattr(self, f"_{name}"), workers.get(name, 1), queue_size)
+            for name in self.STAGES
+        }
+        self.stages['dedup'].downstream = [self.stages['normalize']]
+        normalize = self.stages['normalize']
+        normalize.downstream = [self.stages['persist'], self.stages['detect']]
+        if feed is not None or export_path:
+            normalize.downstream.append(self.stages['export'])
+        self.stages['detect'].downstream = [self.stages['alert']]
+        # A batch lost before it reaches the writer must still release its seq, or no checkpoint commits again
+        for name in ('dedup', 'normalize', 'persist'):
+            self.stages[name].on_drop = self._skip
+
+        self._stop = threading.Event()
+        self._collector: Optional[threading.Thread] = None
+        self._seq = 0
+        self._commit_lock = threading.Lock()
+        self._persisted: Dict[int, Optional[Dict[str, Dict[str, Any]]]] = {}
+        self._next_commit = 1
+        self.collected = 0
+
+    # --- lifecycle -------------------------------------------------------
+
+    def start(self):
+        restore_checkpoints(self.sources, self.checkpoints)
+        for src in self.sources:
+            logger.info(f"🔌 Starting source: {src.name} ({src.mode})")
+            try:
+                src.start()
+            except Exception as e:
+                logger.error(f"Source {src.name} failed to start: {e}")
+        for stage in self.stages.values():
+            stage.start()
+        self._stop.clear()
+        self._collector = threading.Thread(target=self._collect_loop, daemon=True, name="Pipeline-collect")
+        self._collector.start()
+        logger.info("🚀 Pipeline started (" + ", ".join(f"{n}x{s.workers}" for n, s in self.stages.items()) + ")")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the collector stops (finite sources exhausted or ``stop``); True if it did."""
+        if self._collector is None:
+            return True
+        self._collector.join(timeout)
+        return not self._collector.is_alive()
+
+    def run(self):
+        """Start, block until the sources are exhausted (or Ctrl+C), then drain and stop."""
+        self.start()
+        try:
+            while not self.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            logger.info("🛑 SIEM shutdown requested")
+        finally:
+            self.stop()
+
+    def stop(self, timeout: float = 30.0):
+        """Stop collecting, drain every stage in order, then stop the sources."""
+        self._stop.set()
+        if self._collector is not None:
+            self._collector.join(timeout)
+        for name in self.STAGES:
+            self.stages[name].close(timeout)
+        self.detection.close()
+        self.db.close(timeout)
+        if self.feed is not None:
+            self.feed.close()
+        for src in self.sources:
+            try:
+                src.stop()
+            except Exception as e:
+                logger.error(f"Source {src.name} failed to stop: {e}")
+        logger.info(f"Pipeline stopped: {self.stats()}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'collected': self.collected,
+            'db': self.db.stats(),
+            'feed': self.feed.stats() if self.feed is not None else None,
+            'dedup': self.dedup.stats() if self.dedup is not None else None,
+            'detectors': self.detection.stats(),
+            'stages': {name: stage.stats() for name, stage in self.stages.items()},
+        }
+
+    # --- collector -------------------------------------------------------
+
+    def _collect_loop(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            events = poll_sources(self.sources, self.max_records)
+            if events:
+                self._seq += 1
+                self.collected += len(events)
+                self._offer(Batch(self._seq, events, snapshot_checkpoints(self.sources)))
+            if self.sources and all(src.exhausted for src in self.sources):
+                logger.info("All sources exhausted")
+                return
+            if len(events) >= self.max_records:
+                continue  # a full batch: more is probably waiting
+            self._stop.wait(max(0.0, self.interval_seconds - (time.monotonic() - started)))
+
+    def _offer(self, batch: Batch):
+        # Block while the pipeline is saturated, but stay responsive to stop()
+        while not self._stop.is_set():
+            try:
+                self.stages['dedup'].queue.put(batch, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        self.stages['dedup'].queue.put(batch)
+
+    # --- stages ----------------------------------------------------------
+
+    def _dedup(self, batch: Batch) -> Batch:
+        # Forwarded even when every event was a duplicate: its checkpoints still need committing
+        if self.dedup is not None:
+            batch.events = self.dedup.filter(batch.events)
+        return batch
+
+    def _normalize(self, batch: Batch) -> Batch:
+        # From here on events are compact Event records (dict-compatible for the detectors)
+        batch.events = normalize_events([Event.from_dict(e) for e in batch.events])
+        return batch
+
+    def _persist(self, batch: Batch) -> None:
+        # Returns once queued; the writer thread advances checkpoints after the group commit
+        try:
+            self.db.insert_events(batch.events, on_commit=lambda: self._commit(batch),
+                                  on_error=lambda: self._skip(batch, "neither stored nor spooled"))
+        finally:
+            batch.queued.set()
+
+    def _commit(self, batch: Batch):
+        self._release(batch.seq, batch.checkpoints)
+
+    def _skip(self, batch: Batch, reason: str):
+        """Give up on a lost batch: later checkpoints may commit past its events."""
+        logger.error(f"Batch {batch.seq} ({len(batch.events)} events) was lost ({reason}); releasing its checkpoints")
+        self._release(batch.seq, None)
+
+    def _release(self, seq: int, checkpoints: Optional[Dict[str, Dict[str, Any]]]):
+        """Mark a batch finished and advance source checkpoints through the highest contiguous one."""
+        with self._commit_lock:
+            if seq < self._next_commit or seq in self._persisted:
+                return  # already released (e.g. persist raised after the writer took the batch)
+            self._persisted[seq] = checkpoints
+            held = len(self._persisted)
+            if held > MAX_COMMIT_GAP:
+                logger.error(f"Batch {self._next_commit} never finished; giving up on it to commit "
+                             f"{held} later batches")
+                self._next_commit = min(self._persisted)
+            elif held % 100 == 0:
+                logger.warning(f"Checkpoints are waiting on batch {self._next_commit}; {held} later batches held")
+            latest = None
+            while self._next_commit in self._persisted:
+                latest = self._persisted.pop(self._next_commit) or latest
+                self._next_commit += 1
+            if latest is not None:
+                commit_checkpoints(self.sources, self.checkpoints, latest)
+
+    def _export(self, batch: Batch) -> None:
+        if self.feed is not None:
+            self.feed.append(batch.events)
+        if self.export_path:
+            export_latest_events(batch.events, self.export_path)
+
+    def _detect(self, batch: Batch) -> Optional[Batch]:
+        batch.alerts = self.detection.process(batch.events)
+        return batch if batch.alerts else None
+
+    def _alert(self, batch: Batch) -> None:
+        # Queue the alerts behind their events, so the writer links them to stored row ids
+        if not batch.queued.wait(10):
+            logger.warning(f"Batch {batch.seq} not persisted yet; its alerts go out without evidence links")
+        logger.info(f"📢 Dispatching {len(batch.alerts)} alerts")
+        dispatch_alerts(batch.alerts, self.alerts_config, self.db)
+
+
+def build_pipeline(cfg, base_dir: str) -> Pipeline:
+    """Wire the configured sources, database, checkpoint store and export feed into a pipeline."""
+    feed_dir = cfg.export.get('feed_dir', os.path.join(base_dir, 'data', 'feed'))
+    feed = None
+    if feed_dir:
+        feed = EventFeed(feed_dir, cfg.export.get('feed_segment_mb', 64), cfg.export.get('feed_rotate_minutes', 60),
+                         cfg.export.get('feed_keep_segments', 48))
+    return Pipeline(
+        sources=build_sources(cfg, base_dir),
+        db=Database.from_config(cfg.database, os.path.join(base_dir, 'data', 'siem.db')),
+        checkpoints=CheckpointStore(cfg.collector.get('checkpoint_path', os.path.join(base_dir, 'data', 'checkpoints.json'))),
+        thresholds=cfg.thresholds,
+        alerts_config=cfg.alerts.__dict__ if hasattr(cfg.alerts, '__dict__') else cfg.alerts,
+        interval_seconds=cfg.interval_seconds,
+        max_records=cfg.collector.get('max_records', 250),
+        export_path=cfg.export.get('latest_events_json'),
+        options=cfg.pipeline,
+        feed=feed,
+        detector_state=cfg.pipeline.get('detector_state_path', os.path.join(base_dir, 'data', 'detector_state.json')),
+        rules_dir=cfg.pipeline.get('rules_dir', os.path.join(base_dir, 'rules')),
+    )
@@ -27,6 +27,8 @@ def start():
                     'timestamp': datetime.utcnow().isoformat(),
                     'channel': 'ProcessWatcherRT',
                     'event_id': 4688,
+                    'pid': proc.ProcessId,
+                    'creation_date': proc.CreationDate,
                     'user': None,
                     'ip': None,
                     'command': cmdline,
@@ -0,0 +1,187 @@
+import json
+import queue
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable
+
+from utils.logging import setup_logger
+
+logger = setup_logger("ps_reader")
+
+CHANNEL = 'Microsoft-Windows-PowerShell/Operational'
+
+# Long-lived reader: polls for 4104 records newer than the bookmark and writes
+# one compressed JSON object per line, flushing after every record.
+_READER_SCRIPT = r"""
+$ErrorActionPreference = 'SilentlyContinue'
+$log = 'Microsoft-Windows-PowerShell/Operational'
+$last = [int64]{bookmark}
+if ($last -lt 0) {
+    $newest = Get-WinEvent -LogName $log -MaxEvents 1
+    $last = if ($newest) { [int64]$newest.RecordId - {backlog} } else { 0 }
+}
+while ($true) {
+    $xp = "*[System[(EventID=4104) and (EventRecordID>$last)]]"
+    $evts = Get-WinEvent -LogName $log -FilterXPath $xp | Sort-Object RecordId
+    foreach ($e in $evts) {
+        $obj = [ordered]@{
+            RecordId = $e.RecordId
+            TimeCreated = $e.TimeCreated.ToUniversalTime().ToString('o')
+            Id = $e.Id
+            UserId = if ($e.UserId) { $e.UserId.Value } else { $null }
+            ScriptBlockText = if ($e.Properties.Count -gt 2) { $e.Properties[2].Value } else { $null }
+            Message = $e.Message
+        }
+        [Console]::Out.WriteLine(($obj | ConvertTo-Json -Compress))
+        [Console]::Out.Flush()
+        $last = $e.RecordId
+    }
+    Start-Sleep -Milliseconds {poll_ms}
+}
+"""
+
+CREATE_NO_WINDOW = 0x08000000
+
+
+def build_command(bookmark: Optional[int], poll_ms: int = 1000, backlog: int = 50) -> List[str]:
+    script = (_READER_SCRIPT
+              .replace('{bookmark}', str(bookmark if bookmark is not None else -1))
+              .replace('{backlog}', str(backlog))
+              .replace('{poll_ms}', str(poll_ms)))
+    return ['powershell.exe', '-NoProfile', '-NonInteractive', '-ExecutionPolicy', 'Bypass', '-Command', script]
+
+
+def record_to_event(item: Dict[str, Any]) -> Dict[str, Any]:
+    msg = item.get('Message') or ''
+    script = item.get('ScriptBlockText') or msg
+    return {
+        'timestamp': (item.get('TimeCreated') or datetime.utcnow().isoformat()).rstrip('Z'),
+        'channel': CHANNEL,
+        'event_id': 4104,
+        'record_id': item.get('RecordId'),
+        'user': item.get('UserId'),
+        'ip': None,
+        'command': script,
+        'message': msg,
+    }
+
+
+class PowerShellOperationalReader:
+    """
+    Supervises one long-lived ``powershell.exe`` that streams new 4104
+    records as newline-delimited JSON.
+
+    A reader thread parses stdout into a bounded queue (a full queue blocks
+    the reader, which in turn blocks the child - nothing is dropped). If the
+    child exits it is restarted with exponential backoff, resuming after the
+    last record read. ``drain`` never blocks; ``bookmark`` is the RecordId of
+    the last record handed out by ``drain`` and is what callers persist.
+    """
+
+    def __init__(self, bookmark: Optional[int] = None, poll_ms: int = 1000, backlog: int = 50,
+                 max_buffer: int = 10000, restart_delay: float = 1.0, max_restart_delay: float = 60.0,
+                 popen: Callable[..., Any] = subprocess.Popen, command: Optional[Callable[[Optional[int]], List[str]]] = None):
+        self.bookmark = bookmark
+        self._read_bookmark = bookmark
+        self._poll_ms = poll_ms
+        self._backlog = backlog
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_buffer)
+        self._restart_delay = restart_delay
+        self._max_restart_delay = max_restart_delay
+        self._popen = popen
+        self._command = command or (lambda bm: build_command(bm, self._poll_ms, self._backlog))
+        self._stop = threading.Event()
+        self._proc = None
+        self._thread: Optional[threading.Thread] = None
+        self.restarts = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._supervise, daemon=True, name="PSOperationalReader")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        proc = self._proc
+        if proc is not None:
+            try:
+                proc.kill()
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def drain(self, max_items: int = 250) -> List[Dict[str, Any]]:
+        items: List[Dict[str, Any]] = []
+        while len(items) < max_items:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if items and items[-1].get('record_id') is not None:
+            self.bookmark = items[-1]['record_id']
+        return items
+
+    def _spawn(self):
+        kwargs: Dict[str, Any] = dict(stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL,
+                                      text=True, encoding='utf-8', errors='replace', bufsize=1)
+        if sys.platform == 'win32':
+            kwargs['creationflags'] = CREATE_NO_WINDOW
+        return self._popen(self._command(self._read_bookmark), **kwargs)
+
+    def _supervise(self):
+        delay = self._restart_delay
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self._proc = self._spawn()
+                logger.info(f"PowerShell Operational reader started (after RecordId {self._read_bookmark})")
+                self._pump(self._proc)
+                code = self._proc.wait()
+                if not self._stop.is_set():
+                    logger.error(f"PowerShell Operational reader exited with code {code}")
+            except Exception as e:
+                logger.error(f"PowerShell Operational reader failed: {e}")
+            finally:
+                self._proc = None
+            if self._stop.is_set():
+                break
+            # A child that ran for a while resets the backoff
+            if time.monotonic() - started > self._max_restart_delay:
+                delay = self._restart_delay
+            self.restarts += 1
+            self._stop.wait(delay)
+            delay = min(delay * 2, self._max_restart_delay)
+
+    def _pump(self, proc):
+        for line in proc.stdout:
+            if self._stop.is_set():
+                return
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                logger.error(f"Failed to parse 4104 JSON line: {line[:200]}")
+                continue
+            if not isinstance(item, dict):
+                continue
+            evt = record_to_event(item)
+            while not self._stop.is_set():
+                try:
+                    self._queue.put(evt, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+            if evt.get('record_id') is not None:
+                self._read_bookmark = evt['record_id']
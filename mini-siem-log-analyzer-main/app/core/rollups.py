@@ -0,0 +1,321 @@
+"""
+Pre-aggregated event and alert counts for stats and dashboards.
+
+The writer keeps ``rollup_events_<g>`` (bucket, channel, event_id) and
+``rollup_alerts_<g>`` (bucket, severity) counts for g = 1m, 1h, 1d. Each
+insert batch is counted on the caller's thread and applied as a handful
+of upserts inside the same transaction as the raw rows, so the rollups
+never disagree with what is committed. Questions like "events per hour
+per channel last week" then read a few hundred rollup rows instead of
+millions of events. Minute and hour rows are pruned after
+``rollup_retention_days`` (7 and 90 by default); daily rows are kept.
+
+Tables are created by main migration v6; rows written before that are
+counted once by the ``RollupBackfill`` idle job.
+"""
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+
+from app.core.migrations import get_meta, set_meta, from_epoch_us
+from app.core.partitions import to_range
+from utils.logging import setup_logger
+
+logger = setup_logger("rollups")
+
+_MINUTE = 60 * 1_000_000
+GRANULARITIES: Dict[str, int] = {'1m': _MINUTE, '1h': 60 * _MINUTE, '1d': 1440 * _MINUTE}
+DEFAULT_RETENTION_DAYS = {'1m': 7, '1h': 90}
+# Dimensions per rollup kind (NULLs are stored as '' / 0: they are part of the primary key)
+DIMENSIONS = {'events': ('channel', 'event_id'), 'alerts': ('severity',)}
+MAX_POINTS = 1500
+
+META_KEY = 'backfill:rollups'
+
+
+def _now_us() -> int:
+    return int(time.time() * 1_000_000)
+
+
+def count_events(rows: Iterable[tuple]) -> Counter:
+    """Per-minute (bucket, channel, event_id) counts of insert rows (ts_us, channel, event_id at 1, 2, 3)."""
+    counts: Counter = Counter()
+    now = None
+    for row in rows:
+        ts = row[1]
+        if ts is None:
+            ts = now = now or _now_us()
+        counts[(ts - ts % _MINUTE, row[2] or '', row[3] if row[3] is not None else 0)] += 1
+    return counts
+
+
+def count_alert(created_us: Optional[int], severity: Optional[str]) -> Counter:
+    ts = created_us if created_us is not None else _now_us()
+    return Counter({(ts - ts % _MINUTE, severity or ''): 1})
+
+
+def apply(conn: sqlite3.Connection, kind: str, minute_counts: Counter):
+    """Add per-minute counts to all granularities (caller holds the transaction)."""
+    if not minute_counts:
+        return
+    dims = DIMENSIONS[kind]
+    for g, step in GRANULARITIES.items():
+        if step == _MINUTE:
+            counts = minute_counts
+        else:
+            counts = Counter()
+            for key, n in minute_counts.items():
+                counts[(key[0] - key[0] % step,) + key[1:]] += n
+        cols = ', '.join(('bucket_us',) + dims)
+        conn.executemany(
+            f"INSERT INTO rollup_{kind}_{g}({cols}, count) VALUES({', '.join('?' * (len(dims) + 2))}) "
+            f"ON CONFLICT({cols}) DO UPDATE SET count = count + excluded.count",
+            [key + (n,) for key, n in counts.items()])
+
+
+def prune(conn: sqlite3.Connection, retention_days: Dict[str, float]) -> int:
+    """Delete minute/hour buckets older than their retention (one transaction)."""
+    removed = 0
+    now = _now_us()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for g, days in retention_days.items():
+            if g in GRANULARITIES and days:
+                cutoff = now - int(days * GRANULARITIES['1d'])
+                for kind in DIMENSIONS:
+                    removed += conn.execute(f"DELETE FROM rollup_{kind}_{g} WHERE bucket_us < ?", (cutoff,)).rowcount
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return removed
+
+
+def pick_granularity(start_us: Optional[int], end_us: Optional[int]) -> str:
+    """Finest granularity that answers the range in at most ``MAX_POINTS`` buckets."""
+    if start_us is None:
+        return '1d'
+    span = (end_us if end_us is not None else _now_us()) - start_us
+    for g, step in GRANULARITIES.items():
+        if span / step <= MAX_POINTS:
+            return g
+    return '1d'
+
+
+def _conditions(kind: str, filters: Optional[Dict[str, Any]]) -> Tuple[List[str], list]:
+    clauses, params = [], []
+    for column, value in (filters or {}).items():
+        if column not in DIMENSIONS[kind]:
+            raise ValueError(f"Cannot filter {kind} rollups on {column!r}")
+        values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+        clauses.append(f"{column} IN ({','.join('?' * len(values))})" if values else "0")
+        params.extend(values)
+    return clauses, params
+
+
+def _group_columns(kind: str, group_by: Optional[Iterable[str]]) -> List[str]:
+    cols = list(group_by or [])
+    for c in cols:
+        if c not in DIMENSIONS[kind]:
+            raise ValueError(f"Cannot group {kind} rollups by {c!r}")
+    return cols
+
+
+def timeseries(conn: sqlite3.Connection, kind: str = 'events', time_range: Optional[Tuple[Any, Any]] = None,
+               granularity: str = 'auto', filters: Optional[Dict[str, Any]] = None,
+               group_by: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """Counts per bucket (and per ``group_by`` dimension), oldest bucket first."""
+    if kind not in DIMENSIONS:
+        raise ValueError(f"Unknown rollup kind: {kind}")
+    start_us, end_us = to_range(time_range)
+    if granularity == 'auto':
+        granularity = pick_granularity(start_us, end_us)
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+    step = GRANULARITIES[granularity]
+    clauses, params = _conditions(kind, filters)
+    if start_us is not None:
+        clauses.append("bucket_us >= ?")
+        params.append(start_us - start_us % step)
+    if end_us is not None:
+        clauses.append("bucket_us < ?")
+        params.append(end_us)
+    groups = _group_columns(kind, group_by)
+    select = ', '.join(['bucket_us'] + groups)
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    rows = conn.execute(f"SELECT {select}, SUM(count) FROM rollup_{kind}_{granularity}{where} "
+                        f"GROUP BY {select} ORDER BY {select}", params).fetchall()
+    out = []
+    for row in rows:
+        item = {'bucket': from_epoch_us(row[0]), 'bucket_us': row[0], 'granularity': granularity}
+        item.update(zip(groups, row[1:-1]))
+        item['count'] = row[-1]
+        out.append(item)
+    return out
+
+
+def _cover(start_us: int, end_us: int, grans: List[str]) -> List[Tuple[str, int, int]]:
+    """Split [start, end) into the fewest aligned day/hour/minute bucket ranges."""
+    if start_us >= end_us or not grans:
+        return []
+    g, finer = grans[0], grans[1:]
+    step = GRANULARITIES[g]
+    if not finer:
+        return [(g, start_us - start_us % step, end_us)]
+    first = -(-start_us // step) * step
+    last = end_us - end_us % step
+    if first >= last:
+        return _cover(start_us, end_us, finer)
+    return _cover(start_us, first, finer) + [(g, first, last)] + _cover(last, end_us, finer)
+
+
+def _snap(ts_us: int, retention_days: Dict[str, float], up: bool) -> int:
+    """Widen a range end to the finest granularity whose buckets still exist at that time."""
+    now = _now_us()
+    for g in ('1m', '1h'):
+        days = retention_days.get(g)
+        if not days or ts_us >= now - int(days * GRANULARITIES['1d']):
+            step = GRANULARITIES[g]
+            break
+    else:
+        step = GRANULARITIES['1d']
+    floor = ts_us - ts_us % step
+    return floor + step if up and floor != ts_us else floor
+
+
+def totals(conn: sqlite3.Connection, kind: str = 'events', time_range: Optional[Tuple[Any, Any]] = None,
+           filters: Optional[Dict[str, Any]] = None, group_by: Optional[Iterable[str]] = None,
+           retention_days: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+    """
+    Total counts over a range (all time if None), per ``group_by`` dimension.
+
+    Whole days come from the daily rollup and only the ragged ends from
+    hour/minute buckets, so the cost depends on the range length in days,
+    never on the event volume. Ends that fall where minute (or hour)
+    buckets were already pruned are widened to the enclosing hour (or day).
+    """
+    if kind not in DIMENSIONS:
+        raise ValueError(f"Unknown rollup kind: {kind}")
+    start_us, end_us = to_range(time_range)
+    groups = _group_columns(kind, group_by)
+    base, base_params = _conditions(kind, filters)
+    if start_us is None and end_us is None:
+        pieces = [('1d', None, None)]
+    else:
+        retention = DEFAULT_RETENTION_DAYS if retention_days is None else retention_days
+        start_us = _snap(start_us, retention, up=False) if start_us is not None else 0
+        end_us = _snap(end_us, retention, up=True) if end_us is not None else _now_us() + GRANULARITIES['1d']
+        pieces = _cover(start_us, end_us, ['1d', '1h', '1m'])
+    sums: Counter = Counter()
+    select = ', '.join(groups) if groups else "''"
+    for g, lo, hi in pieces:
+        clauses, params = list(base), list(base_params)
+        if lo is not None:
+            clauses += ["bucket_us >= ?", "bucket_us < ?"]
+            params += [lo, hi]
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        group = f" GROUP BY {select}" if groups else ""
+        for row in conn.execute(f"SELECT {select}, SUM(count) FROM rollup_{kind}_{g}{where}{group}", params):
+            if row[-1]:
+                sums[tuple(row[:-1])] += row[-1]
+    return [dict(zip(groups, key), count=n) for key, n in sorted(sums.items(), key=lambda kv: -kv[1])]
+
+
+class RollupBackfill:
+    """
+    Idle job that counts rows written before the rollups existed.
+
+    The plan in ``meta['backfill:rollups']`` lists the main ``events`` and
+    ``alerts`` tables (with the last id that existed at upgrade), every
+    partition (same) and every archived segment. Each step counts one
+    chunk and commits the counts together with the advanced plan, so a
+    restart resumes without double counting.
+    """
+
+    def __init__(self, chunk: int = 20000):
+        self.name = 'rollups'
+        self.chunk = chunk
+        self.rows = 0
+
+    @staticmethod
+    def plan(conn: sqlite3.Connection, partitions, archive) -> Optional[List[Dict[str, Any]]]:
+        """Freeze the plan the first time after the migration (before the writer starts)."""
+        state = get_meta(conn, META_KEY)
+        if state != 'pending':
+            return json.loads(state) if state and state != 'done' else None
+        max_id = lambda c, table: c.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+        items = [{'kind': 'events', 'path': None, 'cursor': 0, 'bound': max_id(conn, 'events')},
+                 {'kind': 'alerts', 'path': None, 'cursor': 0, 'bound': max_id(conn, 'alerts')}]
+        if partitions is not None:
+            for name, _, _ in partitions.list():
+                part = sqlite3.connect(partitions.path(name))
+                try:
+                    items.append({'kind': 'events', 'path': partitions.path(name), 'cursor': 0,
+                                  'bound': max_id(part, 'events')})
+                except sqlite3.Error:
+                    pass
+                finally:
+                    part.close()
+        if archive is not None:
+            items += [{'kind': 'segment', 'path': path} for _, _, _, path in archive.list()]
+        items = [i for i in items if i.get('bound', 1)]
+        conn.execute("BEGIN IMMEDIATE")
+        set_meta(conn, META_KEY, json.dumps(items) if items else 'done')
+        conn.execute("COMMIT")
+        return items or None
+
+    def step(self, conn: sqlite3.Connection) -> bool:
+        state = get_meta(conn, META_KEY)
+        if not state or state in ('done', 'pending'):
+            return False
+        items = json.loads(state)
+        item = items[0]
+        counts, finished = self._count(conn, item)
+        if finished:
+            items.pop(0)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            apply(conn, 'alerts' if item['kind'] == 'alerts' else 'events', counts)
+            set_meta(conn, META_KEY, json.dumps(items) if items else 'done')
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.rows += sum(counts.values())
+        if not items:
+            logger.info(f"Rollup backfill finished ({self.rows} rows counted this run)")
+        return bool(items)
+
+    def _count(self, conn: sqlite3.Connection, item: Dict[str, Any]) -> Tuple[Counter, bool]:
+        from app.core.db import open_readonly
+        if item['kind'] == 'segment':
+            from app.core.archive import SegmentReader
+            if not os.path.exists(item['path']):
+                return Counter(), True
+            rows = SegmentReader(item['path']).scan(newest_first=False)
+            return count_events(rows), True  # EVENT_COLUMNS rows: ts_us, channel, event_id at 1..3
+        source = conn
+        if item['path'] is not None:
+            if not os.path.exists(item['path']):
+                return Counter(), True
+            source = open_readonly(item['path'])
+        try:
+            if item['kind'] == 'alerts':
+                rows = source.execute("SELECT id, created_us, severity FROM alerts WHERE id > ? AND id <= ? "
+                                      "ORDER BY id LIMIT ?", (item['cursor'], item['bound'], self.chunk)).fetchall()
+                counts: Counter = Counter()
+                for r in rows:
+                    counts.update(count_alert(r[1], r[2]))
+            else:
+                rows = source.execute("SELECT id, ts_us, channel, event_id FROM events WHERE id > ? AND id <= ? "
+                                      "ORDER BY id LIMIT ?", (item['cursor'], item['bound'], self.chunk)).fetchall()
+                counts = count_events(rows)
+        finally:
+            if source is not conn:
+                source.close()
+        if rows:
+            item['cursor'] = rows[-1][0]
+        return counts, len(rows) < self.chunk
@@ -1,19 +1,157 @@
-from typing import List, Dict, Any
+import json
+import os
+import time
+from typing import List, Dict, Any, Optional, Tuple
 
-from app.detectors.bruteforce import detect_bruteforce
-from app.detectors.powershell_abuse import detect_powershell_abuse
-from app.detectors.usb_monitor import detect_usb_activity
-from app.detectors.malware_exec import detect_malware_exec
+from app.core.event import Event
+from app.core.feed import write_json_atomic
+from app.detectors.base import FunctionDetector, StreamingDetector
+from app.detectors.bruteforce import BruteForceDetector
+from app.detectors.powershell_abuse import POWERSHELL_EVENT_IDS, detect_powershell_abuse
+from app.detectors.usb_monitor import UsbDetector
+from app.detectors.malware_exec import MalwareExecDetector
+from app.detectors.rules import RuleDetector, load_rule_files
 from utils.logging import setup_logger
 
 logger = setup_logger("rules_engine")
 
+# A detector evicting keys at its cap is reported at most this often (and flagged in stats for as long)
+EVICTION_WARN_SECONDS = 300
+
+
+def build_detectors(thresholds: Dict[str, Any], rules_dir: Optional[str] = None) -> List[StreamingDetector]:
+    """The built-in detectors plus the rules in ``rules_dir``; a rule's ``replaces`` drops the built-in it names."""
+    detectors: List[StreamingDetector] = [
+        BruteForceDetector(thresholds),
+        FunctionDetector('powershell_abuse', detect_powershell_abuse, thresholds, event_ids=POWERSHELL_EVENT_IDS),
+        UsbDetector(thresholds),
+        MalwareExecDetector(thresholds),
+    ]
+    rules = RuleDetector(load_rule_files(rules_dir), thresholds) if rules_dir else None
+    if rules:
+        detectors = [d for d in detectors if d.name not in rules.replaces] + [rules]
+        if rules.replaces:
+            logger.info(f"Rules replace built-in detectors: {', '.join(sorted(rules.replaces))}")
+    return detectors
+
+
+class DetectionEngine:
+    """
+    The detectors with their state kept across batches.
+
+    Each batch is routed once: events are looked up by (channel, event id)
+    in a memoized table of subscribed detectors, and every detector gets
+    only its sub-batch (in stream order) instead of scanning the whole
+    batch. ``stats()`` reports per-detector events routed, alerts, time
+    spent, live entities and entities evicted by a table's key cap; a
+    detector that keeps evicting is logged as a warning and its ``health``
+    reads ``evicting`` instead of ``ok``.
+
+    With a ``state_path``, every detector's state is written there as JSON
+    (temp file + rename) at most every ``snapshot_seconds`` and on
+    ``close()``, and read back on startup, so a window in progress survives
+    a restart. Not thread-safe: run it from one detect worker.
+
+    Declarative rules from ``rules_dir`` run as one more detector
+    (``rules``, see ``app.detectors.rules``).
+    """
+
+    def __init__(self, thresholds: Dict[str, Any], state_path: Optional[str] = None, snapshot_seconds: float = 60,
+                 rules_dir: Optional[str] = None):
+        self.detectors = build_detectors(thresholds, rules_dir)
+        self._routes: Dict[Tuple[Any, Any], Tuple[int, ...]] = {}
+        self._counters = [{'events': 0, 'alerts': 0, 'seconds': 0.0} for _ in self.detectors]
+        self._evicted = [0] * len(self.detectors)  # evictions seen so far / at the last warning
+        self._reported = [0] * len(self.detectors)
+        self._evicting = [float('-inf')] * len(self.detectors)  # when an eviction was last seen / warned about
+        self._warned = [float('-inf')] * len(self.detectors)
+        self.state_path = state_path
+        self.snapshot_seconds = max(0.0, float(snapshot_seconds))
+        self._saved = time.monotonic()
+        self._load()
+
+    def route(self, events: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """One sub-batch per detector, in detector order."""
+        batches: List[List[Dict[str, Any]]] = [[] for _ in self.detectors]
+        routes = self._routes
+        for e in events:
+            key = (e.channel, e.event_id) if type(e) is Event else (e.get('channel'), e.get('event_id'))
+            targets = routes.get(key)
+            if targets is None:
+                if len(routes) > 65536:
+                    routes.clear()  # unbounded id/channel variety (malformed input)
+                targets = routes[key] = tuple(i for i, d in enumerate(self.detectors) if d.wants(*key))
+            for i in targets:
+                batches[i].append(e)
+        return batches
+
+    def process(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        alerts: List[Dict[str, Any]] = []
+        for detector, batch, counters in zip(self.detectors, self.route(events), self._counters):
+            if not batch:
+                continue
+            started = time.perf_counter()
+            found = detector.process(batch)
+            counters['seconds'] += time.perf_counter() - started
+            counters['events'] += len(batch)
+            counters['alerts'] += len(found)
+            alerts += found
+        logger.info(f"Detectors produced {len(alerts)} alerts")
+        self._watch_evictions()
+        if self.state_path and time.monotonic() - self._saved >= self.snapshot_seconds:
+            self.save()
+        return alerts
+
+    def save(self):
+        if not self.state_path:
+            return
+        self._saved = time.monotonic()
+        state = {'version': 1, 'detectors': {d.name: d.snapshot() for d in self.detectors}}
+        try:
+            write_json_atomic(self.state_path, state, separators=(',', ':'))
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Failed to save detector state to {self.state_path}: {e}")
+
+    def close(self):
+        self.save()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        return {d.name: dict(c, seconds=round(c['seconds'], 3), entities=d.entities(),
+                             evicted=sum(t.evicted for t in d.tables.values()),
+                             health='evicting' if now - seen < EVICTION_WARN_SECONDS else 'ok')
+                for d, c, seen in zip(self.detectors, self._counters, self._evicting)}
+
+    def _watch_evictions(self):
+        now = time.monotonic()
+        for i, detector in enumerate(self.detectors):
+            evicted = sum(t.evicted for t in detector.tables.values())
+            if evicted == self._evicted[i]:
+                continue
+            self._evicted[i] = evicted
+            self._evicting[i] = now
+            if now - self._warned[i] >= EVICTION_WARN_SECONDS:
+                logger.warning(f"Detector {detector.name} is at its key cap: {evicted - self._reported[i]} keys evicted "
+                               f"({evicted} in total); evicted keys keep approximate counts at best, "
+                               f"raise its max_keys threshold if this persists")
+                self._warned[i] = now
+                self._reported[i] = evicted
+
+    def _load(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f).get('detectors', {})
+            for detector in self.detectors:
+                if detector.name in saved:
+                    detector.restore(saved[detector.name])
+        except Exception as e:
+            logger.error(f"Failed to load detector state from {self.state_path}: {e}")
+            return
+        logger.info(f"Restored detector state ({sum(d.entities() for d in self.detectors)} entities) from {self.state_path}")
+
 
 def run_detectors(events: List[Dict[str, Any]], thresholds: Dict[str, Any]) -> List[Dict[str, Any]]:
-    alerts: List[Dict[str, Any]] = []
-    alerts += detect_bruteforce(events, thresholds)
-    alerts += detect_powershell_abuse(events, thresholds)
-    alerts += detect_usb_activity(events, thresholds)
-    alerts += detect_malware_exec(events, thresholds)
-    logger.info(f"Detectors produced {len(alerts)} alerts")
-    return alerts
+    """One-shot detection over ``events`` alone; streaming callers keep a ``DetectionEngine`` instead."""
+    return DetectionEngine(thresholds).process(events)
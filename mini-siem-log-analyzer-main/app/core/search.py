@@ -0,0 +1,180 @@
+"""
+Full-text search over event message/command.
+
+Every events table (main and each partition) has an external-content
+FTS5 index, ``events_fts``, maintained by insert/delete triggers (see
+``EVENTS_FTS_SQL`` in migrations). Rows that predate the index are
+indexed in the background: ``FtsBackfill`` walks the main table in
+chunks while the writer is idle, ``PartitionFtsRebuild`` rebuilds one
+partition file per step.
+"""
+import heapq
+import os
+import sqlite3
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.core.migrations import get_meta, set_meta
+from app.core.partitions import PartitionSet, EVENT_COLUMNS, event_conditions, events_source, to_range
+from utils.logging import setup_logger
+
+logger = setup_logger("search")
+
+MAX_PAGE_SIZE = 500
+
+
+def fts_query(text: str) -> str:
+    """Analyst input -> FTS5 expression: every whitespace-separated term must appear, each as a quoted phrase.
+
+    Quoting keeps punctuation-heavy hunts (``-enc``, ``ws01.corp.local``,
+    ``DownloadString(``) from being read as FTS5 operators.
+    """
+    terms = [t.replace('"', '""') for t in text.split()]
+    return ' '.join(f'"{t}"' for t in terms)
+
+
+class FtsBackfill:
+    """
+    Chunked indexing of the main ``events`` rows that predate ``events_fts``.
+
+    State is ``meta['backfill:events_fts'] = "<cursor>:<bound>"``: rows
+    with ``cursor < id <= bound`` still need indexing; later rows were
+    indexed by the trigger. ``reset=True`` (a rebuild) clears the index
+    and sets the bound to the current last row in the same transaction.
+    """
+
+    key = 'backfill:events_fts'
+
+    def __init__(self, reset: bool = False, chunk: int = 5000):
+        self.name = 'events_fts'
+        self.reset = reset
+        self.chunk = chunk
+        self.rows = 0
+
+    def pending(self, conn: sqlite3.Connection) -> bool:
+        return self.reset or get_meta(conn, self.key) not in (None, 'done')
+
+    def step(self, conn: sqlite3.Connection) -> bool:
+        if not _has_fts(conn, 'main'):
+            return False
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.reset:
+                conn.execute("INSERT INTO events_fts(events_fts) VALUES('delete-all')")
+                bound = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+                set_meta(conn, self.key, f"0:{bound}")
+                self.reset = False
+            state = get_meta(conn, self.key)
+            if state in (None, 'done'):
+                conn.execute("COMMIT")
+                return False
+            cursor, bound = (int(v) for v in state.split(':'))
+            rows = conn.execute(f"SELECT id, message, command FROM {events_source(conn)} WHERE id > ? AND id <= ? "
+                                "ORDER BY id LIMIT ?", (cursor, bound, self.chunk)).fetchall()
+            if rows:
+                conn.executemany("INSERT INTO events_fts(rowid, message, command) VALUES(?,?,?)", rows)
+            more = len(rows) == self.chunk
+            set_meta(conn, self.key, f"{rows[-1][0]}:{bound}" if more else 'done')
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.rows += len(rows)
+        if not more:
+            logger.info(f"Full-text index of main events finished ({self.rows} rows this run)")
+        return more
+
+
+class PartitionFtsRebuild:
+    """Rebuild one partition's ``events_fts`` from its rows (a partition is small enough for one transaction)."""
+
+    def __init__(self, partitions: PartitionSet, partition: str):
+        self.name = f"events_fts:{partition}"
+        self.partitions = partitions
+        self.partition = partition
+
+    def step(self, conn: sqlite3.Connection) -> bool:
+        path = self.partitions.path(self.partition)
+        if not os.path.exists(path):
+            return False
+        # Own connection: the partition may not be attached to the writer's
+        part = sqlite3.connect(path, timeout=30)
+        try:
+            if _has_fts(part, 'main'):
+                part.execute("INSERT INTO events_fts(events_fts) VALUES('rebuild')")
+                part.commit()
+                logger.info(f"Rebuilt full-text index of {self.partition}")
+        finally:
+            part.close()
+        return False
+
+
+def _has_fts(conn: sqlite3.Connection, schema: str) -> bool:
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name='events_fts'").fetchone() is not None
+
+
+_SELECT = ', '.join(f"e.{c}" for c in EVENT_COLUMNS)
+
+
+def _search_one(path: str, text: str, raw: bool, conditions: List[str], params: list, limit: int) -> List[tuple]:
+    from app.core.db import open_readonly
+    try:
+        conn = open_readonly(path)
+    except sqlite3.OperationalError:
+        return []
+    try:
+        where = ''.join(f" AND {c}" for c in conditions)
+        if _has_fts(conn, 'main'):
+            sql = (f"SELECT {_SELECT}, bm25(events_fts) AS score, snippet(events_fts, -1, '[', ']', '...', 16) "
+                   f"FROM events_fts JOIN {events_source(conn)} e ON e.id = events_fts.rowid "
+                   f"WHERE events_fts MATCH ?{where} ORDER BY score LIMIT ?")
+            try:
+                return conn.execute(sql, [text if raw else fts_query(text)] + params + [limit]).fetchall()
+            except sqlite3.OperationalError as e:
+                if raw and 'locked' not in str(e):
+                    raise ValueError(f"Bad search expression: {e}")
+                raise
+        # No FTS5 in this SQLite build: substring scan, newest first, unranked
+        like = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        sql = (f"SELECT {_SELECT}, 0.0, substr(e.message, 1, 200) FROM {events_source(conn)} e "
+               f"WHERE (e.message LIKE ? ESCAPE '\\' OR e.command LIKE ? ESCAPE '\\'){where} "
+               f"ORDER BY e.ts_us DESC LIMIT ?")
+        return conn.execute(sql, [like, like] + params + [limit]).fetchall()
+    except sqlite3.OperationalError as e:
+        logger.debug(f"Skipping {path}: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+def search_events(main_path: str, partitions: Optional[PartitionSet], text: str,
+                  time_range: Optional[Tuple[Any, Any]] = None, filters: Optional[Dict[str, Any]] = None,
+                  page: int = 1, page_size: int = 50, raw: bool = False) -> Dict[str, Any]:
+    """
+    Ranked full-text search over message/command in every partition overlapping ``time_range``.
+
+    ``text`` is a list of terms that must all appear (``raw=True`` passes
+    an FTS5 expression through: OR, NOT, NEAR, prefix*). Each partition
+    returns its best ``page * page_size`` hits by bm25 and the lists are
+    merged, so page N costs N pages per partition.
+    """
+    text = (text or '').strip()
+    page = max(1, int(page))
+    page_size = min(MAX_PAGE_SIZE, max(1, int(page_size)))
+    result = {'query': text, 'page': page, 'page_size': page_size, 'results': []}
+    if not text:
+        return result
+    start_us, end_us = to_range(time_range)
+    conditions, params = event_conditions(start_us, end_us, filters, prefix='e.')
+    wanted = page * page_size
+    paths = [partitions.path(name) for name, _, _ in partitions.overlapping(start_us, end_us)] if partitions else []
+    if os.path.exists(main_path):
+        paths.append(main_path)
+    hits = [_search_one(path, text, raw, conditions, params, wanted) for path in paths]
+    merged = list(heapq.merge(*hits, key=lambda r: r[-2]))
+    for row in merged[wanted - page_size:wanted]:
+        item = dict(zip(EVENT_COLUMNS, row))
+        item['score'] = row[-2]
+        item['snippet'] = row[-1]
+        result['results'].append(item)
+    result['has_more'] = len(merged) > wanted
+    return result
@@ -0,0 +1,206 @@
+"""
+Local write-ahead spool for batches the database could not take.
+
+When a write or commit fails (locked file, disk full, I/O error) or the
+writer stops draining its queue, ``Database`` appends the affected
+batches here instead of dropping them, and replays them into SQLite
+while idle once the database answers again.
+
+The spool is a directory of append-only segment files
+(``spool-<epoch_us>.log``): an 8-byte magic, then records of
+``<length:u32><crc32:u32>`` followed by a zlib-compressed JSON payload
+``{"kind": "events"|"alert", "name": <partition>, "rows": [...]}``.
+Every append is flushed (and fsynced unless disabled), a new segment is
+started after ``segment_bytes`` or after a failed write, and a record
+with a short read or a bad checksum ends its segment: the damaged tail
+of a crash is skipped, never misread. The total size is capped at
+``max_bytes``; past it new batches are dropped and counted.
+"""
+import glob
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import List, Dict, Any, Optional, Tuple
+
+from utils.logging import setup_logger
+
+logger = setup_logger("spool")
+
+MAGIC = b'SIEMSPL1'
+HEADER = struct.Struct('<II')  # payload length, crc32(payload)
+
+
+class Spool:
+    """Append-only, size-capped segment files; safe to append from several threads."""
+
+    START = len(MAGIC)  # offset of the first record in a segment
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 2**20, segment_bytes: int = 8 * 2**20,
+                 fsync: bool = True):
+        self.directory = directory
+        self.max_bytes = max(1, int(max_bytes))
+        self.segment_bytes = max(1, int(segment_bytes))
+        self.fsync = fsync
+        self.spooled_batches = 0
+        self.spooled_rows = 0
+        self.replayed_rows = 0
+        self.dropped_batches = 0
+        self.dropped_rows = 0
+        self.corrupt_records = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._active: Optional[str] = None
+        self._full = False
+        self._damaged: set = set()
+        # Segments left by an earlier run are only read: a crash may have torn their last record
+        self._sizes: Dict[str, int] = {p: os.path.getsize(p)
+                                       for p in sorted(glob.glob(os.path.join(directory, 'spool-*.log')))}
+        self._bytes = sum(self._sizes.values())
+        if self._sizes:
+            logger.info(f"Spool holds {len(self._sizes)} segment(s), {self._bytes} bytes, to replay")
+
+    def pending(self) -> bool:
+        return bool(self._sizes)
+
+    def segments(self) -> List[str]:
+        with self._lock:
+            return list(self._sizes)
+
+    def append(self, kind: str, name: Optional[str], rows: List[tuple]) -> bool:
+        """Durably store one batch of insert rows; False if it was dropped (spool full or unwritable)."""
+        payload = zlib.compress(json.dumps({'kind': kind, 'name': name, 'rows': rows}, default=str,
+                                           separators=(',', ':')).encode('ascii'), 1)
+        record = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self._bytes + len(record) > self.max_bytes:
+                if not self._full:
+                    logger.error(f"Spool is full ({self.max_bytes} bytes); dropping batches until it drains")
+                    self._full = True
+                return self._drop(rows)
+            try:
+                f = self._segment()
+                f.write(record)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            except OSError as e:
+                logger.error(f"Spool write failed, dropping {len(rows)} rows: {e}")
+                self._close_segment()  # a torn record may end it; continue in a fresh file
+                return self._drop(rows)
+            self._sizes[self._active] += len(record)
+            self._bytes += len(record)
+            self._full = False
+            self.spooled_batches += 1
+            self.spooled_rows += len(rows)
+        return True
+
+    def read(self, path: str, offset: int) -> Optional[Tuple[str, Optional[str], List[tuple], int]]:
+        """(kind, name, rows, next offset) of the record at ``offset``, or None at the end of the segment."""
+        with self._lock:
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                return None
+            with f:
+                if offset <= self.START:
+                    offset = self.START
+                    if f.read(len(MAGIC)) != MAGIC:
+                        return self._damage(path, 0)
+                f.seek(offset)
+                header = f.read(HEADER.size)
+                if not header:
+                    return None
+                if len(header) < HEADER.size:
+                    return self._damage(path, offset)
+                length, crc = HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    return self._damage(path, offset)
+            try:
+                record = json.loads(zlib.decompress(payload))
+                rows = [tuple(r) for r in record['rows']]
+            except (zlib.error, ValueError, KeyError, TypeError):
+                return self._damage(path, offset)
+        return record['kind'], record.get('name'), rows, offset + HEADER.size + length
+
+    def finish(self, path: str, offset: int) -> bool:
+        """Delete a segment replayed up to ``offset``; False if records were appended past it meanwhile."""
+        with self._lock:
+            size = self._sizes.get(path)
+            if size is None:
+                return True
+            if path not in self._damaged and size > max(offset, self.START):
+                return False
+            if path == self._active:
+                self._close_segment()
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Could not delete replayed spool segment {os.path.basename(path)}: {e}")
+                return False
+            del self._sizes[path]
+            self._bytes -= size
+            self._damaged.discard(path)
+        return True
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'segments': len(self._sizes),
+            'bytes': self._bytes,
+            'spooled_batches': self.spooled_batches,
+            'spooled_rows': self.spooled_rows,
+            'replayed_rows': self.replayed_rows,
+            'dropped_batches': self.dropped_batches,
+            'dropped_rows': self.dropped_rows,
+            'corrupt_records': self.corrupt_records,
+        }
+
+    # --- internals (lock held) -------------------------------------------
+
+    def _segment(self):
+        if self._file is not None and self._sizes.get(self._active, 0) < self.segment_bytes:
+            return self._file
+        self._close_segment()
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.time_ns() // 1000
+        while True:
+            path = os.path.join(self.directory, f"spool-{stamp:017d}.log")
+            try:
+                f = open(path, 'xb')
+                break
+            except FileExistsError:
+                stamp += 1
+        f.write(MAGIC)
+        f.flush()
+        self._file, self._active = f, path
+        self._sizes[path] = len(MAGIC)
+        self._bytes += len(MAGIC)
+        return f
+
+    def _close_segment(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+        self._file = self._active = None
+
+    def _drop(self, rows: List[tuple]) -> bool:
+        self.dropped_batches += 1
+        self.dropped_rows += len(rows)
+        return False
+
+    def _damage(self, path: str, offset: int) -> None:
+        self.corrupt_records += 1
+        self._damaged.add(path)
+        logger.error(f"Spool segment {os.path.basename(path)} is damaged at byte {offset}; skipping the rest of it")
+        return None
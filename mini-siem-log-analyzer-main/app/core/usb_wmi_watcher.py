@@ -2,7 +2,10 @@ import threading
 import time
 from typing import Callable, Dict, Set
 
-import wmi
+try:
+    import wmi
+except Exception:
+    wmi = None
 from utils.logging import setup_logger
 
 logger = setup_logger("usb_wmi_watcher")
@@ -72,6 +75,9 @@ class USBWMIWatcher:
         self._on_event(evt)
 
     def _run(self):
+        if wmi is None:
+            logger.error("Failed to start WMI watcher: wmi module not available")
+            return
         try:
             c = wmi.WMI()
             watcher_add = c.watch_for(notification_type="Creation", wmi_class="Win32_PnPEntity")
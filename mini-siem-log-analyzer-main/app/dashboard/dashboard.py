@@ -1,12 +1,40 @@
-from flask import Flask, jsonify, render_template_string
+from flask import Flask, jsonify, render_template_string, request
 from utils.logging import setup_logger
 import sqlite3
 import os
 
+from app.core.config_loader import AppConfig
+from app.core.db import open_readonly, default_partition_dir, default_archive_dir
+from app.core.partitions import ALERT_COLUMNS, PartitionSet, alert_evidence, now_us, query_events
+from app.core.archive import ArchiveSet
+from app.core.search import search_events
+from app.core import rollups
+
 logger = setup_logger("dashboard")
 app = Flask(__name__)
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), '..', 'data', 'siem.db')
-DB_PATH = os.path.normpath(DB_PATH)
+BASE_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+CONFIG_PATH = os.path.join(BASE_DIR, 'config.json')
+
+_stores = None
+
+
+def stores():
+    """
+    (database path, PartitionSet or None, ArchiveSet) as the writer sees them:
+    ``database.path``, ``partition``, ``partition_dir`` and ``archive_dir``
+    from config.json, resolved like ``Database.from_config``. Built on the
+    first request, so importing the dashboard touches no files.
+    """
+    global _stores
+    if _stores is None:
+        database = AppConfig.load(CONFIG_PATH).database if os.path.exists(CONFIG_PATH) else {}
+        path = database.get('path', os.path.join(BASE_DIR, 'data', 'siem.db'))
+        partition = database.get('partition', 'day')
+        partitions = None
+        if partition and partition != 'none':
+            partitions = PartitionSet(database.get('partition_dir') or default_partition_dir(path), partition)
+        _stores = (path, partitions, ArchiveSet(database.get('archive_dir') or default_archive_dir(path)))
+    return _stores
 
 # HTML Dashboard Template
 DASHBOARD_HTML = """
@@ -120,7 +148,7 @@ DASHBOARD_HTML = """
                 <div class="number" id="totalAlerts">0</div>
             </div>
             <div class="stat-card">
-                <div class="label">Recent Events</div>
+                <div class="label">Events (24h)</div>
                 <div class="number" id="totalEvents">0</div>
             </div>
             <div class="stat-card">
@@ -147,18 +175,24 @@ DASHBOARD_HTML = """
 
     <script>
         function loadData() {
+            // Totals come from the rollup tables, not from the lists below
+            fetch('/api/summary')
+                .then(r => r.json())
+                .then(s => {
+                    document.getElementById('totalAlerts').textContent = s.alerts_total;
+                    document.getElementById('totalEvents').textContent = s.events_24h;
+                    document.getElementById('criticalAlerts').textContent =
+                        (s.alerts_by_severity.CRITICAL || 0) + (s.alerts_by_severity.HIGH || 0);
+                });
+
             // Load alerts
             fetch('/api/alerts')
                 .then(r => r.json())
                 .then(data => {
-                    document.getElementById('totalAlerts').textContent = data.length;
-                    const critical = data.filter(a => a.severity === 'CRITICAL' || a.severity === 'HIGH').length;
-                    document.getElementById('criticalAlerts').textContent = critical;
-                    
                     const html = data.length > 0 ? data.map(a => `
                         <div class="alert-item ${a.severity}">
                             <div class="title">${a.title}</div>
-                            <div class="time">⏰ ${a.created_at}</div>
+                            <div class="time">⏰ ${a.created_at}${a.occurrences > 1 ? ` · seen ${a.occurrences}x, last ${a.last_seen}` : ''}</div>
                             <div class="desc">${a.description}</div>
                         </div>
                     `).join('') : '<div class="no-data">No alerts yet</div>';
@@ -169,8 +203,6 @@ DASHBOARD_HTML = """
             fetch('/api/events')
                 .then(r => r.json())
                 .then(data => {
-                    document.getElementById('totalEvents').textContent = data.length;
-                    
                     const html = data.length > 0 ? data.slice(0, 50).map(e => `
                         <div class="event-item">
                             <div class="event-header">
@@ -196,11 +228,13 @@ DASHBOARD_HTML = """
 """
 
 
-def _rows(q):
-    conn = sqlite3.connect(DB_PATH)
+def _rows(q, params=()):
+    # Read-only connection: WAL readers never block (or get blocked by) the SIEM writer, and a
+    # missing database raises instead of being created empty
+    conn = open_readonly(stores()[0])
     try:
         cur = conn.cursor()
-        cur.execute(q)
+        cur.execute(q, params)
         return cur.fetchall()
     finally:
         conn.close()
@@ -214,15 +248,90 @@ def index():
 
 @app.route('/api/alerts')
 def alerts():
-    rows = _rows("SELECT created_at, severity, title, description FROM alerts ORDER BY id DESC LIMIT 100")
-    return jsonify([{'created_at': r[0], 'severity': r[1], 'title': r[2], 'description': r[3]} for r in rows])
+    try:
+        rows = _rows(f"SELECT {', '.join(ALERT_COLUMNS)} FROM alerts ORDER BY id DESC LIMIT 100")
+    except sqlite3.OperationalError:
+        return jsonify([])  # database not created/migrated yet
+    return jsonify([dict(zip(ALERT_COLUMNS, r)) for r in rows])
+
+
+@app.route('/api/alerts/<int:alert_id>/evidence')
+def alert_evidence_view(alert_id):
+    """The alert with the events that raised it, oldest first."""
+    path, partitions, _ = stores()
+    result = alert_evidence(path, partitions, alert_id)
+    if result is None:
+        return jsonify({'error': 'no such alert'}), 404
+    return jsonify(result)
 
 
 @app.route('/api/events')
 def events():
-    rows = _rows("SELECT timestamp, channel, event_id, user, ip, command FROM events ORDER BY id DESC LIMIT 250")
-    return jsonify([{'timestamp': r[0], 'channel': r[1], 'event_id': r[2], 'user': r[3], 'ip': r[4], 'command': r[5]} for r in rows])
+    path, partitions, archive = stores()
+    rows = query_events(path, partitions, limit=250, archive=archive)
+    return jsonify([{k: r[k] for k in ('timestamp', 'channel', 'event_id', 'user', 'ip', 'command')} for r in rows])
+
 
+@app.route('/api/search')
+def search():
+    """?q=terms&page=1&page_size=50[&start=&end=ISO][&event_id=&channel=&user=&ip=][&raw=1 for FTS5 syntax]"""
+    args = request.args
+    filters = {k: args[k] for k in ('channel', 'user', 'ip') if args.get(k)}
+    if args.get('event_id'):
+        filters['event_id'] = args.get('event_id', type=int)
+    path, partitions, _ = stores()
+    try:
+        result = search_events(path, partitions, args.get('q', ''),
+                               time_range=(args.get('start') or None, args.get('end') or None), filters=filters,
+                               page=args.get('page', 1, type=int), page_size=args.get('page_size', 50, type=int),
+                               raw=args.get('raw') == '1')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+
+@app.route('/api/summary')
+def summary():
+    conn = None
+    try:
+        conn = open_readonly(stores()[0])
+        by_severity = {r['severity']: r['count'] for r in rollups.totals(conn, 'alerts', group_by=['severity'])}
+        events_24h = rollups.totals(conn, 'events', time_range=(now_us() - rollups.GRANULARITIES['1d'], None))
+        events_total = rollups.totals(conn, 'events')
+    except sqlite3.OperationalError:
+        by_severity, events_24h, events_total = {}, [], []  # database not created/migrated yet
+    finally:
+        if conn is not None:
+            conn.close()
+    return jsonify({
+        'alerts_total': sum(by_severity.values()),
+        'alerts_by_severity': by_severity,
+        'events_24h': events_24h[0]['count'] if events_24h else 0,
+        'events_total': events_total[0]['count'] if events_total else 0,
+    })
+
+
+@app.route('/api/stats')
+def stats():
+    """?kind=events|alerts&granularity=auto|1m|1h|1d[&start=&end=ISO][&group_by=channel,event_id][&channel=&event_id=&severity=]"""
+    args = request.args
+    kind = args.get('kind', 'events')
+    filters = {k: args[k] for k in ('channel', 'severity') if args.get(k)}
+    if args.get('event_id'):
+        filters['event_id'] = args.get('event_id', type=int)
+    group_by = [c for c in args.get('group_by', '').split(',') if c]
+    try:
+        conn = open_readonly(stores()[0])
+    except sqlite3.OperationalError:
+        return jsonify([])  # database not created yet
+    try:
+        series = rollups.timeseries(conn, kind, (args.get('start') or None, args.get('end') or None),
+                                    args.get('granularity', 'auto'), filters, group_by)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    return jsonify(series)
 
 if __name__ == '__main__':
     app.run(host='127.0.0.1', port=5000)
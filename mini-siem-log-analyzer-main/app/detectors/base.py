@@ -0,0 +1,408 @@
+"""
+Streaming detector interface.
+
+A ``StreamingDetector`` sees the event stream one batch at a time
+(``process(events) -> alerts``) and keeps whatever it needs between
+batches in ``EntityState`` tables: per-key values that expire once the key
+has been quiet for the table's TTL. Time is event time (the newest
+timestamp seen so far), so a replayed capture ages state the same way a
+live feed does, and every table is bounded by how many keys can be active
+within one TTL.
+
+A detector subscribes to the events it cares about with ``event_ids`` and
+``channels`` (None = any); the detection engine routes each batch once
+and hands every detector only its matching sub-batch.
+
+A table can also be capped at ``max_keys``, so a flood of distinct
+sources costs a fixed amount of memory. Past the cap an insert first
+drops the least recently seen key if it is already past its TTL, else
+evicts (and counts) the lightest of the few least recently seen keys by
+the table's ``weight`` (e.g. the one furthest below an alert threshold).
+``RingWindow`` keeps a per-key sliding window as a few fixed time buckets
+instead of one entry per event, and a ``WindowSketch`` keeps approximate
+windows of evicted keys so they resume counting where they left off.
+
+``snapshot()``/``restore()`` turn that state into JSON and back, so the
+detection engine can save it periodically and pick up after a restart.
+Events themselves are not saved; a restored window holds their times only.
+"""
+import hashlib
+import math
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from itertools import islice
+from typing import List, Dict, Any, Optional, Callable, Iterable, Iterator, Tuple
+
+from app.core.event import Event
+from app.core.migrations import to_epoch_us
+
+_SECONDS: Dict[str, Optional[float]] = {}  # 'YYYY-MM-DDTHH:MM:SS' -> epoch seconds
+_popcount = getattr(int, 'bit_count', None) or (lambda x: bin(x).count('1'))
+
+# Least recently seen keys a capped table weighs against each other to pick one to evict
+EVICT_SAMPLE = 4
+
+
+def event_seconds(evt: Any, default: Optional[float] = None) -> float:
+    """Event time in epoch seconds (``default``, else wall clock, when it has none)."""
+    ts = evt.timestamp if type(evt) is Event else evt.get('timestamp')
+    if isinstance(ts, str) and len(ts) >= 19:
+        # Naive/UTC timestamps: parse each second once, add the fraction as text
+        tail = ts[19:]
+        if tail[-1:] == 'Z':
+            tail = tail[:-1]
+        if not tail or (tail[0] == '.' and tail[1:].isdigit()):
+            second = ts[:19]
+            base = _SECONDS.get(second)
+            if base is None:
+                if len(_SECONDS) > 4096:
+                    _SECONDS.clear()
+                ts_us = to_epoch_us(second)
+                base = _SECONDS[second] = ts_us / 1_000_000 if ts_us is not None else None
+            if base is not None:
+                return base + float(tail) if tail else base
+    ts_us = to_epoch_us(ts)
+    if ts_us is not None:
+        return ts_us / 1_000_000
+    return default if default is not None else time.time()
+
+
+class EntityState:
+    """
+    Per-key values kept in last-seen order; keys quiet for ``ttl_seconds``
+    are dropped by ``expire``. Past ``max_keys`` (0 = no cap) an insert drops
+    the least recently seen key if it has expired, else evicts the one of
+    the ``EVICT_SAMPLE`` least recently seen with the lowest ``weight(value)``
+    (the least recently seen without a ``weight``) and passes it to
+    ``on_evict(key, value)``.
+    """
+
+    def __init__(self, ttl_seconds: float, max_keys: int = 0, weight: Optional[Callable[[Any], float]] = None,
+                 on_evict: Optional[Callable[[str, Any], None]] = None):
+        self.ttl_seconds = max(0.0, float(ttl_seconds))
+        self.max_keys = max(0, int(max_keys or 0))
+        self.weight = weight
+        self.on_evict = on_evict
+        self.evicted = 0
+        self._items: "OrderedDict[str, list]" = OrderedDict()  # key -> [last_seen, value]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._items
+
+    def get(self, key: str, default: Any = None) -> Any:
+        item = self._items.get(key)
+        return item[1] if item is not None else default
+
+    def last_seen(self, key: str) -> Optional[float]:
+        item = self._items.get(key)
+        return item[0] if item is not None else None
+
+    def touch(self, key: str, now: float, value: Any):
+        self._items[key] = [now, value]
+        self._items.move_to_end(key)
+        self._evict(now)
+
+    def setdefault(self, key: str, now: float, factory: Callable[[], Any]) -> Any:
+        """The value for ``key`` (created by ``factory`` if missing), marked as seen at ``now``."""
+        item = self._items.get(key)
+        if item is None:
+            item = self._items[key] = [now, factory()]
+            self._evict(now)
+        else:
+            if now > item[0]:
+                item[0] = now
+            self._items.move_to_end(key)
+        return item[1]
+
+    def _evict(self, now: float):
+        items = self._items
+        if not self.max_keys or len(items) <= self.max_keys:
+            return
+        key, (seen, value) = next(iter(items.items()))
+        if seen <= now - self.ttl_seconds:
+            del items[key]  # quiet for a whole TTL: nothing is lost
+            return
+        weight = self.weight
+        if weight is not None:
+            lightest = weight(value)
+            # never the key just inserted, which is the most recently seen
+            for k, item in islice(items.items(), 1, min(EVICT_SAMPLE, len(items) - 1)):
+                w = weight(item[1])
+                if w < lightest:
+                    key, value, lightest = k, item[1], w
+        del items[key]
+        self.evicted += 1
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        item = self._items.pop(key, None)
+        return item[1] if item is not None else default
+
+    def expire(self, now: float) -> int:
+        cutoff = now - self.ttl_seconds
+        dropped = 0
+        while self._items:
+            key, (seen, _) = next(iter(self._items.items()))
+            if seen > cutoff:
+                break
+            del self._items[key]
+            dropped += 1
+        return dropped
+
+    def items(self) -> Iterator[Tuple[str, float, Any]]:
+        for key, (seen, value) in self._items.items():
+            yield key, seen, value
+
+    def dump(self, encode: Callable[[Any], Any] = lambda v: v) -> List[list]:
+        return [[key, seen, encode(value)] for key, seen, value in self.items()]
+
+    def load(self, rows: List[list], decode: Callable[[Any], Any] = lambda v: v):
+        self._items.clear()
+        rows = sorted(rows or (), key=lambda r: r[1])
+        for key, seen, value in (rows[-self.max_keys:] if self.max_keys else rows):
+            self._items[key] = [seen, decode(value)]
+
+
+class RingWindow:
+    """
+    A sliding window of ``buckets`` fixed time slots, each one int: a count
+    (``add``/``total``) or a bitmap of hashed values (``mark``/``distinct``).
+    Slots are recycled as event time moves on, so the window costs the same
+    however many events fall into it; its edge is one bucket wide.
+    """
+
+    __slots__ = ('head', 'slots')
+
+    def __init__(self, buckets: int, head: Optional[int] = None, slots: Optional[List[int]] = None):
+        self.head = head
+        self.slots = list(slots) if slots else [0] * max(1, int(buckets))
+
+    def advance(self, bucket: int) -> bool:
+        """Move the window to end at ``bucket`` (if later); False when ``bucket`` already fell out of it."""
+        slots = self.slots
+        n = len(slots)
+        head = self.head
+        if head is None or bucket - head >= n:
+            slots[:] = [0] * n
+        elif bucket > head:
+            for b in range(head + 1, bucket + 1):
+                slots[b % n] = 0
+        elif bucket <= head - n:
+            return False
+        else:
+            return True
+        self.head = bucket
+        return True
+
+    def add(self, bucket: int, count: int = 1):
+        if bucket == self.head or self.advance(bucket):
+            self.slots[bucket % len(self.slots)] += count
+
+    def mark(self, bucket: int, bit: int) -> bool:
+        """Set ``bit`` in ``bucket``'s bitmap; True if the window did not have it yet."""
+        if bucket != self.head and not self.advance(bucket):
+            return False
+        mask = 1 << bit
+        slots = self.slots
+        new = True
+        for slot in slots:
+            if slot & mask:
+                new = False
+                break
+        # Set it in this bucket even if an older one has it, or it drops out when that bucket is recycled
+        slots[bucket % len(slots)] |= mask
+        return new
+
+    def total(self) -> int:
+        return sum(self.slots)
+
+    def distinct(self, bits: int) -> float:
+        """Linear-counting estimate of the distinct values marked in the window (``bits`` = bitmap size)."""
+        union = 0
+        for slot in self.slots:
+            union |= slot
+        zeros = bits - _popcount(union)
+        return bits * math.log(bits / zeros) if zeros else bits * math.log(bits)
+
+    def dump(self) -> list:
+        return [self.head, self.slots]
+
+    @classmethod
+    def load(cls, data: list) -> "RingWindow":
+        return cls(len(data[1]), data[0], data[1])
+
+
+class WindowSketch:
+    """
+    Approximate ``RingWindow`` counts for keys evicted from a capped table:
+    a count-min sketch (``depth`` rows of ``width`` counters) per time
+    bucket, recycled like the window's slots. ``save`` raises each of a
+    key's counters to its per-bucket count (a conservative update, so a key
+    saved again after ``restore`` is not counted twice); ``restore`` fills a
+    new window with the smallest of its counters. Collisions can only
+    overestimate. Memory is ``buckets * 4 * width * 2`` bytes, allocated on
+    the first ``save``.
+    """
+
+    DEPTH = 4  # one 16-bit slice of a 64-bit hash per row
+
+    def __init__(self, buckets: int, width: int = 65536):
+        self.buckets = max(1, int(buckets))
+        # a power of two, at most 2**16
+        self.width = 1 << max(4, min(16, int(width).bit_length() - 1))
+        self.head: Optional[int] = None
+        self.saved = 0
+        self.restored = 0
+        self._slots: Optional[List[array]] = None
+        self._zero = array('H', bytes(2 * self.DEPTH * self.width))
+
+    def _index(self, key: str) -> Tuple[int, int, int, int]:
+        h = int.from_bytes(hashlib.blake2b(key.encode('utf-8', 'replace'), digest_size=8).digest(), 'little')
+        width = self.width
+        mask = width - 1
+        return h & mask, width + ((h >> 16) & mask), 2 * width + ((h >> 32) & mask), 3 * width + ((h >> 48) & mask)
+
+    def _advance(self, bucket: int):
+        slots, n = self._slots, self.buckets
+        head = self.head
+        if head is None or bucket - head >= n:
+            for slot in slots:
+                slot[:] = self._zero
+        elif bucket > head:
+            for b in range(head + 1, bucket + 1):
+                slots[b % n][:] = self._zero
+        else:
+            return
+        self.head = bucket
+
+    def _span(self, window: RingWindow) -> range:
+        """Buckets both the window and the sketch still cover."""
+        n = self.buckets
+        return range(max(window.head, self.head) - n + 1, min(window.head, self.head) + 1)
+
+    def save(self, key: str, window: RingWindow):
+        if window.head is None or len(window.slots) != self.buckets:
+            return
+        if self._slots is None:
+            self._slots = [array('H', self._zero) for _ in range(self.buckets)]
+        self._advance(window.head)
+        index = self._index(key)
+        n = self.buckets
+        counts, slots = window.slots, self._slots
+        for b in self._span(window):
+            count = counts[b % n]
+            if count:
+                if count > 0xFFFF:
+                    count = 0xFFFF
+                slot = slots[b % n]
+                for i in index:
+                    if slot[i] < count:
+                        slot[i] = count
+        self.saved += 1
+
+    def restore(self, key: str, window: RingWindow) -> int:
+        """Fill ``window`` (already advanced to the current bucket) with ``key``'s saved counts; their total."""
+        if self._slots is None or window.head is None or len(window.slots) != self.buckets:
+            return 0
+        self._advance(window.head)
+        i0, i1, i2, i3 = self._index(key)
+        n = self.buckets
+        total = 0
+        for b in self._span(window):
+            slot = self._slots[b % n]
+            count = slot[i0]
+            if not count:
+                continue
+            count = min(count, slot[i1], slot[i2], slot[i3])
+            if count:
+                window.slots[b % n] += count
+                total += count
+        if total:
+            self.restored += 1
+        return total
+
+
+def value_bit(value: Any, bits: int) -> int:
+    """Stable bitmap position of ``value`` (same across restarts, unlike ``hash``)."""
+    return zlib.crc32(str(value).encode('utf-8', 'replace')) % bits
+
+
+class StreamingDetector:
+    """
+    Base class: subclasses implement ``detect(events)``, declare their
+    subscription in ``event_ids``/``channels`` and list their
+    ``EntityState`` tables in ``tables`` (name -> table). Tables
+    whose values are not plain JSON override ``encode``/``decode``.
+    """
+
+    name = 'detector'
+    event_ids: Optional[frozenset] = None
+    channels: Optional[frozenset] = None
+
+    def __init__(self, thresholds: Dict[str, Any]):
+        self.thresholds = thresholds
+        self.now: float = 0.0  # newest event time seen
+        self.tables: Dict[str, EntityState] = {}
+
+    def wants(self, channel: Optional[str], event_id: Optional[int]) -> bool:
+        return ((self.event_ids is None or event_id in self.event_ids)
+                and (self.channels is None or channel in self.channels))
+
+    def process(self, events: List[Any]) -> List[Dict[str, Any]]:
+        if not events:
+            return []
+        alerts = self.detect(events)
+        for table in self.tables.values():
+            table.expire(self.now)
+        return alerts
+
+    def detect(self, events: List[Any]) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def clock(self, evt: Any) -> float:
+        """Event time of ``evt``, advancing ``now``; events without a time get the current watermark."""
+        ts = event_seconds(evt, self.now or None)
+        if ts > self.now:
+            self.now = ts
+        return ts
+
+    def entities(self) -> int:
+        return sum(len(t) for t in self.tables.values())
+
+    def encode(self, table: str, value: Any) -> Any:
+        return value
+
+    def decode(self, table: str, value: Any) -> Any:
+        return value
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {'now': self.now,
+                'tables': {name: t.dump(lambda v, n=name: self.encode(n, v)) for name, t in self.tables.items()}}
+
+    def restore(self, state: Dict[str, Any]):
+        self.now = float(state.get('now') or 0.0)
+        for name, rows in (state.get('tables') or {}).items():
+            if name in self.tables:
+                self.tables[name].load(rows, lambda v, n=name: self.decode(n, v))
+
+
+class FunctionDetector(StreamingDetector):
+    """Adapter for a stateless ``fn(events, thresholds) -> alerts`` detector."""
+
+    def __init__(self, name: str, fn: Callable[[List[Any], Dict[str, Any]], List[Dict[str, Any]]],
+                 thresholds: Dict[str, Any], event_ids: Optional[Iterable[int]] = None,
+                 channels: Optional[Iterable[str]] = None):
+        super().__init__(thresholds)
+        self.name = name
+        self.fn = fn
+        self.event_ids = frozenset(event_ids) if event_ids is not None else None
+        self.channels = frozenset(channels) if channels is not None else None
+
+    def detect(self, events: List[Any]) -> List[Dict[str, Any]]:
+        return self.fn(events, self.thresholds)
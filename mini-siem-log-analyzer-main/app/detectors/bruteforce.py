@@ -1,7 +1,13 @@
-from collections import deque
-from datetime import datetime, timedelta
 from typing import List, Dict, Any
 
+from app.core.event import Event
+from app.detectors.base import EntityState, RingWindow, StreamingDetector, WindowSketch, value_bit
+
+# Bitmap size for distinct users/IPs: estimates stay within a few percent up to a few hundred
+DISTINCT_BITS = 512
+# Most recent failures kept per key to link as alert evidence
+EVIDENCE_EVENTS = 5
+
 
 def format_bruteforce_alert(ip: str, count: int, window_minutes: int, username: str = None) -> str:
     """
@@ -30,33 +36,233 @@ def format_bruteforce_alert(ip: str, count: int, window_minutes: int, username:
     return "\n".join(alert)
 
 
-def detect_bruteforce(events: List[Dict[str, Any]], thresholds: Dict[str, Any]) -> List[Dict[str, Any]]:
-    window_minutes = thresholds.get('brute_force_window_minutes', 10)
-    fail_threshold = thresholds.get('brute_force_failures', 2)  # Default 2 attempts
-    window = timedelta(minutes=window_minutes)
-
-    attempts: Dict[str, deque] = {}
-    user_map: Dict[str, str] = {}  # Track username per IP
-    alerted: set = set()  # Track already alerted IPs to prevent duplicates
-    alerts: List[Dict[str, Any]] = []
-
-    for e in events:
-        if e.get('event_id') == 4625:
-            ip = e.get('ip') or 'localhost'
-            user = e.get('user') or 'unknown'
-            ts = datetime.fromisoformat(e.get('timestamp')) if e.get('timestamp') else datetime.utcnow()
-            dq = attempts.setdefault(ip, deque())
-            dq.append(ts)
-            user_map[ip] = user
-            # prune old attempts outside window
-            while dq and ts - dq[0] > window:
-                dq.popleft()
+def format_spray_alert(kind: str, key: str, distinct: int, window_minutes: int) -> str:
+    """
+    Format password spray alert in professional SOC style.
+    """
+    if kind == "source":
+        alert = [
+            "🚨 Password Spray Detected",
+            "",
+            f"Source IP: {key}",
+            f"Target Users: ~{distinct}",
+        ]
+    else:
+        alert = [
+            "🚨 Distributed Brute Force Detected",
+            "",
+            f"Target User: {key}",
+            f"Source IPs: ~{distinct}",
+        ]
+    alert.extend([
+        f"Time Window: {window_minutes} minutes",
+        "",
+        "Risk Level: High 🔴",
+        "MITRE ATT&CK: T1110.003 - Password Spraying" if kind == "source" else "MITRE ATT&CK: T1110 - Brute Force",
+        "",
+        "Recommended Actions:",
+        "• Block source IP immediately" if kind == "source" else "• Lock or reset the targeted account",
+        "• Review successful logons in the same window",
+        "• Enforce MFA for exposed accounts"
+    ])
+    return "\n".join(alert)
+
+
+class _Source:
+    """Per source IP: failure counts, targeted users, last target and alert flags."""
+
+    __slots__ = ('failures', 'users', 'user', 'alerted', 'spray_alerted', 'events')
+
+    def __init__(self, buckets: int, users: bool):
+        self.failures = RingWindow(buckets)
+        self.users = RingWindow(buckets) if users else None
+        self.user = None
+        self.alerted = False
+        self.spray_alerted = False
+        self.events: List[Any] = []  # most recent failures, for alert evidence
+
+
+class _Target:
+    """Per target user: source IP bitmap and alert flag."""
+
+    __slots__ = ('ips', 'alerted', 'events')
+
+    def __init__(self, buckets: int):
+        self.ips = RingWindow(buckets)
+        self.alerted = False
+        self.events: List[Any] = []
+
+
+class BruteForceDetector(StreamingDetector):
+    """
+    Failed logons (4625) over a sliding ``brute_force_window_minutes``, per
+    source IP (``brute_force_failures``), per source IP across users
+    (password spray, ``spray_users_per_ip`` distinct users) and per target
+    user across IPs (``spray_ips_per_user`` distinct IPs; 0 turns a spray
+    check off).
+
+    Each alerts once per burst and again only after its key has been quiet
+    for a whole window. Failures are counted in ``RingWindow`` buckets
+    (``brute_force_buckets`` per window), distinct users/IPs are estimated
+    from hashed bitmaps, and both key tables keep at most
+    ``brute_force_max_keys`` keys, so a spray from tens of thousands of
+    addresses costs bounded memory. Past the cap a source table insert
+    evicts the source with the fewest failures among the least recently
+    seen; its failure counts go to a ``WindowSketch``
+    (``brute_force_sketch_width`` counters per row, 0 = none) and come back
+    if the address returns within the window. Its spray bitmap and
+    evidence do not.
+    """
+
+    name = 'bruteforce'
+    event_ids = frozenset((4625,))
+
+    def __init__(self, thresholds: Dict[str, Any]):
+        super().__init__(thresholds)
+        self.window_minutes = thresholds.get('brute_force_window_minutes', 10)
+        self.fail_threshold = max(1, int(thresholds.get('brute_force_failures', 2)))  # Default 2 attempts
+        self.users_per_ip = int(thresholds.get('spray_users_per_ip', 10))
+        self.ips_per_user = int(thresholds.get('spray_ips_per_user', 20))
+        self.window = self.window_minutes * 60
+        self.buckets = max(1, int(thresholds.get('brute_force_buckets', 10)))
+        self.bucket_seconds = self.window / self.buckets
+        self.evidence = min(self.fail_threshold, EVIDENCE_EVENTS)
+        max_keys = thresholds.get('brute_force_max_keys', 50000)
+        sketch_width = thresholds.get('brute_force_sketch_width', 65536)  # 0 = forget evicted sources
+        self.sketch = WindowSketch(self.buckets, sketch_width) if max_keys and sketch_width else None
+        self.sources = EntityState(self.window, max_keys, weight=_failures,
+                                   on_evict=self._evict_source)  # ip -> _Source
+        self.targets = EntityState(self.window, max_keys)  # user -> _Target
+        self.tables = {'sources': self.sources, 'targets': self.targets}
+
+    def _new_source(self) -> _Source:
+        return _Source(self.buckets, bool(self.users_per_ip))
+
+    def _new_target(self) -> _Target:
+        return _Target(self.buckets)
+
+    def _evict_source(self, ip: str, src: _Source):
+        if self.sketch is not None:
+            self.sketch.save(ip, src.failures)
+
+    def detect(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        alerts: List[Dict[str, Any]] = []
+        for e in events:
+            if type(e) is Event:
+                if e.event_id != 4625:
+                    continue
+                ip, user = e.ip or 'localhost', e.user or 'unknown'
+            else:
+                if e.get('event_id') != 4625:
+                    continue
+                ip, user = e.get('ip') or 'localhost', e.get('user') or 'unknown'
+            ts = self.clock(e)
+            bucket = int(ts // self.bucket_seconds)
+
+            src = self.sources.setdefault(ip, ts, self._new_source)
+            failures = src.failures
+            fresh = failures.head is None
+            if not failures.advance(bucket):
+                continue  # older than the window
+            # an evicted source picks up its approximate count (and, at the threshold, had alerted)
+            if fresh and self.sketch is not None and self.sketch.restore(ip, failures) >= self.fail_threshold:
+                src.alerted = True
+            # a quiet window re-arms the alerts
+            if not failures.total():
+                src.alerted = src.spray_alerted = False
+                src.events.clear()
+            failures.add(bucket)
+            src.user = user
+            recent = src.events
+            recent.append(e)
+            if len(recent) > self.evidence:
+                del recent[0]
             # Only alert once when threshold is FIRST reached, not every time
-            if len(dq) >= fail_threshold and ip not in alerted:
-                alerted.add(ip)
+            if not src.alerted and failures.total() >= self.fail_threshold:
+                src.alerted = True
                 alerts.append({
                     'severity': 'HIGH',
                     'title': f'[HIGH] Brute Force Attack - {user}',
-                    'description': format_bruteforce_alert(ip, len(dq), window_minutes, user_map.get(ip))
+                    'description': format_bruteforce_alert(ip, failures.total(), self.window_minutes, user),
+                    'rule_id': 'bruteforce',
+                    'entities': {'ip': ip, 'user': user, 'host': e.get('computer')},
+                    'events': list(recent),
                 })
-    return alerts
+            if user == 'unknown':
+                continue
+
+            if self.users_per_ip and src.users.mark(bucket, value_bit(user, DISTINCT_BITS)) and not src.spray_alerted:
+                distinct = src.users.distinct(DISTINCT_BITS)
+                if distinct >= self.users_per_ip:
+                    src.spray_alerted = True
+                    alerts.append({
+                        'severity': 'HIGH',
+                        'title': f'[HIGH] Password Spray from {ip}',
+                        'description': format_spray_alert('source', ip, round(distinct), self.window_minutes),
+                        'rule_id': 'bruteforce.spray_source',
+                        'entities': {'ip': ip, 'host': e.get('computer')},
+                        'events': list(recent),
+                    })
+
+            if self.ips_per_user:
+                tgt = self.targets.setdefault(user, ts, self._new_target)
+                ips = tgt.ips
+                if not ips.advance(bucket):
+                    continue
+                if not any(ips.slots):
+                    tgt.alerted = False
+                    tgt.events.clear()
+                new_ip = ips.mark(bucket, value_bit(ip, DISTINCT_BITS))
+                targeted = tgt.events
+                targeted.append(e)
+                if len(targeted) > EVIDENCE_EVENTS:
+                    del targeted[0]
+                if new_ip and not tgt.alerted:
+                    distinct = ips.distinct(DISTINCT_BITS)
+                    if distinct >= self.ips_per_user:
+                        tgt.alerted = True
+                        alerts.append({
+                            'severity': 'HIGH',
+                            'title': f'[HIGH] Distributed Brute Force - {user}',
+                            'description': format_spray_alert('user', user, round(distinct), self.window_minutes),
+                            'rule_id': 'bruteforce.spray_user',
+                            'entities': {'user': user, 'host': e.get('computer')},
+                            'events': list(targeted),
+                        })
+        return alerts
+
+    def encode(self, table: str, value: Any) -> Dict[str, Any]:
+        if table == 'targets':
+            return {'ips': value.ips.dump(), 'alerted': value.alerted}
+        return {'failures': value.failures.dump(), 'users': value.users.dump() if value.users is not None else None,
+                'user': value.user, 'alerted': value.alerted, 'spray_alerted': value.spray_alerted}
+
+    def _ring(self, data: Any) -> RingWindow:
+        # Windows saved with another bucket count start over
+        if data and len(data[1]) == self.buckets:
+            return RingWindow.load(data)
+        return RingWindow(self.buckets)
+
+    def decode(self, table: str, value: Dict[str, Any]) -> Any:
+        if table == 'targets':
+            tgt = self._new_target()
+            tgt.ips = self._ring(value.get('ips'))
+            tgt.alerted = bool(value.get('alerted'))
+            return tgt
+        src = self._new_source()
+        src.failures = self._ring(value.get('failures'))
+        if src.users is not None:
+            src.users = self._ring(value.get('users'))
+        src.user = value.get('user')
+        src.alerted = bool(value.get('alerted'))
+        src.spray_alerted = bool(value.get('spray_alerted'))
+        return src
+
+
+def _failures(src: _Source) -> int:
+    return src.failures.total()
+
+
+def detect_bruteforce(events: List[Dict[str, Any]], thresholds: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One-shot detection over ``events`` alone (no state kept between calls)."""
+    return BruteForceDetector(thresholds).process(events)
@@ -1,5 +1,9 @@
+import zlib
 from typing import List, Dict, Any
 
+from app.detectors.base import EntityState, StreamingDetector
+from app.detectors.matcher import PatternMatcher
+
 # Whitelisted legitimate system processes (exclude from alerts)
 WHITELIST_PROCESSES = [
     "msmpseng.exe",      # Windows Defender
@@ -40,6 +44,18 @@ LOLBINS = [
 
 BLOCKLIST_HASHES = {"44d88612fea8a8f36de82e1278abb02f"}
 
+# Flags that make a LOLBin launch worth an alert
+LOLBIN_FLAGS = ['-decode', 'downloadstring', 'urlcache', 'split', '-f', '/i:']
+
+# All command-line indicator lists, matched in one pass per event
+INDICATORS = PatternMatcher({
+    'tool': SUSPICIOUS_PROCESSES,
+    'lolbin': LOLBINS,
+    'lolbin_flag': LOLBIN_FLAGS,
+    'path': SUSPICIOUS_PATHS,
+})
+WHITELIST = PatternMatcher({'whitelist': WHITELIST_PROCESSES})
+
 
 def format_process_alert(alert_type: str, process: str, user: str = None, parent: str = None, cmdline: str = None) -> str:
     """
@@ -114,50 +130,104 @@ def format_process_alert(alert_type: str, process: str, user: str = None, parent
     return "\n".join(alert)
 
 
-def detect_malware_exec(events: List[Dict[str, Any]], thresholds: Dict[str, Any]) -> List[Dict[str, Any]]:
-    alerts: List[Dict[str, Any]] = []
-    
-    for e in events:
-        # Event ID 4688 = New process creation
-        if e.get('event_id') == 4688:
+class MalwareExecDetector(StreamingDetector):
+    """
+    Process creation (4688) checks: known attack tools, LOLBins used with
+    download/decode flags, and binaries started from user-writable paths.
+
+    The same command line from the same user and host alerts once per
+    ``malware_exec_dedupe_seconds`` (60), so a tool relaunched in a loop, or
+    an event seen again after a restart, does not repeat across batches.
+    """
+
+    name = 'malware_exec'
+    event_ids = frozenset((4688,))
+
+    def __init__(self, thresholds: Dict[str, Any]):
+        super().__init__(thresholds)
+        self.dedupe = float(thresholds.get('malware_exec_dedupe_seconds', 60))
+        self.recent = EntityState(self.dedupe)  # rule|host|user|process|crc32(command) -> None
+        self.tables = {'recent': self.recent}
+
+    def detect(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        alerts: List[Dict[str, Any]] = []
+
+        for e in events:
+            # Event ID 4688 = New process creation
+            if e.get('event_id') != 4688:
+                continue
             cmd = (e.get('command') or e.get('message') or '')
             cmd_lower = cmd.lower()
             user = e.get('user')
-            
-            # Extract process name from command line
-            process_name = cmd.split('\\')[-1].split()[0] if '\\' in cmd else cmd.split()[0]
+            parent = e.get('parent_process')
+
+            # Process image from the 4688 NewProcessName field; fall back to parsing the command line
+            image = e.get('process_name')
+            if image:
+                process_name = image.split('\\')[-1]
+            elif not cmd.strip():
+                continue
+            else:
+                process_name = cmd.split('\\')[-1].split()[0] if '\\' in cmd else cmd.split()[0]
             process_name_lower = process_name.lower()
-            
+
             # Skip whitelisted legitimate system processes
-            if any(whitelist in process_name_lower for whitelist in WHITELIST_PROCESSES):
+            if WHITELIST.find(process_name_lower):
                 continue
-            
+
+            hits = INDICATORS.find(cmd_lower)
             # Check for known malicious tools (CRITICAL)
-            if any(tool in cmd_lower for tool in SUSPICIOUS_PROCESSES):
-                alerts.append({
+            if 'tool' in hits:
+                alert = {
                     'severity': 'CRITICAL',
                     'title': '[CRITICAL] Malicious Tool Execution Detected',
-                    'description': format_process_alert('suspicious_tool', process_name, user, None, cmd)
-                })
-            
+                    'description': format_process_alert('suspicious_tool', process_name, user, parent, cmd),
+                    'rule_id': 'malware_exec.tool',
+                }
+
             # Check for LOLBins (Living-off-the-Land Binaries)
-            elif any(lolbin in cmd_lower for lolbin in LOLBINS):
+            elif 'lolbin' in hits:
                 # Only alert if used with suspicious flags
-                if any(flag in cmd_lower for flag in ['-decode', 'downloadstring', 'urlcache', 'split', '-f', '/i:']):
-                    # Include timestamp in title to allow multiple alerts for repeated commands
-                    timestamp_suffix = e.get('timestamp', '').split('.')[0][-8:].replace(':', '')
-                    alerts.append({
-                        'severity': 'HIGH',
-                        'title': f'[HIGH] LOLBin Abuse - {process_name} - {timestamp_suffix}',
-                        'description': format_process_alert('lolbin', process_name, user, None, cmd)
-                    })
-            
+                if 'lolbin_flag' not in hits:
+                    continue
+                # Include timestamp in title to allow multiple alerts for repeated commands
+                timestamp_suffix = (e.get('timestamp') or '').split('.')[0][-8:].replace(':', '')
+                alert = {
+                    'severity': 'HIGH',
+                    'title': f'[HIGH] LOLBin Abuse - {process_name} - {timestamp_suffix}',
+                    'description': format_process_alert('lolbin', process_name, user, None, cmd),
+                    'rule_id': 'malware_exec.lolbin',
+                }
+
             # Check for suspicious execution paths
-            elif any(p.lower() in cmd_lower for p in SUSPICIOUS_PATHS):
-                alerts.append({
+            elif 'path' in hits:
+                alert = {
                     'severity': 'MEDIUM',
                     'title': '[MEDIUM] Process from Suspicious Location',
-                    'description': format_process_alert('suspicious_path', process_name, user, None, cmd)
-                })
-    
-    return alerts
+                    'description': format_process_alert('suspicious_path', process_name, user, None, cmd),
+                    'rule_id': 'malware_exec.path',
+                }
+            else:
+                continue
+
+            now = self.clock(e)
+            host = e.get('computer')
+            key = f"{alert['rule_id']}|{host}|{user}|{process_name_lower}|{zlib.crc32(cmd.encode('utf-8')):08x}"
+            seen = self.recent.last_seen(key)
+            if seen is not None and now - seen < self.dedupe:
+                continue
+            self.recent.touch(key, now, None)
+            alert.update({
+                'fingerprint_key': process_name_lower,
+                'entities': {'user': user, 'host': host},
+                'events': [e],
+                'indicators': hits,
+            })
+            alerts.append(alert)
+
+        return alerts
+
+
+def detect_malware_exec(events: List[Dict[str, Any]], thresholds: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One-shot detection over ``events`` alone (no state kept between calls)."""
+    return MalwareExecDetector(thresholds).process(events)
@@ -0,0 +1,122 @@
+"""
+Multi-pattern indicator matching.
+
+``PatternMatcher`` compiles categorized indicator lists (tool names,
+LOLBins, paths, PowerShell keywords, ...) into one Aho-Corasick automaton.
+``find(text)`` walks the text once and returns every indicator it
+contains, grouped by category, overlaps included. Per event the cost depends
+on the text length, not on how many indicators are loaded.
+
+Matching is case-insensitive substring matching, the same as
+``pattern.lower() in text.lower()``. The C ``pyahocorasick`` package is used
+when installed; otherwise a pure-Python automaton with precomputed
+transitions does the same job. In pure Python a character step costs about
+as much as a C substring search over a short command line, so sets below
+``LINEAR_MAX`` patterns are matched with plain substring checks instead.
+"""
+from collections import deque
+from typing import List, Dict, Iterable, Tuple
+
+try:
+    import ahocorasick
+except Exception:
+    ahocorasick = None
+
+
+LINEAR_MAX = 64
+
+
+class PatternMatcher:
+    """Case-insensitive substring matcher for ``{category: [pattern, ...]}`` (``linear_max=0`` forces the automaton)."""
+
+    def __init__(self, categories: Dict[str, Iterable[str]], use_c: bool = True, linear_max: int = LINEAR_MAX):
+        entries: Dict[str, List[Tuple[str, str]]] = {}
+        for category, patterns in categories.items():
+            for pattern in patterns:
+                key = pattern.lower()
+                if key and (category, pattern) not in entries.setdefault(key, []):
+                    entries[key].append((category, pattern))
+        self.patterns = len(entries)
+        self.categories = list(categories)
+        self._automaton = None
+        self._linear = None
+        if ahocorasick is not None and use_c:
+            automaton = ahocorasick.Automaton()
+            for key, values in entries.items():
+                automaton.add_word(key, tuple(values))
+            if entries:
+                automaton.make_automaton()
+                self._automaton = automaton
+            self._build(())
+        elif len(entries) < linear_max:
+            self._linear = [(key, tuple(values)) for key, values in entries.items()]
+            self._build(())
+        else:
+            self._build(entries.items())
+
+    def __len__(self) -> int:
+        return self.patterns
+
+    def find(self, text: str) -> Dict[str, List[str]]:
+        """Indicators found in ``text`` as ``{category: [pattern, ...]}``, each pattern listed once."""
+        found: Dict[str, List[str]] = {}
+        if not text:
+            return found
+        text = text.lower()
+        if self._automaton is not None:
+            hits = (values for _, values in self._automaton.iter(text))
+        elif self._linear is not None:
+            hits = [values for key, values in self._linear if key in text]
+        else:
+            hits = self._scan(text)
+        for values in hits:
+            for category, pattern in values:
+                listed = found.setdefault(category, [])
+                if pattern not in listed:
+                    listed.append(pattern)
+        return found
+
+    # --- pure-Python automaton -------------------------------------------
+
+    def _build(self, entries: Iterable[Tuple[str, List[Tuple[str, str]]]]):
+        goto: List[Dict[str, int]] = [{}]
+        out: List[tuple] = [()]
+        for key, values in entries:
+            state = 0
+            for ch in key:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = goto[state][ch] = len(goto)
+                    goto.append({})
+                    out.append(())
+                state = nxt
+            out[state] = tuple(values)
+        # delta[s] holds the transitions of s that do not fall back to the root's,
+        # so a step is delta[s].get(ch) or root.get(ch, 0)
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [{} for _ in goto]
+        queue = deque()
+        for ch, nxt in goto[0].items():
+            delta[nxt] = dict(goto[nxt])
+            queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                f = fail[state]
+                target = delta[f].get(ch) or goto[0].get(ch, 0)
+                fail[nxt] = target
+                out[nxt] = out[nxt] + out[target]
+                delta[nxt] = {**delta[target], **goto[nxt]}
+                queue.append(nxt)
+        self._root = goto[0]
+        self._delta = delta
+        self._out = out
+
+    def _scan(self, text: str) -> Iterable[tuple]:
+        root_get = self._root.get
+        delta, out = self._delta, self._out
+        state = 0
+        for ch in text:
+            state = delta[state].get(ch) or root_get(ch, 0)
+            if out[state]:
+                yield out[state]
@@ -1,6 +1,19 @@
 from typing import List, Dict, Any
+from app.detectors.matcher import PatternMatcher
 from utils.helpers import try_decode_base64_unicode
 
+# 4104 = script block logging, 4688 = process creation (PowerShell command lines)
+POWERSHELL_EVENT_IDS = frozenset((4104, 4688))
+
+POWERSHELL_KEYWORDS = ['iex', 'invoke-expression', 'downloadstring', 'new-object net.webclient']
+
+# All indicator lists, matched in one pass per command line
+POWERSHELL_INDICATORS = PatternMatcher({
+    'powershell': ['powershell'],
+    'encoded': ['-enc', '-encodedcommand'],
+    'keyword': POWERSHELL_KEYWORDS,
+})
+
 
 def format_powershell_alert(alert_type: str, command: str, decoded: str = None, user: str = None) -> str:
     """
@@ -58,47 +71,36 @@ def detect_powershell_abuse(events: List[Dict[str, Any]], thresholds: Dict[str,
     for e in events:
         # Event ID 4104 = PowerShell Script Block Logging (if enabled)
         # Event ID 4688 = Process Creation (fallback for PowerShell commands)
-        if e.get('event_id') == 4104:
-            cmd = e.get('command') or e.get('message') or ''
-            user = e.get('user')
-            s = cmd.lower()
-            if '-enc' in s or '-encodedcommand' in s:
-                parts = cmd.split()
-                b64 = parts[-1] if parts else ''
-                if len(b64) >= min_len:
-                    decoded = try_decode_base64_unicode(b64)
-                    alerts.append({
-                        'severity': 'HIGH',
-                        'title': f'[HIGH] Suspicious Encoded PowerShell - {user or "Unknown"}',
-                        'description': format_powershell_alert('encoded', cmd, decoded, user)
-                    })
-            elif any(x in s for x in ['iex', 'invoke-expression', 'downloadstring', 'new-object net.webclient']):
-                alerts.append({
-                    'severity': 'MEDIUM',
-                    'title': f'[MEDIUM] Suspicious PowerShell Keywords - {user or "Unknown"}',
-                    'description': format_powershell_alert('keywords', cmd, None, user)
-                })
-        # Also detect from process creation events (Event ID 4688)
-        elif e.get('event_id') == 4688:
-            cmd = e.get('command') or e.get('message') or ''
-            if 'powershell' not in cmd.lower():
-                continue
-            user = e.get('user')
-            s = cmd.lower()
-            if '-enc' in s or '-encodedcommand' in s:
-                parts = cmd.split()
-                b64 = parts[-1] if parts else ''
-                if len(b64) >= min_len:
-                    decoded = try_decode_base64_unicode(b64)
-                    alerts.append({
-                        'severity': 'HIGH',
-                        'title': f'[HIGH] Suspicious Encoded PowerShell - {user or "Unknown"}',
-                        'description': format_powershell_alert('encoded', cmd, decoded, user)
-                    })
-            elif any(x in s for x in ['iex', 'invoke-expression', 'downloadstring', 'new-object net.webclient']):
+        eid = e.get('event_id')
+        if eid not in POWERSHELL_EVENT_IDS:
+            continue
+        cmd = e.get('command') or e.get('message') or ''
+        hits = POWERSHELL_INDICATORS.find(cmd)
+        if eid == 4688 and 'powershell' not in hits:
+            continue
+        user = e.get('user')
+        if 'encoded' in hits:
+            parts = cmd.split()
+            b64 = parts[-1] if parts else ''
+            if len(b64) >= min_len:
+                decoded = try_decode_base64_unicode(b64)
                 alerts.append({
-                    'severity': 'MEDIUM',
-                    'title': f'[MEDIUM] Suspicious PowerShell Keywords - {user or "Unknown"}',
-                    'description': format_powershell_alert('keywords', cmd, None, user)
+                    'severity': 'HIGH',
+                    'title': f'[HIGH] Suspicious Encoded PowerShell - {user or "Unknown"}',
+                    'description': format_powershell_alert('encoded', cmd, decoded, user),
+                    'rule_id': 'powershell.encoded',
+                    'entities': {'user': user, 'host': e.get('computer')},
+                    'events': [e],
+                    'indicators': hits,
                 })
+        elif 'keyword' in hits:
+            alerts.append({
+                'severity': 'MEDIUM',
+                'title': f'[MEDIUM] Suspicious PowerShell Keywords - {user or "Unknown"}',
+                'description': format_powershell_alert('keywords', cmd, None, user),
+                'rule_id': 'powershell.keywords',
+                'entities': {'user': user, 'host': e.get('computer')},
+                'events': [e],
+                'indicators': hits,
+            })
     return alerts
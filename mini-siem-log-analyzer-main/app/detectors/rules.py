@@ -0,0 +1,390 @@
+"""
+Declarative detection rules (a Sigma-style subset).
+
+Rules are YAML (needs PyYAML) or JSON files in the rules directory, one
+rule or a list of rules per file::
+
+    id: bruteforce.rule
+    title: "[HIGH] Brute Force Attack - {user}"
+    severity: HIGH
+    description: "Source IP: {ip}, {count} failures in {window_minutes} minutes"
+    event_ids: [4625]               # optional subscription (also: channels)
+    detection:
+      selection:
+        event_id: 4625
+      filter:
+        ip|cidr: [10.0.0.0/8]
+      condition: selection and not filter
+    threshold: {count: 5, window_minutes: 10, by: [ip]}
+    entities: {ip: ip, user: user, host: computer}
+
+A selection maps ``field|modifier`` to a value or a list of values (any of
+them, or all with ``|all``); its fields must all match, and a list of maps
+matches if any map does. Modifiers: ``equals`` (default), ``contains``,
+``startswith``, ``endswith``, ``re``, ``cidr`` and ``exists``; comparisons
+are case-insensitive. ``condition`` combines selection names with
+``and``/``or``/``not``, parentheses, ``1 of sel_*`` and ``all of them``.
+
+Each (field, modifier, values) test is compiled once and shared by every
+rule that uses it; per event a test runs at most once, on demand, and a
+rule's condition is generated into a Python expression over those tests.
+With a ``threshold``, a rule alerts once ``count`` matches with the same
+``by`` key fall within the window, then again only after that key has been
+quiet for a whole window; with ``suppress_seconds`` it re-arms that long
+after the alert instead (``count: 1`` plus ``suppress_seconds`` is a per-key
+debounce).
+``replaces: <detector>`` turns the named built-in detector off while the rule is
+loaded, and ``enabled: false`` keeps a file from loading.
+"""
+import glob
+import ipaddress
+import json
+import os
+import re
+from collections import deque
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+from app.core.event import Event
+from app.detectors.base import EntityState, StreamingDetector
+from app.detectors.matcher import LINEAR_MAX, PatternMatcher
+from utils.logging import setup_logger
+
+try:
+    import yaml
+except Exception:
+    yaml = None
+
+logger = setup_logger("rules")
+
+MODIFIERS = ('equals', 'contains', 'startswith', 'endswith', 're', 'cidr', 'exists')
+_TOKEN = re.compile(r"\s*(\(|\)|[A-Za-z_][\w.*-]*|\d+)")
+
+
+class RuleError(ValueError):
+    pass
+
+
+def load_rule_files(directory: str) -> List[Dict[str, Any]]:
+    """Raw rule documents from ``*.yml``/``*.yaml``/``*.json`` in ``directory`` (sorted by file name)."""
+    rules: List[Dict[str, Any]] = []
+    if not directory or not os.path.isdir(directory):
+        return rules
+    for path in sorted(glob.glob(os.path.join(directory, '*'))):
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in ('.yml', '.yaml', '.json'):
+            continue
+        if ext != '.json' and yaml is None:
+            logger.warning(f"Skipping rule file {os.path.basename(path)}: PyYAML is not installed")
+            continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                docs = [json.load(f)] if ext == '.json' else list(yaml.safe_load_all(f))
+        except Exception as e:
+            logger.error(f"Could not read rule file {path}: {e}")
+            continue
+        for doc in docs:
+            for rule in (doc if isinstance(doc, list) else [doc]):
+                if isinstance(rule, dict):
+                    rules.append(dict(rule, _file=os.path.basename(path)))
+    return rules
+
+
+def _field(evt: Any, name: str) -> Tuple[Any, Optional[str]]:
+    raw = evt.get(name)
+    return raw, (raw.lower() if isinstance(raw, str) else (str(raw).lower() if raw is not None else None))
+
+
+def _compile_test(modifier: str, values: List[Any], match_all: bool) -> Callable[[Tuple[Any, Optional[str]]], bool]:
+    """Predicate over a (raw, lowercased) field value."""
+    if modifier == 'exists':
+        want = bool(values[0]) if values else True
+        return lambda v: (v[0] is not None and v[0] != '') == want
+    nulls = any(x is None for x in values)
+    values = [x for x in values if x is not None]
+    combine = all if match_all else any
+    if modifier == 'equals':
+        wanted = {str(x).lower() for x in values}
+        if match_all and len(wanted) > 1:
+            return lambda v: False
+        return lambda v: (v[1] in wanted) if v[1] else nulls
+    if modifier == 'cidr':
+        networks = [ipaddress.ip_network(str(x), strict=False) for x in values]
+
+        def in_networks(v):
+            try:
+                ip = ipaddress.ip_address(str(v[0]).strip())
+            except ValueError:
+                return False
+            return combine(ip in net for net in networks)
+        return lambda v: in_networks(v) if v[1] else nulls
+    if modifier == 're':
+        patterns = [re.compile(str(x), re.IGNORECASE) for x in values]
+        if not match_all and len(patterns) > 1:
+            patterns = [re.compile('|'.join(f"(?:{p.pattern})" for p in patterns), re.IGNORECASE)]
+        return lambda v: combine(p.search(str(v[0])) is not None for p in patterns) if v[1] else nulls
+    lowered = [str(x).lower() for x in values]
+    if modifier in ('startswith', 'endswith'):
+        if match_all:
+            return lambda v: all(getattr(v[1], modifier)(x) for x in lowered) if v[1] else nulls
+        prefixes = tuple(lowered)
+        if modifier == 'startswith':
+            return lambda v: v[1].startswith(prefixes) if v[1] else nulls
+        return lambda v: v[1].endswith(prefixes) if v[1] else nulls
+    # contains
+    if match_all:
+        return lambda v: all(x in v[1] for x in lowered) if v[1] else nulls
+    if len(lowered) >= LINEAR_MAX:
+        matcher = PatternMatcher({'v': lowered})
+        return lambda v: bool(matcher.find(v[1])) if v[1] else nulls
+    return lambda v: any(x in v[1] for x in lowered) if v[1] else nulls
+
+
+class _Vars(dict):
+    def __missing__(self, key):
+        return ''
+
+
+class Rule:
+    __slots__ = ('id', 'title', 'severity', 'description', 'condition', 'event_ids', 'channels', 'entities',
+                 'fingerprint', 'count', 'window', 'suppress', 'by', 'replaces', 'source')
+
+    def wants(self, channel: Any, event_id: Any) -> bool:
+        return ((self.event_ids is None or event_id in self.event_ids)
+                and (self.channels is None or channel in self.channels))
+
+
+class RuleDetector(StreamingDetector):
+    """All loaded rules as one detector: one pass over the events, shared tests, per-rule threshold state."""
+
+    name = 'rules'
+
+    def __init__(self, documents: List[Dict[str, Any]], thresholds: Optional[Dict[str, Any]] = None):
+        super().__init__(thresholds or {})
+        self._tests: List[Tuple[str, Callable]] = []
+        self._test_ids: Dict[tuple, int] = {}
+        self.rules: List[Rule] = []
+        seen: Dict[str, str] = {}  # rule id -> file it came from
+        for doc in documents:
+            if doc.get('enabled', True) is False:
+                continue
+            source = doc.get('_file', 'inline')
+            try:
+                rule = self._compile(doc)
+            except (RuleError, re.error, ValueError, TypeError, KeyError) as e:
+                logger.error(f"Skipping rule {doc.get('id') or '?'} ({source}): {e}")
+                continue
+            if rule.id in seen:
+                # Ids key the threshold state and alert fingerprints: the first one loaded wins
+                logger.error(f"Skipping rule {rule.id} ({source}): duplicate id, already loaded from {seen[rule.id]}")
+                continue
+            seen[rule.id] = source
+            self.rules.append(rule)
+        self.replaces = {name for r in self.rules for name in r.replaces}
+        self.event_ids = (frozenset().union(*(r.event_ids for r in self.rules))
+                          if self.rules and all(r.event_ids is not None for r in self.rules) else None)
+        self.channels = (frozenset().union(*(r.channels for r in self.rules))
+                         if self.rules and all(r.channels is not None for r in self.rules) else None)
+        self.tables = {r.id: EntityState(max(r.window, r.suppress or 0)) for r in self.rules if r.count}
+        self._routes: Dict[Tuple[Any, Any], Tuple[Rule, ...]] = {}
+        if self.rules:
+            logger.info(f"Loaded {len(self.rules)} rules ({len(self._tests)} distinct field tests)")
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    # --- compilation ---------------------------------------------------
+
+    def _test(self, key: str, value: Any) -> int:
+        field, _, mods = key.partition('|')
+        mods = [m for m in mods.split('|') if m] if mods else []
+        match_all = 'all' in mods
+        mods = [m for m in mods if m != 'all'] or ['equals']
+        if len(mods) != 1 or mods[0] not in MODIFIERS:
+            raise RuleError(f"Unknown modifier in {key!r}")
+        values = value if isinstance(value, list) else [value]
+        ident = (field, mods[0], match_all, tuple(sorted(repr(v) for v in values)))
+        index = self._test_ids.get(ident)
+        if index is None:
+            index = self._test_ids[ident] = len(self._tests)
+            self._tests.append((field, _compile_test(mods[0], values, match_all)))
+        return index
+
+    def _selection(self, body: Any) -> str:
+        maps = body if isinstance(body, list) else [body]
+        alternatives = []
+        for m in maps:
+            if not isinstance(m, dict) or not m:
+                raise RuleError("A selection is a map of field tests (or a list of maps)")
+            alternatives.append('(' + ' and '.join(f"t({self._test(k, v)})" for k, v in m.items()) + ')')
+        return '(' + ' or '.join(alternatives) + ')'
+
+    def _condition(self, text: str, selections: Dict[str, str]) -> str:
+        tokens, pos = [], 0
+        text = text.strip()
+        while pos < len(text):
+            m = _TOKEN.match(text, pos)
+            if not m:
+                raise RuleError(f"Bad condition near {text[pos:]!r}")
+            tokens.append(m.group(1))
+            pos = m.end()
+
+        def expr(i):
+            left, i = term(i)
+            while i < len(tokens) and tokens[i] == 'or':
+                right, i = term(i + 1)
+                left = f"({left} or {right})"
+            return left, i
+
+        def term(i):
+            left, i = factor(i)
+            while i < len(tokens) and tokens[i] == 'and':
+                right, i = factor(i + 1)
+                left = f"({left} and {right})"
+            return left, i
+
+        def factor(i):
+            if i >= len(tokens):
+                raise RuleError("Condition ends early")
+            tok = tokens[i]
+            if tok == 'not':
+                inner, i = factor(i + 1)
+                return f"(not {inner})", i
+            if tok == '(':
+                inner, i = expr(i + 1)
+                if i >= len(tokens) or tokens[i] != ')':
+                    raise RuleError("Unbalanced parentheses")
+                return inner, i + 1
+            if tok in ('1', 'all') and i + 1 < len(tokens) and tokens[i + 1] == 'of':
+                if i + 2 >= len(tokens):
+                    raise RuleError("'of' needs a selection pattern")
+                pattern = tokens[i + 2]
+                names = [n for n in selections if pattern == 'them' or
+                         (n.startswith(pattern[:-1]) if pattern.endswith('*') else n == pattern)]
+                if not names:
+                    raise RuleError(f"No selection matches {pattern!r}")
+                joiner = ' or ' if tok == '1' else ' and '
+                return '(' + joiner.join(selections[n] for n in names) + ')', i + 3
+            if tok not in selections:
+                raise RuleError(f"Unknown selection {tok!r}")
+            return selections[tok], i + 1
+
+        code, end = expr(0)
+        if end != len(tokens):
+            raise RuleError(f"Unexpected {tokens[end]!r} in condition")
+        return code
+
+    def _compile(self, doc: Dict[str, Any]) -> Rule:
+        if not doc.get('id') or not doc.get('title'):
+            raise RuleError("Rules need an id and a title")
+        detection = dict(doc.get('detection') or {})
+        condition = detection.pop('condition', None)
+        if not detection:
+            raise RuleError("No selections in detection")
+        selections = {name: self._selection(body) for name, body in detection.items()}
+        code = self._condition(condition or ' and '.join(selections), selections)
+        rule = Rule()
+        rule.id = str(doc['id'])
+        rule.title = str(doc['title'])
+        rule.severity = str(doc.get('severity', 'MEDIUM')).upper()
+        rule.description = str(doc.get('description', ''))
+        # Generated from selection names and test indexes only, never from rule text
+        rule.condition = eval(f"lambda t: {code}", {})
+        ids = doc.get('event_ids')
+        rule.event_ids = frozenset(int(x) for x in ids) if ids is not None else None
+        channels = doc.get('channels')
+        rule.channels = frozenset(channels) if channels is not None else None
+        rule.entities = dict(doc.get('entities') or {})
+        rule.fingerprint = list(doc.get('fingerprint') or [])
+        threshold = doc.get('threshold') or {}
+        rule.count = int(threshold.get('count', 0))
+        rule.suppress = float(threshold['suppress_seconds']) if threshold.get('suppress_seconds') is not None else None
+        rule.window = float(threshold.get('window_seconds', float(threshold.get('window_minutes', 0)) * 60))
+        if rule.count and rule.window <= 0 and not (rule.count == 1 and rule.suppress):
+            raise RuleError("A threshold needs window_seconds or window_minutes")
+        by = threshold.get('by') or []
+        rule.by = [by] if isinstance(by, str) else list(by)
+        replaces = doc.get('replaces') or []
+        rule.replaces = [replaces] if isinstance(replaces, str) else list(replaces)
+        rule.source = doc.get('_file', 'inline')
+        return rule
+
+    # --- evaluation ----------------------------------------------------
+
+    def detect(self, events: List[Any]) -> List[Dict[str, Any]]:
+        alerts: List[Dict[str, Any]] = []
+        tests = self._tests
+        routes = self._routes
+        for e in events:
+            key = (e.channel, e.event_id) if type(e) is Event else (e.get('channel'), e.get('event_id'))
+            rules = routes.get(key)
+            if rules is None:
+                if len(routes) > 65536:
+                    routes.clear()
+                rules = routes[key] = tuple(r for r in self.rules if r.wants(*key))
+            if not rules:
+                continue
+            done: Dict[int, bool] = {}
+            fields: Dict[str, tuple] = {}
+
+            def t(i, e=e, done=done, fields=fields):
+                r = done.get(i)
+                if r is None:
+                    name, test = tests[i]
+                    value = fields.get(name)
+                    if value is None:
+                        value = fields[name] = _field(e, name)
+                    r = done[i] = test(value)
+                return r
+
+            for rule in rules:
+                if rule.condition(t):
+                    alert = self._hit(rule, e)
+                    if alert is not None:
+                        alerts.append(alert)
+        return alerts
+
+    def _hit(self, rule: Rule, e: Any) -> Optional[Dict[str, Any]]:
+        evidence, count = [e], 1
+        if rule.count:
+            ts = self.clock(e)
+            key = '|'.join(str(e.get(f) or '') for f in rule.by)
+            state = self.tables[rule.id].setdefault(key, ts, lambda: {'hits': deque(maxlen=rule.count), 'alerted': None})
+            hits = state['hits']
+            while hits and ts - hits[0][0] > rule.window:
+                hits.popleft()
+            alerted = state['alerted']
+            if alerted is not None and (ts - alerted >= rule.suppress if rule.suppress is not None else not hits):
+                alerted = state['alerted'] = None
+            hits.append([ts, e])
+            if len(hits) < rule.count or alerted is not None:
+                return None
+            state['alerted'] = ts
+            evidence = [evt for _, evt in hits if evt is not None]
+            count = len(hits)
+        fields = _Vars(e.to_dict() if isinstance(e, Event) else e)
+        fields.update(count=count, window_minutes=round(rule.window / 60, 2), rule=rule.id)
+        entities = {k: e.get(f) for k, f in rule.entities.items()}
+        return {
+            'severity': rule.severity,
+            'title': self._format(rule.title, fields),
+            'description': self._format(rule.description, fields),
+            'rule_id': rule.id,
+            'entities': entities,
+            'fingerprint_key': '|'.join(str(e.get(f) or '') for f in rule.fingerprint) or None,
+            'events': evidence,
+        }
+
+    @staticmethod
+    def _format(template: str, fields: Dict[str, Any]) -> str:
+        try:
+            return template.format_map(fields)
+        except (ValueError, IndexError, AttributeError):
+            return template
+
+    def encode(self, table: str, value: Dict[str, Any]) -> Dict[str, Any]:
+        return {'hits': [ts for ts, _ in value['hits']], 'alerted': value['alerted']}
+
+    def decode(self, table: str, value: Dict[str, Any]) -> Dict[str, Any]:
+        count = next((r.count for r in self.rules if r.id == table), None)
+        return {'hits': deque(([ts, None] for ts in value.get('hits', [])), maxlen=count),
+                'alerted': value.get('alerted')}
@@ -1,17 +1,20 @@
 from typing import List, Dict, Any, Set
-import time
+
+from app.detectors.base import EntityState, StreamingDetector
 
 USB_EVENT_IDS: Set[int] = {2003, 2100, 2102, 400, 410, 9999}
 USB_SIGNATURES = ["USB\\VID_", "USB VID", "Device configured (USB\\VID", "USB attach:", "USB remove:"]
 
-# In-memory dedupe per physical device (serial extracted from PNP ID)
-_recent_usb: Dict[str, float] = {}
-_USB_DEDUPE_SECONDS = 8  # window to collapse Volume/HARSHRAJ/Mass Storage into one alert
+# Default window to collapse Volume/HARSHRAJ/Mass Storage into one alert (``usb_debounce_seconds``)
+_USB_DEDUPE_SECONDS = 8
+
+
+_USB_SIGNATURES_LOWER = tuple(sig.lower() for sig in USB_SIGNATURES)
 
 
 def _looks_usb(message: str) -> bool:
     m = (message or '').lower()
-    return any(sig.lower() in m for sig in USB_SIGNATURES)
+    return any(sig in m for sig in _USB_SIGNATURES_LOWER)
 
 
 def _extract_label(pnp: str, name: str) -> str:
@@ -121,42 +124,67 @@ def format_usb_alert(e: Dict[str, Any]) -> tuple:
     return (severity, title, description)
 
 
-def detect_usb_activity(events: List[Dict[str, Any]], thresholds: Dict[str, Any]) -> List[Dict[str, Any]]:
-    alerts: List[Dict[str, Any]] = []
-    now = time.time()
-    # Clean old dedupe entries
-    for k, ts in list(_recent_usb.items()):
-        if now - ts > _USB_DEDUPE_SECONDS:
-            del _recent_usb[k]
-
-    for e in events:
-        if e.get('channel') != 'System':
-            continue
-        eid = e.get('event_id')
-        msg = e.get('message') or ''
-        if not (eid in USB_EVENT_IDS or _looks_usb(msg)):
-            continue
-
-        if eid == 9999:  # synthetic enriched
-            pnp = e.get('usb_pnp_id') or ''
-            serial = _extract_serial(pnp)
-            kind = e.get('usb_kind', '')
-            # Collapse multiple entity events (Volume / label / device) into single per kind+serial
-            dedupe_key = f"{kind}:{serial}"
-            if dedupe_key in _recent_usb:
-                # skip duplicate within window
+class UsbDetector(StreamingDetector):
+    """
+    USB attach/remove alerts, one per device and kind within ``usb_debounce_seconds``.
+
+    The Volume / label / mass storage events of one plug-in share a serial
+    and collapse into a single alert, even when they arrive in separate batches.
+    """
+
+    name = 'usb_monitor'
+    channels = frozenset(('System',))  # any id: legacy USB messages are matched on text
+
+    def __init__(self, thresholds: Dict[str, Any]):
+        super().__init__(thresholds)
+        self.debounce = float(thresholds.get('usb_debounce_seconds', _USB_DEDUPE_SECONDS))
+        self.recent = EntityState(self.debounce)  # "kind:serial" -> None, last alerted at
+        self.tables = {'recent': self.recent}
+
+    def detect(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        alerts: List[Dict[str, Any]] = []
+        for e in events:
+            if e.get('channel') != 'System':
+                continue
+            eid = e.get('event_id')
+            msg = e.get('message') or ''
+            if not (eid in USB_EVENT_IDS or _looks_usb(msg)):
                 continue
-            _recent_usb[dedupe_key] = now
-            severity, title, desc = format_usb_alert(e)
-        else:
-            # Legacy USB logs (rare); low severity generic alert
-            desc = msg[:400]
-            severity = 'LOW'
-            title = 'USB Activity'
-
-        alerts.append({
-            'severity': severity,
-            'title': title,
-            'description': desc
-        })
-    return alerts
+            now = self.clock(e)
+
+            if eid == 9999:  # synthetic enriched
+                pnp = e.get('usb_pnp_id') or ''
+                serial = _extract_serial(pnp)
+                kind = e.get('usb_kind', '')
+                # Collapse multiple entity events (Volume / label / device) into single per kind+serial
+                dedupe_key = f"{kind}:{serial}"
+                seen = self.recent.last_seen(dedupe_key)
+                if seen is not None and now - seen <= self.debounce:
+                    # skip duplicate within window
+                    continue
+                self.recent.touch(dedupe_key, now, None)
+                severity, title, desc = format_usb_alert(e)
+                rule_id = 'usb.' + (kind or 'device').lower()
+                entities = {'host': e.get('computer'), 'device_serial': serial}
+            else:
+                # Legacy USB logs (rare); low severity generic alert
+                desc = msg[:400]
+                severity = 'LOW'
+                title = 'USB Activity'
+                rule_id = 'usb.legacy'
+                entities = {'host': e.get('computer')}
+
+            alerts.append({
+                'severity': severity,
+                'title': title,
+                'description': desc,
+                'rule_id': rule_id,
+                'entities': entities,
+                'events': [e],
+            })
+        return alerts
+
+
+def detect_usb_activity(events: List[Dict[str, Any]], thresholds: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One-shot detection over ``events`` alone (no state kept between calls)."""
+    return UsbDetector(thresholds).process(events)
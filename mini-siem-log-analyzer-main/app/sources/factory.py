@@ -0,0 +1,47 @@
+import os
+from typing import List, Dict, Any
+
+from app.sources.base import EventSource
+from app.sources.evtx import EvtxFileSource
+from app.sources.replay import FeedSource, JsonlReplaySource, LatestEventsReplaySource
+from app.sources.windows import WindowsEventLogSource, ProcessWatcherSource, USBWatcherSource
+
+DEFAULT_SOURCES = ["eventlog", "process_watcher", "usb_wmi"]
+
+
+def build_sources(cfg, base_dir: str) -> List[EventSource]:
+    """
+    Build the configured sources from ``collector.sources``.
+
+    Entries are either a type name or a dict with a ``type`` key, e.g.
+    ``"eventlog"`` or ``{"type": "jsonl", "path": "data/replay.jsonl"}``.
+    """
+    sources: List[EventSource] = []
+    max_records = cfg.collector.get('max_records', 250)
+    for spec in cfg.collector.get('sources', DEFAULT_SOURCES):
+        opts: Dict[str, Any] = spec if isinstance(spec, dict) else {'type': spec}
+        kind = opts.get('type')
+        if kind == 'eventlog':
+            sources.append(WindowsEventLogSource(
+                opts.get('channels', cfg.channels),
+                opts.get('max_records', max_records),
+                timeout=opts.get('timeout_seconds', cfg.collector.get('channel_timeout_seconds', 5.0)),
+                timeouts=opts.get('timeouts', cfg.collector.get('channel_timeouts', {})),
+            ))
+        elif kind == 'process_watcher':
+            sources.append(ProcessWatcherSource())
+        elif kind == 'usb_wmi':
+            sources.append(USBWatcherSource())
+        elif kind == 'jsonl':
+            sources.append(JsonlReplaySource(opts['path'], follow=opts.get('follow', False)))
+        elif kind == 'evtx':
+            sources.append(EvtxFileSource(opts['path'], workers=opts.get('workers', 1)))
+        elif kind == 'feed':
+            path = opts.get('path') or cfg.export.get('feed_dir', os.path.join(base_dir, 'data', 'feed'))
+            sources.append(FeedSource(path, follow=opts.get('follow', True)))
+        elif kind == 'latest_events':
+            path = opts.get('path') or cfg.export.get('latest_events_json', os.path.join(base_dir, 'data', 'latest_events.json'))
+            sources.append(LatestEventsReplaySource(path))
+        else:
+            raise ValueError(f"Unknown event source type: {kind}")
+    return sources
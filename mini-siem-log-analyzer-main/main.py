@@ -6,8 +6,6 @@ Process Monitoring, Brute Force Detection, Web Dashboard, and Telegram Alerts
 
 AUTO-ELEVATES TO ADMINISTRATOR IF NEEDED
 """
-import threading
-import time
 import os
 import sys
 import ctypes
@@ -25,15 +23,9 @@ def is_admin():
 
 
 from app.core.config_loader import AppConfig
-from app.core.db import Database
-from app.core.event_collector import collect_latest_events, export_latest_events
-from app.core.process_watcher import start as start_process_watcher, drain as drain_process_events
-from app.core.event_parser import normalize_event
-from app.core.rules_engine import run_detectors
-from app.alerts.alert_engine import dispatch_alerts
+from app.core.pipeline import build_pipeline
 from utils.logging import setup_logger
 from app.dashboard.dashboard import app as dashboard_app
-from app.core.usb_wmi_watcher import USBWMIWatcher
 
 logger = setup_logger("main")
 
@@ -67,82 +59,15 @@ def print_banner():
 
 
 def run_siem():
-    """Main SIEM loop with USB monitoring"""
+    """Start the staged SIEM pipeline over the configured event sources (event logs, USB, processes)"""
     try:
         cfg = AppConfig.load(CONFIG_PATH)
-        db = Database(cfg.database.get('path', os.path.join(BASE_DIR, 'data', 'siem.db')))
-        
         logger.info("🚀 Starting SIEM Event Collection Engine")
-        
-        # In-memory buffer for synthetic USB events from WMI watcher
-        synthetic_events = []
-        
-        def _on_usb_event(evt: dict):
-            """Callback when USB device attached/removed"""
-            synthetic_events.append(evt)
-            logger.debug(f"USB event queued: {evt.get('usb_kind')} - {evt.get('usb_name')}")
-        
-        # Start USB WMI watcher thread
-        logger.info("🔌 Starting USB WMI Watcher...")
-        usb_watcher = USBWMIWatcher(on_event=_on_usb_event)
-        usb_watcher.start()
-        logger.info("✅ USB monitoring active")
-        
-        # Start real-time process watcher (non-admin works)
-        try:
-            start_process_watcher()
-        except Exception:
-            pass
-
-        # Main event collection loop
-        while True:
-            # Collect events from Windows Event Logs
-            events = collect_latest_events(cfg.channels, max_records=250)
-            
-            # Merge synthetic USB events from WMI watcher
-            if synthetic_events:
-                logger.debug(f"Merging {len(synthetic_events)} USB events")
-                events.extend(synthetic_events)
-                synthetic_events.clear()
-            
-            # Drain any real-time process events and merge
-            try:
-                rt_events = drain_process_events(250)
-                if rt_events:
-                    events.extend(rt_events)
-            except Exception:
-                pass
-
-            # Normalize and enrich events
-            events = [normalize_event(e) for e in events]
-            
-            # Persist to database
-            db.insert_events(events)
-            
-            # Export latest events to JSON
-            export_latest_events(
-                events, 
-                cfg.export.get('latest_events_json', os.path.join(BASE_DIR, 'data', 'latest_events.json'))
-            )
-            
-            # Run detection rules
-            alerts = run_detectors(events, cfg.thresholds)
-            
-            # Dispatch alerts (Telegram, Discord, Email)
-            if alerts:
-                logger.info(f"📢 Dispatching {len(alerts)} alerts")
-            dispatch_alerts(
-                alerts, 
-                cfg.alerts.__dict__ if hasattr(cfg.alerts, '__dict__') else cfg.alerts, 
-                db
-            )
-            
-            # Sleep before next collection cycle
-            time.sleep(cfg.interval_seconds)
-            
-    except KeyboardInterrupt:
-        logger.info("🛑 SIEM shutdown requested")
-        usb_watcher.stop()
+
+        # collect -> normalize -> persist / export / detect -> alert, each stage on its own threads
+        pipeline = build_pipeline(cfg, BASE_DIR)
+        pipeline.start()
+        return pipeline
     except Exception as e:
         logger.error(f"❌ SIEM error: {e}", exc_info=True)
         raise
@@ -176,18 +101,17 @@ def main():
     else:
         logger.info("✅ Running with Administrator privileges")
     
-    # Start SIEM in background thread
-    logger.info("🔧 Starting background SIEM thread...")
-    siem_thread = threading.Thread(target=run_siem, daemon=True, name="SIEM-Thread")
-    siem_thread.start()
-    
-    # Wait for SIEM to initialize
-    logger.info("⏳ Waiting for SIEM initialization...")
-    time.sleep(3)
-    
-    # Start Flask dashboard (blocks main thread)
+    # Start the SIEM pipeline (its stages run on their own threads)
+    logger.info("🔧 Starting SIEM pipeline...")
+    pipeline = run_siem()
+
+    # Start Flask dashboard (blocks main thread); Ctrl+C ends up here, so drain and stop the pipeline
     logger.info("🎬 Launching dashboard...")
-    start_dashboard()
+    try:
+        start_dashboard()
+    finally:
+        logger.info("🛑 Stopping SIEM pipeline...")
+        pipeline.stop()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The project is run from its directory, not installed
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
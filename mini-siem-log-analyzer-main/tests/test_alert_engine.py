@@ -0,0 +1,113 @@
+"""Alert fingerprints, the cooldown keyed on them, and evidence gathered across partitions."""
+import hashlib
+import sqlite3
+from datetime import timedelta
+
+import pytest
+
+from app.alerts import alert_engine
+from app.alerts.alert_engine import alert_fingerprint, dispatch_alerts
+from app.core import db as db_module
+from app.core.db import Database
+from app.core.event import Event
+
+CONFIG = {'enabled_channels': []}
+
+
+@pytest.fixture(autouse=True)
+def alert_cache():
+    alert_engine._alert_cache.clear()
+    yield
+    alert_engine._alert_cache.clear()
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'siem.db'), flush_interval_ms=10, spool_max_mb=0)
+    yield db
+    db.close()
+
+
+def alert(ip='203.0.113.9', user=None, **extra):
+    return dict({'title': '[HIGH] Brute force', 'severity': 'HIGH', 'description': 'x', 'rule_id': 'bruteforce',
+                 'entities': {'ip': ip, 'user': user}}, **extra)
+
+
+def stored_alerts(db):
+    db.flush()
+    conn = sqlite3.connect(db.path)
+    try:
+        return conn.execute("SELECT ip, user, fingerprint, occurrences FROM alerts ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+def test_fingerprint_is_stable_and_keyed_on_rule_entities_and_key():
+    fp = alert_fingerprint('bruteforce', {'ip': '203.0.113.9'})
+    # Stored with every alert: the format must not change between releases
+    assert fp == hashlib.sha1(b'bruteforce|203.0.113.9||||').hexdigest()[:16]
+    assert alert_fingerprint('bruteforce', {'user': None, 'ip': '203.0.113.9', 'note': 'ignored'}) == fp
+    assert alert_fingerprint('bruteforce', {'ip': '203.0.113.9', 'user': ''}) == fp
+    assert alert_fingerprint('bruteforce', {'user': 'Admin'}) == alert_fingerprint('bruteforce', {'user': 'admin'})
+    distinct = {fp, alert_fingerprint('bruteforce', {'ip': '203.0.113.10'}),
+                alert_fingerprint('spray', {'ip': '203.0.113.9'}),
+                alert_fingerprint('bruteforce', {'user': '203.0.113.9'}),  # same value, other entity
+                alert_fingerprint('bruteforce', {'ip': '203.0.113.9'}, 'k'),
+                alert_fingerprint('bruteforce')}
+    assert len(distinct) == 6
+
+
+def test_cooldown_is_per_fingerprint_and_repeats_bump_the_stored_alert(db):
+    dispatch_alerts([alert(), alert(), alert(ip='198.51.100.7')], CONFIG, db)
+    # Same rule and entities, different text: still a repeat
+    dispatch_alerts([alert(title='[HIGH] Brute force (again)', description='y')], CONFIG, db)
+    rows = stored_alerts(db)
+    assert [(ip, n) for ip, _, _, n in rows] == [('203.0.113.9', 3), ('198.51.100.7', 1)]
+    assert rows[0][2] == alert_fingerprint('bruteforce', {'ip': '203.0.113.9'})
+
+    # Once the cooldown has passed the same fingerprint alerts again
+    fp = rows[0][2]
+    alert_engine._alert_cache[fp] -= timedelta(minutes=alert_engine._ALERT_COOLDOWN_MINUTES + 1)
+    dispatch_alerts([alert()], CONFIG, db)
+    assert [(ip, n) for ip, _, _, n in stored_alerts(db)] == [('203.0.113.9', 3), ('198.51.100.7', 1),
+                                                              ('203.0.113.9', 1)]
+    assert fp in alert_engine._alert_cache and len(alert_engine._alert_cache) == 2
+
+
+def test_evidence_from_main_and_several_partitions_in_one_query(db, monkeypatch):
+    legacy = sqlite3.connect(db.path)
+    row_id = legacy.execute("INSERT INTO events(timestamp, ts_us, channel, event_id, user, ip, message) "
+                            "VALUES('2024-04-30T23:59:00', 1714521540000000, 'Security', 4625, 'admin', "
+                            "'203.0.113.9', 'from before partitioning')").lastrowid
+    legacy.commit()
+    legacy.close()
+    old = Event.from_dict({'timestamp': '2024-04-30T23:59:00', 'event_id': 4625, 'user': 'admin'})
+    old.ref = ('', row_id)
+
+    batch = [Event.from_dict({'timestamp': f'2024-05-0{day}T10:00:0{i}', 'channel': 'Security', 'event_id': 4625,
+                              'user': 'admin', 'ip': '203.0.113.9', 'message': f'failure {day}.{i}'})
+             for day in (1, 2, 3) for i in range(2)]
+    unrelated = [Event.from_dict({'timestamp': '2024-05-02T11:00:00', 'event_id': 4624, 'message': 'logon'})]
+    db.insert_events(batch + unrelated)
+    dispatch_alerts([alert(events=batch[::-1] + [old])], CONFIG, db)
+    db.flush()
+
+    statements = []
+    real = db_module.open_readonly
+
+    def traced(path):
+        conn = real(path)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(db_module, 'open_readonly', traced)
+    evidence = db.alert_evidence(1)
+    assert evidence['rule_id'] == 'bruteforce' and evidence['ip'] == '203.0.113.9'
+    assert [e['message'] for e in evidence['events']] == ['from before partitioning'] + [
+        f'failure {day}.{i}' for day in (1, 2, 3) for i in range(2)]
+    assert [e['partition'] for e in evidence['events']] == [''] + [e.ref[0] for e in batch]
+    assert sorted({e['partition'] for e in evidence['events']}) == ['', 'events_20240501', 'events_20240502',
+                                                                      'events_20240503']
+    event_queries = [s for s in statements if 'JOIN' in s]
+    assert len(event_queries) == 1 and event_queries[0].count('UNION ALL') == 3
+    assert db.alert_evidence(2) is None
@@ -0,0 +1,73 @@
+"""The columnar cold tier: segment round trips, block skipping and archiving a partition."""
+import sqlite3
+import time
+from datetime import datetime
+
+from app.core.archive import SegmentReader, write_segment
+from app.core.db import Database
+from app.core.event import Event
+from app.core.migrations import to_epoch_us
+
+
+def event(ts, i=0):
+    return {'timestamp': ts, 'channel': 'Security', 'event_id': 4625, 'user': f'user{i}', 'ip': '10.0.0.5',
+            'command': None, 'message': f'failure {i}'}
+
+
+def row(ts, event_id, user, message=None):
+    return (ts, to_epoch_us(ts), 'Security', event_id, user, None, None, message)
+
+
+def test_segment_round_trip_and_block_skipping(tmp_path):
+    path = str(tmp_path / 'events_20240501.seg')
+    rows = [row(f'2024-05-01T10:00:{i:02d}', 4625 if i < 10 else 4688, f'user{i % 3}', None if i % 4 else 'x')
+            for i in range(20)]
+    rows.append((None, None, 'Security', None, None, None, None, 'no time'))
+    rows.sort(key=lambda r: (r[1] is not None, r[1]))
+    info = write_segment(path, rows, block_rows=5, codec='lzma')
+    assert info['rows'] == 21 and info['blocks'] == 5
+
+    reader = SegmentReader(path)
+    assert list(reader.scan(newest_first=False)) == rows
+    hits = list(reader.scan(filters={'event_id': '4688', 'user': 'user1'}))
+    assert [r[0] for r in hits] == ['2024-05-01T10:00:19', '2024-05-01T10:00:16', '2024-05-01T10:00:13',
+                                   '2024-05-01T10:00:10']
+    assert reader.blocks_skipped == 2  # the two blocks holding only 4625s
+
+    reader.blocks_read = reader.blocks_skipped = 0
+    start, end = to_epoch_us('2024-05-01T10:00:06'), to_epoch_us('2024-05-01T10:00:08')
+    assert [r[0] for r in reader.scan(start, end, limit=1)] == ['2024-05-01T10:00:07']
+    assert reader.blocks_read == 1
+
+
+def test_archiving_drops_the_partition_and_its_evidence_links(tmp_path):
+    path = str(tmp_path / 'siem.db')
+    today = datetime.utcnow().replace(microsecond=0).isoformat()
+    old = [Event.from_dict(event(f'2024-05-01T10:00:0{i}', i)) for i in range(3)]
+    recent = [Event.from_dict(event(today, 9))]
+    db = Database(path, flush_interval_ms=10, spool_max_mb=0)
+    db.insert_events(old + recent)
+    db.insert_alert('high', 'Brute force', 'x', today, rule_id='brute_force', events=old + recent)
+    db.close()
+    assert [e['partition'] for e in db.alert_evidence(1)['events']] == ['events_20240501'] * 3 + [recent[0].ref[0]]
+
+    db = Database(path, archive_after_days=1, flush_interval_ms=10, spool_max_mb=0)
+    try:
+        deadline = time.monotonic() + 5
+        while db.stats()['partitions_removed'] < 1 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert db.stats()['partitions_removed'] == 1
+        assert [p[0] for p in db.partitions.list()] == [recent[0].ref[0]]
+        conn = sqlite3.connect(path)
+        try:
+            links = conn.execute("SELECT partition, event_row FROM alert_events").fetchall()
+        finally:
+            conn.close()
+        assert links == [recent[0].ref]
+        evidence = db.alert_evidence(1)
+        assert [e['user'] for e in evidence['events']] == ['user9']
+        # The archived rows are still there for queries
+        assert [r['user'] for r in db.query(('2024-05-01T00:00:00', '2024-05-02T00:00:00'))] == \
+            ['user2', 'user1', 'user0']
+    finally:
+        db.close()
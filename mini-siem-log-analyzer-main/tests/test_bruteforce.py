@@ -0,0 +1,122 @@
+"""BruteForceDetector: sprays in both directions, eviction under the key cap, and RingWindow bucket expiry."""
+from datetime import datetime, timedelta
+
+from app.detectors.base import RingWindow, value_bit
+from app.detectors.bruteforce import DISTINCT_BITS, BruteForceDetector
+
+START = datetime(2024, 5, 1, 9, 0)
+# Plain brute force needs 3 failures in 10 minutes (10 one-minute buckets); spray checks are off unless set
+THRESHOLDS = {'brute_force_failures': 3, 'brute_force_window_minutes': 10, 'spray_users_per_ip': 0,
+              'spray_ips_per_user': 0}
+
+
+def failure(seconds, ip='203.0.113.9', user='admin'):
+    return {'timestamp': (START + timedelta(seconds=seconds)).isoformat(), 'channel': 'Security', 'event_id': 4625,
+            'ip': ip, 'user': user, 'computer': 'DC01'}
+
+
+def rules(alerts):
+    return [a['rule_id'] for a in alerts]
+
+
+def test_one_ip_trying_many_users_is_a_spray():
+    detector = BruteForceDetector(dict(THRESHOLDS, brute_force_failures=100, spray_users_per_ip=5))
+    alerts = []
+    for i in range(4):
+        alerts += detector.process([failure(i, user=f'user{i}'), failure(i, user=f'user{i}')])  # repeats count once
+    assert alerts == []
+    alerts = detector.process([failure(10 + i, user=f'user{i}') for i in range(4, 12)])
+    assert rules(alerts) == ['bruteforce.spray_source']
+    assert alerts[0]['entities'] == {'ip': '203.0.113.9', 'host': 'DC01'}
+    assert 'Target Users: ~5' in alerts[0]['description']
+    # Once per burst; another source is judged on its own
+    assert detector.process([failure(30 + i, user=f'other{i}') for i in range(10)]) == []
+    assert rules(detector.process([failure(40 + i, ip='198.51.100.7', user=f'user{i}') for i in range(5)])) == \
+        ['bruteforce.spray_source']
+
+
+def test_many_ips_trying_one_user_is_a_distributed_attack():
+    detector = BruteForceDetector(dict(THRESHOLDS, spray_ips_per_user=5))
+    alerts = []
+    for i in range(12):
+        alerts += detector.process([failure(i * 20, ip=f'10.0.{i}.1', user='Administrator')])
+    assert rules(alerts) == ['bruteforce.spray_user']
+    assert alerts[0]['entities'] == {'user': 'Administrator', 'host': 'DC01'}
+    assert [e['ip'] for e in alerts[0]['events']] == [f'10.0.{i}.1' for i in range(5)]
+    # A quiet window re-arms it
+    alerts = detector.process([failure(1200 + i, ip=f'10.1.{i}.1', user='Administrator') for i in range(5)])
+    assert rules(alerts) == ['bruteforce.spray_user']
+
+
+def test_failures_outside_the_window_do_not_add_up():
+    detector = BruteForceDetector(THRESHOLDS)
+    assert detector.process([failure(0), failure(300), failure(700)]) == []  # the first fell out at 600 s
+    assert rules(detector.process([failure(720)])) == ['bruteforce']
+    assert detector.process([failure(30)]) == []  # late, and older than the window
+
+
+def evict_with_crowd(detector, attacker_failures):
+    """The attacker fails, then a crowd of sources with as many failures pushes it out of the capped table."""
+    alerts = detector.process([failure(i, ip='203.0.113.9') for i in range(attacker_failures)])
+    for i in range(20):
+        alerts += detector.process([failure(10 + i, ip=f'10.0.0.{i}')] * attacker_failures)
+    assert '203.0.113.9' not in detector.sources and len(detector.sources) == 4
+    assert detector.sources.evicted == 17
+    return alerts
+
+
+def test_evicted_source_keeps_counting_through_the_sketch():
+    detector = BruteForceDetector(dict(THRESHOLDS, brute_force_max_keys=4))
+    assert evict_with_crowd(detector, 2) == []
+    alerts = detector.process([failure(60)])
+    assert rules(alerts) == ['bruteforce']
+    assert 'Failed Attempts: 3' in alerts[0]['description']
+    assert detector.sketch.restored == 1
+
+    # Without the sketch the returning address starts from zero
+    forgetful = BruteForceDetector(dict(THRESHOLDS, brute_force_max_keys=4, brute_force_sketch_width=0))
+    assert forgetful.sketch is None
+    evict_with_crowd(forgetful, 2)
+    assert forgetful.process([failure(60)]) == []
+    assert forgetful.sources.get('203.0.113.9').failures.total() == 1
+
+
+def test_evicted_source_that_already_alerted_does_not_alert_again():
+    detector = BruteForceDetector(dict(THRESHOLDS, brute_force_max_keys=4))
+    alerts = evict_with_crowd(detector, 3)
+    assert sum(1 for a in alerts if a['entities']['ip'] == '203.0.113.9') == 1
+    assert detector.process([failure(60)]) == []
+    assert detector.sources.get('203.0.113.9').alerted
+
+
+def test_ring_window_buckets_expire_as_time_moves_on():
+    window = RingWindow(3)
+    window.add(10)
+    window.add(11, 2)
+    assert window.total() == 3 and window.head == 11
+    window.add(13)  # recycles bucket 10
+    assert window.total() == 3 and window.slots == [0, 1, 2]
+    window.add(11)  # late, but still inside the window
+    assert window.total() == 4 and window.head == 13
+    window.add(10)  # fell out of the window
+    assert window.total() == 4
+    assert window.advance(10) is False and window.advance(12) is True and window.head == 13
+    window.add(15)
+    assert window.total() == 2  # 13 and 15 are left
+    window.add(40)
+    assert window.slots == [0, 1, 0] and window.total() == 1
+
+    restored = RingWindow.load(window.dump())
+    assert (restored.head, restored.slots) == (40, [0, 1, 0])
+
+
+def test_ring_window_distinct_counts_expire_too():
+    window = RingWindow(2)
+    for user in ('alice', 'bob', 'carol'):
+        assert window.mark(5, value_bit(user, DISTINCT_BITS)) is True
+    assert window.mark(6, value_bit('alice', DISTINCT_BITS)) is False  # still in the window
+    assert round(window.distinct(DISTINCT_BITS)) == 3
+    window.mark(7, value_bit('dave', DISTINCT_BITS))  # bucket 5 leaves; alice was marked again in 6
+    assert round(window.distinct(DISTINCT_BITS)) == 2
+    window.advance(9)
+    assert window.distinct(DISTINCT_BITS) == 0
@@ -0,0 +1,134 @@
+"""The group-committing database writer: flush triggers, shutdown, readers and failed writes."""
+import sqlite3
+import time
+
+import pytest
+
+from app.core.db import Database, open_readonly
+from app.core.event import Event
+
+
+def events(start, count, **fields):
+    return [dict({'timestamp': f'2024-05-01T10:00:{i % 60:02d}', 'channel': 'Security', 'event_id': 4625,
+                  'user': f'user{i}', 'ip': '10.0.0.5', 'command': None, 'message': f'failure {i}'}, **fields)
+            for i in range(start, start + count)]
+
+
+def stored(db):
+    conn = open_readonly(db.path)
+    try:
+        return conn.execute("SELECT count(*) FROM events").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def wait_for(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def open_db(tmp_path):
+    opened = []
+
+    def make(**kwargs):
+        kwargs.setdefault('partition', 'none')
+        kwargs.setdefault('spool_max_mb', 0)
+        db = Database(str(tmp_path / 'siem.db'), **kwargs)
+        opened.append(db)
+        return db
+
+    yield make
+    for db in opened:
+        db.close()
+
+
+def test_commits_every_flush_rows(open_db):
+    db = open_db(flush_rows=5, flush_interval_ms=60000)
+    db.insert_events(events(0, 3))
+    time.sleep(0.2)
+    assert stored(db) == 0  # neither enough rows nor the interval yet
+    db.insert_events(events(3, 2))
+    wait_for(lambda: stored(db) == 5)
+    assert db.stats()['commits'] == 1
+
+
+def test_commits_after_flush_interval(open_db):
+    db = open_db(flush_rows=1000, flush_interval_ms=50)
+    started = time.monotonic()
+    db.insert_events(events(0, 2))
+    wait_for(lambda: stored(db) == 2)
+    assert time.monotonic() - started >= 0.05
+
+
+def test_on_commit_runs_after_the_rows_are_visible(open_db):
+    db = open_db(flush_rows=1000, flush_interval_ms=50)
+    seen = []
+    db.insert_events(events(0, 4), on_commit=lambda: seen.append(stored(db)))
+    wait_for(lambda: seen)
+    assert seen == [4]
+
+
+def test_flush_and_close_persist_everything_queued(open_db, tmp_path):
+    db = open_db(flush_rows=100000, flush_interval_ms=60000)
+    db.insert_events(events(0, 10))
+    assert db.flush(5)
+    assert stored(db) == 10
+
+    for i in range(10, 1010, 100):
+        db.insert_events(events(i, 100))
+    db.close()
+    assert stored(db) == 1010
+    with pytest.raises(RuntimeError):
+        db.insert_events(events(0, 1))
+    assert db.flush()  # nothing left to wait for
+
+
+def test_readonly_connections_see_commits_and_cannot_write(open_db):
+    db = open_db(flush_rows=1000, flush_interval_ms=60000)
+    reader = db.reader()
+    try:
+        assert reader.execute("SELECT count(*) FROM events").fetchone()[0] == 0
+        db.insert_events(events(0, 3))
+        assert reader.execute("SELECT count(*) FROM events").fetchone()[0] == 0  # still in the open transaction
+        db.flush()
+        assert reader.execute("SELECT count(*) FROM events").fetchone()[0] == 3
+        assert [r[0] for r in reader.execute("SELECT message FROM events_v ORDER BY id")] == \
+            ['failure 0', 'failure 1', 'failure 2']
+        with pytest.raises(sqlite3.OperationalError):
+            reader.execute("DELETE FROM events")
+    finally:
+        reader.close()
+
+
+def test_failed_write_loses_its_transaction_but_not_the_writer(open_db, caplog):
+    db = open_db(flush_rows=1000, flush_interval_ms=60000)
+    outcome = {}
+
+    def hooks(name):
+        return dict(on_commit=lambda: outcome.setdefault(name, 'stored'),
+                    on_error=lambda: outcome.setdefault(name, 'lost'))
+
+    db.insert_events(events(0, 2), **hooks('before'))
+    db.insert_events(events(2, 2, user=object()), **hooks('bad'))  # cannot be bound: the insert raises
+    db.flush()
+    assert outcome == {'before': 'lost', 'bad': 'lost'}  # rolled back together, and nothing to spool to
+    assert "DB write failed (events)" in caplog.text
+    assert db.stats()['failed_batches'] == 2
+
+    db.insert_events(events(4, 3), **hooks('after'))
+    db.flush()
+    assert outcome['after'] == 'stored'
+    assert db._thread.is_alive()
+    assert stored(db) == 3
+
+
+def test_stored_events_get_their_row_ref(open_db):
+    db = open_db(partition='day', flush_interval_ms=10)
+    batch = [Event.from_dict(e) for e in events(0, 3)]
+    db.insert_events(batch)
+    db.flush()
+    assert [e.ref for e in batch] == [('events_20240501', 1), ('events_20240501', 2), ('events_20240501', 3)]
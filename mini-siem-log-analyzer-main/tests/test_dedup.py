@@ -0,0 +1,108 @@
+"""Event fingerprints, the rotating Bloom filter and the dedup stage."""
+from types import SimpleNamespace
+
+from app.core import dedup, event_collector
+from app.core.dedup import BloomFilter, Deduplicator, RotatingBloomFilter, event_fingerprint
+
+CREATED = '20240501100000.123456+000'
+
+
+def process_event(channel, pid=4242, created=CREATED, command='cmd.exe /c whoami', observed='2024-05-01T10:00:01'):
+    return {'timestamp': observed, 'channel': channel, 'event_id': 4688, 'pid': pid, 'creation_date': created,
+            'user': None, 'ip': None, 'command': command, 'message': command}
+
+
+def unique_events(start, count):
+    return [{'timestamp': '2024-05-01T10:00:00', 'channel': 'Security', 'event_id': 4625, 'record_id': i,
+             'message': f'failure {i}'} for i in range(start, start + count)]
+
+
+def test_both_process_watchers_collapse_to_one_event():
+    polled = process_event('ProcessWatcher', observed='2024-05-01T10:00:05')
+    realtime = process_event('ProcessWatcherRT', observed='2024-05-01T10:00:01')
+    assert event_fingerprint(polled) == event_fingerprint(realtime)
+
+    d = Deduplicator(capacity=1000)
+    assert d.filter([realtime, polled]) == [realtime]
+    assert d.stats()['dropped'] == {'ProcessWatcher': 1}
+
+
+def test_reused_pid_is_a_new_process():
+    first = process_event('ProcessWatcherRT')
+    reused = process_event('ProcessWatcher', created='20240501101500.654321+000')
+    assert event_fingerprint(first) != event_fingerprint(reused)
+    assert len(Deduplicator(capacity=1000).filter([first, reused])) == 2
+
+
+def test_record_events_are_keyed_on_position_and_message():
+    evt = unique_events(1, 1)[0]
+    assert event_fingerprint(evt) == event_fingerprint(dict(evt))
+    assert event_fingerprint(evt) != event_fingerprint(dict(evt, record_id=2))
+    assert event_fingerprint(evt) != event_fingerprint(dict(evt, message='other'))
+    # No record id: the timestamp stands in for it
+    no_id = dict(evt, record_id=None)
+    assert event_fingerprint(no_id) != event_fingerprint(dict(no_id, timestamp='2024-05-01T10:00:01'))
+
+
+def test_false_positive_rate_stays_within_the_configured_bound():
+    capacity, error_rate = 5000, 0.01
+    bloom = BloomFilter(capacity, error_rate)
+    for evt in unique_events(0, capacity):
+        bloom.add(event_fingerprint(evt))
+    probes = [event_fingerprint(e) for e in unique_events(capacity, 20000)]
+    assert sum(fp in bloom for fp in probes) / len(probes) < 1.5 * error_rate
+
+    # Through the rotating filter, every event is new: anything dropped is a false positive
+    d = Deduplicator(capacity=capacity, error_rate=error_rate)
+    events = unique_events(0, 4 * capacity)
+    for i in range(0, len(events), 500):
+        d.filter(events[i:i + 500])
+    stats = d.stats()
+    assert stats['rotations'] == 3
+    assert sum(stats['dropped'].values()) / len(events) < 2 * error_rate
+    assert stats['memory_bytes'] == 2 * len(bloom.bits)
+
+
+def test_rotation_keeps_one_full_generation():
+    f = RotatingBloomFilter(capacity=100, error_rate=0.001)
+    first = [event_fingerprint(e) for e in unique_events(0, 100)]
+    second = [event_fingerprint(e) for e in unique_events(100, 100)]
+    for fp in first:
+        f.add(fp)
+    assert f.rotations == 0
+    for fp in second:
+        f.add(fp)
+    assert f.rotations == 1
+    assert all(fp in f for fp in first)  # now the previous generation
+
+    f.add(event_fingerprint(unique_events(200, 1)[0]))
+    assert f.rotations == 2
+    assert all(fp in f for fp in second)
+    assert sum(fp in f for fp in first) <= 2  # dropped with its generation, bar false positives
+
+
+def test_ttl_rotates_an_idle_generation(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(dedup.time, 'monotonic', lambda: now[0])
+    f = RotatingBloomFilter(capacity=100, ttl_seconds=60)
+    f.add('0' * 32)
+    now[0] += 30
+    f.add('1' * 32)
+    assert f.rotations == 0
+    now[0] += 31
+    f.add('2' * 32)
+    assert f.rotations == 1
+
+
+def test_polled_fallback_reports_a_reused_pid(monkeypatch):
+    procs = [SimpleNamespace(ProcessId=4242, CreationDate=CREATED, CommandLine='cmd.exe', Name='cmd.exe')]
+    monkeypatch.setattr(event_collector, 'wmi', SimpleNamespace(WMI=lambda: SimpleNamespace(Win32_Process=lambda: procs)))
+    monkeypatch.setattr(event_collector, '_seen_pids', {})
+
+    first = event_collector._synthesize_process_events()
+    assert [(e['pid'], e['creation_date']) for e in first] == [(4242, CREATED)]
+    assert event_collector._synthesize_process_events() == []
+
+    procs[0] = SimpleNamespace(ProcessId=4242, CreationDate='20240501101500.654321+000', CommandLine='cmd.exe',
+                               Name='cmd.exe')
+    assert len(event_collector._synthesize_process_events()) == 1
@@ -0,0 +1,115 @@
+"""DetectionEngine: routing by (channel, event id), per-detector stats and the eviction warning."""
+import time
+
+import pytest
+
+from app.core import rules_engine
+from app.core.event import Event
+from app.core.rules_engine import DetectionEngine
+from app.detectors.base import EntityState, StreamingDetector
+
+THRESHOLDS = {'brute_force_failures': 3, 'brute_force_window_minutes': 10, 'spray_users_per_ip': 0,
+              'spray_ips_per_user': 0}
+
+
+def event(i, channel, event_id, **fields):
+    return dict({'timestamp': f'2024-05-01T10:00:{i:02d}', 'channel': channel, 'event_id': event_id,
+                 'record_id': i, 'ip': '203.0.113.9', 'user': 'admin', 'command': None, 'message': ''}, **fields)
+
+
+def mixed():
+    """One batch of dicts and Event objects across channels and ids."""
+    batch = [event(0, 'Security', 4625), event(1, 'Security', 4688, command='cmd.exe /c whoami'),
+             event(2, 'Microsoft-Windows-PowerShell/Operational', 4104, message='Get-Process'),
+             event(3, 'System', 7036), event(4, 'Security', 4624), event(5, 'Application', 4625),
+             event(6, 'System', 20001), event(7, 'Security', 4625)]
+    return [Event.from_dict(e) if i % 2 else e for i, e in enumerate(batch)]
+
+
+def ids(batch):
+    return [e.record_id if type(e) is Event else e['record_id'] for e in batch]
+
+
+class Recorder(StreamingDetector):
+    """Records the batches it is handed; alerts on every ``alert_on`` event id, with ``delay`` per batch."""
+
+    def __init__(self, name, event_ids=None, channels=None, alert_on=(), delay=0.0, max_keys=0):
+        super().__init__({})
+        self.name = name
+        self.event_ids = frozenset(event_ids) if event_ids is not None else None
+        self.channels = frozenset(channels) if channels is not None else None
+        self.alert_on = alert_on
+        self.delay = delay
+        self.batches = []
+        self.seen = EntityState(600, max_keys)
+        self.tables = {'seen': self.seen}
+
+    def detect(self, events):
+        self.batches.append(ids(events))
+        time.sleep(self.delay)
+        for e in events:
+            self.seen.touch(str(e['record_id']), self.clock(e), True)
+        return [{'rule_id': self.name} for e in events if e['event_id'] in self.alert_on]
+
+
+@pytest.fixture
+def recorders(monkeypatch):
+    made = [Recorder('failures', event_ids=[4625], alert_on=[4625], delay=0.02),
+            Recorder('system', channels=['System']),
+            Recorder('security_procs', event_ids=[4688, 4624], channels=['Security'], alert_on=[4688]),
+            Recorder('everything'),
+            Recorder('nothing', event_ids=[])]
+    monkeypatch.setattr(rules_engine, 'build_detectors', lambda thresholds, rules_dir=None: made)
+    return made
+
+
+def test_each_detector_gets_exactly_its_sub_batch(recorders):
+    engine = DetectionEngine(THRESHOLDS)
+    batch = mixed()
+    routed = engine.route(batch)
+    assert [ids(b) for b in routed] == [[0, 5, 7], [3, 6], [1, 4], list(range(8)), []]
+    assert all(a is b for a, b in zip(routed[3], batch))  # the same objects, not copies
+
+    engine.process(batch)
+    assert [r.batches for r in recorders] == [[[0, 5, 7]], [[3, 6]], [[1, 4]], [list(range(8))], []]
+    # The subscription of each (channel, id) is worked out once
+    assert engine._routes[('Security', 4625)] == (0, 3)
+    assert engine._routes[('System', 20001)] == (1, 3)
+    assert len(engine._routes) == 7
+
+    engine.process([event(9, 'Application', 1000)])
+    assert [len(r.batches) for r in recorders] == [1, 1, 1, 2, 0]  # idle detectors are not called
+
+
+def test_stats_record_events_alerts_and_time_per_detector(recorders):
+    engine = DetectionEngine(THRESHOLDS)
+    alerts = engine.process(mixed()) + engine.process([event(8, 'Security', 4625)])
+    assert sorted(a['rule_id'] for a in alerts) == ['failures'] * 4 + ['security_procs']
+    stats = engine.stats()
+    assert list(stats) == ['failures', 'system', 'security_procs', 'everything', 'nothing']
+    assert {n: (s['events'], s['alerts']) for n, s in stats.items()} == {
+        'failures': (4, 4), 'system': (2, 0), 'security_procs': (2, 1), 'everything': (9, 0), 'nothing': (0, 0)}
+    assert stats['failures']['seconds'] >= 0.04  # two batches at 20 ms each
+    assert stats['nothing']['seconds'] == 0
+    assert stats['everything']['entities'] == 9
+    assert all(s['evicted'] == 0 and s['health'] == 'ok' for s in stats.values())
+
+
+def test_a_detector_at_its_key_cap_is_flagged_and_warned_about_once(monkeypatch, caplog):
+    capped = Recorder('capped', max_keys=2)
+    monkeypatch.setattr(rules_engine, 'build_detectors', lambda thresholds, rules_dir=None: [capped])
+    engine = DetectionEngine(THRESHOLDS)
+    engine.process(mixed()[:2])
+    assert engine.stats()['capped']['health'] == 'ok'
+    engine.process(mixed())
+    engine.process([event(9, 'Security', 4625)])
+    stats = engine.stats()['capped']
+    assert stats['evicted'] == 7 and stats['entities'] == 2 and stats['health'] == 'evicting'
+    assert caplog.text.count("Detector capped is at its key cap") == 1
+
+
+def test_builtin_subscriptions():
+    engine = DetectionEngine(THRESHOLDS)
+    routed = dict(zip([d.name for d in engine.detectors], (ids(b) for b in engine.route(mixed()))))
+    assert routed == {'bruteforce': [0, 5, 7], 'powershell_abuse': [1, 2], 'usb_monitor': [3, 6],
+                      'malware_exec': [1]}
@@ -0,0 +1,129 @@
+"""EntityState tables and StreamingDetector state: TTL expiry, the key cap, snapshots and cross-batch counting."""
+import json
+from datetime import datetime, timedelta
+
+from app.detectors.base import EVICT_SAMPLE, EntityState, StreamingDetector
+from app.detectors.bruteforce import BruteForceDetector
+
+START = datetime(2024, 5, 1, 9, 0)
+
+
+def failure(seconds, ip='203.0.113.9', user='admin'):
+    return {'timestamp': (START + timedelta(seconds=seconds)).isoformat(), 'channel': 'Security', 'event_id': 4625,
+            'ip': ip, 'user': user}
+
+
+class FailureCounter(StreamingDetector):
+    """Counts failures per IP until it has been quiet for ``ttl`` seconds; alerts at ``failures``."""
+
+    name = 'counter'
+    event_ids = frozenset((4625,))
+
+    def __init__(self, thresholds):
+        super().__init__(thresholds)
+        self.counts = EntityState(thresholds.get('ttl', 600), thresholds.get('max_keys', 0))
+        self.tables = {'counts': self.counts}
+
+    def detect(self, events):
+        alerts = []
+        for e in events:
+            ts = self.clock(e)
+            state = self.counts.setdefault(e['ip'], ts, lambda: {'n': 0})
+            state['n'] += 1
+            if state['n'] == self.thresholds['failures']:
+                alerts.append({'rule_id': 'counter', 'entities': {'ip': e['ip']}, 'at': e['timestamp']})
+        return alerts
+
+
+def test_keys_expire_after_a_quiet_ttl():
+    table = EntityState(60)
+    table.touch('a', 0, 1)
+    table.touch('b', 30, 2)
+    assert table.setdefault('a', 50, dict) == 1  # seen again: now the newest
+    assert [k for k, _, _ in table.items()] == ['b', 'a'] and table.last_seen('a') == 50
+    assert table.setdefault('a', 40, dict) == 1 and table.last_seen('a') == 50  # an older time does not rewind it
+    assert table.expire(89) == 0
+    assert table.expire(90) == 1 and 'b' not in table and table.get('a') == 1
+    assert table.expire(200) == 1 and len(table) == 0
+    assert table.evicted == 0
+
+
+def test_key_cap_evicts_least_recently_seen_and_bounds_memory():
+    evicted = []
+    table = EntityState(600, max_keys=3, on_evict=lambda k, v: evicted.append((k, v)))
+    for i, key in enumerate('abc'):
+        table.touch(key, i, i)
+    table.setdefault('a', 3, dict)
+    table.touch('d', 4, 4)
+    assert evicted == [('b', 1)] and table.evicted == 1
+    assert [k for k, _, _ in table.items()] == ['c', 'a', 'd']
+
+    # A least recently seen key already past its TTL is dropped without counting as an eviction
+    table.touch('e', 602, 5)
+    assert 'c' not in table and table.evicted == 1 and evicted == [('b', 1)]
+
+    for i in range(10000):
+        table.touch(f'ip{i}', 700 + i / 100, i)
+        assert len(table) <= 3
+    # 'a' and 'd' had expired by then; 'e' and every ip key but the last three were evicted
+    assert table.evicted == 1 + 9998
+
+
+def test_weighted_cap_evicts_the_lightest_of_the_oldest_sample():
+    weights = {'heavy': 10, 'light': 1, 'mid': 5, 'newest': 0}
+    table = EntityState(600, max_keys=EVICT_SAMPLE, weight=lambda v: v)
+    for i, key in enumerate(['heavy', 'light', 'mid', 'other']):
+        table.touch(key, i, weights.get(key, 7))
+    table.touch('newest', 10, weights['newest'])  # lightest, but never the key just inserted
+    assert 'light' not in table and 'newest' in table and table.evicted == 1
+
+
+def test_state_survives_snapshot_and_restore():
+    detector = FailureCounter({'failures': 3, 'ttl': 600, 'max_keys': 2})
+    assert detector.process([failure(0), failure(10), failure(20, ip='198.51.100.7')]) == []
+    state = json.loads(json.dumps(detector.snapshot()))
+
+    restored = FailureCounter({'failures': 3, 'ttl': 600, 'max_keys': 2})
+    restored.restore(state)
+    assert restored.now == detector.now and restored.entities() == 2
+    assert [a['entities']['ip'] for a in restored.process([failure(30)])] == ['203.0.113.9']
+
+    # A smaller cap keeps the most recently seen keys
+    small = FailureCounter({'failures': 3, 'ttl': 600, 'max_keys': 1})
+    small.restore(state)
+    assert [k for k, _, _ in small.counts.items()] == ['198.51.100.7']
+
+
+def test_bruteforce_window_and_alert_flag_survive_a_restart():
+    thresholds = {'brute_force_failures': 3, 'brute_force_window_minutes': 10, 'spray_users_per_ip': 0,
+                  'spray_ips_per_user': 0}
+    first = BruteForceDetector(thresholds)
+    assert first.process([failure(0), failure(60)]) == []
+    second = BruteForceDetector(thresholds)
+    second.restore(json.loads(json.dumps(first.snapshot())))
+    assert [a['rule_id'] for a in second.process([failure(120)])] == ['bruteforce']
+
+    third = BruteForceDetector(thresholds)
+    third.restore(json.loads(json.dumps(second.snapshot())))
+    assert third.process([failure(180)]) == []  # already alerted for this burst
+    # A window saved with another bucket count starts over
+    finer = BruteForceDetector(dict(thresholds, brute_force_buckets=20))
+    finer.restore(second.snapshot())
+    assert finer.sources.get('203.0.113.9').failures.total() == 0
+
+
+def test_an_attack_split_across_batches_is_counted_once():
+    detector = FailureCounter({'failures': 4, 'ttl': 300})
+    alerts = []
+    for s in range(0, 200, 20):  # ten single-event batches, 20 s apart
+        alerts += detector.process([failure(s)])
+    assert [a['at'] for a in alerts] == [failure(60)['timestamp']]
+    assert detector.counts.get('203.0.113.9') == {'n': 10}
+
+    # Quiet for a whole TTL: the key is gone after the next batch, and counting starts over
+    detector.process([failure(600, ip='198.51.100.7')])
+    assert '203.0.113.9' not in detector.counts
+    alerts = []
+    for s in (610, 620, 630, 640):
+        alerts += detector.process([failure(s)])
+    assert [a['at'] for a in alerts] == [failure(640)['timestamp']]
@@ -0,0 +1,65 @@
+"""The ``Event`` record and its dict-compatible view."""
+import pytest
+
+from app.core.event import FIELDS, Event, as_dict
+
+USB = {'timestamp': '2024-05-01T10:00:00', 'channel': 'USB', 'event_id': 9999, 'user': None, 'ip': None,
+       'command': None, 'message': 'USB attached: SanDisk', 'usb_name': 'SanDisk', 'usb_capacity_gb': 32}
+
+
+def test_get_reads_core_and_extra_fields():
+    evt = Event.from_dict(USB)
+    assert evt.get('channel') == 'USB' and evt.channel == 'USB'
+    assert evt.get('usb_name') == 'SanDisk'
+    assert evt.get('record_id') is None  # core field, present but empty
+    assert evt.get('missing') is None
+    assert evt.get('missing', 'x') == 'x'
+    assert Event(channel='Security').get('usb_name', 0) == 0  # no extra at all
+
+
+def test_getitem_raises_for_unknown_keys():
+    evt = Event.from_dict(USB)
+    assert evt['usb_capacity_gb'] == 32
+    with pytest.raises(KeyError):
+        evt['missing']
+
+
+def test_setitem_on_core_and_extra_keys():
+    evt = Event(channel='Security', event_id=4625)
+    assert evt.extra is None
+    evt['ip'] = '10.0.0.5'
+    evt['logon_type'] = 3
+    assert evt.ip == '10.0.0.5'
+    assert evt.extra == {'logon_type': 3}
+    evt['channel'] = ''.join(['Sec', 'urity'])
+    assert evt.channel is Event(channel='Security').channel  # interned
+
+
+def test_contains_covers_core_fields_and_extra():
+    evt = Event.from_dict(USB)
+    assert 'record_id' in evt  # core fields are always present
+    assert 'usb_name' in evt
+    assert 'usb_model' not in evt
+    assert 'usb_name' not in Event(channel='USB')
+
+
+def test_to_dict_round_trip_and_equality_with_dicts():
+    evt = Event.from_dict(USB)
+    d = evt.to_dict()
+    assert list(d)[:len(FIELDS)] == list(FIELDS)
+    assert {k: v for k, v in d.items() if v is not None} == {k: v for k, v in USB.items() if v is not None}
+    assert Event.from_dict(d) == evt
+    assert evt == d and d == evt
+    assert evt != dict(d, usb_name='Kingston')
+    assert evt != 'not an event'
+    assert as_dict(evt) == d and as_dict(USB) is USB
+    assert len(evt) == len(d) and dict(evt.items()) == d and list(evt) == list(d)
+
+
+def test_from_dict_coerces_event_id_and_passes_events_through():
+    assert Event.from_dict({'event_id': '4625'}).event_id == 4625
+    assert Event.from_dict({'event_id': 'n/a'}).event_id is None
+    evt = Event(event_id=1)
+    assert Event.from_dict(evt) is evt
+    with pytest.raises(TypeError):
+        hash(evt)
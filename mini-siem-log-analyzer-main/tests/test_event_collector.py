@@ -0,0 +1,157 @@
+"""Checkpointed channel reads against the in-memory ``win32evtlog`` stand-in."""
+import sys
+import threading
+import time
+
+import pytest
+
+from app.core import event_collector, fake_win32evtlog
+from app.core.checkpoints import CheckpointStore
+
+
+@pytest.fixture
+def evtlog():
+    original = event_collector.win32evtlog
+    fake = fake_win32evtlog.install()
+    fake.reset()
+    yield fake
+    fake.reset()
+    event_collector.win32evtlog = original
+    sys.modules.pop('win32evtlog', None)
+
+
+@pytest.fixture
+def collect():
+    checkpoints = CheckpointStore()
+
+    def run(max_records=250):
+        return [e['record_id'] for e in event_collector.collect_latest_events(['System'], max_records, checkpoints)]
+
+    run.checkpoints = checkpoints
+    return run
+
+
+def fill(log, count):
+    for _ in range(count):
+        log.append(7036, ["Service", "running"])
+
+
+def test_first_read_takes_newest_records(evtlog, collect):
+    fill(evtlog.get_log('System'), 30)
+    assert collect(max_records=10) == list(range(21, 31))
+    assert collect.checkpoints.get('System')['record_number'] == 30
+
+
+def test_resumes_after_checkpoint(evtlog, collect):
+    log = evtlog.get_log('System')
+    fill(log, 5)
+    assert collect() == [1, 2, 3, 4, 5]
+    assert collect() == []
+    fill(log, 3)
+    assert collect() == [6, 7, 8]
+
+
+def test_resume_spans_read_batches_and_max_records(evtlog, collect):
+    log = evtlog.get_log('System')
+    fill(log, 1)
+    collect()
+    fill(log, 40)  # more than two ReadEventLog batches of 16
+    assert collect(max_records=25) == list(range(2, 27))
+    assert collect(max_records=25) == list(range(27, 42))
+
+
+def test_wraparound_restarts_at_oldest(evtlog, collect):
+    log = evtlog.get_log('System', max_records=10)
+    fill(log, 5)
+    collect()
+    fill(log, 20)  # records 6-15 are overwritten unread
+    assert log.oldest == 16
+    assert collect() == list(range(16, 26))
+
+
+def test_clear_restarts_at_oldest(evtlog, collect):
+    log = evtlog.get_log('System')
+    fill(log, 8)
+    collect()
+    log.clear()
+    fill(log, 3)  # newest is now below the checkpoint
+    assert collect() == [1, 2, 3]
+
+
+def test_clear_and_refill_past_checkpoint_is_detected(evtlog, collect):
+    log = evtlog.get_log('System')
+    fill(log, 3)
+    collect()
+    log.clear()
+    fill(log, 5)  # record 3 exists again, with another timestamp
+    assert collect() == [1, 2, 3, 4, 5]
+
+
+def test_empty_log_resets_checkpoint(evtlog, collect):
+    log = evtlog.get_log('System')
+    fill(log, 3)
+    collect()
+    log.clear()
+    assert collect() == []
+    assert collect.checkpoints.get('System') is None
+
+
+def test_stalled_channel_is_delivered_late_without_holding_back_others(evtlog, monkeypatch):
+    monkeypatch.setattr(event_collector, 'wmi', None)
+    release = threading.Event()
+    read = fake_win32evtlog.ReadEventLog
+
+    def stalling_read(handle, flags, offset):
+        if handle.log.name == 'System':
+            release.wait(5)
+        return read(handle, flags, offset)
+
+    monkeypatch.setattr(fake_win32evtlog, 'ReadEventLog', stalling_read)
+    security, system = evtlog.get_log('Security'), evtlog.get_log('System')
+    for i in range(3):
+        security.append(4625, ["S-1-0-0", "-", "-", "0x0", "S-1-0-0", f"user{i}"])
+    fill(system, 4)
+
+    collector = event_collector.ChannelCollector()
+    checkpoints = CheckpointStore()
+
+    def cycle():
+        events = collector.collect(['Security', 'System'], 250, checkpoints, timeout=1.0, timeouts={'System': 0.1})
+        return [(e['channel'], e['record_id']) for e in events]
+
+    try:
+        # System misses its deadline; Security still goes out this cycle
+        assert cycle() == [('Security', 1), ('Security', 2), ('Security', 3)]
+        assert collector.stats()['System']['status'] == 'timeout'
+        assert checkpoints.get('Security')['record_number'] == 3
+        assert checkpoints.get('System') is None
+
+        # Still stalled: the channel is not read a second time
+        security.append(4625, ["S-1-0-0", "-", "-", "0x0", "S-1-0-0", "user3"])
+        assert cycle() == [('Security', 4)]
+        assert collector.stats()['System']['status'] == 'busy'
+        assert checkpoints.get('System') is None
+
+        release.set()
+        wait_for(lambda: collector._inflight['System'].done())
+        # The late read is handed out first and moves the checkpoint with it
+        assert cycle() == [('System', 1), ('System', 2), ('System', 3), ('System', 4)]
+        stats = collector.stats()['System']
+        assert stats['events'] == 4 and stats['late_events'] == 4
+        assert checkpoints.get('System')['record_number'] == 4
+        assert checkpoints.get('Security')['record_number'] == 4
+
+        fill(system, 1)
+        assert cycle() == [('System', 5)]
+        assert collector.stats()['System']['status'] == 'ok'
+    finally:
+        release.set()
+        collector.close()
+
+
+def wait_for(cond, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
@@ -0,0 +1,79 @@
+"""Address extraction in ``normalize_events`` and ``clean_ip``."""
+import pytest
+
+from app.core.event import Event
+from app.core.event_parser import clean_ip, normalize_event, normalize_events
+
+
+def ip_of(message, event_id=1, **fields):
+    return normalize_event(dict({'event_id': event_id, 'message': message, 'ip': None, 'command': None}, **fields))['ip']
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('10.0.0.5', '10.0.0.5'),
+    (' 10.0.0.5 ', '10.0.0.5'),
+    ('::ffff:192.168.1.20', '192.168.1.20'),
+    ('::FFFF:192.168.1.20', '192.168.1.20'),
+    ('2001:DB8::1', '2001:db8::1'),
+    ('fe80::1%12', 'fe80::1%12'),
+    ('-', None),
+    ('', None),
+    (None, None),
+    ('::', None),
+    ('0.0.0.0', None),
+    ('::0', None),
+    ('300.1.1.1', None),
+    ('host.example.com', None),
+])
+def test_clean_ip(value, expected):
+    assert clean_ip(value) == expected
+
+
+def test_ipv6_and_zone_ids_in_messages():
+    assert ip_of('connection from 2001:db8:0:1::25 refused') == '2001:db8:0:1::25'
+    assert ip_of('link-local peer fe80::1c2d:3e4f%eth0 joined') == 'fe80::1c2d:3e4f%eth0'
+    assert ip_of('peer 2001:0db8:0000:0000:0000:ff00:0042:8329 up') == '2001:db8::ff00:42:8329'
+    assert ip_of('mapped ::ffff:198.51.100.4 seen') == '198.51.100.4'
+    # Earliest address by position wins across families
+    assert ip_of('from 2001:db8::9 via 10.1.1.1') == '2001:db8::9'
+    assert ip_of('from 10.1.1.1 via 2001:db8::9') == '10.1.1.1'
+    assert ip_of('logged at 10:00:00, no peer') is None
+
+
+def test_dotted_version_strings_are_not_addresses():
+    assert ip_of('Windows 10.0.19041.1 build') is None
+    assert ip_of('agent v1.2.3.4.5 started') is None
+    assert ip_of('version 10.0.19041.1 talking to 10.0.0.7.') == '10.0.0.7'  # sentence-final dot is fine
+    assert ip_of('bad 256.1.1.1 then 10.0.0.8') == '10.0.0.8'
+
+
+def test_logon_events_take_the_labelled_address():
+    msg = ('An account failed to log on. Caller Process: 10.0.19041.1 1.2.3.4 '
+           'Network Information: Workstation Name: WS01 Source Network Address: 203.0.113.9 Source Port: 0')
+    assert ip_of(msg, 4625) == '203.0.113.9'
+    assert ip_of(msg, 7036) == '1.2.3.4'  # not a logon event: first address in the text
+    assert ip_of('Client Address: ::ffff:198.51.100.7', 4771) == '198.51.100.7'
+    # A labelled placeholder means "no address": do not go hunting elsewhere in the text
+    assert ip_of('Caller 10.0.0.1 Source Network Address: - Source Port: -', 4625) is None
+
+
+def test_script_blocks_and_usb_events_are_never_scanned():
+    script = '$c = New-Object Net.Sockets.TCPClient("10.10.10.10", 4444)'
+    evt = normalize_event({'event_id': 4104, 'message': script, 'ip': None, 'command': None})
+    assert evt['ip'] is None
+    assert ip_of('USB attached: device at 1.2.3.4', 9999) is None
+
+
+def test_structured_fields_win_over_the_message():
+    assert ip_of('from 10.0.0.1', 4625, ip='203.0.113.9') == '203.0.113.9'
+    evt = normalize_event({'event_id': 4104, 'message': 'powershell -enc AAAA', 'ip': None, 'command': 'IEX x'})
+    assert evt['command'] == 'IEX x'
+    evt = normalize_event({'event_id': 4688, 'message': 'C:\\powershell.exe -nop', 'ip': None, 'command': None})
+    assert evt['command'] == 'C:\\powershell.exe -nop'
+
+
+def test_works_in_place_on_event_records_and_skips_empty_messages():
+    events = [Event(event_id=4625, message='Source Network Address: 10.0.0.9'), Event(event_id=1, message='')]
+    assert normalize_events(events) is events
+    assert events[0].ip == '10.0.0.9'
+    assert events[1].ip is None and events[1].command is None
@@ -0,0 +1,354 @@
+"""EVTX reader against synthetic files: header/chunk validation, templates, substitutions, corruption, pool parity."""
+import struct
+from datetime import datetime
+
+import pytest
+
+from app.core import evtx_reader
+from app.core.event import Event
+from app.core.event_parser import normalize_events
+from app.core.evtx_reader import (CHUNK_HEADER_SIZE, CHUNK_MAGIC, CHUNK_SIZE, FILE_HEADER_SIZE, FILE_MAGIC,
+                                  EvtxError, read_evtx)
+
+FILETIME_2024 = (int((datetime(2024, 5, 1, 10, 0, 0) - datetime(1601, 1, 1)).total_seconds()) * 10**7)
+
+
+class E:
+    """Element of a template: name, [(attribute name, node)], children."""
+
+    def __init__(self, name, attrs=(), children=()):
+        self.name, self.attrs, self.children = name, list(attrs), list(children)
+
+
+class S:
+    """Substitution slot."""
+
+    def __init__(self, index, optional=False):
+        self.index, self.optional = index, optional
+
+
+# Substitution values as (type, payload)
+def wstr(s):
+    return 0x01, (s + '\x00').encode('utf-16le')
+
+
+def u16(v):
+    return 0x06, struct.pack('<H', v)
+
+
+def u32(v):
+    return 0x08, struct.pack('<I', v)
+
+
+def u64(v):
+    return 0x0A, struct.pack('<Q', v)
+
+
+def filetime(v):
+    return 0x11, struct.pack('<Q', v)
+
+
+def sid(authority, *subs):
+    return 0x13, bytes([1, len(subs)]) + authority.to_bytes(6, 'big') + b''.join(struct.pack('<I', s) for s in subs)
+
+
+def guid():
+    return 0x0F, struct.pack('<IHH', 0x12345678, 0x9ABC, 0xDEF0) + bytes(range(8))
+
+
+def hexint64(v):
+    return 0x15, struct.pack('<Q', v)
+
+
+def boolean(v):
+    return 0x0D, struct.pack('<I', int(v))
+
+
+def null():
+    return 0x00, b''
+
+
+def binxml(root):
+    """Embedded BinXML value (written in place, since its names use chunk offsets)."""
+    return 0x21, root
+
+
+class ChunkBuilder:
+    """Writes one 64 KiB chunk: records with resident/shared templates and inline/shared names."""
+
+    def __init__(self):
+        self.buf = bytearray(CHUNK_HEADER_SIZE)
+        self.buf[:8] = CHUNK_MAGIC
+        self._names = {}
+        self._templates = {}
+        self.last_id = 0
+
+    def _named(self, prefix: bytes, name: str, suffix: bytes = b''):
+        off = self._names.get(name)
+        inline = off is None
+        if inline:
+            off = self._names[name] = len(self.buf) + len(prefix) + 4 + len(suffix)
+        self.buf += prefix + struct.pack('<I', off) + suffix
+        if inline:
+            self.buf += struct.pack('<IHH', 0, 0, len(name)) + name.encode('utf-16le') + b'\x00\x00'
+
+    def _node(self, node):
+        if isinstance(node, str):
+            self.buf += bytes([0x05, 0x01]) + struct.pack('<H', len(node)) + node.encode('utf-16le')
+        elif isinstance(node, S):
+            self.buf += bytes([0x0E if node.optional else 0x0D]) + struct.pack('<H', node.index) + b'\x01'
+        else:
+            flag = 0x40 if node.attrs else 0
+            self._named(bytes([0x01 | flag]) + struct.pack('<HI', 0xFFFF, 0), node.name,
+                        struct.pack('<I', 0) if node.attrs else b'')
+            for name, value in node.attrs:
+                self._named(b'\x06', name)
+                self._node(value)
+            if node.children:
+                self.buf += b'\x02'
+                for child in node.children:
+                    self._node(child)
+                self.buf += b'\x04'
+            else:
+                self.buf += b'\x03'
+
+    def _fragment(self, root):
+        self.buf += b'\x0f\x01\x01\x00'
+        self._node(root)
+        self.buf += b'\x00'
+
+    def _instance(self, key, root, values):
+        pos = len(self.buf)
+        off = self._templates.get(key)
+        resident = off is None
+        if resident:
+            off = self._templates[key] = pos + 10
+        self.buf += bytes([0x0C, 0x01]) + struct.pack('<II', 0, off)
+        if resident:
+            self.buf += struct.pack('<I', 0) + bytes(16) + struct.pack('<I', 0)
+            start = len(self.buf)
+            self._fragment(root)
+            struct.pack_into('<I', self.buf, off + 20, len(self.buf) - start)
+        self.buf += struct.pack('<I', len(values))
+        decls = len(self.buf)
+        self.buf += bytes(4 * len(values))
+        for i, (vtype, payload) in enumerate(values):
+            start = len(self.buf)
+            if vtype == 0x21:
+                self._fragment(payload)
+            else:
+                self.buf += payload
+            struct.pack_into('<HBB', self.buf, decls + 4 * i, len(self.buf) - start, vtype, 0)
+
+    def _record(self, record_id, body):
+        start = len(self.buf)
+        self.buf += struct.pack('<IIQQ', 0x2a2a, 0, record_id, FILETIME_2024)
+        body()
+        size = len(self.buf) - start + 4
+        self.buf += struct.pack('<I', size)
+        struct.pack_into('<I', self.buf, start + 4, size)
+        self.last_id = max(self.last_id, record_id)
+
+    def record(self, record_id, key, root, values):
+        """A record whose body is a single template instance."""
+        self._record(record_id, lambda: (self.buf.extend(b'\x0f\x01\x01\x00'), self._instance(key, root, values)))
+
+    def raw_record(self, record_id, body: bytes):
+        self._record(record_id, lambda: self.buf.extend(body))
+
+    def literal_record(self, record_id, root):
+        """A record written as plain BinXML, without a template."""
+        self._record(record_id, lambda: self._fragment(root))
+
+    def build(self) -> bytes:
+        struct.pack_into('<Q', self.buf, 32, self.last_id)
+        struct.pack_into('<I', self.buf, 48, len(self.buf))
+        assert len(self.buf) <= CHUNK_SIZE
+        return bytes(self.buf) + bytes(CHUNK_SIZE - len(self.buf))
+
+
+def write_evtx(path, chunks):
+    header = bytearray(FILE_HEADER_SIZE)
+    header[:8] = FILE_MAGIC
+    with open(path, 'wb') as f:
+        f.write(bytes(header))
+        for chunk in chunks:
+            f.write(chunk)
+    return str(path)
+
+
+def system(channel_sub=4):
+    return E('System', children=[
+        E('Provider', [('Name', S(0))]),
+        E('EventID', children=[S(1)]),
+        E('TimeCreated', [('SystemTime', S(2))]),
+        E('EventRecordID', children=[S(3)]),
+        E('Channel', children=[S(channel_sub)]),
+        E('Computer', children=[S(5)]),
+        E('Security', [('UserID', S(6, optional=True))]),
+    ])
+
+
+# 4625 with named <Data> items under the template itself
+LOGON = E('Event', children=[system(), E('EventData', children=[
+    E('Data', [('Name', 'TargetUserName')], [S(7)]),
+    E('Data', [('Name', 'IpAddress')], [S(8)]),
+    E('Data', [('Name', 'LogonType')], [S(9)]),
+    E('Data', [('Name', 'SubjectUserSid')], [S(10)]),
+])])
+
+# 4688 whose EventData arrives as an embedded BinXML substitution
+PROCESS = E('Event', children=[system(), S(7)])
+
+
+def system_values(event_id, record_id, channel='Security'):
+    return [wstr('Microsoft-Windows-Security-Auditing'), u16(event_id), filetime(FILETIME_2024 + record_id * 10**7),
+            u64(record_id), wstr(channel), wstr('WS01'), sid(5, 18)]
+
+
+def logon(builder, record_id, user, ip, logon_type=3):
+    builder.record(record_id, 'logon', LOGON, system_values(4625, record_id) + [
+        wstr(user), wstr(ip), u32(logon_type), sid(5, 21, 1000, 2000, 3000, 500)])
+
+
+def process(builder, record_id, command):
+    data = E('EventData', children=[
+        E('Data', [('Name', 'SubjectUserName')], ['alice']),
+        E('Data', [('Name', 'NewProcessName')], ['C:\\Windows\\System32\\cmd.exe']),
+        E('Data', [('Name', 'CommandLine')], [command]),
+    ])
+    builder.record(record_id, 'process', PROCESS, system_values(4688, record_id) + [binxml(data)])
+
+
+def security_chunk(first_id, count):
+    b = ChunkBuilder()
+    for i in range(count):
+        rid = first_id + i
+        if i % 3 == 2:
+            process(b, rid, f'cmd.exe /c whoami {rid}')
+        else:
+            logon(b, rid, f'user{rid}', f'10.0.{rid // 256}.{rid % 256}')
+    return b.build()
+
+
+@pytest.fixture
+def sample(tmp_path):
+    return write_evtx(tmp_path / 'Security.evtx', [security_chunk(1, 6), security_chunk(7, 6)])
+
+
+def test_rejects_bad_magic_and_short_files(tmp_path):
+    short = tmp_path / 'short.evtx'
+    short.write_bytes(FILE_MAGIC + bytes(100))
+    with pytest.raises(EvtxError):
+        list(read_evtx(str(short)))
+    bad = tmp_path / 'bad.evtx'
+    bad.write_bytes(b'NotEvtx\x00' + bytes(FILE_HEADER_SIZE + CHUNK_SIZE))
+    with pytest.raises(EvtxError):
+        list(read_evtx(str(bad)))
+
+
+def test_template_records_decode_to_event_dicts(sample):
+    events = list(read_evtx(sample))
+    assert [e['record_id'] for e in events] == list(range(1, 13))
+
+    first = events[0]
+    assert first['event_id'] == 4625
+    assert first['channel'] == 'Security'
+    assert first['computer'] == 'WS01'
+    assert first['timestamp'] == '2024-05-01T10:00:01'
+    assert first['user'] == 'user1'
+    assert first['ip'] == '10.0.0.1'
+    # Field-map keys match what the live collector extracts
+    assert first['target_user'] == 'user1'
+    assert first['logon_type'] == 3
+    assert 'user1' in first['message'] and 'S-1-5-21-1000-2000-3000-500' in first['message']
+
+    proc = events[2]
+    assert proc['event_id'] == 4688
+    assert proc['command'] == 'cmd.exe /c whoami 3'
+    assert proc['process_name'] == 'C:\\Windows\\System32\\cmd.exe'
+    assert proc['user'] == 'alice'
+
+
+def test_events_pass_through_normalize(sample):
+    events = normalize_events([Event.from_dict(e) for e in read_evtx(sample)])
+    assert events[0]['ip'] == '10.0.0.1'
+    assert events[2]['ip'] is None  # 4688 message has no address
+    assert events[2]['command'] == 'cmd.exe /c whoami 3'
+
+
+def test_substitution_types(tmp_path):
+    root = E('Event', children=[system(), E('EventData', children=[
+        E('Data', [('Name', name)], [S(7 + i)]) for i, name in enumerate(
+            ('Guid', 'Flags', 'Elevated', 'Missing', 'Sid', 'When', 'Ansi'))
+    ])])
+    b = ChunkBuilder()
+    b.record(1, 'types', root, system_values(4000, 1, channel='Application') + [
+        guid(), hexint64(0x1F), boolean(True), null(), sid(5, 32, 544), filetime(FILETIME_2024),
+        (0x02, b'ascii\x00')])
+    evt = list(read_evtx(write_evtx(tmp_path / 'types.evtx', [b.build()])))[0]
+    assert evt['channel'] == 'Application'
+    parts = evt['message'].split(' ')
+    assert parts == ['{12345678-9ABC-DEF0-0001-020304050607}', '0x1f', 'true', 'S-1-5-32-544',
+                     '2024-05-01T10:00:00', 'ascii']
+
+
+def test_literal_record_without_template(tmp_path):
+    b = ChunkBuilder()
+    b.literal_record(1, E('Event', children=[
+        E('System', children=[E('EventID', children=['4104']), E('Channel', children=['Microsoft-Windows-PowerShell/Operational'])]),
+        E('EventData', children=[E('Data', [('Name', 'ScriptBlockText')], ['IEX (New-Object Net.WebClient)'])]),
+    ]))
+    evt = list(read_evtx(write_evtx(tmp_path / 'ps.evtx', [b.build()])))[0]
+    assert evt['event_id'] == 4104
+    assert evt['command'] == 'IEX (New-Object Net.WebClient)'
+    assert evt['timestamp'] == '2024-05-01T10:00:00'  # falls back to the record's written time
+
+
+def test_corrupt_records_and_chunks_are_skipped(tmp_path):
+    b = ChunkBuilder()
+    logon(b, 1, 'alice', '10.0.0.1')
+    # An element followed by a value token where attributes/close are expected
+    b.raw_record(2, b'\x0f\x01\x01\x00\x01\xff\xff\x00\x00\x00\x00' + struct.pack('<I', len(b.buf) + 24 + 15)
+                 + struct.pack('<IHH', 0, 0, 1) + 'X'.encode('utf-16le') + b'\x00\x00\x05\x01\x00\x00')
+    logon(b, 3, 'bob', '10.0.0.2')
+    good = b.build()
+
+    broken = bytearray(security_chunk(4, 3))
+    broken[:8] = b'garbage!'
+    path = write_evtx(tmp_path / 'corrupt.evtx', [good, bytes(broken), security_chunk(7, 3)])
+    assert [e['record_id'] for e in read_evtx(path)] == [1, 3, 7, 8, 9]
+
+
+def test_after_record_id_skips_whole_chunks(sample):
+    assert [e['record_id'] for e in read_evtx(sample, after_record_id=8)] == [9, 10, 11, 12]
+    assert list(read_evtx(sample, after_record_id=12)) == []
+
+
+def test_pool_output_matches_single_process(tmp_path):
+    path = write_evtx(tmp_path / 'big.evtx', [security_chunk(1 + 20 * i, 20) for i in range(6)])
+    single = list(read_evtx(path, workers=1))
+    pooled = list(read_evtx(path, workers=2))
+    assert len(single) == 120
+    assert pooled == single
+    assert list(read_evtx(path, workers=2, after_record_id=50)) == single[50:]
+
+
+def test_worker_init_maps_without_keeping_the_file_open(tmp_path, monkeypatch):
+    path = write_evtx(tmp_path / 'one.evtx', [security_chunk(1, 3)])
+    opened = []
+    real_open = open
+
+    def tracking_open(*args, **kwargs):
+        f = real_open(*args, **kwargs)
+        opened.append(f)
+        return f
+
+    monkeypatch.setattr('builtins.open', tracking_open)
+    monkeypatch.setattr(evtx_reader, '_worker_mm', None)
+    evtx_reader._worker_init(path)
+    try:
+        assert opened and all(f.closed for f in opened)
+        assert [e['record_id'] for e in evtx_reader._worker_parse(FILE_HEADER_SIZE)] == [1, 2, 3]
+    finally:
+        evtx_reader._worker_mm.close()
@@ -0,0 +1,136 @@
+"""NDJSON feed: rollover, rotation, reader offsets and recovery from torn writes."""
+import os
+
+import pytest
+
+from app.core.feed import EventFeed, FeedReader, read_index
+
+
+def event(i):
+    return {'timestamp': f'2024-05-01T10:{i // 60:02d}:{i % 60:02d}', 'channel': 'Security', 'event_id': 4625,
+            'user': f'user{i}', 'ip': '10.0.0.5'}
+
+
+def drain(reader, offset=0, max_records=1000):
+    ids, at_end = [], False
+    while not at_end:
+        events, offset, at_end = reader.read(offset, max_records)
+        ids += [int(e['user'][4:]) for e in events]
+    return ids, offset
+
+
+@pytest.fixture
+def feed(tmp_path):
+    feed = EventFeed(str(tmp_path), segment_mb=600 / 2**20)  # about six events per segment
+    yield feed
+    feed.close()
+
+
+def test_rollover_seals_segments_with_contiguous_offsets(feed, tmp_path):
+    for i in range(0, 30, 3):
+        feed.append([event(i), event(i + 1), event(i + 2)])
+    segments = read_index(str(tmp_path))
+    assert len(segments) > 2
+    assert all(s['sealed'] for s in segments[:-1]) and not segments[-1]['sealed']
+    for prev, seg in zip(segments, segments[1:]):
+        assert seg['base'] == prev['base'] + prev['bytes']
+    assert sum(s['records'] for s in segments) == 30
+    assert feed.stats()['end_offset'] == segments[-1]['base'] + segments[-1]['bytes']
+
+
+def test_reader_follows_rollovers_and_resumes_from_its_offset(feed, tmp_path):
+    reader = FeedReader(str(tmp_path))
+    for i in range(10):
+        feed.append([event(i)])
+    ids, offset = drain(reader, max_records=4)
+    assert ids == list(range(10))
+    assert offset == feed.stats()['end_offset']
+    for i in range(10, 25):
+        feed.append([event(i)])
+    assert drain(reader, offset)[0] == list(range(10, 25))
+
+
+def test_reader_leaves_a_line_being_written(feed, tmp_path):
+    feed.append([event(0)])
+    reader = FeedReader(str(tmp_path))
+    seg = read_index(str(tmp_path))[-1]
+    with open(os.path.join(str(tmp_path), seg['name']), 'ab') as f:
+        f.write(b'{"user":"user1"')  # no newline yet
+    events, offset, at_end = reader.read(0)
+    assert [e['user'] for e in events] == ['user0'] and at_end
+    assert offset == seg['bytes']
+
+
+def test_rotated_offset_resumes_at_oldest_segment(tmp_path):
+    feed = EventFeed(str(tmp_path), segment_mb=100 / 2**20, keep_segments=2)
+    for i in range(10):
+        feed.append([event(i)])
+    feed.close()
+    segments = read_index(str(tmp_path))
+    assert len(segments) == 2 and segments[0]['base'] > 0
+    ids, _ = drain(FeedReader(str(tmp_path)), 0)
+    assert ids == [8, 9]
+
+
+def test_offset_for_time_skips_older_segments(feed, tmp_path):
+    for i in range(20):
+        feed.append([event(i)])
+    reader = FeedReader(str(tmp_path))
+    ids, _ = drain(reader, reader.offset_for_time('2024-05-01T10:00:15'))
+    assert ids[0] <= 15 and ids[-1] == 19 and ids[0] > 0
+
+
+def test_restart_truncates_torn_last_line(tmp_path):
+    feed = EventFeed(str(tmp_path))
+    feed.append([event(0), event(1)])
+    feed.close()
+    seg = read_index(str(tmp_path))[-1]
+    path = os.path.join(str(tmp_path), seg['name'])
+    with open(path, 'ab') as f:
+        f.write(b'{"user":"us')  # crash mid-write
+    feed = EventFeed(str(tmp_path))
+    assert os.path.getsize(path) == seg['bytes']
+    feed.append([event(2)])
+    feed.close()
+    assert drain(FeedReader(str(tmp_path)))[0] == [0, 1, 2]
+
+
+class TornFile:
+    """Writes part of a batch, lets a reader run, then fails like a full disk."""
+
+    def __init__(self, f, keep, reader):
+        self.f, self.keep, self.reader = f, keep, reader
+        self.seen = None
+
+    def write(self, data):
+        self.f.write(data[:self.keep(data)])
+        self.f.flush()
+        self.seen = self.reader.read(0)
+        raise OSError(28, 'No space left on device')
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def test_failed_write_seals_after_last_complete_line(feed, tmp_path):
+    reader = FeedReader(str(tmp_path))
+    feed.append([event(0), event(1)])
+    # two complete lines of the next batch and part of a third reach the file
+    torn = TornFile(feed._file, lambda data: data.index(b'\n', data.index(b'\n') + 1) + 5, reader)
+    feed._file = torn
+    with pytest.raises(OSError):
+        feed.append([event(2), event(3), event(4)])
+
+    events, offset, _ = torn.seen
+    assert [e['user'] for e in events] == ['user0', 'user1', 'user2', 'user3']
+    seg = read_index(str(tmp_path))[-1]
+    assert seg['sealed'] and seg['records'] == 4
+    assert offset == seg['base'] + seg['bytes']  # the reader's offset is still a line boundary
+    assert os.path.getsize(os.path.join(str(tmp_path), seg['name'])) == seg['bytes']
+
+    feed.append([event(5)])
+    assert drain(reader, offset)[0] == [5]
+    assert drain(reader)[0] == [0, 1, 2, 3, 5]
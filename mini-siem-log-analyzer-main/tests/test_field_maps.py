@@ -0,0 +1,74 @@
+"""Positional (``extract_fields``) and named (``extract_named``) EventData extraction."""
+from app.core.field_maps import FIELD_MAPS, extract_fields, extract_named
+
+
+def inserts(event_id, **values):
+    """StringInserts for ``event_id`` with the named fields set and '-' everywhere else."""
+    layout = FIELD_MAPS[event_id]
+    out = ['-'] * len(layout)
+    for name, value in values.items():
+        out[layout[name]] = value
+    return out
+
+
+LOGON = dict(SubjectUserSid='S-1-5-18', SubjectUserName='WS01$', TargetUserName='alice', TargetDomainName='CORP',
+             LogonType='10', IpAddress='203.0.113.9', IpPort='50123', WorkstationName='WS01')
+
+
+def test_4624_takes_the_target_account_not_the_subject():
+    fields = extract_fields(4624, inserts(4624, **LOGON))
+    assert fields['user'] == 'alice'
+    assert fields['target_user'] == 'alice' and fields['subject_user'] == 'WS01$'
+    assert fields['ip'] == '203.0.113.9'
+    assert fields['logon_type'] == 10 and isinstance(fields['logon_type'], int)
+    assert fields['ip_port'] == 50123
+    assert fields['workstation'] == 'WS01'
+    assert 'S-1-5-18' not in fields.values()
+
+
+def test_4625_cleans_placeholders_and_keeps_status():
+    values = dict(TargetUserName='admin', LogonType='3', IpAddress='-', IpPort='-', Status='0xc000006d',
+                  SubStatus='0xc000006a')
+    fields = extract_fields(4625, inserts(4625, **values))
+    assert fields['user'] == 'admin'
+    assert 'ip' not in fields and 'ip_port' not in fields  # '-' means no address
+    assert fields['logon_type'] == 3
+    assert fields['status'] == '0xc000006d' and fields['sub_status'] == '0xc000006a'
+
+    mapped = extract_fields(4625, inserts(4625, TargetUserName='admin', IpAddress='::ffff:10.0.0.5'))
+    assert mapped['ip'] == '10.0.0.5'
+    junk = extract_fields(4625, inserts(4625, TargetUserName='admin', IpAddress='not-an-ip', LogonType='n/a'))
+    assert 'ip' not in junk and 'logon_type' not in junk
+
+
+def test_4688_user_is_the_subject_and_command_line_is_kept():
+    values = dict(SubjectUserSid='S-1-5-21-1', SubjectUserName='bob', TargetUserName='-',
+                  NewProcessName='C:\\Windows\\System32\\cmd.exe', CommandLine='cmd.exe /c whoami',
+                  ParentProcessName='C:\\Windows\\explorer.exe')
+    fields = extract_fields(4688, inserts(4688, **values))
+    assert fields['user'] == 'bob'
+    assert 'target_user' not in fields
+    assert fields['command'] == 'cmd.exe /c whoami'
+    assert fields['process_name'] == 'C:\\Windows\\System32\\cmd.exe'
+    assert fields['parent_process'] == 'C:\\Windows\\explorer.exe'
+
+
+def test_4104_has_no_user_and_takes_the_script_block():
+    fields = extract_fields(4104, ['1', '1', 'IEX (New-Object Net.WebClient).DownloadString("x")', '{guid}', ''])
+    assert fields == {'command': 'IEX (New-Object Net.WebClient).DownloadString("x")'}
+
+
+def test_short_missing_and_unmapped_inserts():
+    assert extract_fields(4625, inserts(4625, TargetUserName='admin')[:7]) == {'user': 'admin', 'target_user': 'admin'}
+    assert extract_fields(4625, None) == {}
+    assert extract_fields(4625, []) == {}
+    assert extract_fields(7036, ['Service', 'running']) == {}
+
+
+def test_extract_named_matches_positional_extraction():
+    for event_id, values in ((4624, LOGON), (4625, dict(LOGON, IpAddress='-')),
+                             (4688, dict(SubjectUserName='bob', CommandLine='cmd.exe /c dir'))):
+        assert extract_named(event_id, values) == extract_fields(event_id, inserts(event_id, **values))
+    assert extract_named(4104, {'ScriptBlockText': 'Get-Process'}) == {'command': 'Get-Process'}
+    assert extract_named(4625, {}) == {}
+    assert extract_named(7036, {'param1': 'x'}) == {}
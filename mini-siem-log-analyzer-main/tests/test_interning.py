@@ -0,0 +1,90 @@
+"""Interned message/command text: read back through events_v, the dashboard and search; cache hits and misses."""
+import sqlite3
+
+import pytest
+
+from app.core import interning
+from app.core.db import Database
+from app.dashboard import dashboard
+
+LONG = 'C:\\Windows\\System32\\svchost.exe -k netsvcs -p -s ' + 'x' * 600
+
+
+def event(ts, message, command=None):
+    return {'timestamp': ts, 'channel': 'System', 'event_id': 7036, 'user': None, 'ip': None, 'command': command,
+            'message': message}
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'siem.db'), flush_interval_ms=10, spool_max_mb=0)
+    yield db
+    db.close()
+
+
+def partition_rows(db, name, sql):
+    conn = sqlite3.connect(db.partitions.path(name))
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def test_interned_text_reads_back_everywhere(db, monkeypatch):
+    db.insert_events([event('2024-05-01T10:00:00', 'Service entered the running state', LONG),
+                      event('2024-05-01T10:00:01', 'Service entered the running state', LONG),
+                      event('2024-05-01T10:00:02', 'Service entered the stopped state'),
+                      event('2024-05-01T10:00:03', 'naïve ünïcode ✓', LONG)])
+    db.flush()
+    assert partition_rows(db, 'events_20240501', "SELECT count(*) FROM strings") == [(4,)]
+    assert partition_rows(db, 'events_20240501', "SELECT message, command FROM events") == [(None, None)] * 4
+    view = partition_rows(db, 'events_20240501', "SELECT message, command FROM events_v ORDER BY id")
+    assert view == [('Service entered the running state', LONG), ('Service entered the running state', LONG),
+                    ('Service entered the stopped state', None), ('naïve ünïcode ✓', LONG)]
+
+    assert [(r['message'], r['command']) for r in db.query()] == view[::-1]
+    assert [r['message'] for r in db.search('stopped')['results']] == ['Service entered the stopped state']
+    assert [r['command'] for r in db.search('netsvcs')['results']] == [LONG] * 3
+
+    monkeypatch.setattr(dashboard, '_stores', (db.path, db.partitions, db.archive))
+    client = dashboard.app.test_client()
+    assert [r['command'] for r in client.get('/api/events').get_json()] == [LONG, None, LONG, LONG]
+    found = client.get('/api/search', query_string={'q': 'running state'}).get_json()['results']
+    assert [r['message'] for r in found] == ['Service entered the running state'] * 2
+
+
+def test_cache_hits_misses_and_evictions(tmp_path):
+    db = Database(str(tmp_path / 'siem.db'), flush_interval_ms=10, spool_max_mb=0, intern_cache_kb=1)
+    try:
+        db.insert_events([event('2024-05-01T10:00:00', 'a'), event('2024-05-01T10:00:01', 'a'),
+                          event('2024-05-01T10:00:02', 'b', 'a')])
+        db.flush()
+        assert db.stats()['interning'] == {'hits': 2, 'misses': 2, 'inserted': 2, 'cached': 2}
+
+        # Same text in another partition: that database gets its own copy
+        db.insert_events([event('2024-05-02T10:00:00', 'a')])
+        db.flush()
+        assert db.stats()['interning'] == {'hits': 2, 'misses': 3, 'inserted': 3, 'cached': 3}
+
+        # A 1 KiB cache holds one long string at a time: the evicted one is found again by hash, not re-inserted
+        db.insert_events([event('2024-05-02T10:00:01', LONG), event('2024-05-02T10:00:02', LONG + 'y'),
+                          event('2024-05-02T10:00:03', LONG)])
+        db.flush()
+        stats = db.stats()['interning']
+        assert (stats['hits'], stats['misses'], stats['inserted']) == (2, 6, 5)
+        assert partition_rows(db, 'events_20240502', "SELECT count(*) FROM strings") == [(3,)]
+        assert [r['message'] for r in db.query(('2024-05-02T10:00:01', None))] == [LONG, LONG + 'y', LONG]
+    finally:
+        db.close()
+
+
+def test_hash_collisions_keep_texts_apart(db, monkeypatch):
+    monkeypatch.setattr(interning, 'text_hash', lambda text: 42)
+    db.insert_events([event('2024-05-01T10:00:00', 'first'), event('2024-05-01T10:00:01', 'second')])
+    db.flush()
+    db._interner.forget()  # the next batch has to look both up by their (shared) hash
+    db.insert_events([event('2024-05-01T10:00:02', 'second'), event('2024-05-01T10:00:03', 'first')])
+    db.flush()
+    assert partition_rows(db, 'events_20240501', "SELECT hash, text FROM strings ORDER BY id") == \
+        [(42, 'first'), (42, 'second')]
+    assert [r['message'] for r in db.query()] == ['first', 'second', 'second', 'first']
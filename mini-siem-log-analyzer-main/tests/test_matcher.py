@@ -0,0 +1,72 @@
+"""PatternMatcher against plain substring checks: overlaps, suffixes, case and the three matching paths."""
+import random
+
+import pytest
+
+from app.detectors import matcher
+from app.detectors.matcher import PatternMatcher
+
+
+def expected(categories, text):
+    """What ``find`` must return, by ``pattern.lower() in text.lower()``."""
+    out = {}
+    for category, patterns in categories.items():
+        for p in patterns:
+            if p and p.lower() in text.lower() and p not in out.get(category, []):
+                out.setdefault(category, []).append(p)
+    return out
+
+
+def as_sets(found):
+    return {c: sorted(p) for c, p in found.items()}
+
+
+def check(m, categories, text):
+    found = m.find(text)
+    assert all(len(p) == len(set(p)) for p in found.values()), text  # each pattern listed once
+    assert as_sets(found) == as_sets(expected(categories, text)), text
+
+
+def test_overlapping_and_suffix_patterns():
+    categories = {'words': ['he', 'she', 'his', 'hers', 'e'], 'other': ['HERS', 'rs', 'ushers'], 'empty': ['']}
+    m = PatternMatcher(categories, use_c=False, linear_max=0)
+    assert m._linear is None and m._automaton is None  # the pure-Python automaton
+    assert len(m) == 7  # 'HERS' shares a key with 'hers'; '' is dropped
+    assert as_sets(m.find('uSHErs')) == {'words': ['e', 'he', 'hers', 'she'], 'other': ['HERS', 'rs', 'ushers']}
+    # In the order they end in the text, longest first where several end together
+    assert m.find('ahishers')['words'] == ['his', 'she', 'he', 'e', 'hers']
+    assert m.find('') == {} and m.find(None) == {} and m.find('xyz') == {}
+    assert PatternMatcher({}, use_c=False, linear_max=0).find('anything') == {}
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_automaton_matches_substring_search(seed):
+    rnd = random.Random(seed)
+    alphabet = 'abAB.-\\' if seed % 2 else 'aab'  # few letters: lots of shared prefixes, suffixes and overlaps
+
+    def word(lo, hi):
+        return ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(lo, hi)))
+
+    categories = {f'c{i}': [word(1, 6) for _ in range(rnd.randint(1, 30))] for i in range(3)}
+    # Suffixes and prefixes of other patterns, in other categories and cases
+    every = [p for ps in categories.values() for p in ps]
+    categories['derived'] = [p[rnd.randrange(len(p)):].upper() for p in rnd.sample(every, 10)] + \
+                            [p[:rnd.randint(1, len(p))] for p in rnd.sample(every, 10)]
+    automaton = PatternMatcher(categories, use_c=False, linear_max=0)
+    linear = PatternMatcher(categories, use_c=False, linear_max=10 ** 6)
+    assert automaton._linear is None and linear._linear is not None
+    for _ in range(50):
+        text = word(0, 40) if rnd.random() < 0.5 else word(0, 5).join(rnd.sample(every, 3)).swapcase()
+        check(automaton, categories, text)
+        check(linear, categories, text)
+
+
+@pytest.mark.skipif(matcher.ahocorasick is None, reason="pyahocorasick not installed")
+def test_c_automaton_agrees_with_the_python_one():
+    rnd = random.Random(1)
+    categories = {'a': ['mimikatz', 'katz', 'mimi', 'z'], 'b': ['IEX', 'iex (', 'x (n']}
+    c = PatternMatcher(categories)
+    assert c._automaton is not None
+    for text in ['MimiKatz.exe', 'iex (new-object', 'powershell -c IEX (New-Object Net.WebClient)',
+                 ''.join(rnd.choice('mikatzex (n') for _ in range(200))]:
+        check(c, categories, text)
@@ -0,0 +1,148 @@
+"""Schema migrations on a pre-migration database, the resumable ts_us backfill and timestamp conversion."""
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from app.core.db import Database, open_readonly
+from app.core.migrations import (MAIN_MIGRATIONS, Backfill, from_epoch_us, get_meta, main_backfills, run_migrations,
+                                 to_epoch_us)
+
+# The tables as the first release created them, before user_version was used
+BASELINE_SQL = """
+    CREATE TABLE events (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, channel TEXT, event_id INTEGER,
+                         user TEXT, ip TEXT, command TEXT, message TEXT);
+    CREATE TABLE alerts (id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TEXT, severity TEXT, title TEXT,
+                         description TEXT);
+"""
+
+MAY_1 = int(datetime(2024, 5, 1, tzinfo=timezone.utc).timestamp()) * 1_000_000
+
+
+def baseline(path, count=12):
+    conn = sqlite3.connect(str(path), isolation_level=None)
+    conn.executescript(BASELINE_SQL)
+    conn.executemany("INSERT INTO events(timestamp, channel, event_id, user, ip, command, message) "
+                     "VALUES(?, 'Security', 4625, 'admin', '10.0.0.5', NULL, 'failure')",
+                     [(f'2024-05-01T00:00:{i:02d}',) for i in range(count)])
+    conn.execute("INSERT INTO alerts(created_at, severity, title, description) "
+                 "VALUES('2024-05-01T00:01:00Z', 'high', 'Brute force', 'x')")
+    return conn
+
+
+def test_to_epoch_us_reads_naive_timestamps_as_utc():
+    assert to_epoch_us('2024-05-01T00:00:00') == MAY_1
+    assert to_epoch_us('2024-05-01T00:00:00Z') == MAY_1
+    assert to_epoch_us('2024-05-01T00:00:00+00:00') == MAY_1
+    assert to_epoch_us('2024-05-01T02:00:00+02:00') == MAY_1
+    assert to_epoch_us(datetime(2024, 5, 1)) == MAY_1
+    assert to_epoch_us('2024-05-01T00:00:00.000250') == MAY_1 + 250
+    assert to_epoch_us('1969-12-31T23:59:59') == -1_000_000
+    assert to_epoch_us('yesterday') is None and to_epoch_us('') is None and to_epoch_us(None) is None
+    assert from_epoch_us(MAY_1 + 250) == '2024-05-01T00:00:00.000250'
+
+
+def test_migrations_upgrade_a_baseline_database(tmp_path):
+    conn = baseline(tmp_path / 'siem.db')
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+
+    assert run_migrations(conn, MAIN_MIGRATIONS) == MAIN_MIGRATIONS[-1][0]
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == MAIN_MIGRATIONS[-1][0]
+    indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert {'idx_events_ts', 'idx_events_event_id_ts', 'idx_events_ip_ts', 'idx_events_user_ts', 'idx_alerts_created',
+            'idx_alerts_severity_created'} <= indexes
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT id FROM events WHERE ip = ? AND ts_us > ?",
+                        ('10.0.0.5', 0)).fetchall()
+    assert any('idx_events_ip_ts' in row[-1] for row in plan)
+    # Old rows keep their data; the new columns wait for the backfill
+    assert conn.execute("SELECT count(*) FROM events WHERE ts_us IS NULL").fetchone()[0] == 12
+    assert [b.name for b in main_backfills() if b.pending(conn)] == ['events.ts_us', 'alerts.created_us']
+    # Running again is a no-op
+    assert run_migrations(conn, MAIN_MIGRATIONS) == MAIN_MIGRATIONS[-1][0]
+    conn.close()
+
+
+def test_failed_migration_rolls_back_and_resumes_at_that_step(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'x.db'), isolation_level=None)
+
+    def broken(c):
+        c.execute("CREATE TABLE half_done (x)")
+        raise RuntimeError("power cut")
+
+    steps = [(1, "one", "CREATE TABLE one (x)"), (2, "two", broken), (3, "three", "CREATE TABLE three (x)")]
+    with pytest.raises(RuntimeError):
+        run_migrations(conn, steps)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 1
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    assert tables == {'one'}
+
+    steps[1] = (2, "two", "CREATE TABLE two (x)")
+    assert run_migrations(conn, steps) == 3
+    conn.close()
+
+
+def test_backfill_interrupted_midway_resumes_from_its_cursor(tmp_path):
+    conn = baseline(tmp_path / 'siem.db')
+    run_migrations(conn, MAIN_MIGRATIONS)
+
+    first = Backfill('events.ts_us', 'events', 'timestamp', 'ts_us', to_epoch_us, chunk=5)
+    assert first.step(conn) is True
+    assert get_meta(conn, 'backfill:events.ts_us') == '5'
+
+    # The next chunk dies half way through: nothing of it is kept, the cursor stays put
+    calls = []
+
+    def dying(value):
+        calls.append(value)
+        if len(calls) == 3:
+            raise OSError("disk went away")
+        return to_epoch_us(value)
+
+    with pytest.raises(OSError):
+        Backfill('events.ts_us', 'events', 'timestamp', 'ts_us', dying, chunk=5).step(conn)
+    assert get_meta(conn, 'backfill:events.ts_us') == '5'
+    assert conn.execute("SELECT count(*) FROM events WHERE ts_us IS NOT NULL").fetchone()[0] == 5
+
+    # A fresh job (as after a restart) continues from the stored cursor
+    resumed = Backfill('events.ts_us', 'events', 'timestamp', 'ts_us', to_epoch_us, chunk=5)
+    assert resumed.pending(conn)
+    while resumed.step(conn):
+        pass
+    assert resumed.rows == 7
+    assert get_meta(conn, 'backfill:events.ts_us') == 'done'
+    assert not resumed.pending(conn)
+    rows = conn.execute("SELECT id, ts_us FROM events ORDER BY id").fetchall()
+    assert [us for _, us in rows] == [MAY_1 + i * 1_000_000 for i in range(12)]
+    conn.close()
+
+
+def test_database_upgrades_and_backfills_an_old_file(tmp_path):
+    path = tmp_path / 'siem.db'
+    baseline(path).close()
+    db = Database(str(path), partition='none', spool_max_mb=0)
+    try:
+        deadline = time.monotonic() + 5
+        while db.stats()['backfills_pending'] and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert db.stats()['backfills_pending'] == []
+    finally:
+        db.close()
+    conn = open_readonly(str(path))
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == MAIN_MIGRATIONS[-1][0]
+        assert [r[0] for r in conn.execute("SELECT ts_us FROM events ORDER BY id")] == \
+            [MAY_1 + i * 1_000_000 for i in range(12)]
+        assert conn.execute("SELECT created_us FROM alerts").fetchone()[0] == MAY_1 + 60_000_000
+        # Pre-interning rows are still readable through the view
+        assert conn.execute("SELECT DISTINCT message FROM events_v").fetchall() == [('failure',)]
+        assert get_meta(conn, 'backfill:events.ts_us') == 'done'
+    finally:
+        conn.close()
+
+
+def test_migration_log_names_each_step(tmp_path, caplog):
+    conn = baseline(tmp_path / 'siem.db')
+    run_migrations(conn, MAIN_MIGRATIONS[:4])
+    assert "Applied main migration v4: hunt indexes" in caplog.text
+    conn.close()
@@ -0,0 +1,133 @@
+"""Time partitions: naming, routing, newest-first fan-out, range pruning and retention."""
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core import partitions as partitions_module
+from app.core.db import Database
+from app.core.migrations import to_epoch_us
+from app.core.partitions import PartitionSet, group_rows, partition_bounds, partition_name, query_events
+
+
+def event(ts, i=0, **fields):
+    return dict({'timestamp': ts, 'channel': 'Security', 'event_id': 4625, 'user': f'user{i}', 'ip': '10.0.0.5',
+                 'command': None, 'message': f'failure {i}'}, **fields)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'siem.db'), flush_interval_ms=10, spool_max_mb=0)
+    yield db
+    db.close()
+
+
+def fill(db, days=('2024-05-01', '2024-05-02', '2024-05-03'), per_day=4):
+    for d, day in enumerate(days):
+        db.insert_events([event(f'{day}T{h:02d}:00:00', d * per_day + h) for h in range(per_day)])
+    db.flush()
+
+
+def opened(monkeypatch):
+    """Record which database files ``query_events`` reads."""
+    paths = []
+    real = partitions_module._select
+
+    def spy(path, where, params, limit):
+        paths.append(path.replace('\\', '/').rsplit('/', 1)[-1])
+        return real(path, where, params, limit)
+
+    monkeypatch.setattr(partitions_module, '_select', spy)
+    return paths
+
+
+def test_names_and_bounds():
+    us = to_epoch_us('2024-05-01T13:45:00')
+    assert partition_name(us) == 'events_20240501'
+    assert partition_name(us, 'hour') == 'events_2024050113'
+    assert partition_bounds('events_20240501') == (to_epoch_us('2024-05-01T00:00:00'), to_epoch_us('2024-05-02T00:00:00'))
+    assert partition_bounds('events_2024050113') == (to_epoch_us('2024-05-01T13:00:00'), to_epoch_us('2024-05-01T14:00:00'))
+    assert partition_bounds('events_20241301') is None
+    assert partition_bounds('alerts') is None
+    with pytest.raises(ValueError):
+        PartitionSet('/tmp/unused', 'week')
+
+
+def test_group_rows_routes_by_timestamp(tmp_path):
+    ps = PartitionSet(str(tmp_path), 'day')
+    rows = [('a', to_epoch_us('2024-05-01T23:59:59')), ('b', to_epoch_us('2024-05-02T00:00:00')),
+            ('c', to_epoch_us('2024-05-01T00:00:00')), ('d', None)]
+    groups = {name: ([r[0] for r in batch], items) for name, batch, items in group_rows(rows, ps, ['A', 'B', 'C', 'D'])}
+    assert groups['events_20240501'] == (['a', 'c'], ['A', 'C'])
+    assert groups['events_20240502'] == (['b'], ['B'])
+    assert ps.name_for(int(time.time() * 1_000_000)) in groups  # no time: the current partition
+
+
+def test_fan_out_is_newest_first_and_stops_early(db, monkeypatch):
+    fill(db)
+    assert [p[0] for p in db.partitions.list()] == ['events_20240501', 'events_20240502', 'events_20240503']
+
+    paths = opened(monkeypatch)
+    rows = query_events(db.path, db.partitions, limit=3)
+    assert [r['timestamp'] for r in rows] == ['2024-05-03T03:00:00', '2024-05-03T02:00:00', '2024-05-03T01:00:00']
+    # The newest partition filled the limit, and the next one ends before its oldest row
+    assert paths == ['events_20240503.db', 'siem.db']
+
+    paths.clear()
+    rows = query_events(db.path, db.partitions, limit=6)
+    assert [r['timestamp'][:13] for r in rows] == ['2024-05-03T03', '2024-05-03T02', '2024-05-03T01', '2024-05-03T00',
+                                                   '2024-05-02T03', '2024-05-02T02']
+    assert paths == ['events_20240503.db', 'events_20240502.db', 'siem.db']
+
+
+def test_time_range_prunes_partitions(db, monkeypatch):
+    fill(db)
+    paths = opened(monkeypatch)
+    rows = query_events(db.path, db.partitions, ('2024-05-02T01:00:00', '2024-05-02T03:00:00'))
+    assert [r['timestamp'] for r in rows] == ['2024-05-02T02:00:00', '2024-05-02T01:00:00']
+    assert paths == ['events_20240502.db', 'siem.db']
+
+    rows = query_events(db.path, db.partitions, ('2024-05-02T03:00:00', None), filters={'user': ['user7', 'user9']})
+    assert [r['user'] for r in rows] == ['user9', 'user7']
+    with pytest.raises(ValueError):
+        query_events(db.path, db.partitions, filters={'message': 'x'})
+
+
+def test_legacy_main_rows_merge_by_time(db):
+    fill(db)
+    conn = sqlite3.connect(db.path)
+    conn.execute("INSERT INTO events(timestamp, ts_us, channel, event_id, user, message) VALUES(?, ?, 'Security', "
+                 "4625, 'legacy', 'from before partitioning')",
+                 ('2024-05-02T12:00:00', to_epoch_us('2024-05-02T12:00:00')))
+    conn.commit()
+    conn.close()
+    rows = query_events(db.path, db.partitions, limit=6)
+    assert [r['user'] for r in rows] == ['user11', 'user10', 'user9', 'user8', 'legacy', 'user7']
+    assert rows[4]['message'] == 'from before partitioning'
+
+
+def test_retention_removes_expired_partition_files(tmp_path):
+    path = str(tmp_path / 'siem.db')
+    today = datetime.utcnow().replace(microsecond=0)
+    old = Database(path, flush_interval_ms=10, spool_max_mb=0)
+    old.insert_events([event('2024-05-01T10:00:00', 1), event((today - timedelta(days=10)).isoformat(), 2),
+                       event(today.isoformat(), 3)])
+    old.close()
+    partitions = PartitionSet(str(tmp_path / 'partitions'))
+    assert len(partitions.list()) == 3
+    assert partitions.expired(3) == [p[0] for p in partitions.list()[:2]]
+
+    db = Database(path, retention_days=3, flush_interval_ms=10, spool_max_mb=0)
+    try:
+        deadline = time.monotonic() + 5
+        while db.stats()['partitions_removed'] < 2 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert db.stats()['partitions_removed'] == 2
+        names = [p[0] for p in db.partitions.list()]
+        assert names == [partition_name(to_epoch_us(today.isoformat()))]
+        assert sorted(f.name for f in (tmp_path / 'partitions').iterdir()
+                      if not f.name.startswith(names[0])) == []  # no -wal/-shm left behind either
+        assert [r['user'] for r in db.query()] == ['user3']
+    finally:
+        db.close()
@@ -0,0 +1,185 @@
+"""Pipeline checkpoint ordering: contiguous commits, lost batches, the commit gap and backpressure."""
+import json
+import threading
+import time
+
+from app.core import pipeline as pipeline_module
+from app.core.checkpoints import CheckpointStore
+from app.core.pipeline import Batch, Pipeline
+from app.sources.replay import JsonlReplaySource
+
+OPTIONS = {'dedup': {'enabled': False}}
+
+
+class StubDatabase:
+    """Holds each batch's commit callbacks so a test decides when (and in which order) batches persist."""
+
+    def __init__(self, auto_commit=False):
+        self.auto_commit = auto_commit
+        self.gate = threading.Event()
+        self.gate.set()
+        self.pending = []
+        self.stored = []
+        self._lock = threading.Lock()
+
+    def insert_events(self, events, on_commit=None, on_error=None):
+        self.gate.wait()
+        if self.auto_commit:
+            self.stored.extend(e['record_id'] for e in events)
+            on_commit()
+            return
+        with self._lock:
+            self.pending.append(([e['record_id'] for e in events], on_commit, on_error))
+
+    def batch(self, first_record_id):
+        with self._lock:
+            return next(p for p in self.pending if p[0][0] == first_record_id)
+
+    def close(self, timeout=None):
+        self.gate.set()
+
+    def stats(self):
+        return {}
+
+
+def write_capture(path, count):
+    """NDJSON capture; returns the source and the byte offset after each record."""
+    ends, offset = [], 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(1, count + 1):
+            line = json.dumps({'timestamp': f'2024-05-01T10:00:{i % 60:02d}', 'channel': 'System',
+                               'event_id': 7036, 'record_id': i, 'message': f'service {i} running'}) + '\n'
+            f.write(line)
+            offset += len(line.encode())
+            ends.append(offset)
+    return JsonlReplaySource(str(path)), ends
+
+
+def make_pipeline(tmp_path, source, db, max_records=2, options=OPTIONS):
+    checkpoints = CheckpointStore(str(tmp_path / 'checkpoints.json'))
+    return Pipeline([source], db, checkpoints, {}, {'enabled_channels': []}, interval_seconds=0.01,
+                    max_records=max_records, options=options)
+
+
+def offset(pipeline):
+    cp = pipeline.checkpoints.get(pipeline.sources[0].name)
+    return cp['offset'] if cp else None
+
+
+def wait_for(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+
+def test_release_commits_only_the_contiguous_prefix(tmp_path):
+    source, _ = write_capture(tmp_path / 'capture.jsonl', 1)
+    p = make_pipeline(tmp_path, source, StubDatabase())
+
+    def state(n):
+        return {source.name: {'offset': n}}
+
+    p._release(2, state(20))
+    p._release(3, state(30))
+    assert offset(p) is None  # batch 1 still outstanding
+
+    p._release(1, state(10))
+    assert offset(p) == 30
+    assert CheckpointStore(p.checkpoints.path).get(source.name) == {'offset': 30}  # saved
+
+    # A lost batch releases its seq without checkpoints; the next one commits past it
+    p._skip(Batch(4, [{}], state(40)), "test")
+    assert offset(p) == 30
+    p._release(5, state(50))
+    assert offset(p) == 50
+
+    # Releasing again (persist raised after the writer took the batch) is ignored
+    p._release(5, state(99))
+    p._release(4, state(99))
+    assert offset(p) == 50 and p._next_commit == 6
+
+
+def test_unfinished_batch_is_given_up_after_max_commit_gap(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(pipeline_module, 'MAX_COMMIT_GAP', 5)
+    source, _ = write_capture(tmp_path / 'capture.jsonl', 1)
+    p = make_pipeline(tmp_path, source, StubDatabase())
+    for seq in range(2, 7):
+        p._release(seq, {source.name: {'offset': seq}})
+    assert offset(p) is None
+
+    p._release(7, {source.name: {'offset': 7}})
+    assert offset(p) == 7
+    assert "Batch 1 never finished" in caplog.text
+    p._release(1, {source.name: {'offset': 1}})  # arrives too late to move anything back
+    assert offset(p) == 7
+
+
+def test_checkpoints_never_pass_an_unpersisted_batch(tmp_path):
+    source, ends = write_capture(tmp_path / 'capture.jsonl', 10)
+    db = StubDatabase()
+    p = make_pipeline(tmp_path, source, db)
+    p.start()
+    try:
+        assert p.wait(5)
+        wait_for(lambda: len(db.pending) == 5)
+
+        def after_batch(n):
+            return ends[2 * n - 1]
+
+        # The writer finishes batches out of order; batch 4 is lost
+        steps = [(3, 'commit', None), (1, 'commit', after_batch(1)), (5, 'commit', after_batch(1)),
+                 (2, 'commit', after_batch(3)), (4, 'error', after_batch(5))]
+        for n, outcome, expected in steps:
+            _, on_commit, on_error = db.batch(2 * n - 1)
+            if outcome == 'commit':
+                on_commit()
+            else:
+                on_error()
+            assert offset(p) == expected, f"after batch {n} {outcome}"
+    finally:
+        p.stop(5)
+
+
+def test_stage_failure_releases_the_batch_through_on_drop(tmp_path, monkeypatch, caplog):
+    source, ends = write_capture(tmp_path / 'capture.jsonl', 6)
+    real = pipeline_module.normalize_events
+
+    def poisoned(events):
+        if any(e['record_id'] == 3 for e in events):
+            raise ValueError("bad event")
+        return real(events)
+
+    monkeypatch.setattr(pipeline_module, 'normalize_events', poisoned)
+    db = StubDatabase(auto_commit=True)
+    p = make_pipeline(tmp_path, source, db)
+    p.run()
+
+    assert db.stored == [1, 2, 5, 6]
+    assert p.stages['normalize'].stats()['failed'] == 1
+    assert "Batch 2 (2 events) was lost (normalize failed: bad event)" in caplog.text
+    assert CheckpointStore(p.checkpoints.path).get(source.name) == {'offset': ends[-1]}
+
+
+def test_slow_writer_backs_up_to_the_collector(tmp_path):
+    source, ends = write_capture(tmp_path / 'capture.jsonl', 200)
+    db = StubDatabase(auto_commit=True)
+    db.gate.clear()
+    p = make_pipeline(tmp_path, source, db, max_records=1, options=dict(OPTIONS, queue_size=1))
+    p.start()
+    try:
+        time.sleep(0.3)
+        held = p.collected
+        # collector + dedup/normalize/persist (one in each worker and one in each queue)
+        assert held <= 7
+        time.sleep(0.2)
+        assert p.collected == held
+        assert offset(p) is None
+
+        db.gate.set()
+        assert p.wait(10)
+    finally:
+        p.stop(5)
+    assert db.stored == list(range(1, 201))
+    assert offset(p) == ends[-1]
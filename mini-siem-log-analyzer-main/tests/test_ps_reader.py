@@ -0,0 +1,163 @@
+"""PowerShell Operational reader driven by a fake Popen that streams NDJSON lines."""
+import json
+import queue
+import time
+
+import pytest
+
+from app.core.ps_reader import PowerShellOperationalReader, CHANNEL
+
+_EOF = object()
+
+
+class FakeProc:
+    """A child whose stdout yields queued lines; it exits at ``end()`` or ``kill()``."""
+
+    def __init__(self, lines=(), code=0, hold=False):
+        self._lines: queue.Queue = queue.Queue()
+        self.code = code
+        self.killed = False
+        for line in lines:
+            self._lines.put(line)
+        if not hold:
+            self._lines.put(_EOF)
+        self.stdout = iter(self._lines.get, _EOF)
+
+    def end(self):
+        self._lines.put(_EOF)
+
+    def kill(self):
+        self.killed = True
+        self.code = -9
+        self.end()
+
+    def wait(self):
+        return self.code
+
+
+class FakePopen:
+    """Hands out the scripted children in order, then children that stay up until killed."""
+
+    def __init__(self, *children):
+        self.children = list(children)
+        self.spawned = []
+        self.commands = []
+        self.times = []
+
+    def __call__(self, command, **kwargs):
+        proc = self.children.pop(0) if self.children else FakeProc(hold=True)
+        self.spawned.append(proc)
+        self.commands.append(command)
+        self.times.append(time.monotonic())
+        return proc
+
+
+def line(record_id, text='Write-Host hi'):
+    return json.dumps({'RecordId': record_id, 'TimeCreated': '2024-05-01T10:00:00.0000000Z', 'Id': 4104,
+                       'UserId': 'S-1-5-21-1', 'ScriptBlockText': text, 'Message': f'Creating Scriptblock text: {text}'}) + '\n'
+
+
+def wait_for(cond, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+
+def make_reader(popen, bookmark=100, **kwargs):
+    return PowerShellOperationalReader(bookmark=bookmark, popen=popen, command=lambda bm: ['fake-ps', str(bm)],
+                                       restart_delay=kwargs.pop('restart_delay', 0.05), **kwargs)
+
+
+@pytest.fixture
+def readers():
+    started = []
+    yield started
+    for r in started:
+        r.stop()
+
+
+def test_drain_is_non_blocking_capped_and_moves_the_bookmark(readers):
+    child = FakeProc([line(i) for i in range(101, 106)], hold=True)
+    reader = make_reader(FakePopen(child))
+    readers.append(reader)
+    reader.start()
+    wait_for(lambda: reader._queue.qsize() == 5)
+
+    # Read ahead by the thread, but nothing handed out yet
+    assert reader.bookmark == 100
+    assert reader._read_bookmark == 105
+
+    first = reader.drain(2)
+    assert [e['record_id'] for e in first] == [101, 102]
+    assert reader.bookmark == 102
+    evt = first[0]
+    assert evt['channel'] == CHANNEL and evt['event_id'] == 4104
+    assert evt['command'] == 'Write-Host hi' and evt['timestamp'] == '2024-05-01T10:00:00.0000000'
+
+    assert [e['record_id'] for e in reader.drain(10)] == [103, 104, 105]
+    assert reader.bookmark == 105
+
+    # The child is still up with nothing to say: drain returns at once and keeps the bookmark
+    started = time.monotonic()
+    assert reader.drain() == []
+    assert time.monotonic() - started < 0.1
+    assert reader.bookmark == 105
+
+
+def test_malformed_and_non_dict_lines_are_skipped(readers, caplog):
+    child = FakeProc([line(101), 'not json\n', '\n', '[1, 2]\n', '"text"\n', line(102)], hold=True)
+    reader = make_reader(FakePopen(child))
+    readers.append(reader)
+    reader.start()
+    wait_for(lambda: reader._queue.qsize() == 2)
+    assert [e['record_id'] for e in reader.drain()] == [101, 102]
+    assert 'Failed to parse 4104 JSON line: not json' in caplog.text
+
+
+def test_child_exit_restarts_after_the_last_read_record_with_backoff(readers):
+    popen = FakePopen(FakeProc([line(101), line(102)], code=1), FakeProc(code=1), FakeProc([line(103)], hold=True))
+    reader = make_reader(popen, restart_delay=0.05, max_restart_delay=5.0)
+    readers.append(reader)
+    reader.start()
+    wait_for(lambda: len(popen.spawned) == 3)
+    wait_for(lambda: reader._queue.qsize() == 3)
+
+    assert popen.commands == [['fake-ps', '100'], ['fake-ps', '102'], ['fake-ps', '102']]
+    assert reader.restarts == 2
+    first_gap = popen.times[1] - popen.times[0]
+    second_gap = popen.times[2] - popen.times[1]
+    assert first_gap >= 0.05
+    assert second_gap >= 0.1  # doubled
+    assert [e['record_id'] for e in reader.drain()] == [101, 102, 103]
+    assert reader.bookmark == 103
+
+
+def test_stop_kills_the_child_and_joins_the_thread():
+    popen = FakePopen(FakeProc([line(101)], hold=True))
+    reader = make_reader(popen)
+    reader.start()
+    wait_for(lambda: reader._queue.qsize() == 1)
+    assert reader.running
+
+    reader.stop()
+    assert popen.spawned[0].killed
+    assert not reader.running
+    assert len(popen.spawned) == 1  # no restart after a stop
+    # Whatever was read before the stop can still be drained
+    assert [e['record_id'] for e in reader.drain()] == [101]
+
+
+def test_full_queue_blocks_the_reader_without_dropping(readers):
+    child = FakeProc([line(i) for i in range(101, 111)], hold=True)
+    reader = make_reader(FakePopen(child), max_buffer=3)
+    readers.append(reader)
+    reader.start()
+    wait_for(lambda: reader._queue.full())
+    time.sleep(0.05)
+    assert reader._read_bookmark == 103
+
+    got = []
+    wait_for(lambda: got.extend(reader.drain()) or len(got) == 10)
+    assert [e['record_id'] for e in got] == list(range(101, 111))
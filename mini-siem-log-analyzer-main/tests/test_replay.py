@@ -0,0 +1,93 @@
+"""Replay sources on their own and driven through the staged pipeline (no Windows APIs)."""
+import json
+import logging
+
+import pytest
+
+from app.alerts import alert_engine
+from app.core.checkpoints import CheckpointStore
+from app.core.db import Database, open_readonly
+from app.core.partitions import query_events
+from app.core.pipeline import Pipeline
+from app.sources.replay import JsonlReplaySource, LatestEventsReplaySource
+
+THRESHOLDS = {'brute_force_failures': 3, 'brute_force_window_minutes': 10}
+
+
+def failure(i, ip='203.0.113.9'):
+    return {'timestamp': f'2024-05-01T10:00:{i:02d}', 'channel': 'Security', 'event_id': 4625, 'record_id': i,
+            'user': 'admin', 'ip': ip, 'message': f'An account failed to log on from {ip}.'}
+
+
+def write_jsonl(path, lines):
+    path.write_bytes(b''.join(lines))
+    return str(path)
+
+
+def test_jsonl_skips_malformed_lines_and_logs_their_offset(tmp_path, caplog):
+    good = json.dumps(failure(1)).encode() + b'\n'
+    bad = b'   {"event_id": \n'
+    path = write_jsonl(tmp_path / 'capture.jsonl', [good, b'\n', bad, b'[1, 2]\n', good])
+    src = JsonlReplaySource(path)
+    with caplog.at_level(logging.ERROR):
+        events = src.poll(10)
+    assert [e['record_id'] for e in events] == [1, 1]
+    assert src.exhausted
+    assert f"at offset {len(good) + 1}:" in caplog.text  # where the raw line starts, before its indent
+
+
+def test_jsonl_follow_leaves_partial_line_and_resumes_from_checkpoint(tmp_path):
+    line = json.dumps(failure(1)).encode() + b'\n'
+    path = tmp_path / 'tail.jsonl'
+    write_jsonl(path, [line, b'{"event_id": 46'])
+    src = JsonlReplaySource(str(path), follow=True)
+    assert len(src.poll(10)) == 1 and not src.exhausted
+    assert src.checkpoint() == {'offset': len(line)}
+    with open(path, 'ab') as f:
+        f.write(b'25}\n')
+    resumed = JsonlReplaySource(str(path), follow=True)
+    resumed.restore(src.checkpoint())
+    assert resumed.poll(10) == [{'event_id': 4625}]
+
+
+def test_latest_events_pages_and_restores(tmp_path):
+    path = tmp_path / 'latest_events.json'
+    path.write_text(json.dumps([failure(i) for i in range(5)] + ['not an event']))
+    src = LatestEventsReplaySource(str(path))
+    assert [e['record_id'] for e in src.poll(3)] == [0, 1, 2]
+    again = LatestEventsReplaySource(str(path))
+    again.restore(src.checkpoint())
+    assert [e['record_id'] for e in again.poll(10)] == [3, 4]
+    assert again.exhausted
+
+
+@pytest.fixture(autouse=True)
+def alert_cache():
+    alert_engine._alert_cache.clear()
+    yield
+    alert_engine._alert_cache.clear()
+
+
+def test_replays_run_through_the_pipeline(tmp_path):
+    jsonl = write_jsonl(tmp_path / 'capture.jsonl', [json.dumps(failure(i)).encode() + b'\n' for i in range(1, 8)])
+    latest = tmp_path / 'latest_events.json'
+    latest.write_text(json.dumps([failure(i, ip='198.51.100.7') for i in range(20, 23)]))
+    sources = [JsonlReplaySource(jsonl), LatestEventsReplaySource(str(latest))]
+    db = Database(str(tmp_path / 'siem.db'), flush_interval_ms=10)
+    checkpoints = CheckpointStore(str(tmp_path / 'checkpoints.json'))
+    pipeline = Pipeline(sources, db, checkpoints, THRESHOLDS, {'enabled_channels': []}, interval_seconds=0.01,
+                        max_records=3)
+    pipeline.run()
+
+    rows = query_events(db.path, db.partitions, limit=100)
+    assert sorted(r['ip'] for r in rows) == ['198.51.100.7'] * 3 + ['203.0.113.9'] * 7
+    conn = open_readonly(db.path)
+    try:
+        alerts = conn.execute("SELECT rule_id, ip FROM alerts ORDER BY ip").fetchall()
+    finally:
+        conn.close()
+    assert alerts == [('bruteforce', '198.51.100.7'), ('bruteforce', '203.0.113.9')]
+    # both sources committed through to their ends, and saved
+    saved = CheckpointStore(str(tmp_path / 'checkpoints.json'))
+    assert saved.get(sources[0].name) == {'offset': (tmp_path / 'capture.jsonl').stat().st_size}
+    assert saved.get(sources[1].name) == {'index': 3}
@@ -0,0 +1,77 @@
+"""Rollups: written in the raw rows' transaction, and 1m/1h/1d totals that agree with the raw events."""
+import random
+
+import pytest
+
+from app.core.db import Database
+from app.core.migrations import from_epoch_us, to_epoch_us
+
+CHANNELS = (('Security', 4625), ('Security', 4688), ('Microsoft-Windows-PowerShell/Operational', 4104))
+
+
+def events(count, start='2024-05-01T22:00:00', span_minutes=3 * 1440, seed=7):
+    rnd = random.Random(seed)
+    base = to_epoch_us(start)
+    out = []
+    for i in range(count):
+        channel, event_id = rnd.choice(CHANNELS)
+        ts = from_epoch_us(base + rnd.randrange(span_minutes * 60) * 1_000_000)
+        out.append({'timestamp': ts, 'channel': channel, 'event_id': event_id, 'user': f'user{i}', 'ip': None,
+                    'command': None, 'message': f'event {i}'})
+    return out
+
+
+def rollup_sum(conn, g):
+    return conn.execute(f"SELECT COALESCE(SUM(count), 0) FROM rollup_events_{g}").fetchone()[0]
+
+
+@pytest.fixture
+def db(tmp_path):
+    # Keep minute and hour buckets: the test data is older than the default retention
+    db = Database(str(tmp_path / 'siem.db'), flush_rows=100000, flush_interval_ms=60000, spool_max_mb=0,
+                  rollup_retention_days={'1m': 0, '1h': 0})
+    yield db
+    db.close()
+
+
+def test_rollups_commit_and_roll_back_with_the_rows(db, caplog):
+    reader = db.reader()
+    try:
+        db.insert_events(events(50))
+        assert [rollup_sum(reader, g) for g in ('1m', '1h', '1d')] == [0, 0, 0]  # not committed yet
+        db.flush()
+        assert [rollup_sum(reader, g) for g in ('1m', '1h', '1d')] == [50, 50, 50]
+        assert len(db.query(limit=1000)) == 50
+
+        # A batch that cannot be written takes the counts of its whole transaction with it
+        db.insert_events(events(20, seed=8))
+        db.insert_events([dict(e, user=object()) for e in events(5, seed=9)])
+        db.flush()
+        assert "DB write failed (events)" in caplog.text
+        assert [rollup_sum(reader, g) for g in ('1m', '1h', '1d')] == [50, 50, 50]
+        assert len(db.query(limit=1000)) == 50
+    finally:
+        reader.close()
+
+
+def test_every_granularity_matches_a_raw_count(db):
+    rows = events(2000)
+    db.insert_events(rows)
+    db.insert_alert('high', 'Brute force', 'x', '2024-05-02T10:00:00')
+    db.flush()
+    for g in ('1m', '1h', '1d'):
+        series = db.timeseries(time_range=('2024-05-01T00:00:00', '2024-05-06T00:00:00'), granularity=g)
+        assert sum(p['count'] for p in series) == 2000
+        assert all(p['granularity'] == g for p in series)
+
+    by_channel = {r['channel']: r['count'] for r in db.totals(group_by=['channel'])}
+    assert by_channel == {c: sum(1 for e in rows if e['channel'] == c) for c, _ in CHANNELS[::2]}
+    assert db.totals('alerts') == [{'count': 1}]
+
+    # Ragged ends are answered from hour and minute buckets
+    for start, end in (('2024-05-02T03:17:00', '2024-05-03T21:05:00'), ('2024-05-01T23:59:00', '2024-05-02T00:01:00'),
+                       ('2024-05-03T10:30:00', '2024-05-03T11:00:00')):
+        raw = db.query((start, end), limit=10000)
+        assert db.totals(time_range=(start, end)) == [{'count': len(raw)}]
+        raw_4625 = [r for r in raw if r['event_id'] == 4625]
+        assert db.totals(time_range=(start, end), filters={'event_id': 4625}) == [{'count': len(raw_4625)}]
